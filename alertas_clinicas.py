@@ -0,0 +1,254 @@
+"""
+Alertas clínicas de la receta: alergias y duplicidad terapéutica
+Cada nombre del catálogo de stock se reduce a su principio activo (el texto
+antes de la forma farmacéutica: "Amoxicilina Sólido Oral 500 mg ..." ->
+"amoxicilina"; los paréntesis son sinónimos) y a sus grupos terapéuticos
+(GRUPOS). TablasPrincipios calcula esas tablas una vez al cargar el catálogo;
+revisar una receta es buscar en diccionarios.
+
+Se alerta de:
+- medicamentos que coinciden con las alergias declaradas (principio o grupo),
+- el mismo principio activo o dos del mismo grupo en la receta,
+- el mismo principio activo recetado a la CI en los últimos DIAS_REPETICION
+  días (medicamentos_recientes, por el índice idx_recetas_ci).
+Son advertencias: el prescriptor decide si guarda igualmente.
+
+    python alertas_clinicas.py --listar            # tabla principio/grupos del stock
+    python alertas_clinicas.py --ci 1712345678     # medicamentos recientes del paciente
+"""
+
+import re
+import logging
+import argparse
+import unicodedata
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DIAS_REPETICION = 30
+
+# Primera palabra de la forma farmacéutica: lo anterior es el principio activo
+FORMAS = ("solido", "solid", "liquido", "semisolido", "gas", "gaseoso", "suspension", "solucion", "polvo",
+          "crema", "unguento", "gel", "jarabe", "tableta", "capsula", "ovulo", "parche", "aerosol", "inhalador")
+PATRON_FORMA = re.compile(r"\b(?:" + "|".join(FORMAS) + r")\b")
+# Nombres de categoría del catálogo: el principio es el sinónimo entre paréntesis
+GENERICOS = {"carbohidratos", "combinaciones", "electrolitos", "vitaminas"}
+NEGACIONES = ("ninguna", "ninguno", "niega", "no refiere", "no conocida", "desconoce")
+
+# (grupo, raíces de sus principios activos, términos con que se declara la alergia al grupo)
+GRUPOS = (
+    ("penicilinas", ("penicilin", "amoxicilin", "ampicilin", "oxacilin", "dicloxacilin", "piperacilin"),
+     ("penicilin", "betalactam")),
+    ("cefalosporinas", ("cefalexin", "cefazolin", "cefuroxim", "ceftriaxon", "cefotaxim", "ceftazidim",
+                        "cefepim", "cefadroxil"), ("cefalospor", "betalactam")),
+    ("carbapenémicos", ("imipenem", "meropenem", "ertapenem"), ("carbapenem", "betalactam")),
+    ("AINE", ("acido acetil salicilico", "ibuprofen", "diclofenac", "ketorolac", "naproxen", "metamizol",
+              "meloxicam", "indometacin", "celecoxib", "ketoprofen", "piroxicam"),
+     ("aine", "antiinflamatorio", "aspirina", "asa", "salicilat")),
+    ("sulfonamidas", ("sulfametoxazol", "sulfadiazin", "sulfasalazin"), ("sulfa",)),
+    ("macrólidos", ("azitromicin", "claritromicin", "eritromicin"), ("macrolid",)),
+    ("quinolonas", ("ciprofloxacin", "levofloxacin", "moxifloxacin", "norfloxacin"), ("quinolon",)),
+    ("aminoglucósidos", ("gentamicin", "amikacin", "tobramicin", "estreptomicin"), ("aminogluc",)),
+    ("opioides", ("morfin", "tramadol", "fentanil", "buprenorfin", "codein", "oxicodon", "metadon",
+                  "petidin", "nalbufin"), ("opioide", "opiaceo")),
+    ("benzodiazepinas", ("alprazolam", "diazepam", "midazolam", "clonazepam", "lorazepam", "bromazepam"),
+     ("benzodiazepin",)),
+    ("inhibidores de bomba de protones", ("omeprazol", "esomeprazol", "pantoprazol", "lansoprazol"), ()),
+    ("IECA", ("enalapril", "captopril", "lisinopril", "ramipril"), ("ieca",)),
+    ("ARA II", ("losartan", "valsartan", "irbesartan", "telmisartan", "candesartan"), ()),
+    ("anticoagulantes", ("warfarin", "heparin", "enoxaparin", "rivaroxaban", "apixaban", "dabigatran"), ()),
+    ("corticoides sistémicos", ("prednison", "prednisolon", "metilprednisolon", "dexametason",
+                                "hidrocortison", "betametason"), ("corticoid",)),
+)
+
+Principio = namedtuple("Principio", "principios sinonimos grupos")
+SIN_PRINCIPIO = Principio((), (), ())
+
+
+def normalizar(texto):
+    """Minúsculas sin tildes y con espacios simples"""
+    texto = unicodedata.normalize("NFKD", str(texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+
+def _empieza_palabra(texto, termino, completa=False):
+    """termino aparece en texto al inicio de una palabra (o como palabras completas)"""
+    return re.search(r"\b" + re.escape(termino) + (r"\b" if completa else ""), texto) is not None
+
+
+def _componentes(texto):
+    """Principios de una combinación ("a + b", "a / b", "a - b")"""
+    return tuple(p for p in (p.strip(" -,") for p in re.split(r"[+/]| - ", texto)) if p)
+
+
+def analizar_nombre(nombre):
+    """
+    Principio(s) activo(s), sinónimos y grupos de un nombre de catálogo (o
+    escrito a mano). Sin forma farmacéutica reconocible (insumos, dispositivos)
+    devuelve SIN_PRINCIPIO.
+    """
+    texto = normalizar(nombre)
+    forma = PATRON_FORMA.search(texto)
+    if not forma or forma.start() == 0:
+        return SIN_PRINCIPIO
+    cabeza = texto[:forma.start()]
+    sinonimos = _componentes(" + ".join(re.findall(r"\(([^)]*)\)", cabeza)))
+    principios = _componentes(re.sub(r"\([^)]*\)?", " ", cabeza).split(":")[-1])
+    if sinonimos and (not principios or len(principios) == 1 and principios[0] in GENERICOS):
+        principios, sinonimos = sinonimos, ()
+    if not principios or any("." in p for p in principios):
+        return SIN_PRINCIPIO  # fragmento de texto del CSV, no un medicamento
+    nombres = principios + sinonimos
+    grupos = tuple(g for g, raices, _ in GRUPOS if any(r in n for r in raices for n in nombres))
+    return Principio(principios, sinonimos, grupos)
+
+
+class TablasPrincipios:
+    """Principio activo y grupos de cada nombre del catálogo, calculados una vez"""
+
+    def __init__(self, nombres=()):
+        self._tabla = {nombre: analizar_nombre(nombre) for nombre in nombres}
+
+    def __len__(self):
+        return len(self._tabla)
+
+    def principio(self, nombre):
+        """Principio del nombre; los que no están en el catálogo se analizan y se recuerdan"""
+        info = self._tabla.get(nombre)
+        if info is None:
+            info = self._tabla[nombre] = analizar_nombre(nombre)
+        return info
+
+
+def terminos_alergia(data):
+    """Alergias declaradas en la receta, normalizadas ([] si no hay o se niegan)"""
+    if normalizar(data.get("alergias")) in ("", "no"):
+        return []
+    texto = normalizar(data.get("alergias_especificar"))
+    if not texto or any(texto.startswith(n) for n in NEGACIONES):
+        return []
+    return [t.strip() for t in re.split(r"[,;/\n]| y ", texto) if len(t.strip()) >= 3]
+
+
+def _conflicto_alergia(info, termino):
+    """Descripción del conflicto entre un medicamento y un término de alergia, o None"""
+    for nombre in info.principios + info.sinonimos:
+        if _empieza_palabra(termino, nombre, True) or (
+                len(termino) >= 4 and _empieza_palabra(nombre, termino, True)):
+            return nombre
+    for grupo, raices, terminos in GRUPOS:
+        if grupo in info.grupos and any(_empieza_palabra(termino, t) for t in terminos + raices):
+            return f"grupo {grupo}"
+    return None
+
+
+def revisar_receta(data, tablas, recientes=(), dias=DIAS_REPETICION):
+    """
+    Alertas [(titulo, mensaje)] de la receta. recientes: salida de
+    medicamentos_recientes para su CI (vacío si no se pudo consultar).
+    """
+    alertas = []
+    meds = [(m.get("nombre") or "").strip() for m in data.get("meds") or []]
+    analizados = [(nombre, tablas.principio(nombre)) for nombre in meds if nombre]
+
+    for termino in terminos_alergia(data):
+        for nombre, info in analizados:
+            motivo = _conflicto_alergia(info, termino)
+            if motivo:
+                alertas.append(("Alergia", f"{nombre}: el paciente refiere alergia a '{termino}' ({motivo})"))
+
+    vistos, vistos_grupo = {}, {}
+    for nombre, info in analizados:
+        for p in info.principios + info.sinonimos:
+            otro = vistos.setdefault(p, nombre)
+            if otro != nombre:
+                alertas.append(("Duplicidad", f"{otro} y {nombre} contienen {p}"))
+                break
+        else:
+            for g in info.grupos:
+                otro = vistos_grupo.setdefault(g, nombre)
+                if otro != nombre:
+                    alertas.append(("Duplicidad terapéutica", f"{otro} y {nombre} son del grupo {g}"))
+
+    previos = {}
+    for receta in recientes:
+        for nombre in receta["meds"]:
+            info = tablas.principio(nombre)
+            for p in info.principios + info.sinonimos:
+                previos.setdefault(p, receta)
+    for nombre, info in analizados:
+        p = next((p for p in info.principios + info.sinonimos if p in previos), None)
+        if p:
+            receta = previos[p]
+            alertas.append(("Repetición", f"{nombre}: {p} ya se recetó a este paciente en {receta['numero']} "
+                                          f"({receta['created_at'][:10]}, últimos {dias} días)"))
+    return alertas
+
+
+def medicamentos_recientes(conn, ci, dias=DIAS_REPETICION):
+    """
+    [{numero, created_at, meds: [nombres]}] de las recetas activas de la CI en
+    los últimos días, de la más reciente a la más antigua. Si el período empieza
+    en un año ya archivado, incluye ese archivo.
+    """
+    from codec_payload import decodificar
+    from datos_recetas import anios_archivados, archivo_adjunto
+
+    ci = str(ci or "").strip()
+    if not ci:
+        return []
+    desde = (datetime.now() - timedelta(days=dias)).isoformat()
+    sql = ("SELECT numero, created_at, payload FROM {}.recetas "
+           "WHERE ci = ? AND created_at >= ? AND estado = 'ACTIVA' ORDER BY created_at DESC")
+    filas = conn.execute(sql.format("main"), (ci, desde)).fetchall()
+    for anio in anios_archivados(conn):
+        if anio < int(desde[:4]):
+            break
+        with archivo_adjunto(conn, anio) as esquema:
+            filas += conn.execute(sql.format(esquema), (ci, desde)).fetchall()
+    recetas = []
+    for numero, creada, payload in filas:
+        try:
+            meds = [m.get("nombre") or "" for m in decodificar(payload).get("meds") or []]
+        except ValueError as e:
+            logger.warning(f"Receta {numero} omitida en el historial de medicamentos: {e}")
+            continue
+        recetas.append({"numero": numero, "created_at": creada or "", "meds": meds})
+    return recetas
+
+
+def main(argv=None):
+    import sqlite3
+    parser = argparse.ArgumentParser(description="Alertas clínicas (alergias y duplicidades)")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--stock", help="CSV de stock (por defecto el más reciente)")
+    parser.add_argument("--listar", action="store_true", help="Muestra principio y grupos de cada medicamento")
+    parser.add_argument("--ci", help="Muestra los medicamentos recetados a esta CI en los últimos días")
+    parser.add_argument("--dias", type=int, default=DIAS_REPETICION)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.listar:
+        from catalogos import leer_stock, ultimo_stock
+        import os
+        path = args.stock or ultimo_stock(os.path.dirname(os.path.abspath(__file__)))
+        for item in leer_stock(path):
+            info = analizar_nombre(item["nombre"])
+            if info.principios:
+                print(f"{' + '.join(info.principios):<40}{', '.join(info.grupos):<30}{item['nombre']}")
+    if args.ci:
+        if not args.db:
+            from app_enhanced_fixed import db_path
+            args.db = db_path()
+        conn = sqlite3.connect(args.db, timeout=30)
+        try:
+            for receta in medicamentos_recientes(conn, args.ci, args.dias):
+                print(f"{receta['numero']}  {receta['created_at'][:10]}  {'; '.join(receta['meds'])}")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,25 +8,54 @@ FIXED VERSION - CIE-10 and Medications lists working
 import os
 import sqlite3
 import uuid
-import json
-import csv
 import re
 import platform
 import subprocess
-import hashlib
 import logging
+import atexit
+import threading
+import queue
+import time
 from datetime import datetime, timedelta
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-import pandas as pd
 
 # Import the FIXED PDF layout
-from pdf_layout_fixed import build_pdf
+from pdf_layout_fixed import build_documentos, build_indicaciones_pdf
+from catalogos import leer_xlsx, ultimo_stock
+from catalogo_binario import cargar_catalogos
+from recarga_catalogos import VigilanteArchivos
+from ventanas_catalogo import VentanaCatalogo, ListaSugerencias
+import reportes_farmacia
+import estadisticas
+from registro_eventos import EscritorRegistros
+from identidad_equipo import IdentidadEquipo
+from visor_registros import VisorRegistros
+from datos_recetas import (
+    BackendLocal, crear_esquema, calcular_hash, serializar_receta, escribir_exportacion, verificar_integridad,
+)
+from validacion_recetas import validar_receta, validate_ci
+from cliente_recetas import ClienteRecetas
+from bandeja_salida import BandejaSalida
+from cola_impresion import ColaImpresion, crear_impresora, parsear_copias
+from verificacion_recetas import VentanaVerificacion, codigo_verificacion
+from firma_recetas import AlmacenFirmas, PoolFirmas, VALIDA, SIN_FIRMA, pdfs_de, numero_de_pdf
+from archivo_anual import archivar_anios_cerrados
+from pacientes import CachePacientes
+from frecuencias_uso import ModeloUso
+from alertas_clinicas import TablasPrincipios, revisar_receta, DIAS_REPETICION
+from metricas import METRICAS, DiagnosticoWindow, span, medido, registrar
+from registro_archivo import iniciar_logging
 
 # Ruta del catálogo CIE-10 (CSV con columnas: code,desc)
 CIE10_CSV = os.path.join(os.path.dirname(__file__), "cie10_es.csv")
 # Ruta del catálogo de medicamentos
 MEDICAMENTOS_CSV = os.path.join(os.path.dirname(__file__), "stock_medicamentos_dispositivos_HBC_2025-09-24.csv")
+# Lista de usuarios (login)
+USUARIOS_XLSX = os.path.join(os.path.dirname(__file__), "LISTADO NOMBRES.xlsx")
+
+# Campos que aparecen en la hoja de indicaciones del paciente
+CAMPOS_INDICACIONES = ("paciente", "fecha_nacimiento", "edad", "meses", "ci", "prescriptor", "indicaciones")
 
 APP_TITLE = "Receta Electrónica Hospital Básico Cayambe by Dr.P."
 
@@ -38,59 +67,63 @@ else:
 
 DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), "output")
 
+# Modo cliente/servidor (ver servidor_recetas.py): con URL definida la app no abre recetas.db
+SERVER_URL = os.environ.get("RECETAS_SERVER_URL", "")
+SERVER_TOKEN = os.environ.get("RECETAS_SERVER_TOKEN", "")
+
+# Bandeja de salida local (ver bandeja_salida.py): las recetas se confirman en la
+# estación y se sincronizan con la base central en segundo plano
+LOCAL_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+BANDEJA_SALIDA = os.environ.get("RECETAS_BANDEJA", "1") != "0"
+# Vigencia del historial de la central precargado al escribir la CI (alertas de repetición)
+SEGUNDOS_HISTORIAL = 300
+
+# Impresión directa (ver cola_impresion.py): "lp", "lp:<nombre>", "windows" o
+# "archivo:<carpeta>". Vacío: se abre el PDF en el visor como antes
+IMPRESORA = os.environ.get("RECETAS_IMPRESORA", "")
+COPIAS_IMPRESION = os.environ.get("RECETAS_COPIAS", "farmacia,paciente")
+
+# Firma digital de los PDF (ver firma_recetas.py): sin clave del almacén no se firma
+ALMACEN_FIRMAS = os.environ.get("RECETAS_ALMACEN_FIRMAS", os.path.join(LOCAL_DATA_DIR, "firmas"))
+CLAVE_FIRMAS = os.environ.get("RECETAS_CLAVE_FIRMAS", "")
+
 # Configure logging for audit trail
 def setup_logging():
     """Configura el sistema de logging para auditoría"""
     log_dir = os.path.join(NETWORK_DB_DIR, "logs")
-    os.makedirs(log_dir, exist_ok=True)
-    
-    log_file = os.path.join(log_dir, f"recetas_audit_{datetime.now().strftime('%Y%m')}.log")
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+    except OSError:
+        # El log de texto puede quedar en la estación; los datos no (ver db_path)
+        log_dir = os.path.join(LOCAL_DATA_DIR, "logs")
+        os.makedirs(log_dir, exist_ok=True)
     
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+    # Escritura en segundo plano (JSON Lines, rotación y compresión): logger.* no
+    # espera al recurso de red en el hilo de la interfaz
+    listener = iniciar_logging(log_dir, platform.node())
+    atexit.register(listener.stop)
 
     return logging.getLogger(__name__)
 
 # Initialize logger
 logger = setup_logging()
 
-# Professional services mapping for validation
-SERVICIOS_AUTORIZADOS = {
-    "MEDICINA INTERNA": ["MEDICO GENERAL", "MEDICO INTERNISTA", "MEDICO ESPECIALISTA"],
-    "GINECOLOGÍA": ["MEDICO GINECOLOGO", "MEDICO OBSTETRA", "MEDICO ESPECIALISTA"],
-    "CIRUGÍA GENERAL": ["MEDICO CIRUJANO", "MEDICO ESPECIALISTA"],
-    "PEDIATRÍA": ["MEDICO PEDIATRA", "MEDICO ESPECIALISTA"],
-    "MEDICINA OCUPACIONAL": ["MEDICO OCUPACIONAL", "MEDICO GENERAL"],
-    "EMERGENCIA": ["MEDICO GENERAL", "MEDICO ESPECIALISTA", "MEDICO EMERGENCIOLOGO"],
-    "HOSPITALIZACIÓN": ["MEDICO GENERAL", "MEDICO ESPECIALISTA", "MEDICO INTERNISTA"],
-}
+_identidad = None
+
+def identidad_equipo():
+    """Identidad de la estación (nombre, IP, MAC) resuelta una vez y en caché"""
+    global _identidad
+    if _identidad is None:
+        _identidad = IdentidadEquipo().iniciar()
+    return _identidad
 
 def get_local_ip():
-    """Obtiene la dirección IP local"""
-    try:
-        import socket
-        hostname = socket.gethostname()
-        return socket.gethostbyname(hostname)
-    except:
-        return "127.0.0.1"
+    """Obtiene la dirección IP local (valor en caché, sin consultar DNS)"""
+    return identidad_equipo().ip
 
 def calculate_hash(data):
-    """Calcula hash SHA-256 para verificación de integridad"""
-    try:
-        data_str = json.dumps(data, sort_keys=True, ensure_ascii=False)
-        return hashlib.sha256(data_str.encode('utf-8')).hexdigest()
-    except:
-        return ""
-
-def validate_professional_service(servicio, prescriptor_especialidad):
-    # Validación desactivada: usamos especialidad del usuario y no hay servicio
-    return True
+    """Calcula el hash de integridad (BLAKE2b versionado, ver integridad.py)"""
+    return calcular_hash(data)
 
 def create_backup():
     """Crea respaldo de la base de datos"""
@@ -101,8 +134,9 @@ def create_backup():
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_file = os.path.join(backup_dir, f"recetas_backup_{timestamp}.db")
         
-        # Copiar base de datos
+        # Copiar base de datos (con la bitácora pendiente ya escrita)
         import shutil
+        escritor_registros().flush()
         shutil.copy2(db_path(), backup_file)
         
         logger.info(f"Respaldo creado: {backup_file}")
@@ -112,192 +146,179 @@ def create_backup():
         logger.error(f"Error creando respaldo: {e}")
         return False
 
+def archivar_historial():
+    """Traslada los años cerrados a recetas_AAAA.db (ver archivo_anual.py)"""
+    try:
+        conn = sqlite3.connect(db_path(), timeout=30)
+        try:
+            for anio, n in archivar_anios_cerrados(conn):
+                logger.info(f"Archivo anual {anio}: {n} recetas trasladadas")
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error archivando años cerrados: {e}")
+
 def db_path():
-    """Obtiene la ruta de la base de datos"""
+    """Obtiene la ruta de la base de datos central"""
     folder = NETWORK_DB_DIR
     try:
         os.makedirs(folder, exist_ok=True)
-    except PermissionError:
-        # Fallback to local directory if network path is not accessible
-        folder = os.path.join(os.path.dirname(__file__), "data")
-        os.makedirs(folder, exist_ok=True)
+    except OSError as e:
+        # Sin caer a una recetas.db local: las recetas guardadas allí quedaban
+        # huérfanas. Si la central no está accesible, esperan en la bandeja de salida.
+        logger.warning(f"Base central no accesible en {folder}: {e}")
     return os.path.join(folder, "recetas.db")
 
+_backend = None
+
+def backend():
+    """Acceso a datos: recetas.db directa o cliente del servidor de recetas"""
+    global _backend
+    if _backend is None:
+        _backend = ClienteRecetas(SERVER_URL, SERVER_TOKEN) if SERVER_URL else BackendLocal(db_path)
+    return _backend
+
+def unir_historial(*listas):
+    """Une listas de medicamentos_recientes sin repetir número, de la más reciente a la más antigua"""
+    recetas = {}
+    for lista in listas:
+        for r in lista:
+            recetas.setdefault(r["numero"], r)
+    return sorted(recetas.values(), key=lambda r: r["created_at"], reverse=True)
+
+_bandeja = None
+
+def bandeja():
+    """Bandeja de salida local compartida (se crea y arranca al primer uso)"""
+    global _bandeja
+    if _bandeja is None:
+        os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
+        _bandeja = BandejaSalida(
+            os.path.join(LOCAL_DATA_DIR, "bandeja_salida.db"), backend,
+            estacion=identidad_equipo().hostname
+        ).iniciar()
+        atexit.register(_bandeja.detener, 5.0)
+    return _bandeja
+
+_cola_impresion = None
+
+def cola_impresion():
+    """Cola de impresión compartida (None sin RECETAS_IMPRESORA; se arranca al primer uso)"""
+    global _cola_impresion
+    if _cola_impresion is None and IMPRESORA:
+        os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
+        _cola_impresion = ColaImpresion(
+            os.path.join(LOCAL_DATA_DIR, "impresion.db"), crear_impresora(IMPRESORA),
+            al_terminar=registrar_impresion
+        ).iniciar()
+        atexit.register(_cola_impresion.detener, 5.0)
+    return _cola_impresion
+
+def registrar_impresion(trabajo, impreso, error):
+    """Deja en auditoría cada copia impresa (o que no se pudo imprimir)"""
+    detalles = f"{trabajo['documento']}, copia {trabajo['copia']}"
+    if impreso:
+        log_audit(trabajo["numero"], "IMPRESION", trabajo["usuario"], f"{detalles} enviada a {IMPRESORA}")
+    else:
+        log_audit(trabajo["numero"], "IMPRESION_FALLIDA", trabajo["usuario"], f"{detalles}: {error}")
+
+_pool_firmas = None
+
+def pool_firmas():
+    """
+    Pool de firma en segundo plano (None sin RECETAS_CLAVE_FIRMAS; se crea al
+    primer uso). No crea claves: cada prescriptor se da de alta con --crear-clave
+    """
+    global _pool_firmas
+    if _pool_firmas is None and CLAVE_FIRMAS:
+        _pool_firmas = PoolFirmas(AlmacenFirmas(ALMACEN_FIRMAS, CLAVE_FIRMAS), hilos=2, crear=False,
+                                  al_terminar=registrar_firma)
+        atexit.register(_pool_firmas.cerrar)
+    return _pool_firmas
+
+def registrar_firma(pdf_path, prescriptor, ruta_firma, error):
+    """Deja en auditoría cada PDF firmado (o que no se pudo firmar)"""
+    documento = os.path.basename(pdf_path)
+    if error:
+        log_audit(numero_de_pdf(pdf_path), "FIRMA_FALLIDA", prescriptor, f"{documento}: {error}")
+    else:
+        log_audit(numero_de_pdf(pdf_path), "FIRMA", prescriptor, f"{documento} firmado")
+
 def ensure_db():
     """Crea la base de datos y tablas si no existen - ENHANCED VERSION"""
     try:
+        if SERVER_URL:
+            # En modo servidor el esquema lo mantiene servidor_recetas.py
+            if not backend().salud():
+                raise ConnectionError(f"El servidor {SERVER_URL} no responde")
+            return True
+
         path = db_path()
         conn = sqlite3.connect(path)
-        cur = conn.cursor()
-        
-        # Crear tabla de secuencias
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS secuencias (
-                tipo TEXT PRIMARY KEY, 
-                ultimo INTEGER NOT NULL
-            )
-        """)
-        
-        # Crear tabla de recetas ENHANCED con campos de auditoría
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS recetas (
-                id TEXT PRIMARY KEY,
-                numero TEXT NOT NULL UNIQUE,
-                tipo TEXT NOT NULL,
-                fecha TEXT,
-                unidad TEXT, 
-                servicio TEXT, 
-                prescriptor TEXT,
-                prescriptor_especialidad TEXT,
-                paciente TEXT, 
-                ci TEXT, 
-                hc TEXT,
-                edad TEXT, 
-                meses TEXT, 
-                sexo TEXT,
-                talla TEXT, 
-                peso TEXT,
-                cie TEXT, 
-                cie_desc TEXT,
-                indicaciones TEXT,
-                actividad_fisica TEXT,
-                estado_enfermedad TEXT,
-                alergias TEXT,
-                alergias_especificar TEXT,
-                payload TEXT,
-                pdf_path TEXT,
-                created_at TEXT,
-                created_by TEXT,
-                ip_address TEXT,
-                hash_verificacion TEXT,
-                estado TEXT DEFAULT 'ACTIVA',
-                modificaciones TEXT
-            )
-        """)
-
-        # Crear tabla de auditoría para trazabilidad completa
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS auditoria (
-                id TEXT PRIMARY KEY,
-                receta_numero TEXT,
-                accion TEXT,
-                usuario TEXT,
-                fecha_hora TEXT,
-                ip_address TEXT,
-                detalles TEXT,
-                hash_anterior TEXT,
-                hash_nuevo TEXT
-            )
-        """)
-
-        # Crear tabla de accesos para bitácora de seguridad
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS bitacora_accesos (
-                id TEXT PRIMARY KEY,
-                usuario TEXT,
-                accion TEXT,
-                fecha_hora TEXT,
-                ip_address TEXT,
-                detalles TEXT,
-                resultado TEXT
-            )
-        """)
-
-        # Crear tabla de respaldos
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS respaldos (
-                id TEXT PRIMARY KEY,
-                fecha_respaldo TEXT,
-                tipo_respaldo TEXT,
-                archivo_respaldo TEXT,
-                estado TEXT,
-                registros_respaldados INTEGER
-            )
-        """)
-
-        # --- MIGRACIÓN DE ESQUEMA: agregar columnas nuevas si faltan ---
-        try:
-            cur.execute("PRAGMA table_info(recetas)")
-            existing_cols = {row[1] for row in cur.fetchall()}
-            needed = {
-                "actividad_fisica": "TEXT",
-                "estado_enfermedad": "TEXT",
-                "alergias": "TEXT",
-                "alergias_especificar": "TEXT",
-                "prescriptor_especialidad": "TEXT",
-                "created_at": "TEXT",
-                "created_by": "TEXT", 
-                "ip_address": "TEXT",
-                "hash_verificacion": "TEXT",
-                "estado": "TEXT DEFAULT 'ACTIVA'",
-                "modificaciones": "TEXT"
-            }
-            for col, coltype in needed.items():
-                if col not in existing_cols:
-                    cur.execute(f"ALTER TABLE recetas ADD COLUMN {col} {coltype}")
-        except Exception as e:
-            logger.warning(f"Migración de esquema: {e}")
-
-        # Inicializar secuencias
-        for tipo in ("CE", "EH", "EM"):
-            cur.execute(
-                "INSERT OR IGNORE INTO secuencias(tipo, ultimo) VALUES(?,?)", 
-                (tipo, -1)
-            )
-
-        conn.commit()
+        crear_esquema(conn)
         conn.close()
         
         logger.info("Base de datos inicializada correctamente")
         return True
         
     except Exception as e:
+        if BANDEJA_SALIDA:
+            # Se trabaja contra la bandeja local; la barra de estado muestra la desconexión
+            logger.warning(f"Base central no disponible, trabajando sin conexión: {e}")
+            return True
         logger.error(f"Error al crear la base de datos: {str(e)}")
         messagebox.showerror("Error de Base de Datos", f"Error al crear la base de datos: {str(e)}")
         return False
 
-def log_access(usuario, accion, detalles="", resultado="EXITOSO"):
+# Escritor en segundo plano para bitácora y auditoría (ver registro_eventos.py)
+ACCIONES_CRITICAS = {"LOGIN", "CIERRE_APLICACION"}
+RESULTADOS_CRITICOS = {"FALLIDO", "DENEGADO"}
+_escritor_registros = None
+
+def escritor_registros():
+    """Devuelve el escritor de registros compartido (se crea al primer uso)"""
+    global _escritor_registros
+    if _escritor_registros is None:
+        if BANDEJA_SALIDA:
+            destino = bandeja().registrar
+        else:
+            destino = backend().registrar if SERVER_URL else None
+        _escritor_registros = EscritorRegistros(db_path, destino=destino)
+        atexit.register(_escritor_registros.cerrar)
+    return _escritor_registros
+
+def log_access(usuario, accion, detalles="", resultado="EXITOSO", critico=None):
     """Registra accesos en la bitácora de seguridad"""
     try:
-        conn = sqlite3.connect(db_path())
-        cur = conn.cursor()
-        
         access_id = str(uuid.uuid4())
         ip_address = get_local_ip()
         fecha_hora = datetime.now().isoformat()
-        
-        cur.execute("""
-            INSERT INTO bitacora_accesos 
-            (id, usuario, accion, fecha_hora, ip_address, detalles, resultado)
-            VALUES (?,?,?,?,?,?,?)
-        """, (access_id, usuario, accion, fecha_hora, ip_address, detalles, resultado))
-        
-        conn.commit()
-        conn.close()
+
+        if critico is None:
+            critico = accion in ACCIONES_CRITICAS or resultado in RESULTADOS_CRITICOS
+        escritor_registros().encolar(
+            "bitacora_accesos",
+            (access_id, usuario, accion, fecha_hora, ip_address, detalles, resultado),
+            critico=critico
+        )
         
         logger.info(f"Acceso registrado: {usuario} - {accion} - {resultado}")
         
     except Exception as e:
         logger.error(f"Error registrando acceso: {e}")
 
-def log_audit(receta_numero, accion, usuario, detalles="", hash_anterior="", hash_nuevo=""):
+def log_audit(receta_numero, accion, usuario, detalles="", hash_anterior="", hash_nuevo="", critico=False):
     """Registra eventos de auditoría para trazabilidad"""
     try:
-        conn = sqlite3.connect(db_path())
-        cur = conn.cursor()
-        
         audit_id = str(uuid.uuid4())
         ip_address = get_local_ip()
         fecha_hora = datetime.now().isoformat()
-        
-        cur.execute("""
-            INSERT INTO auditoria 
-            (id, receta_numero, accion, usuario, fecha_hora, ip_address, detalles, hash_anterior, hash_nuevo)
-            VALUES (?,?,?,?,?,?,?,?,?)
-        """, (audit_id, receta_numero, accion, usuario, fecha_hora, ip_address, detalles, hash_anterior, hash_nuevo))
-        
-        conn.commit()
-        conn.close()
+
+        escritor_registros().encolar(
+            "auditoria",
+            (audit_id, receta_numero, accion, usuario, fecha_hora, ip_address, detalles, hash_anterior, hash_nuevo),
+            critico=critico
+        )
         
         logger.info(f"Auditoría registrada: {receta_numero} - {accion} - {usuario}")
         
@@ -307,53 +328,15 @@ def log_audit(receta_numero, accion, usuario, detalles="", hash_anterior="", has
 def next_number(tipo):
     """Genera el siguiente número correlativo"""
     try:
-        conn = sqlite3.connect(db_path())
-        cur = conn.cursor()
-        cur.execute("SELECT ultimo FROM secuencias WHERE tipo= ?", (tipo,))
-        result = cur.fetchone()
-        
-        if not result:
-            raise ValueError(f"Tipo de receta '{tipo}' no encontrado")
-            
-        ultimo = result[0] + 1
-        cur.execute("UPDATE secuencias SET ultimo=? WHERE tipo=?", (ultimo, tipo))
-        conn.commit()
-        conn.close()
-        
-        return f"{tipo}-{datetime.now().year}-{ultimo:06d}"
+        if BANDEJA_SALIDA:
+            return bandeja().siguiente_numero(tipo)
+        return backend().asignar_numero(tipo)
         
     except Exception as e:
         logger.error(f"Error generando número: {e}")
         messagebox.showerror("Error", f"Error al generar número: {str(e)}")
         return None
 
-def validate_ci(ci):
-    """Valida el identificador del paciente (CI)"""
-    if not ci:
-        return False
-    ci = ci.strip().replace(" ", "")
-    if len(ci) < 10:
-        return False
-    return ci.isalnum()
-
-def validate_numeric(value, field_name, min_val=0, max_val=None):
-    """Valida que un valor sea numérico y esté en el rango especificado"""
-    if not value or not str(value).strip():
-        return True  # Campos opcionales
-    
-    try:
-        num_val = float(value)
-        if num_val < min_val:
-            messagebox.showerror("Validación", f"{field_name} debe ser mayor o igual a {min_val}")
-            return False
-        if max_val is not None and num_val > max_val:
-            messagebox.showerror("Validación", f"{field_name} debe ser menor o igual a {max_val}")
-            return False
-        return True
-    except ValueError:
-        messagebox.showerror("Validación", f"{field_name} debe ser un número válido")
-        return False
-
 def open_file_cross_platform(filepath):
     """Abre un archivo de manera multiplataforma"""
     try:
@@ -381,6 +364,10 @@ def contraction_username(nombres: str, apellidos: str) -> str:
     initials = ''.join([p[0] for p in parts if p])
     return initials or 'usuario'
 
+def stock_vigente():
+    """CSV de stock más reciente publicado por farmacia (MEDICAMENTOS_CSV si no hay otro)"""
+    return ultimo_stock(os.path.dirname(os.path.abspath(__file__))) or MEDICAMENTOS_CSV
+
 def load_user_directory(excel_path: str):
     """
     Lee LISTADO NOMBRES.xlsx y devuelve un diccionario por usuario:
@@ -397,9 +384,8 @@ def load_user_directory(excel_path: str):
     Columnas toleradas (cualquier combinación): 
     ['NOMBRES','APELLIDOS','CEDULA','ESPECIALIDAD','ROL','TIPO','CARGO']
     """
-    import pandas as pd
-    xls = pd.read_excel(excel_path)
-    cols = {c.strip().lower(): c for c in xls.columns}
+    filas = leer_xlsx(excel_path)
+    cols = {c.strip().lower(): c for c in (filas[0] if filas else {})}
     def pick(*keys):
         for k in keys:
             if k in cols: return cols[k]
@@ -416,7 +402,7 @@ def load_user_directory(excel_path: str):
     col_rol = pick('rol','tipo','cargo','categoria')
 
     directory = {}
-    for _, row in xls.iterrows():
+    for row in filas:
         nombres = str(row.get(col_nombres, '') if col_nombres else '').strip()
         apellidos = str(row.get(col_apellidos, '') if col_apellidos else '').strip()
         cedula = str(row.get(col_cedula, '') if col_cedula else '').strip()
@@ -472,6 +458,7 @@ class LoginDialog(tk.Toplevel):
             self.result = self.user_dir[u] | {'username': u}
             self.destroy()
         else:
+            log_access(u or "(vacío)", "LOGIN", "Usuario o contraseña inválidos", "FALLIDO")
             messagebox.showerror("Acceso denegado", "Usuario o contraseña inválidos.")
 
     def on_cancel(self):
@@ -480,6 +467,7 @@ class LoginDialog(tk.Toplevel):
 
 class EnhancedApp(tk.Tk):
     def __init__(self):
+        inicio = time.perf_counter()
         super().__init__()
         self.title(APP_TITLE)
         self.geometry("1200x900")
@@ -488,17 +476,20 @@ class EnhancedApp(tk.Tk):
         self.current_user = 'USUARIO_SISTEMA'
         
         # Log inicio de sesión
-        log_access(self.current_user, "INICIO_APLICACION", "Aplicación iniciada")
+        log_access(self.current_user, "INICIO_APLICACION", f"Aplicación iniciada en {identidad_equipo().descripcion()}")
         # Cargar directorio de usuarios y mostrar login
         try:
-            excel_path = os.path.join(os.path.dirname(__file__), "LISTADO NOMBRES.xlsx")
-            user_dir = load_user_directory(excel_path)
+            with span("arranque.directorio_usuarios"):
+                user_dir = load_user_directory(USUARIOS_XLSX)
         except Exception as e:
             user_dir = {}
             logger.error(f"Error cargando LISTADO NOMBRES.xlsx: {e}")
 
+        registrar("arranque.previo_login", (time.perf_counter() - inicio) * 1000)
+        self.user_dir = user_dir
         login = LoginDialog(self, user_dir)
         self.wait_window(login)
+        inicio = time.perf_counter()
 
         if not login.result:
             messagebox.showwarning("Salida", "Debe iniciar sesión para usar la aplicación.")
@@ -508,21 +499,86 @@ class EnhancedApp(tk.Tk):
         self.user_info = login.result  # contiene nombres, apellidos, nombre_completo, especialidad, rol, username
         self.current_user = self.user_info.get('nombre_completo', self.current_user)
         log_access(self.current_user, "LOGIN", f"Rol: {self.user_info.get('rol')} - Esp: {self.user_info.get('especialidad')}")
-        # Cargar CIE-10 si existe el CSV
-        self.cie_index = self.load_cie10()
-        self.cie_items = [(c, d) for c, d in (self.cie_index or {}).items()]
-        
-        # Cargar medicamentos
-        self.medicamentos_list = self.load_medicamentos()
-        
-        self.create_menu()
-        self.create_ui()
+        # Catálogos CIE-10 y de medicamentos: compilados y compartidos por mmap entre sesiones
+        self.catalogo = self.load_catalogos()
+        self.cie_index = self.catalogo.cie
+        self.cie_items = self.catalogo.cie_items
+        self.medicamentos_list = self.catalogo.medicamentos
+        # Principio activo y grupo terapéutico de cada medicamento (alertas clínicas al validar)
+        self.tablas_principios = TablasPrincipios(self.medicamentos_list)
+
+        # Datos demográficos por CI (maestro de pacientes con caché en memoria)
+        self.cache_pacientes = CachePacientes(lambda ci: backend().buscar_paciente(ci))
+        self._ci_autocompletada = ""
+        self._ci_consultando = set()
+        # Historial de medicamentos por CI para las alertas: el de la central se
+        # precarga al escribir la CI ({ci: (momento, recetas)}); el de esta sesión
+        # se suma al guardar
+        self._historial = {}
+        self._historial_consultando = set()
+        self._historial_sesion = {}
+        # (número, campos, ruta) de la hoja de indicaciones generada junto con la última receta
+        self._hoja_indicaciones = None
+        
+        with span("arranque.interfaz"):
+            self.create_menu()
+            self.create_ui()
+        # Listas de catálogo y de sugerencias: se construyen una vez y se reutilizan (ventanas_catalogo.py)
+        self.sugerencias_cie = ListaSugerencias(self, 600, self.elegir_cie, lambda it: f"{it[0]} — {it[1]}")
+        self.sugerencias_med = ListaSugerencias(self, 800, self.elegir_medicamento_sugerido, caracteres=100)
+        self._ventana_cie = self._ventana_med = None
+        self.after(1500, self.preparar_ventanas_catalogo)
+
+        # Frecuencias de uso y plantillas del prescriptor (en segundo plano: pueden venir del servidor)
+        self.modelo_uso = ModeloUso(self.prescriptor.get(), self.prescriptor_especialidad.get())
+        self._plantillas = []
+        threading.Thread(target=self.cargar_preferencias, name="preferencias", daemon=True).start()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Recarga en caliente: el hilo reconstruye y deja el resultado en la cola; se aplica en este hilo
+        self._recargas = queue.Queue()
+        self.vigilante = VigilanteArchivos()
+        self.vigilante.vigilar("catalogos", lambda: (CIE10_CSV, stock_vigente()), self.reconstruir_catalogos,
+                               lambda nuevo: self._recargas.put((self.aplicar_catalogos, nuevo)))
+        self.vigilante.vigilar("usuarios", lambda: (USUARIOS_XLSX,), load_user_directory,
+                               lambda nuevo: self._recargas.put((self.aplicar_usuarios, nuevo)))
+        self.vigilante.iniciar()
+        self.aplicar_recargas()
         
         # Crear respaldo automático al iniciar (una vez al día)
-        self.check_and_create_backup()
+        with span("arranque.respaldo"):
+            self.check_and_create_backup()
+        registrar("arranque.posterior_login", (time.perf_counter() - inicio) * 1000)
+
+        # Métricas de rendimiento: volcado periódico local (Auditoría -> Diagnóstico)
+        METRICAS.iniciar_volcado(os.path.join(LOCAL_DATA_DIR, "metricas"), identidad_equipo().hostname)
+
+    def solo_modo_local(self, funcion):
+        """En modo servidor, informa que la función se ejecuta en el servidor"""
+        if SERVER_URL:
+            messagebox.showinfo(
+                "Modo servidor",
+                f"{funcion} se ejecuta en el servidor de recetas (línea de comandos)."
+            )
+            return False
+        return True
+
+    def on_close(self):
+        """Cierra la aplicación vaciando los registros pendientes"""
+        log_access(self.current_user, "CIERRE_APLICACION", "Aplicación cerrada")
+        self.vigilante.detener()
+        # Sólo si se usó: crearla aquí arrancaría su hilo e imprimiría trabajos viejos al cerrar
+        if _cola_impresion is not None:
+            _cola_impresion.detener(timeout=5.0)
+        escritor_registros().cerrar()
+        if BANDEJA_SALIDA:
+            bandeja().detener(timeout=5.0)
+        self.destroy()
 
     def check_and_create_backup(self):
         """Verifica si es necesario crear un respaldo automático"""
+        if SERVER_URL:
+            return  # Los respaldos se hacen en el servidor
         try:
             conn = sqlite3.connect(db_path())
             cur = conn.cursor()
@@ -546,6 +602,9 @@ class EnhancedApp(tk.Tk):
             
             if should_backup:
                 create_backup()
+
+            # Años cerrados: se trasladan una vez, en segundo plano
+            threading.Thread(target=archivar_historial, name="archivo-anual", daemon=True).start()
                 
         except Exception as e:
             logger.error(f"Error verificando respaldos: {e}")
@@ -568,6 +627,16 @@ class EnhancedApp(tk.Tk):
         audit_menu.add_command(label="Ver Auditoría de Recetas", command=self.show_audit_log)
         audit_menu.add_command(label="Crear Respaldo Manual", command=self.manual_backup)
         audit_menu.add_command(label="Verificar Integridad", command=self.verify_integrity)
+        audit_menu.add_command(label="Estadísticas de Recetas", command=self.show_statistics)
+        audit_menu.add_command(label="Diagnóstico", command=self.show_diagnostico)
+
+        # Menú de Farmacia
+        farmacia_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Farmacia", menu=farmacia_menu)
+        farmacia_menu.add_command(label="Reporte de Consumo (CSV)", command=lambda: self.reporte_consumo("csv"))
+        farmacia_menu.add_command(label="Reporte de Consumo (PDF)", command=lambda: self.reporte_consumo("pdf"))
+        farmacia_menu.add_separator()
+        farmacia_menu.add_command(label="Verificar / Dispensar Receta (QR)", command=self.show_verificacion)
 
     def create_ui(self):
         """Crea la interfaz de usuario"""
@@ -577,11 +646,34 @@ class EnhancedApp(tk.Tk):
         
         nb.add(self.tab_form, text="Nueva Receta")
         nb.add(self.tab_search, text="Buscar / Reimprimir")
+
+        # Barra de estado de sincronización con la base central
+        self.lbl_sync = ttk.Label(self, text="", anchor="w", padding=(8, 2))
+        self.lbl_sync.pack(side="bottom", fill="x")
         nb.pack(fill="both", expand=True)
+        if BANDEJA_SALIDA or IMPRESORA:
+            self.actualizar_estado_sync()
 
         self.create_form_tab()
         self.create_search_tab()
 
+    def actualizar_estado_sync(self):
+        """Refresca la barra de estado con los pendientes de la bandeja de salida y de la impresora"""
+        try:
+            partes, alerta = [], False
+            if BANDEJA_SALIDA:
+                b = bandeja()
+                partes.append(b.estado())
+                alerta = b.conectado is False or b.pendientes()[2] > 0
+            cola = cola_impresion()
+            if cola:
+                partes.append(cola.estado())
+                alerta = alerta or bool(cola.ultimo_error) or cola.pendientes()[1] > 0
+            self.lbl_sync.config(text="  ||  ".join(partes), foreground="red" if alerta else "")
+        except Exception as e:
+            self.lbl_sync.config(text=f"Sincronización: error ({e})", foreground="red")
+        self.after(3000, self.actualizar_estado_sync)
+
     def create_form_tab(self):
         """Crea la pestaña del formulario con campos adicionales de seguridad"""
         f = self.tab_form
@@ -647,6 +739,9 @@ class EnhancedApp(tk.Tk):
         ttk.Label(f, text="CI:").grid(row=row, column=4, sticky="e")
         self.ci = tk.Entry(f, width=20)
         self.ci.grid(row=row, column=5, sticky="w")
+        self.ci.bind("<FocusOut>", lambda e: self.autofill_paciente())
+        self.ci.bind("<Return>", lambda e: self.autofill_paciente())
+        self.ci.bind("<KeyRelease>", lambda e: self.autofill_paciente(al_escribir=True))
 
         row += 1
         
@@ -698,6 +793,7 @@ class EnhancedApp(tk.Tk):
             except Exception:
                 pass
         
+        self.calc_edad_from_dob = calc_edad_from_dob
         self.fecha_nacimiento.bind("<FocusOut>", calc_edad_from_dob)
         self.fecha_nacimiento.bind("<Return>", calc_edad_from_dob)
 
@@ -813,6 +909,10 @@ class EnhancedApp(tk.Tk):
         ttk.Button(button_frame_med, text="Agregar", command=self.add_med).pack(side="left", padx=(0, 10))
         ttk.Button(button_frame_med, text="Eliminar Seleccionado", command=self.remove_med).pack(side="left", padx=(0, 10))
         ttk.Button(button_frame_med, text="Lista Medicamentos", command=self.show_medicamentos_list).pack(side="left")
+        plantillas_btn = ttk.Menubutton(button_frame_med, text="Plantillas")
+        self.menu_plantillas = tk.Menu(plantillas_btn, tearoff=0, postcommand=self.actualizar_menu_plantillas)
+        plantillas_btn.config(menu=self.menu_plantillas)
+        plantillas_btn.pack(side="left", padx=(10, 0))
 
         row += 1
         
@@ -841,13 +941,19 @@ class EnhancedApp(tk.Tk):
         def imprimir_indicaciones():
             try:
                 data = self.collect_form()
-                data["fecha_nacimiento"] = getattr(self, "fecha_nacimiento", tk.Entry()).get() if hasattr(self, "fecha_nacimiento") else ""
-                from pdf_layout_fixed import build_indicaciones_pdf
-                output_dir = DEFAULT_OUTPUT
-                os.makedirs(output_dir, exist_ok=True)
-                nombre_pdf = (self.numero_var.get() or "INDICACIONES") + "_indicaciones.pdf"
-                out_path = os.path.join(output_dir, nombre_pdf)
-                build_indicaciones_pdf(out_path, data)
+                numero = self.numero_var.get()
+                previa = self._hoja_indicaciones
+                if (previa and previa[0] == numero and os.path.exists(previa[2])
+                        and previa[1] == {c: data.get(c) for c in CAMPOS_INDICACIONES}):
+                    # Ya se generó al guardar la receta y el formulario no cambió
+                    out_path = previa[2]
+                else:
+                    output_dir = DEFAULT_OUTPUT
+                    os.makedirs(output_dir, exist_ok=True)
+                    nombre_pdf = (numero or "INDICACIONES") + "_indicaciones.pdf"
+                    out_path = os.path.join(output_dir, nombre_pdf)
+                    with span("pdf.indicaciones"):
+                        build_indicaciones_pdf(out_path, data)
                 open_file_cross_platform(out_path)
                 messagebox.showinfo("Indicaciones", f"PDF de indicaciones generado: {out_path}")
             except Exception as e:
@@ -857,18 +963,25 @@ class EnhancedApp(tk.Tk):
         ttk.Button(button_frame, text="Limpiar", command=self.clear_form).pack(side="left")
 
         # Ajustes según rol del usuario autenticado
+        self.aplicar_rol_usuario()
+
+    def aplicar_rol_usuario(self):
+        """Prescriptor, especialidad y tipos permitidos según self.user_info (al crear el formulario y al recargar usuarios)"""
+        f = self.tab_form
         try:
             rol = (self.user_info.get("rol","")).upper()
             esp = (self.user_info.get("especialidad","") or "").upper().strip()
             nombre_comp = self.user_info.get("nombre_completo","")
 
             # Prescriptor: nombre y apellidos completos (readonly)
+            self.prescriptor.config(state="normal")
             self.prescriptor.delete(0, "end")
             self.prescriptor.insert(0, nombre_comp)
             self.prescriptor.config(state="readonly")
 
             # Set especialidad en el campo y bloquear edición
             try:
+                self.prescriptor_especialidad.config(state="normal")
                 self.prescriptor_especialidad.delete(0, "end")
                 self.prescriptor_especialidad.insert(0, esp if esp else "MEDICO ESPECIALISTA")
                 self.prescriptor_especialidad.config(state="readonly")
@@ -876,15 +989,14 @@ class EnhancedApp(tk.Tk):
                 logger.warning(f"No se pudo fijar especialidad: {_e}")
 
             # Restricciones por rol
-            if rol == "RESIDENTE":
-                # Tipo: solo EM (amarillo) y EH (rojo) -> deshabilitar CE
-                for child in f.grid_slaves():
-                    if isinstance(child, ttk.Radiobutton) and "Consulta Externa" in str(child.cget("text")):
-                        child.state(["disabled"])
-                # No hay servicio; especialidad queda fija del usuario
-            else:
-                # ESPECIALISTA: puede CE/EM/EH
-                pass
+            # Tipo: RESIDENTE solo EM (amarillo) y EH (rojo) -> deshabilitar CE;
+            # ESPECIALISTA: puede CE/EM/EH
+            residente = rol == "RESIDENTE"
+            for child in f.grid_slaves():
+                if isinstance(child, ttk.Radiobutton) and "Consulta Externa" in str(child.cget("text")):
+                    child.state(["disabled"] if residente else ["!disabled"])
+            if residente and self.tipo.get() == "CE":
+                self.tipo.set("EM")
 
         except Exception as e:
             logger.error(f"Error aplicando restricciones por rol: {e}")
@@ -903,297 +1015,164 @@ class EnhancedApp(tk.Tk):
         self.result_label = ttk.Label(s, text="")
         self.result_label.grid(row=1, column=0, columnspan=4, sticky="w", padx=6)
 
-    def load_medicamentos(self):
-        """Carga la lista de medicamentos desde el CSV"""
-        medicamentos = []
-        try:
-            if not os.path.exists(MEDICAMENTOS_CSV):
-                logger.warning(f"Archivo de medicamentos no encontrado: {MEDICAMENTOS_CSV}")
-                return medicamentos
-            
+    @medido("catalogo.cargar")
+    def load_catalogos(self):
+        """CIE-10 y stock compilados (catalogo_binario.py); si no se puede, los CSV en memoria"""
+        stock = stock_vigente()
+        for path in (CIE10_CSV, stock):
+            if not os.path.exists(path):
+                logger.warning(f"Catálogo no encontrado: {path}")
+        catalogo = cargar_catalogos(CIE10_CSV, stock, os.path.join(LOCAL_DATA_DIR, "catalogos"))
+        logger.info(f"Catálogos: {len(catalogo.cie)} códigos CIE-10, {len(catalogo.medicamentos)} medicamentos "
+                    f"({catalogo.path or 'en memoria'})")
+        return catalogo
+
+    def reconstruir_catalogos(self, cie_path, stock_path):
+        """Hilo de recarga: compila el catálogo nuevo y su tabla de principios activos"""
+        catalogo = cargar_catalogos(cie_path, stock_path, os.path.join(LOCAL_DATA_DIR, "catalogos"))
+        return catalogo, TablasPrincipios(catalogo.medicamentos)
+
+    def aplicar_recargas(self):
+        """Aplica en el hilo de la interfaz lo que el vigilante dejó reconstruido"""
+        while True:
             try:
-                df = pd.read_csv(MEDICAMENTOS_CSV, sep='|')
-                if 'nombre' in df.columns:
-                    medicamentos = df['nombre'].dropna().tolist()
-                else:
-                    medicamentos = df.iloc[:, 0].dropna().tolist()
-            except:
-                with open(MEDICAMENTOS_CSV, 'r', encoding='utf-8') as f:
-                    reader = csv.reader(f, delimiter='|')
-                    for row in reader:
-                        if row and len(row) > 0:
-                            medicamento = row[0].strip()
-                            if medicamento and not medicamento.startswith('nombre'):
-                                medicamentos.append(medicamento)
-            
-            logger.info(f"Medicamentos cargados: {len(medicamentos)}")
-            return medicamentos
-            
-        except Exception as e:
-            logger.error(f"Error cargando medicamentos: {e}")
-            return []
-
-    def load_cie10(self):
-        """Carga el CSV de CIE-10 en un diccionario {CODE: DESC}"""
-        idx = {}
-        try:
-            if not os.path.exists(CIE10_CSV):
-                logger.warning(f"Archivo CIE-10 no encontrado: {CIE10_CSV}")
-                return idx
-                
-            with open(CIE10_CSV, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-            cie_pattern = r'\b([A-Z]\d{2}(?:\.\d+)?)\b'
-            lines = content.split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                    
-                matches = re.findall(cie_pattern, line)
-                
-                for code in matches:
-                    code_pos = line.find(code)
-                    if code_pos != -1:
-                        desc_start = code_pos + len(code)
-                        desc = line[desc_start:].strip()
-                        desc = re.sub(r'^[^\w]*', '', desc)
-                        desc = desc.split('  ')[0]
-                        
-                        if desc and len(desc) > 3:
-                            idx[code.upper()] = desc[:200]
-            
-            if not idx:
-                try:
-                    with open(CIE10_CSV, 'r', encoding='utf-8') as f:
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            code = (row.get('code') or row.get('codigo') or '').strip().upper()
-                            desc = (row.get('desc') or row.get('descripcion') or '').strip()
-                            if code and desc:
-                                idx[code] = desc
-                except:
-                    pass
-            
-            if not idx:
-                common_codes = {
-                    'Z00.0': 'Examen médico general',
-                    'Z51.1': 'Quimioterapia para neoplasia',
-                    'I10': 'Hipertensión esencial (primaria)',
-                    'E11': 'Diabetes mellitus no insulinodependiente',
-                    'J06.9': 'Infección aguda de las vías respiratorias superiores, no especificada',
-                    'K59.0': 'Estreñimiento',
-                    'M79.3': 'Paniculitis, no especificada',
-                    'R50.9': 'Fiebre, no especificada',
-                    'R06.0': 'Disnea',
-                    'R51': 'Cefalea'
-                }
-                idx.update(common_codes)
-                
-            logger.info(f"CIE-10: Cargados {len(idx)} códigos")
-            
-        except Exception as e:
-            logger.error(f"Error cargando CIE-10: {e}")
-            messagebox.showwarning("CIE-10", f"Error al cargar catálogo CIE-10: {e}")
-            
-        return idx
+                aplicar, nuevo = self._recargas.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                aplicar(nuevo)
+            except Exception as e:
+                logger.error(f"Error aplicando la recarga: {e}")
+        self.after(1000, self.aplicar_recargas)
+
+    def aplicar_catalogos(self, nuevo):
+        """Reemplaza catálogo e índices de una vez y refresca las sugerencias abiertas"""
+        catalogo, tablas = nuevo
+        anterior = self.catalogo
+        self.catalogo = catalogo
+        self.cie_index = catalogo.cie
+        self.cie_items = catalogo.cie_items
+        self.medicamentos_list = catalogo.medicamentos
+        self.tablas_principios = tablas
+        for ventana in (self._ventana_cie, self._ventana_med):
+            if ventana:
+                ventana.refrescar()
+        anterior.cerrar()
+        log_access(self.current_user, "RECARGA_CATALOGOS",
+                   f"{len(catalogo.cie)} códigos CIE-10, {len(catalogo.medicamentos)} medicamentos")
+        if self.sugerencias_cie.visible:
+            self.show_cie_suggestions(self._cie_desde_desc)
+        if self.sugerencias_med.visible:
+            self.show_medicamento_suggestions()
+
+    def aplicar_usuarios(self, user_dir):
+        """Nueva lista de usuarios; aplica al formulario el rol y la especialidad del usuario actual si cambiaron"""
+        self.user_dir = user_dir
+        username = self.user_info.get('username')
+        actual = user_dir.get(username)
+        if not actual:
+            # Dado de baja en la lista: sigue la sesión abierta, el próximo ingreso lo rechaza
+            log_access(self.current_user, "RECARGA_USUARIOS", f"{len(user_dir)} usuarios; {username} ya no figura")
+            return
+        anterior = self.user_info
+        self.user_info = actual | {'username': username}
+        cambios = [f"{campo}: {anterior.get(campo)} -> {self.user_info.get(campo)}"
+                   for campo in ('rol', 'especialidad', 'nombre_completo')
+                   if anterior.get(campo) != self.user_info.get(campo)]
+        if cambios:
+            self.aplicar_rol_usuario()
+            self.current_user = self.user_info.get('nombre_completo', self.current_user)
+            # Preferencias por prescriptor y especialidad
+            self.modelo_uso = ModeloUso(self.prescriptor.get(), self.prescriptor_especialidad.get())
+            threading.Thread(target=self.cargar_preferencias, name="preferencias", daemon=True).start()
+        log_access(self.current_user, "RECARGA_USUARIOS",
+                   f"{len(user_dir)} usuarios" + (f"; {'; '.join(cambios)}" if cambios else ""))
+
+    def preparar_ventanas_catalogo(self):
+        """Construye ocultas las listas de catálogo para que la primera apertura también sea inmediata"""
+        with span("arranque.ventanas_catalogo"):
+            self.ventana_cie()
+            self.ventana_medicamentos()
+
+    def ventana_cie(self):
+        if self._ventana_cie is None:
+            self._ventana_cie = VentanaCatalogo(
+                self, "Lista de Códigos CIE-10", ("Código CIE-10", "Descripción"),
+                lambda texto: self.catalogo.filtrar_cie(texto), self.elegir_cie, anchos={0: 120},
+            )
+        return self._ventana_cie
+
+    def ventana_medicamentos(self):
+        if self._ventana_med is None:
+            self._ventana_med = VentanaCatalogo(
+                self, "Lista de Medicamentos Disponibles", ("Medicamento",),
+                lambda texto: ((med,) for med in self.catalogo.filtrar_medicamentos(texto)),
+                lambda fila: self.elegir_medicamento(fila[0]), geometria="1000x600", anchos={0: 940},
+            )
+        return self._ventana_med
 
     def show_cie10_list(self):
-        """Muestra una ventana con la lista completa de códigos CIE-10 - FIXED"""
+        """Muestra la lista completa de códigos CIE-10 (como quedó la última vez)"""
         if not self.cie_index:
             messagebox.showinfo("CIE-10", "No se ha cargado el catálogo CIE-10")
             return
-            
-        cie_window = tk.Toplevel(self)
-        cie_window.title("Lista de Códigos CIE-10")
-        cie_window.geometry("900x600")
-        
-        main_frame = ttk.Frame(cie_window)
-        main_frame.pack(fill="both", expand=True, padx=10, pady=10)
-        
-        search_frame = ttk.Frame(main_frame)
-        search_frame.pack(fill="x", pady=(0, 10))
-        
-        ttk.Label(search_frame, text="Buscar:").pack(side="left")
-        search_var = tk.StringVar()
-        search_entry = tk.Entry(search_frame, textvariable=search_var, width=50)
-        search_entry.pack(side="left", padx=(5, 10))
-        
-        columns = ("codigo", "descripcion")
-        tree = ttk.Treeview(main_frame, columns=columns, show="headings", height=20)
-        
-        tree.heading("codigo", text="Código CIE-10")
-        tree.heading("descripcion", text="Descripción")
-        
-        tree.column("codigo", width=120, anchor="w")
-        tree.column("descripcion", width=600, anchor="w")
-        
-        v_scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=tree.yview)
-        h_scrollbar = ttk.Scrollbar(main_frame, orient="horizontal", command=tree.xview)
-        tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
-        
-        tree.pack(side="left", fill="both", expand=True)
-        v_scrollbar.pack(side="right", fill="y")
-        h_scrollbar.pack(side="bottom", fill="x")
-        
-        def filter_list():
-            search_text = search_var.get().lower()
-            tree.delete(*tree.get_children())
-            
-            for code, desc in sorted(self.cie_index.items()):
-                if (search_text in code.lower() or 
-                    search_text in desc.lower()):
-                    tree.insert("", "end", values=(code, desc))
-        
-        def select_code(event):
-            selection = tree.selection()
-            if selection:
-                item = tree.item(selection[0])
-                code, desc = item['values']
-                
-                self.cie.delete(0, "end")
-                self.cie.insert(0, code)
-                self.cie_desc.delete(0, "end")
-                self.cie_desc.insert(0, desc)
-                
-                cie_window.destroy()
-        
-        search_entry.bind("<KeyRelease>", lambda e: filter_list())
-        tree.bind("<Double-1>", select_code)
-        
-        button_frame = ttk.Frame(main_frame)
-        button_frame.pack(fill="x", pady=(10, 0))
-        
-        ttk.Button(button_frame, text="Seleccionar", 
-                  command=lambda: select_code(None) if tree.selection() else None).pack(side="left")
-        ttk.Button(button_frame, text="Cerrar", 
-                  command=cie_window.destroy).pack(side="right")
-        
-        filter_list()
-        search_entry.focus()
+        self.ventana_cie().mostrar()
 
     def show_medicamentos_list(self):
-        """Muestra una ventana con la lista completa de medicamentos - FIXED"""
+        """Muestra la lista completa de medicamentos (como quedó la última vez)"""
         if not self.medicamentos_list:
             messagebox.showinfo("Medicamentos", "No se ha cargado el catálogo de medicamentos")
             return
-            
-        med_window = tk.Toplevel(self)
-        med_window.title("Lista de Medicamentos Disponibles")
-        med_window.geometry("1000x600")
-        
-        main_frame = ttk.Frame(med_window)
-        main_frame.pack(fill="both", expand=True, padx=10, pady=10)
-        
-        search_frame = ttk.Frame(main_frame)
-        search_frame.pack(fill="x", pady=(0, 10))
-        
-        ttk.Label(search_frame, text="Buscar:").pack(side="left")
-        search_var = tk.StringVar()
-        search_entry = tk.Entry(search_frame, textvariable=search_var, width=60)
-        search_entry.pack(side="left", padx=(5, 10))
-        
-        listbox_frame = ttk.Frame(main_frame)
-        listbox_frame.pack(fill="both", expand=True)
-        
-        listbox = tk.Listbox(listbox_frame, width=120, height=25)
-        scrollbar = ttk.Scrollbar(listbox_frame, orient="vertical", command=listbox.yview)
-        listbox.configure(yscrollcommand=scrollbar.set)
-        
-        listbox.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        
-        def filter_list():
-            search_text = search_var.get().lower()
-            listbox.delete(0, tk.END)
-            
-            for medicamento in self.medicamentos_list:
-                if search_text in medicamento.lower():
-                    listbox.insert(tk.END, medicamento)
-        
-        def select_medicamento(event=None):
-            selection = listbox.curselection()
-            if selection:
-                medicamento = listbox.get(selection[0])
-                
-                self.m_nombre.delete(0, "end")
-                self.m_nombre.insert(0, medicamento)
-                
-                med_window.destroy()
-        
-        search_entry.bind("<KeyRelease>", lambda e: filter_list())
-        listbox.bind("<Double-1>", select_medicamento)
-        
-        button_frame = ttk.Frame(main_frame)
-        button_frame.pack(fill="x", pady=(10, 0))
-        
-        ttk.Button(button_frame, text="Seleccionar", 
-                  command=select_medicamento).pack(side="left")
-        ttk.Button(button_frame, text="Cerrar", 
-                  command=med_window.destroy).pack(side="right")
-        
-        filter_list()
-        search_entry.focus()
+        self.ventana_medicamentos().mostrar()
+
+    def elegir_cie(self, item):
+        """Llena código y descripción con (code, desc)"""
+        code, desc = item
+        self.cie.delete(0, "end")
+        self.cie.insert(0, code)
+        self.cie_desc.delete(0, "end")
+        self.cie_desc.insert(0, desc)
+        self.hide_cie_suggestions()
+
+    def elegir_medicamento(self, medicamento):
+        self.m_nombre.delete(0, "end")
+        self.m_nombre.insert(0, medicamento)
 
     def show_medicamento_suggestions(self):
         """Muestra sugerencias de medicamentos mientras se escribe - FIXED"""
         try:
-            query = self.m_nombre.get().lower().strip()
-            if len(query) < 3:
-                self.hide_medicamento_suggestions()
-                return
-            
-            matches = [med for med in self.medicamentos_list if query in med.lower()]
-            matches = matches[:10]
-            
+            with span("busqueda.medicamentos"):
+                matches = self.catalogo.buscar_medicamentos(self.m_nombre.get(),
+                                                            preferidos=self.modelo_uso.medicamentos_preferidos())
             if not matches:
                 self.hide_medicamento_suggestions()
                 return
-            
-            if not hasattr(self, '_med_win') or not self._med_win or not self._med_win.winfo_exists():
-                self._med_win = tk.Toplevel(self)
-                self._med_win.overrideredirect(True)
-                self._med_list = tk.Listbox(self._med_win, height=8, width=100)
-                self._med_list.pack(fill='both', expand=True)
-                self._med_list.bind('<Double-Button-1>', lambda e: self.pick_medicamento_suggestion())
-                self._med_list.bind('<Return>', lambda e: self.pick_medicamento_suggestion())
-            else:
-                self._med_list.delete(0, 'end')
-            
-            for med in matches:
-                self._med_list.insert('end', med)
-            
-            x = self.m_nombre.winfo_rootx()
-            y = self.m_nombre.winfo_rooty() + self.m_nombre.winfo_height()
-            self._med_win.geometry(f"800x160+{x}+{y}")
-            self._med_win.deiconify()
-            
+            self.sugerencias_med.mostrar(matches, self.m_nombre)
         except Exception:
             pass
 
     def hide_medicamento_suggestions(self):
         try:
-            if hasattr(self, '_med_win') and self._med_win and self._med_win.winfo_exists():
-                self._med_win.withdraw()
+            self.sugerencias_med.ocultar()
         except Exception:
             pass
 
-    def pick_medicamento_suggestion(self):
-        """Toma el medicamento seleccionado y llena el campo"""
-        try:
-            if not hasattr(self, '_med_list'):
-                return
-            sel = self._med_list.curselection()
-            if not sel:
-                return
-            medicamento = self._med_list.get(sel[0])
-            self.m_nombre.delete(0, 'end')
-            self.m_nombre.insert(0, medicamento)
-            self.hide_medicamento_suggestions()
-        except Exception:
-            pass
+    def elegir_medicamento_sugerido(self, medicamento):
+        """Llena el campo con la sugerencia y la pauta habitual del prescriptor"""
+        self.elegir_medicamento(medicamento)
+        self.aplicar_pauta_habitual(medicamento)
+
+    def aplicar_pauta_habitual(self, nombre):
+        """Completa dosis, frecuencia, vía y duración con la pauta más usada (sólo campos vacíos)"""
+        pauta = self.modelo_uso.pauta_habitual(nombre)
+        if not pauta:
+            return
+        for entry, campo in ((self.m_dosis, "dosis"), (self.m_dur, "duracion")):
+            if pauta[campo] and not entry.get().strip():
+                entry.insert(0, pauta[campo])
+        for combo, campo in ((self.m_frec, "frecuencia"), (self.m_via, "via")):
+            if pauta[campo] and not combo.get():
+                combo.set(pauta[campo])
 
     def autofill_cie_desc(self, partial=False):
         """Autorrellena la descripción desde el catálogo CIE-10 - FIXED"""
@@ -1210,195 +1189,165 @@ class EnhancedApp(tk.Tk):
                     pass
         self.show_cie_suggestions()
 
+    def autofill_paciente(self, al_escribir=False):
+        """
+        Completa los datos del paciente desde el maestro por CI (sólo campos
+        vacíos). Lo que no está en la caché se consulta en un hilo de fondo: la
+        tecla no espera a la central ni al servidor.
+        """
+        ci = (self.ci.get() or "").strip()
+        if not validate_ci(ci):
+            return
+        self.precargar_historial(ci)
+        if ci == self._ci_autocompletada:
+            return
+        encontrado, p = self.cache_pacientes.en_cache(ci)
+        if encontrado:
+            self.aplicar_paciente(ci, p)
+            return
+        if ci in self._ci_consultando:
+            return
+        self._ci_consultando.add(ci)
+
+        def consultar():
+            p = None
+            try:
+                with span("pacientes.consulta"):
+                    p = self.cache_pacientes.obtener(ci)
+            finally:
+                self.after(0, lambda: (self._ci_consultando.discard(ci), self.aplicar_paciente(ci, p)))
+        threading.Thread(target=consultar, name="paciente", daemon=True).start()
+
+    def precargar_historial(self, ci):
+        """
+        Consulta en un hilo de fondo las recetas recientes de la CI en la central
+        para las alertas de repetición (guardar no espera a la central)
+        """
+        momento, _ = self._historial.get(ci, (None, None))
+        if momento is not None and time.monotonic() - momento < SEGUNDOS_HISTORIAL:
+            return
+        if ci in self._historial_consultando or (BANDEJA_SALIDA and bandeja().conectado is False):
+            return
+        self._historial_consultando.add(ci)
+
+        def consultar():
+            recientes = None
+            try:
+                with span("historial.precarga"):
+                    recientes = backend().medicamentos_recientes(ci, DIAS_REPETICION)
+            except Exception as e:
+                logger.warning(f"Historial de medicamentos no disponible: {e}")
+            finally:
+                self.after(0, lambda: self.aplicar_historial(ci, recientes))
+        threading.Thread(target=consultar, name="historial", daemon=True).start()
+
+    def aplicar_historial(self, ci, recientes):
+        """Guarda el historial precargado (en el hilo de la interfaz); None si falló la consulta"""
+        self._historial_consultando.discard(ci)
+        if recientes is not None:
+            self._historial[ci] = (time.monotonic(), recientes)
+
+    def aplicar_paciente(self, ci, p):
+        """Llena los campos vacíos con el paciente p si la CI sigue siendo la del formulario"""
+        if not p or ci != (self.ci.get() or "").strip() or ci == self._ci_autocompletada:
+            return
+        with span("pacientes.autocompletar"):
+            self._ci_autocompletada = ci
+            for widget, campo in ((self.paciente, "paciente"), (self.hc, "hc"), (self.talla, "talla"),
+                                  (self.peso, "peso"), (self.fecha_nacimiento, "fecha_nacimiento"),
+                                  (self.alergias_especificar, "alergias_especificar")):
+                if p.get(campo) and not widget.get().strip():
+                    widget.insert(0, p[campo])
+            for combo, campo in ((self.sexo, "sexo"), (self.alergias, "alergias")):
+                if p.get(campo) and not combo.get():
+                    combo.set(p[campo])
+            if p.get("fecha_nacimiento"):
+                self.calc_edad_from_dob()
+
     def show_cie_suggestions(self, from_desc: bool=False):
         """Muestra un menú flotante de sugerencias (código + descripción) - FIXED"""
         try:
             if not self.cie_items:
                 return
+            self._cie_desde_desc = from_desc
             if from_desc:
-                q = (self.cie_desc.get() or '').strip().lower()
-                if len(q) < 3:
-                    self.hide_cie_suggestions(); return
-                def match(item):
-                    c, d = item; return q in (d or '').lower()
+                q = self.cie_desc.get()
             else:
-                q = (self.cie.get() or '').strip().upper()
-                if len(q) < 1:
-                    self.hide_cie_suggestions(); return
-                def match(item):
-                    c, d = item; return c.startswith(q)
-            results = [it for it in self.cie_items if match(it)]
-            results = results[:12]
+                q = self.cie.get()
+            with span("busqueda.cie"):
+                cie_index = self.cie_index or {}
+                preferidos = ((c, cie_index[c]) for c in self.modelo_uso.cie_preferidos() if c in cie_index)
+                results = self.catalogo.buscar_cie(q, por_descripcion=from_desc, preferidos=preferidos)
             if not results:
                 self.hide_cie_suggestions(); return
 
-            if not hasattr(self, '_cie_win') or not self._cie_win or not self._cie_win.winfo_exists():
-                self._cie_win = tk.Toplevel(self)
-                self._cie_win.overrideredirect(True)
-                self._cie_list = tk.Listbox(self._cie_win, height=8, width=80)
-                self._cie_list.pack(fill='both', expand=True)
-                self._cie_list.bind('<Double-Button-1>', lambda e: self.pick_cie_suggestion())
-                self._cie_list.bind('<Return>', lambda e: self.pick_cie_suggestion())
-            else:
-                self._cie_list.delete(0, 'end')
-
-            for c, d in results:
-                self._cie_list.insert('end', f"{c} — {d}")
-
-            widget = self.cie_desc if from_desc else self.cie
-            x = widget.winfo_rootx()
-            y = widget.winfo_rooty() + widget.winfo_height()
-            self._cie_win.geometry(f"600x160+{x}+{y}")
-            self._cie_win.deiconify()
+            self.sugerencias_cie.mostrar(results, self.cie_desc if from_desc else self.cie)
         except Exception:
             pass
 
     def hide_cie_suggestions(self):
         try:
-            if hasattr(self, '_cie_win') and self._cie_win and self._cie_win.winfo_exists():
-                self._cie_win.withdraw()
-        except Exception:
-            pass
-
-    def pick_cie_suggestion(self):
-        """Toma el seleccionado y llena código y descripción."""
-        try:
-            if not hasattr(self, '_cie_list'):
-                return
-            sel = self._cie_list.curselection()
-            if not sel:
-                return
-            text = self._cie_list.get(sel[0])
-            if '—' in text:
-                code, desc = text.split('—', 1)
-                code = code.strip(); desc = desc.strip()
-                self.cie.delete(0, 'end'); self.cie.insert(0, code)
-                self.cie_desc.delete(0, 'end'); self.cie_desc.insert(0, desc)
-            self.hide_cie_suggestions()
+            self.sugerencias_cie.ocultar()
         except Exception:
             pass
 
     def search_cie10_dialog(self):
-        """Abre un diálogo de búsqueda rápida de CIE-10 - FIXED"""
+        """Búsqueda rápida de CIE-10: la lista completa filtrada por lo escrito en el código"""
         if not self.cie_index:
             messagebox.showinfo("CIE-10", "No se ha cargado el catálogo CIE-10")
             return
-            
-        search_text = simpledialog.askstring("Buscar CIE-10", 
-                                           "Ingrese código o descripción a buscar:")
-        if not search_text:
-            return
-            
-        search_text = search_text.lower()
-        results = []
-        
-        for code, desc in self.cie_index.items():
-            if (search_text in code.lower() or 
-                search_text in desc.lower()):
-                results.append((code, desc))
-                
-        if not results:
-            messagebox.showinfo("Búsqueda", "No se encontraron resultados")
-            return
-            
-        if len(results) == 1:
-            code, desc = results[0]
-            self.cie.delete(0, "end")
-            self.cie.insert(0, code)
-            self.cie_desc.delete(0, "end")
-            self.cie_desc.insert(0, desc)
-            messagebox.showinfo("CIE-10", f"Código seleccionado: {code}")
-        else:
-            result_window = tk.Toplevel(self)
-            result_window.title(f"Resultados de búsqueda: {len(results)} encontrados")
-            result_window.geometry("800x400")
-            
-            listbox = tk.Listbox(result_window, width=100, height=20)
-            listbox.pack(fill="both", expand=True, padx=10, pady=10)
-            
-            for code, desc in results[:50]:
-                listbox.insert("end", f"{code} - {desc}")
-                
-            def select_result():
-                selection = listbox.curselection()
-                if selection:
-                    selected_text = listbox.get(selection[0])
-                    code = selected_text.split(" - ")[0]
-                    desc = " - ".join(selected_text.split(" - ")[1:])
-                    
-                    self.cie.delete(0, "end")
-                    self.cie.insert(0, code)
-                    self.cie_desc.delete(0, "end")
-                    self.cie_desc.insert(0, desc)
-                    
-                    result_window.destroy()
-            
-            button_frame = ttk.Frame(result_window)
-            button_frame.pack(fill="x", padx=10, pady=5)
-            
-            ttk.Button(button_frame, text="Seleccionar", command=select_result).pack(side="left")
-            ttk.Button(button_frame, text="Cerrar", command=result_window.destroy).pack(side="right")
-            
-            listbox.bind("<Double-1>", lambda e: select_result())
+        self.ventana_cie().mostrar(self.cie.get().strip() or None)
 
     def validate(self, data):
         """Valida los datos del formulario con validaciones adicionales de seguridad"""
-        # Campos requeridos
-        required_fields = [
-            ("Paciente", data["paciente"]),
-            ("CI", data["ci"]),
-            ("CIE-10", data["cie"]),
-            ("Prescriptor", data["prescriptor"]),
-            ("Especialidad del Prescriptor", data.get("prescriptor_especialidad", ""))
-        ]
-        
-        for label, val in required_fields:
-            if not (val or "").strip():
-                messagebox.showerror("Campo requerido", f"Falta: {label}")
-                return False
-        
-        # Validar CI
-        if not validate_ci(data["ci"]):
-            messagebox.showerror("Validación", "CI no válida (mínimo 10 caracteres alfanuméricos)")
+        # Mismas reglas que la ingesta masiva (validacion_recetas.py); se muestra el primer error
+        errores = validar_receta(data, getattr(self, 'cie_index', None), todos=False)
+        if errores:
+            messagebox.showerror(*errores[0])
             return False
-        
-        # NUEVA VALIDACIÓN: Correspondencia profesional-servicio
-        if not validate_professional_service(data["servicio"], data.get("prescriptor_especialidad", "")):
-            messagebox.showerror(
-                "Validación Profesional", 
-                f"La especialidad '{data.get('prescriptor_especialidad', '')}' no está autorizada para el servicio '{data['servicio']}'"
-            )
+
+        if not self.confirmar_alertas(data):
             return False
         
-        # Validar campos numéricos
-        if data["edad"] and not validate_numeric(data["edad"], "Edad", 0, 150):
-            return False
-            
-        if data["meses"] and not validate_numeric(data["meses"], "Meses", 0, 11):
-            return False
-            
-        if data["talla"] and not validate_numeric(data["talla"], "Talla", 0, 300):
-            return False
-            
-        if data["peso"] and not validate_numeric(data["peso"], "Peso", 0, 1000):
-            return False
+        try:
+            self.cie_desc.delete(0, "end")
+            self.cie_desc.insert(0, data.get("cie_desc", ""))
+        except Exception:
+            pass
         
-        # Validar medicamentos
-        if len(data["meds"]) == 0:
-            messagebox.showerror("Medicamentos", "Agregue al menos un medicamento.")
+        return True
+
+    def historial_medicamentos(self, ci):
+        """
+        Recetas recientes de la CI para las alertas de repetición, sin esperar a
+        la central: las precargadas al escribir la CI (si ya llegaron), las
+        guardadas en esta sesión y las que siguen en la bandeja de salida
+        """
+        _, central = self._historial.get(ci, (None, []))
+        if ci not in self._historial:
+            logger.info(f"Historial de la central aún no disponible para la CI {ci}")
+            self.precargar_historial(ci)
+        pendientes = []
+        if BANDEJA_SALIDA:
+            try:
+                pendientes = bandeja().medicamentos_recientes(ci, DIAS_REPETICION)
+            except Exception as e:
+                logger.warning(f"Recetas de la bandeja no disponibles para alertas: {e}")
+        return unir_historial(central, self._historial_sesion.get(ci, []), pendientes)
+
+    def confirmar_alertas(self, data):
+        """Alergias, duplicidades y repeticiones (alertas_clinicas.py); True si se puede guardar"""
+        with span("alertas.revisar"):
+            recientes = self.historial_medicamentos(data["ci"].strip())
+            alertas = revisar_receta(data, self.tablas_principios, recientes)
+        if not alertas:
+            return True
+        texto = "\n\n".join(f"{titulo}: {mensaje}" for titulo, mensaje in alertas)
+        if not messagebox.askyesno("Alertas clínicas", f"{texto}\n\n¿Guardar la receta de todos modos?",
+                                   icon="warning"):
             return False
-        
-        # Si tenemos catálogo CIE-10 y el código existe, aseguramos descripción estándar
-        if hasattr(self, 'cie_index') and self.cie_index and data["cie"]:
-            desc = self.cie_index.get(data["cie"].strip().upper())
-            if desc:
-                data["cie_desc"] = desc
-                try:
-                    self.cie_desc.delete(0, "end")
-                    self.cie_desc.insert(0, desc)
-                except Exception:
-                    pass
-        
+        log_access(self.current_user, "ALERTA_CLINICA",
+                   f"CI {data['ci']}: guardada con {len(alertas)} alerta(s): " + "; ".join(t for t, _ in alertas))
         return True
 
     def save_and_pdf(self):
@@ -1407,7 +1356,8 @@ class EnhancedApp(tk.Tk):
         if not self.validate(data):
             return
             
-        if not ensure_db():
+        # Con bandeja de salida, guardar no depende de la base central
+        if not BANDEJA_SALIDA and not ensure_db():
             return
             
         try:
@@ -1429,64 +1379,152 @@ class EnhancedApp(tk.Tk):
             output_dir = DEFAULT_OUTPUT
             os.makedirs(output_dir, exist_ok=True)
             out_path = os.path.join(output_dir, f"{numero}.pdf")
+            ind_path = os.path.join(output_dir, f"{numero}_indicaciones.pdf") if data.get("indicaciones") else None
+
+            # ENHANCED: Calcular hash para integridad (antes del PDF: va en su código QR).
+            # La receta se serializa una sola vez: los mismos bytes son el payload guardado
+            canonico, data_hash = serializar_receta(data)
             
-            # Generar PDF
+            # Generar PDF (y, en la misma pasada, la hoja de indicaciones del paciente)
             try:
-                build_pdf(out_path, data, tipo=data["tipo"])            
+                with span("pdf.receta"):
+                    build_documentos(out_path, data, tipo=data["tipo"], indicaciones_path=ind_path,
+                                     codigo_verificacion=codigo_verificacion(numero, data_hash))
+                self._hoja_indicaciones = (numero, {c: data.get(c) for c in CAMPOS_INDICACIONES}, ind_path) \
+                    if ind_path else None
             except Exception as pdf_error:
                 logger.error(f"Error generando PDF: {pdf_error}")
                 messagebox.showerror("Error PDF", f"Error al generar PDF: {str(pdf_error)}")
                 return
             
-            # ENHANCED: Calcular hash para integridad
-            data_hash = calculate_hash(data)
-            
-            # Guardar en base de datos con campos adicionales de seguridad
-            conn = sqlite3.connect(db_path())
-            cur = conn.cursor()
-            
-            cur.execute("""
-                INSERT INTO recetas (
-                    id, numero, tipo, fecha, unidad, servicio, prescriptor, prescriptor_especialidad,
-                    paciente, ci, hc, edad, meses, sexo, talla, peso,
-                    cie, cie_desc, indicaciones, actividad_fisica, estado_enfermedad,
-                    alergias, alergias_especificar, payload, pdf_path,
-                    created_at, created_by, ip_address, hash_verificacion, estado
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """, (
-                str(uuid.uuid4()), numero, data["tipo"], data["fecha"], 
-                data["unidad"], data["servicio"], data["prescriptor"], data["prescriptor_especialidad"],
-                data["paciente"], data["ci"], data["hc"], data["edad"], 
-                data["meses"], data.get("sexo", ""), data["talla"], data["peso"],
-                data["cie"], data["cie_desc"], data["indicaciones"],
-                data["actividad_fisica"], data["estado_enfermedad"],
-                data["alergias"], data["alergias_especificar"],
-                json.dumps(data, ensure_ascii=False), out_path,
-                datetime.now().isoformat(), self.current_user, get_local_ip(), data_hash, "ACTIVA"
-            ))
-            
-            conn.commit()
-            conn.close()
+            # Guardar con campos adicionales de seguridad (recetas.db o servidor de recetas);
+            # los agregados de farmacia y estadísticas se actualizan en la misma transacción.
+            # Con bandeja de salida se confirma en la estación y se sincroniza después.
+            with span("receta.guardar"):
+                if BANDEJA_SALIDA:
+                    bandeja().encolar_receta(data, out_path, self.current_user, get_local_ip(), data_hash, canonico)
+                else:
+                    backend().guardar_receta(data, out_path, self.current_user, get_local_ip(), data_hash, canonico)
             
+            self.cache_pacientes.actualizar(data, datetime.now().isoformat())
+            self.modelo_uso.registrar(data)
+            self._historial_sesion.setdefault(data["ci"].strip(), []).append({
+                "numero": numero, "created_at": datetime.now().isoformat(),
+                "meds": [m.get("nombre") or "" for m in data.get("meds") or []]})
+
             # ENHANCED: Registrar en auditoría
             log_audit(numero, "CREACION", self.current_user, f"Receta creada para paciente {data['paciente']}", "", data_hash)
             
             # Log acceso
             log_access(self.current_user, "CREAR_RECETA", f"Receta {numero} creada exitosamente", "EXITOSO")
             
+            # Firma separada en segundo plano, sólo de recetas guardadas (el PDF no
+            # cambia: se imprime sin esperarla)
+            try:
+                firmas = pool_firmas()
+                if firmas:
+                    for path in (out_path, ind_path):
+                        if path:
+                            firmas.enviar(path, data["prescriptor"])
+            except Exception as e:
+                logger.error(f"No se pudo encolar la firma de {numero}: {e}")
+
+            # Con impresora configurada los PDF van a la cola (segundo plano); si no, al visor
+            try:
+                cola = cola_impresion()
+                if cola:
+                    cola.encolar(numero, {"receta": out_path, "indicaciones": ind_path},
+                                 parsear_copias(COPIAS_IMPRESION), self.current_user)
+            except Exception as e:
+                # La receta ya está guardada: sin cola se abre el visor
+                logger.error(f"No se pudo encolar la impresión de {numero}: {e}")
+                cola = None
+
             messagebox.showinfo(
                 "Receta", 
                 f"Receta guardada con trazabilidad completa.\nNúmero: {numero}\nPDF: {out_path}"
+                + ("\nEnviada a la cola de impresión" if cola else "")
             )
 
-            # Intentar abrir el PDF
-            open_file_cross_platform(out_path)
+            if not cola:
+                open_file_cross_platform(out_path)
                 
         except Exception as e:
             logger.error(f"Error guardando receta: {e}")
             log_access(self.current_user, "CREAR_RECETA", f"Error: {str(e)}", "ERROR")
             messagebox.showerror("Error", f"Error al guardar la receta: {str(e)}")
 
+    def cargar_preferencias(self):
+        """Carga frecuencias de uso y plantillas del prescriptor (hilo de fondo; sin ellas se sugiere en orden del catálogo)"""
+        prescriptor, especialidad = self.modelo_uso.prescriptor, self.modelo_uso.especialidad
+        try:
+            with span("preferencias.cargar"):
+                datos = backend().modelo_uso(prescriptor, especialidad)
+                self._plantillas = backend().plantillas(prescriptor)
+            self.modelo_uso = ModeloUso(prescriptor, especialidad, datos)
+        except Exception as e:
+            logger.warning(f"No se pudieron cargar las preferencias de {prescriptor}: {e}")
+
+    def actualizar_menu_plantillas(self):
+        """Rehace el menú Plantillas al abrirlo"""
+        menu = self.menu_plantillas
+        menu.delete(0, "end")
+        for p in self._plantillas:
+            menu.add_command(label=f"{p['nombre']} ({len(p.get('meds') or [])} medicamentos)",
+                             command=lambda p=p: self.aplicar_plantilla(p))
+        if self._plantillas:
+            menu.add_separator()
+        menu.add_command(label="Guardar receta actual como plantilla...", command=self.guardar_como_plantilla)
+        if self._plantillas:
+            menu.add_command(label="Eliminar plantilla...", command=self.eliminar_plantilla)
+
+    def aplicar_plantilla(self, plantilla):
+        """Reemplaza los medicamentos por los de la plantilla; CIE e indicaciones sólo si están vacíos"""
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+        for med in plantilla.get("meds") or []:
+            self.tree.insert("", "end", values=[med.get(k, "") for k in
+                                                ("nombre", "dosis", "frecuencia", "via", "duracion", "cantidad")])
+        for entry, campo in ((self.cie, "cie"), (self.cie_desc, "cie_desc")):
+            if plantilla.get(campo) and not entry.get().strip():
+                entry.insert(0, plantilla[campo])
+        if plantilla.get("indicaciones") and not self.indicaciones.get("1.0", "end").strip():
+            self.indicaciones.insert("1.0", plantilla["indicaciones"])
+
+    def guardar_como_plantilla(self):
+        data = self.collect_form()
+        if not data["meds"]:
+            messagebox.showwarning("Plantillas", "Agregue al menos un medicamento antes de guardar la plantilla.")
+            return
+        nombre = (simpledialog.askstring("Plantillas", "Nombre de la plantilla:", parent=self) or "").strip()
+        if not nombre:
+            return
+        contenido = {k: data[k] for k in ("meds", "cie", "cie_desc", "indicaciones")}
+        try:
+            backend().guardar_plantilla(self.modelo_uso.prescriptor, nombre, contenido)
+        except Exception as e:
+            logger.error(f"Error guardando plantilla: {e}")
+            messagebox.showerror("Plantillas", f"No se pudo guardar la plantilla: {e}")
+            return
+        self._plantillas = sorted([p for p in self._plantillas if p["nombre"] != nombre] +
+                                  [dict(contenido, nombre=nombre)], key=lambda p: p["nombre"])
+        log_access(self.current_user, "PLANTILLA", f"Plantilla '{nombre}' guardada")
+
+    def eliminar_plantilla(self):
+        nombres = [p["nombre"] for p in self._plantillas]
+        nombre = (simpledialog.askstring(
+            "Plantillas", "Nombre de la plantilla a eliminar:\n" + "\n".join(nombres), parent=self) or "").strip()
+        if nombre not in nombres:
+            return
+        try:
+            backend().eliminar_plantilla(self.modelo_uso.prescriptor, nombre)
+        except Exception as e:
+            logger.error(f"Error eliminando plantilla: {e}")
+            messagebox.showerror("Plantillas", f"No se pudo eliminar la plantilla: {e}")
+            return
+        self._plantillas = [p for p in self._plantillas if p["nombre"] != nombre]
+        log_access(self.current_user, "PLANTILLA", f"Plantilla '{nombre}' eliminada")
+
     def collect_form(self):
         """Recolecta los datos del formulario"""
         meds = []
@@ -1529,111 +1567,64 @@ class EnhancedApp(tk.Tk):
 
     # Métodos de auditoría y seguridad
     def show_access_log(self):
-        """Muestra la bitácora de accesos"""
-        try:
-            conn = sqlite3.connect(db_path())
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT fecha_hora, usuario, accion, ip_address, resultado, detalles
-                FROM bitacora_accesos 
-                ORDER BY fecha_hora DESC LIMIT 100
-            """)
-            rows = cur.fetchall()
-            conn.close()
-            
-            # Crear ventana para mostrar log
-            log_window = tk.Toplevel(self)
-            log_window.title("Bitácora de Accesos")
-            log_window.geometry("1000x600")
-            
-            # Crear Treeview
-            columns = ("fecha_hora", "usuario", "accion", "ip", "resultado", "detalles")
-            tree = ttk.Treeview(log_window, columns=columns, show="headings", height=25)
-            
-            headers = {
-                "fecha_hora": "Fecha/Hora",
-                "usuario": "Usuario", 
-                "accion": "Acción",
-                "ip": "IP",
-                "resultado": "Resultado",
-                "detalles": "Detalles"
-            }
-            
-            for col in columns:
-                tree.heading(col, text=headers[col])
-                tree.column(col, width=150 if col == "detalles" else 120)
-            
-            # Insertar datos
-            for row in rows:
-                tree.insert("", "end", values=row)
-            
-            # Scrollbar
-            scrollbar = ttk.Scrollbar(log_window, orient="vertical", command=tree.yview)
-            tree.configure(yscrollcommand=scrollbar.set)
-            
-            tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
-            scrollbar.pack(side="right", fill="y", pady=10)
-            
-            log_access(self.current_user, "VER_BITACORA_ACCESOS", "Consulta de bitácora de accesos")
-            
-        except Exception as e:
-            logger.error(f"Error mostrando bitácora: {e}")
-            messagebox.showerror("Error", f"Error al mostrar bitácora: {str(e)}")
+        """Muestra la bitácora de accesos (paginada, con filtros)"""
+        self.show_registro("accesos", "VER_BITACORA_ACCESOS", "Consulta de bitácora de accesos")
 
     def show_audit_log(self):
-        """Muestra la auditoría de recetas"""
+        """Muestra la auditoría de recetas (paginada, con filtros)"""
+        self.show_registro("auditoria", "VER_AUDITORIA_RECETAS", "Consulta de auditoría de recetas")
+
+    def show_registro(self, registro, accion, detalles):
+        """Abre un visor paginado de bitácora o auditoría"""
         try:
-            conn = sqlite3.connect(db_path())
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT fecha_hora, receta_numero, accion, usuario, ip_address, detalles
-                FROM auditoria 
-                ORDER BY fecha_hora DESC LIMIT 100
-            """)
-            rows = cur.fetchall()
-            conn.close()
-            
-            # Crear ventana para mostrar auditoría
-            audit_window = tk.Toplevel(self)
-            audit_window.title("Auditoría de Recetas")
-            audit_window.geometry("1000x600")
-            
-            # Crear Treeview
-            columns = ("fecha_hora", "receta", "accion", "usuario", "ip", "detalles")
-            tree = ttk.Treeview(audit_window, columns=columns, show="headings", height=25)
-            
-            headers = {
-                "fecha_hora": "Fecha/Hora",
-                "receta": "Receta",
-                "accion": "Acción", 
-                "usuario": "Usuario",
-                "ip": "IP",
-                "detalles": "Detalles"
-            }
-            
-            for col in columns:
-                tree.heading(col, text=headers[col])
-                tree.column(col, width=150 if col == "detalles" else 120)
-            
-            # Insertar datos
-            for row in rows:
-                tree.insert("", "end", values=row)
-            
-            # Scrollbar
-            scrollbar = ttk.Scrollbar(audit_window, orient="vertical", command=tree.yview)
-            tree.configure(yscrollcommand=scrollbar.set)
-            
-            tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
-            scrollbar.pack(side="right", fill="y", pady=10)
-            
-            log_access(self.current_user, "VER_AUDITORIA_RECETAS", "Consulta de auditoría de recetas")
-            
+            VisorRegistros(self, registro, backend().pagina_registros)
+            log_access(self.current_user, accion, detalles)
+
         except Exception as e:
-            logger.error(f"Error mostrando auditoría: {e}")
-            messagebox.showerror("Error", f"Error al mostrar auditoría: {str(e)}")
+            logger.error(f"Error mostrando {registro}: {e}")
+            messagebox.showerror("Error", f"Error al mostrar {registro}: {str(e)}")
+
+    def show_diagnostico(self):
+        """Percentiles de las operaciones instrumentadas y perfiles en caliente"""
+        DiagnosticoWindow(self, directorio=os.path.join(LOCAL_DATA_DIR, "metricas"),
+                          estacion=identidad_equipo().hostname)
+        log_access(self.current_user, "VER_DIAGNOSTICO", "Ventana de diagnóstico abierta")
+
+    def show_verificacion(self):
+        """Ventana de farmacia: lee el QR de una receta impresa y registra la dispensación"""
+        def verificar(codigo):
+            with span("receta.verificar"):
+                r = backend().verificar_receta(codigo)
+            log_audit(r["numero"], "VERIFICACION", self.current_user,
+                      "válida" if r["valida"] else r["motivo"])
+            return r
+
+        def dispensar(codigo):
+            r = backend().dispensar_receta(codigo, self.current_user, identidad_equipo().hostname)
+            if r.get("dispensada_ahora"):
+                log_audit(r["numero"], "DISPENSACION", self.current_user, f"Dispensada en {identidad_equipo().hostname}")
+            return r
+
+        VentanaVerificacion(self, verificar, dispensar)
+        log_access(self.current_user, "VER_VERIFICACION", "Ventana de verificación abierta")
+
+    def show_statistics(self):
+        """Muestra las estadísticas diarias materializadas"""
+        if not self.solo_modo_local("Estadísticas"):
+            return
+        try:
+            if not ensure_db():
+                return
+            estadisticas.EstadisticasWindow(self, lambda: sqlite3.connect(db_path()))
+            log_access(self.current_user, "VER_ESTADISTICAS", "Consulta de estadísticas de recetas")
+        except Exception as e:
+            logger.error(f"Error mostrando estadísticas: {e}")
+            messagebox.showerror("Error", f"Error al mostrar estadísticas: {str(e)}")
 
     def manual_backup(self):
         """Crea un respaldo manual"""
+        if not self.solo_modo_local("El respaldo"):
+            return
         try:
             if create_backup():
                 messagebox.showinfo("Respaldo", "Respaldo creado exitosamente")
@@ -1646,48 +1637,77 @@ class EnhancedApp(tk.Tk):
 
     def verify_integrity(self):
         """Verifica la integridad de las recetas"""
+        if not self.solo_modo_local("La verificación de integridad"):
+            return
         try:
             conn = sqlite3.connect(db_path())
-            cur = conn.cursor()
-            cur.execute("SELECT numero, payload, hash_verificacion FROM recetas WHERE estado = 'ACTIVA'")
-            rows = cur.fetchall()
-            conn.close()
-            
-            corrupted = []
-            verified = 0
-            
-            for numero, payload_str, stored_hash in rows:
+            try:
+                verified, corrupted = verificar_integridad(conn)
+            finally:
+                conn.close()
+
+            # Firmas de los PDF generados en esta estación (verificar no necesita la clave del almacén)
+            firmas_txt, firmas_mal = "", []
+            if os.path.isdir(ALMACEN_FIRMAS) and os.path.isdir(DEFAULT_OUTPUT):
+                pool = PoolFirmas(AlmacenFirmas(ALMACEN_FIRMAS), hilos=os.cpu_count() or 2)
                 try:
-                    if payload_str and stored_hash:
-                        payload = json.loads(payload_str)
-                        calculated_hash = calculate_hash(payload)
-                        
-                        if calculated_hash != stored_hash:
-                            corrupted.append(numero)
-                        else:
-                            verified += 1
-                except Exception:
-                    corrupted.append(numero)
-            
-            if corrupted:
+                    with span("firma.verificar_lote"):
+                        resultados = pool.verificar_lote(list(pdfs_de([DEFAULT_OUTPUT])))
+                finally:
+                    pool.cerrar()
+                firmas_mal = [f"{os.path.basename(p)}: {r}" for p, r, _ in resultados if r not in (VALIDA, SIN_FIRMA)]
+                sin_firma = sum(1 for _, r, _ in resultados if r == SIN_FIRMA)
+                firmas_txt = (f"\n\nFirmas: {len(resultados) - len(firmas_mal) - sin_firma} PDF con firma válida, "
+                              f"{sin_firma} sin firma, {len(firmas_mal)} con problemas")
+            
+            if corrupted or firmas_mal:
+                problemas = corrupted + firmas_mal
                 messagebox.showwarning(
                     "Verificación de Integridad",
-                    f"ATENCIÓN: Se encontraron {len(corrupted)} recetas con posibles alteraciones:\n" +
-                    "\n".join(corrupted[:10]) + 
-                    ("\n..." if len(corrupted) > 10 else "")
+                    f"ATENCIÓN: Se encontraron {len(corrupted)} recetas con posibles alteraciones"
+                    f" y {len(firmas_mal)} PDF con firma inválida o alterados:\n" +
+                    "\n".join(problemas[:10]) + 
+                    ("\n..." if len(problemas) > 10 else "") + firmas_txt
                 )
             else:
                 messagebox.showinfo(
                     "Verificación de Integridad",
-                    f"Verificación completada exitosamente.\n{verified} recetas verificadas sin problemas."
+                    f"Verificación completada exitosamente.\n{verified} recetas verificadas sin problemas." + firmas_txt
                 )
 
-            log_access(self.current_user, "VERIFICAR_INTEGRIDAD", f"Verificadas {verified} recetas, {len(corrupted)} con problemas")
+            log_access(self.current_user, "VERIFICAR_INTEGRIDAD",
+                       f"Verificadas {verified} recetas, {len(corrupted)} con problemas, {len(firmas_mal)} firmas inválidas")
             
         except Exception as e:
             logger.error(f"Error verificando integridad: {e}")
             messagebox.showerror("Error", f"Error al verificar integridad: {str(e)}")
 
+    def reporte_consumo(self, formato="csv"):
+        """Genera el reporte de consumo de farmacia y proyección de agotamiento"""
+        if not self.solo_modo_local("El reporte de consumo"):
+            return
+        if not ensure_db():
+            return
+
+        try:
+            conn = sqlite3.connect(db_path())
+            try:
+                paths = reportes_farmacia.generar_reporte(
+                    conn, DEFAULT_OUTPUT, formato, stock_path=stock_vigente()
+                )
+            finally:
+                conn.close()
+
+            log_access(self.current_user, "REPORTE_CONSUMO", f"Reporte {formato.upper()} generado: {', '.join(paths)}")
+            messagebox.showinfo("Farmacia", "Reporte generado:\n" + "\n".join(paths))
+            if formato == "pdf":
+                open_file_cross_platform(paths[0])
+
+        except Exception as e:
+            logger.error(f"Error generando reporte de consumo: {e}")
+            log_access(self.current_user, "REPORTE_CONSUMO", f"Error: {str(e)}", "ERROR")
+            messagebox.showerror("Error", f"Error al generar el reporte: {str(e)}")
+
     def add_med(self):
         """Agrega un medicamento a la lista"""
         vals = [
@@ -1732,11 +1752,12 @@ class EnhancedApp(tk.Tk):
             fields = [
                 self.prescriptor, self.paciente, self.ci, self.hc, 
                 self.edad, self.meses, self.talla, self.peso, 
-                self.cie, self.cie_desc, self.alergias_especificar
+                self.cie, self.cie_desc, self.alergias_especificar, self.fecha_nacimiento
             ]
             
             for w in fields:
                 w.delete(0, "end")
+            self._ci_autocompletada = ""
                 
             try:
                 self.sexo.set("")
@@ -1768,22 +1789,26 @@ class EnhancedApp(tk.Tk):
             return
             
         try:
-            conn = sqlite3.connect(db_path())
-            cur = conn.cursor()
-            cur.execute("SELECT pdf_path, estado FROM recetas WHERE numero=?", (num,))
-            row = cur.fetchone()
-            conn.close()
+            # Recetas aún no sincronizadas: se sirven desde la bandeja local
+            info = bandeja().buscar_receta(num) if BANDEJA_SALIDA else None
+            if not info:
+                info = backend().buscar_receta(num)
             
-            if not row:
+            if not info:
                 self.result_label.config(text="No encontrado.")
                 log_access(self.current_user, "BUSCAR_RECETA", f"Receta {num} no encontrada", "NO_ENCONTRADO")
                 return
                 
-            path, estado = row
-            self.result_label.config(text=f"Abrir: {path} (Estado: {estado})")
+            estado = info["estado"]
+            # En modo servidor el PDF se descarga a la carpeta de salida local
+            if estado == "PENDIENTE":
+                path = info["pdf_path"] if os.path.exists(info["pdf_path"] or "") else None
+            else:
+                path = backend().obtener_pdf(num, DEFAULT_OUTPUT)
+            self.result_label.config(text=f"Abrir: {path or info['pdf_path']} (Estado: {estado})")
             
-            if not os.path.exists(path):
-                messagebox.showerror("Error", f"El archivo PDF no existe: {path}")
+            if not path:
+                messagebox.showerror("Error", f"El archivo PDF no existe: {info['pdf_path']}")
                 return
             
             # Registrar acceso a la receta
@@ -1803,15 +1828,7 @@ class EnhancedApp(tk.Tk):
             return
             
         try:
-            conn = sqlite3.connect(db_path())
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT numero, tipo, fecha, paciente, ci, cie, cie_desc, pdf_path, estado, created_by
-                FROM recetas 
-                ORDER BY fecha DESC
-            """)
-            rows = cur.fetchall()
-            conn.close()
+            rows = backend().exportar()
             
             if not rows:
                 messagebox.showinfo("Exportar", "No hay recetas para exportar.")
@@ -1820,10 +1837,7 @@ class EnhancedApp(tk.Tk):
             os.makedirs(DEFAULT_OUTPUT, exist_ok=True)
             out = os.path.join(DEFAULT_OUTPUT, f"recetas_export_{int(datetime.now().timestamp())}.csv")
             
-            with open(out, "w", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                w.writerow(["numero", "tipo", "fecha", "paciente", "ci", "cie", "cie_desc", "pdf_path", "estado", "created_by"])
-                w.writerows(rows)
+            escribir_exportacion(out, rows)
             
             log_access(self.current_user, "EXPORTAR_CSV", f"Exportadas {len(rows)} recetas a {out}")
             messagebox.showinfo("CSV", f"Exportado: {out}")
@@ -0,0 +1,166 @@
+"""
+Archivo anual de recetas
+Las recetas de años cerrados (según el año de su número, TIPO-AAAA-NNNNNN)
+se trasladan de recetas.db a recetas_AAAA.db en la misma carpeta, que queda
+de solo lectura. recetas.db conserva sólo el año en curso, de modo que el
+respaldo diario copia poco; búsqueda, reimpresión y exportación siguen viendo
+todo el historial (datos_recetas adjunta el archivo del año cuando hace falta).
+Los agregados de farmacia y estadísticas, la auditoría y la bitácora quedan
+en recetas.db.
+
+El traslado es en dos pasos: copia al archivo (INSERT OR IGNORE) y luego
+borrado en recetas.db sólo de las filas que ya están en el archivo. Si se
+interrumpe, volver a ejecutarlo lo completa.
+
+    python archivo_anual.py                 # archiva todos los años cerrados
+    python archivo_anual.py --listar
+    python archivo_anual.py --verificar
+    python archivo_anual.py --vacuum        # y recupera el espacio en recetas.db
+"""
+
+import os
+import sys
+import stat
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+
+from datos_recetas import (
+    TIPOS_RECETA, ruta_principal, ruta_archivo, anios_archivados, anio_numero, archivo_adjunto,
+    verificar_integridad,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _rango_anio(anio):
+    """Condición sobre numero que usa su índice único (un rango por tipo)"""
+    condicion = " OR ".join("(numero >= ? AND numero < ?)" for _ in TIPOS_RECETA)
+    params = []
+    for tipo in TIPOS_RECETA:
+        params += [f"{tipo}-{anio}-", f"{tipo}-{anio + 1}-"]
+    return f"({condicion})", params
+
+
+def anios_cerrados(conn, anio_actual=None):
+    """Años anteriores al actual que todavía tienen recetas en la base principal"""
+    anio_actual = anio_actual or datetime.now().year
+    anios = set()
+    for tipo in TIPOS_RECETA:
+        desde = f"{tipo}-"
+        while True:
+            row = conn.execute(
+                "SELECT numero FROM main.recetas WHERE numero >= ? AND numero < ? ORDER BY numero LIMIT 1",
+                (desde, f"{tipo}-{anio_actual}-")
+            ).fetchone()
+            anio = row and anio_numero(row[0])
+            if not anio:
+                break
+            anios.add(anio)
+            desde = f"{tipo}-{anio + 1}-"
+    return sorted(anios)
+
+
+def _solo_lectura(path, activar=True):
+    modo = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+    os.chmod(path, modo if activar else modo | stat.S_IWUSR)
+
+
+def _crear_archivo(conn, path):
+    """Crea recetas_AAAA.db con la misma definición de recetas que la base principal"""
+    ddl = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'recetas'").fetchone()[0]
+    archivo = sqlite3.connect(path)
+    try:
+        archivo.execute(ddl)
+        # Solo lectura: los índices no cuestan escrituras
+        archivo.execute("CREATE INDEX IF NOT EXISTS idx_recetas_ci ON recetas(ci, created_at)")
+        archivo.execute("CREATE INDEX IF NOT EXISTS idx_recetas_created_at ON recetas(created_at)")
+        archivo.commit()
+    finally:
+        archivo.close()
+
+
+def archivar_anio(conn, anio):
+    """Traslada las recetas del año a su archivo; devuelve (copiadas, eliminadas)"""
+    if anio >= datetime.now().year:
+        raise ValueError(f"El año {anio} no está cerrado")
+    path = ruta_archivo(ruta_principal(conn), anio)
+    conn.commit()  # ATTACH no se permite dentro de una transacción
+    if os.path.exists(path):
+        _solo_lectura(path, False)
+    else:
+        _crear_archivo(conn, path)
+    condicion, params = _rango_anio(anio)
+    try:
+        with archivo_adjunto(conn, anio) as esquema:
+            with conn:
+                copiadas = conn.execute(
+                    f"INSERT OR IGNORE INTO {esquema}.recetas SELECT * FROM main.recetas WHERE {condicion}", params
+                ).rowcount
+            with conn:
+                eliminadas = conn.execute(
+                    f"DELETE FROM main.recetas WHERE {condicion} "
+                    f"AND id IN (SELECT id FROM {esquema}.recetas)", params
+                ).rowcount
+    finally:
+        _solo_lectura(path)
+    logger.info(f"Año {anio} archivado en {path}: {copiadas} copiadas, {eliminadas} retiradas de la base actual")
+    return copiadas, eliminadas
+
+
+def archivar_anios_cerrados(conn):
+    """Archiva todos los años cerrados; devuelve [(año, eliminadas)]"""
+    return [(anio, archivar_anio(conn, anio)[1]) for anio in anios_cerrados(conn)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivo anual de recetas")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--anio", type=int, help="Archivar sólo este año")
+    parser.add_argument("--listar", action="store_true", help="Muestra archivos y años pendientes")
+    parser.add_argument("--verificar", action="store_true", help="Verifica la integridad de los archivos")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM de recetas.db al terminar")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.listar:
+            for anio in anios_archivados(conn):
+                with archivo_adjunto(conn, anio) as esquema:
+                    n = conn.execute(f"SELECT COUNT(*) FROM {esquema}.recetas").fetchone()[0]
+                print(f"{ruta_archivo(args.db, anio)}: {n} recetas")
+            pendientes = anios_cerrados(conn)
+            print(f"Años cerrados en la base actual: {', '.join(map(str, pendientes)) or 'ninguno'}")
+        elif args.verificar:
+            corruptas_total = 0
+            for anio in anios_archivados(conn):
+                archivo = sqlite3.connect(ruta_archivo(args.db, anio))
+                try:
+                    verificadas, corruptas = verificar_integridad(archivo)
+                finally:
+                    archivo.close()
+                corruptas_total += len(corruptas)
+                print(f"{anio}: {verificadas} verificadas, {len(corruptas)} con posibles alteraciones")
+                for numero in corruptas[:20]:
+                    print(f"  {numero}")
+            return 1 if corruptas_total else 0
+        else:
+            for anio in [args.anio] if args.anio else anios_cerrados(conn):
+                copiadas, eliminadas = archivar_anio(conn, anio)
+                print(f"{anio}: {copiadas} copiadas, {eliminadas} retiradas de {args.db}")
+            if args.vacuum:
+                conn.execute("VACUUM")
+                print("VACUUM completado")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,502 @@
+"""
+Bandeja de salida local (modo sin conexión)
+Las recetas y los eventos de bitácora se confirman primero en una base SQLite
+local (modo WAL) y un hilo los sincroniza con la base central (recetas.db en el
+recurso de red o el servidor de recetas) en lotes idempotentes: cada receta
+lleva su id definitivo desde la estación, así un lote reenviado tras un corte
+no se duplica.
+
+Los números de receta salen de bloques cedidos por la central
+(datos_recetas.reservar_bloque) y guardados en la bandeja; mientras quede
+bloque, guardar una receta no espera a la red.
+
+Si la central rechaza un lote por su contenido (número repetido tras una
+restauración, payload inválido) se reenvía receta por receta, así una mala no
+retiene a las siguientes; la rechazada queda con ERROR tras max_intentos y se
+muestra aparte en la barra de estado hasta que se corrija y se reintente:
+
+    python bandeja_salida.py --errores
+    python bandeja_salida.py --reintentar [ID]
+"""
+
+import os
+import sys
+import argparse
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from datos_recetas import TIPOS_RECETA, formatear_numero
+import integridad
+from metricas import span, medido
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS bloques (
+    tipo TEXT NOT NULL,
+    inicio INTEGER NOT NULL,
+    fin INTEGER NOT NULL,
+    siguiente INTEGER NOT NULL,
+    PRIMARY KEY (tipo, inicio)
+);
+CREATE TABLE IF NOT EXISTS recetas_pendientes (
+    id TEXT PRIMARY KEY,
+    numero TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    pdf_path TEXT,
+    usuario TEXT,
+    ip_address TEXT,
+    hash_verificacion TEXT,
+    created_at TEXT NOT NULL,
+    intentos INTEGER DEFAULT 0,
+    ultimo_error TEXT
+);
+CREATE TABLE IF NOT EXISTS registros_pendientes (
+    orden INTEGER PRIMARY KEY AUTOINCREMENT,
+    tabla TEXT NOT NULL,
+    fila TEXT NOT NULL
+);
+"""
+
+
+def _canonico_guardado(payload, data_hash):
+    """
+    Bytes del payload de la bandeja si son la forma canónica del hash (las filas
+    encoladas por versiones anteriores guardaban json.dumps); si no, None y la
+    central serializa la receta.
+    """
+    canonico = payload.encode("utf-8")
+    return canonico if data_hash and integridad.hash_canonico(canonico) == data_hash else None
+
+
+class SinNumerosDisponibles(Exception):
+    """No quedan números cedidos y la base central no está accesible"""
+
+
+def error_de_datos(e):
+    """
+    Rechazo por el contenido de las recetas (la central respondió), a diferencia
+    de una caída de la red o de la base central
+    """
+    if isinstance(e, (sqlite3.IntegrityError, ValueError, KeyError, TypeError)):
+        return True
+    estado = getattr(e, "estado", None)  # cliente_recetas.ErrorServidor
+    return estado in (400, 409, 422)
+
+
+class BandejaSalida:
+    """
+    destino_fn() -> backend central (BackendLocal o ClienteRecetas) con
+    reservar_bloque, guardar_recetas_lote y registrar.
+    """
+
+    def __init__(self, path, destino_fn, estacion="", tam_bloque=50, minimo=10,
+                 intervalo=5.0, lote=50, tipos=TIPOS_RECETA, max_intentos=5):
+        self.path = path
+        self.destino_fn = destino_fn
+        self.estacion = estacion
+        self.tam_bloque = tam_bloque
+        self.minimo = minimo
+        self.intervalo = intervalo
+        self.lote = lote
+        self.tipos = tuple(tipos)
+        self.max_intentos = max_intentos
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._lock_sync = threading.Lock()
+        self._hilo = None
+        # Estado visible en la interfaz
+        self.conectado = None
+        self.ultima_sync = None
+        self.ultimo_error = ""
+
+        conn = self._conectar()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(ESQUEMA)
+        finally:
+            conn.close()
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Hilo de sincronización ---
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._run, name="bandeja-salida", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, timeout=10.0):
+        """Detiene el hilo tras un último intento de sincronización"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def despertar(self):
+        """Pide una sincronización inmediata (p. ej. tras guardar)"""
+        self._despertar.set()
+
+    def _run(self):
+        while True:
+            self._despertar.clear()
+            try:
+                self.sincronizar()
+            except Exception as e:
+                logger.error(f"Error en la sincronización de la bandeja: {e}")
+            if self._detener.is_set():
+                return
+            self._despertar.wait(self.intervalo)
+
+    # --- Números ---
+    def disponibles(self, tipo):
+        conn = self._conectar()
+        try:
+            row = conn.execute(
+                "SELECT COALESCE(SUM(fin - siguiente + 1), 0) FROM bloques WHERE tipo = ? AND siguiente <= fin",
+                (tipo,)
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+
+    def reponer_bloques(self):
+        """Pide a la central un bloque nuevo para cada tipo por debajo del mínimo"""
+        for tipo in self.tipos:
+            if self.disponibles(tipo) < self.minimo:
+                inicio, fin = self.destino_fn().reservar_bloque(tipo, self.tam_bloque, self.estacion)
+                conn = self._conectar()
+                try:
+                    with conn:
+                        conn.execute(
+                            "INSERT INTO bloques (tipo, inicio, fin, siguiente) VALUES (?,?,?,?)",
+                            (tipo, inicio, fin, inicio)
+                        )
+                finally:
+                    conn.close()
+                logger.info(f"Bloque de números {tipo} {inicio}-{fin} cedido a esta estación")
+
+    @medido("bandeja.numero")
+    def siguiente_numero(self, tipo):
+        """Toma el siguiente número del bloque local; sólo va a la red si no queda ninguno"""
+        numero = self._tomar_numero(tipo)
+        if numero is None:
+            try:
+                self.reponer_bloques()
+                self.conectado = True
+            except Exception as e:
+                self.conectado = False
+                raise SinNumerosDisponibles(
+                    f"No quedan números de receta {tipo} en esta estación y la base central no responde: {e}"
+                )
+            numero = self._tomar_numero(tipo)
+            if numero is None:
+                raise SinNumerosDisponibles(f"No se pudo obtener un bloque de números {tipo}")
+        elif self.disponibles(tipo) < self.minimo:
+            self.despertar()
+        return numero
+
+    def _tomar_numero(self, tipo):
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT inicio, siguiente FROM bloques WHERE tipo = ? AND siguiente <= fin ORDER BY inicio LIMIT 1",
+                (tipo,)
+            ).fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            conn.execute("UPDATE bloques SET siguiente = siguiente + 1 WHERE tipo = ? AND inicio = ?", (tipo, row[0]))
+            # Los bloques agotados ya no sirven; se borran para que la tabla no crezca
+            conn.execute("DELETE FROM bloques WHERE siguiente > fin")
+            conn.commit()
+            return formatear_numero(tipo, row[1])
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    # --- Encolado ---
+    @medido("bandeja.encolar")
+    def encolar_receta(self, data, pdf_path, usuario, ip_address, data_hash, canonico=None):
+        """
+        Confirma la receta en la bandeja local y devuelve su id definitivo.
+        canonico: bytes de datos_recetas.serializar_receta; se guardan tal cual
+        y la central los usa como payload sin volver a serializar.
+        """
+        receta_id = str(uuid.uuid4())
+        if canonico is None:
+            canonico = integridad.canonico(data)
+        conn = self._conectar()
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT INTO recetas_pendientes
+                       (id, numero, payload, pdf_path, usuario, ip_address, hash_verificacion, created_at)
+                       VALUES (?,?,?,?,?,?,?,?)""",
+                    (receta_id, data["numero"], canonico.decode("utf-8"), pdf_path,
+                     usuario, ip_address, data_hash, datetime.now().isoformat())
+                )
+        finally:
+            conn.close()
+        self.despertar()
+        return receta_id
+
+    def registrar(self, items):
+        """Destino para EscritorRegistros: guarda [(tabla, fila)] en la bandeja"""
+        conn = self._conectar()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO registros_pendientes (tabla, fila) VALUES (?, ?)",
+                    [(tabla, json.dumps(list(fila), ensure_ascii=False)) for tabla, fila in items]
+                )
+        finally:
+            conn.close()
+        return len(items)
+
+    def buscar_receta(self, numero):
+        """Receta aún no sincronizada, con las mismas claves que datos_recetas.buscar_receta"""
+        conn = self._conectar()
+        try:
+            row = conn.execute(
+                """SELECT id, numero, payload, pdf_path, created_at, usuario, intentos
+                   FROM recetas_pendientes WHERE numero = ?""",
+                (numero,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        data = json.loads(row[2])
+        estado = "ERROR" if row[6] >= self.max_intentos else "PENDIENTE"
+        return {
+            "id": row[0], "numero": row[1], "tipo": data.get("tipo"), "fecha": data.get("fecha"),
+            "paciente": data.get("paciente"), "ci": data.get("ci"), "pdf_path": row[3],
+            "created_at": row[4], "usuario": row[5], "estado": estado,
+        }
+
+    def medicamentos_recientes(self, ci, dias):
+        """
+        Recetas de la CI aún en la bandeja, con la forma de
+        alertas_clinicas.medicamentos_recientes (se suman a las de la central)
+        """
+        ci = str(ci or "").strip()
+        if not ci:
+            return []
+        desde = (datetime.now() - timedelta(days=dias)).isoformat()
+        conn = self._conectar()
+        try:
+            filas = conn.execute(
+                """SELECT numero, created_at, payload FROM recetas_pendientes
+                   WHERE created_at >= ? AND payload LIKE ? ORDER BY created_at DESC""",
+                (desde, f"%{ci}%")
+            ).fetchall()
+        finally:
+            conn.close()
+        recetas = []
+        for numero, creada, payload in filas:
+            data = json.loads(payload)
+            if str(data.get("ci") or "").strip() == ci:
+                recetas.append({"numero": numero, "created_at": creada,
+                                "meds": [m.get("nombre") or "" for m in data.get("meds") or []]})
+        return recetas
+
+    # --- Sincronización ---
+    def pendientes(self):
+        """(recetas por enviar, eventos por enviar, recetas con ERROR)"""
+        conn = self._conectar()
+        try:
+            recetas, errores = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(intentos >= ?), 0) FROM recetas_pendientes", (self.max_intentos,)
+            ).fetchone()
+            registros = conn.execute("SELECT COUNT(*) FROM registros_pendientes").fetchone()[0]
+            return recetas - errores, registros, errores
+        finally:
+            conn.close()
+
+    def errores(self):
+        """[(id, numero, intentos, ultimo_error)] de las recetas rechazadas por la central"""
+        conn = self._conectar()
+        try:
+            return conn.execute(
+                """SELECT id, numero, intentos, ultimo_error FROM recetas_pendientes
+                   WHERE intentos > 0 ORDER BY created_at"""
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def reintentar(self, receta_id=None):
+        """Vuelve a enviar las recetas con ERROR (todas o una, por id)"""
+        conn = self._conectar()
+        try:
+            with conn:
+                n = conn.execute(
+                    "UPDATE recetas_pendientes SET intentos = 0 WHERE intentos > 0 AND (? IS NULL OR id = ?)",
+                    (receta_id, receta_id)
+                ).rowcount
+        finally:
+            conn.close()
+        if n:
+            self.despertar()
+        return n
+
+    def sincronizar(self):
+        """Una pasada completa: bloques, recetas y registros. Devuelve recetas enviadas"""
+        with self._lock_sync, span("bandeja.sincronizar"):
+            enviadas = 0
+            try:
+                destino = self.destino_fn()
+                self.reponer_bloques()
+                rechazadas = set()
+                while True:
+                    leidas, n = self._enviar_recetas(destino, rechazadas)
+                    enviadas += n
+                    if leidas < self.lote:
+                        break
+                while self._enviar_registros(destino) >= self.lote * 10:
+                    pass
+                self.conectado = True
+                self.ultima_sync = datetime.now()
+                self.ultimo_error = ""
+            except Exception as e:
+                if self.conectado is not False:
+                    logger.warning(f"Base central no disponible; las recetas quedan en la bandeja local: {e}")
+                self.conectado = False
+                self.ultimo_error = str(e)
+            return enviadas
+
+    def _enviar_recetas(self, destino, rechazadas):
+        """
+        Envía el lote más antiguo (sin las recetas con ERROR ni las rechazadas en
+        esta pasada); devuelve (leídas, enviadas). Los errores de conexión se
+        propagan: las recetas siguen pendientes sin sumar intentos.
+        """
+        conn = self._conectar()
+        try:
+            excluir = ",".join("?" * len(rechazadas))
+            filas = conn.execute(
+                f"""SELECT id, payload, pdf_path, usuario, ip_address, hash_verificacion, created_at, intentos
+                    FROM recetas_pendientes WHERE intentos < ? AND id NOT IN ({excluir})
+                    ORDER BY created_at LIMIT ?""",
+                (self.max_intentos, *rechazadas, self.lote)
+            ).fetchall()
+            if not filas:
+                return 0, 0
+            items = [
+                {"id": f[0], "data": json.loads(f[1]), "pdf_path": f[2], "usuario": f[3],
+                 "ip_address": f[4], "hash": f[5], "created_at": f[6], "canonico": _canonico_guardado(f[1], f[5])}
+                for f in filas
+            ]
+            try:
+                destino.guardar_recetas_lote(items)
+                enviados = items
+            except Exception as e:
+                if not error_de_datos(e):
+                    raise
+                enviados, rechazos = [], []
+                if len(items) == 1:
+                    rechazos.append((items[0], filas[0], e))
+                else:
+                    # Se aísla la receta culpable enviando de a una (idempotente por id)
+                    logger.warning(f"Lote de {len(items)} recetas rechazado por la central ({e}); reintentando por receta")
+                    for item, fila in zip(items, filas):
+                        try:
+                            destino.guardar_recetas_lote([item])
+                            enviados.append(item)
+                        except Exception as e_rec:
+                            if not error_de_datos(e_rec):
+                                raise
+                            rechazos.append((item, fila, e_rec))
+                for item, fila, error in rechazos:
+                    rechazadas.add(item["id"])
+                    self._marcar_rechazo(conn, item, fila[7] + 1, error)
+            # Confirmadas en la central (o ya estaban): se retiran de la bandeja
+            with conn:
+                conn.executemany("DELETE FROM recetas_pendientes WHERE id = ?", [(it["id"],) for it in enviados])
+            return len(filas), len(enviados)
+        finally:
+            conn.close()
+
+    def _marcar_rechazo(self, conn, item, intentos, error):
+        with conn:
+            conn.execute(
+                "UPDATE recetas_pendientes SET intentos = ?, ultimo_error = ? WHERE id = ?",
+                (intentos, str(error), item["id"])
+            )
+        numero = item["data"].get("numero")
+        if intentos >= self.max_intentos:
+            logger.error(f"Receta {numero} rechazada {intentos} veces por la central; queda con ERROR: {error}")
+        else:
+            logger.warning(f"Receta {numero} rechazada por la central (intento {intentos}): {error}")
+
+    def _enviar_registros(self, destino):
+        conn = self._conectar()
+        try:
+            filas = conn.execute(
+                "SELECT orden, tabla, fila FROM registros_pendientes ORDER BY orden LIMIT ?",
+                (self.lote * 10,)
+            ).fetchall()
+            if not filas:
+                return 0
+            # INSERT OR IGNORE por id en la central: reenviar es inocuo
+            destino.registrar([(tabla, tuple(json.loads(fila))) for _, tabla, fila in filas])
+            with conn:
+                conn.execute("DELETE FROM registros_pendientes WHERE orden <= ?", (filas[-1][0],))
+            return len(filas)
+        finally:
+            conn.close()
+
+    def estado(self):
+        """Texto corto para la barra de estado"""
+        recetas, registros, errores = self.pendientes()
+        if self.conectado is None:
+            texto = "Sincronización: iniciando"
+        elif self.conectado:
+            texto = "Sincronización: conectado"
+        else:
+            texto = "Sincronización: SIN CONEXIÓN"
+        texto += f" | {recetas} recetas y {registros} eventos pendientes"
+        if errores:
+            texto += f" | {errores} recetas con ERROR (python bandeja_salida.py --errores)"
+        if self.ultima_sync:
+            texto += f" | última: {self.ultima_sync.strftime('%H:%M:%S')}"
+        return texto
+
+
+def main(argv=None):
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Bandeja de salida local de recetas")
+    parser.add_argument("--db", default=os.path.join(raiz, "data", "bandeja_salida.db"))
+    parser.add_argument("--errores", action="store_true", help="Lista las recetas rechazadas por la central")
+    parser.add_argument("--reintentar", nargs="?", const="", metavar="ID",
+                        help="Vuelve a enviar las recetas con ERROR (todas o una)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No existe la bandeja {args.db}")
+        return 1
+    # Sin destino: sólo se consulta o se modifica la bandeja; envía la aplicación
+    b = BandejaSalida(args.db, destino_fn=None)
+    if args.reintentar is not None:
+        print(f"Recetas que vuelven a enviarse: {b.reintentar(args.reintentar or None)}")
+    else:
+        recetas, registros, errores = b.pendientes()
+        print(f"{recetas} recetas y {registros} eventos pendientes, {errores} con ERROR")
+        if args.errores:
+            for receta_id, numero, intentos, error in b.errores():
+                print(f"{numero}  {receta_id}  intentos={intentos}  {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
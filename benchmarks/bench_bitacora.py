@@ -0,0 +1,87 @@
+"""
+Benchmark: eventos/segundo de la bitácora
+Compara el registro anterior (una conexión + commit por evento) con el
+escritor por lotes de registro_eventos.EscritorRegistros.
+
+    python benchmarks/bench_bitacora.py --eventos 2000
+"""
+
+import os
+import sys
+import time
+import uuid
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registro_eventos import EscritorRegistros, SQL_INSERT
+
+
+def crear_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bitacora_accesos (
+            id TEXT PRIMARY KEY, usuario TEXT, accion TEXT, fecha_hora TEXT,
+            ip_address TEXT, detalles TEXT, resultado TEXT
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def fila(i):
+    return (str(uuid.uuid4()), "bench", "ABRIR_PDF", datetime.now().isoformat(),
+            "127.0.0.1", f"evento {i}", "EXITOSO")
+
+
+def por_evento(path, n):
+    """Comportamiento anterior de log_access: conectar, insertar, commit, cerrar"""
+    inicio = time.perf_counter()
+    for i in range(n):
+        conn = sqlite3.connect(path)
+        conn.execute(SQL_INSERT["bitacora_accesos"], fila(i))
+        conn.commit()
+        conn.close()
+    return time.perf_counter() - inicio
+
+
+def por_lotes(path, n):
+    """Encolar todos los eventos y esperar a que estén confirmados"""
+    escritor = EscritorRegistros(lambda: path)
+    inicio = time.perf_counter()
+    for i in range(n):
+        escritor.encolar("bitacora_accesos", fila(i))
+    encolado = time.perf_counter() - inicio
+    escritor.cerrar()
+    return encolado, time.perf_counter() - inicio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--eventos", type=int, default=2000)
+    parser.add_argument("--dir", help="Directorio de la base de prueba (p. ej. el recurso de red)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        a, b = os.path.join(tmp, "por_evento.db"), os.path.join(tmp, "por_lotes.db")
+        crear_db(a)
+        crear_db(b)
+        t_evento = por_evento(a, args.eventos)
+        t_encolar, t_lotes = por_lotes(b, args.eventos)
+        for path in (a, b):
+            conn = sqlite3.connect(path)
+            assert conn.execute("SELECT COUNT(*) FROM bitacora_accesos").fetchone()[0] == args.eventos
+            conn.close()
+
+    n = args.eventos
+    print(f"Eventos: {n}")
+    print(f"Commit por evento:  {n / t_evento:10.0f} ev/s  ({t_evento * 1000 / n:.3f} ms/evento)")
+    print(f"Escritor por lotes: {n / t_lotes:10.0f} ev/s  (total hasta confirmar)")
+    print(f"Latencia al llamador: {t_encolar * 1000 / n:.4f} ms/evento")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Memoria por sesión de los catálogos: CSV en memoria frente a catálogo compilado (mmap)
+Arranca --sesiones procesos a la vez por modo (como en un servidor de
+terminales), cada uno carga los catálogos y hace unas búsquedas; cuando todos
+están listos se mide la memoria de cada uno respecto de antes de cargar:
+    rss  memoria residente (cuenta entera cada página compartida)
+    pss  residente proporcional (las páginas compartidas se dividen entre procesos)
+    uss  memoria privada del proceso (lo que se libera al cerrar la sesión)
+Modo "csv": como antes, dict CIE-10 + lista de tuplas + lista de nombres e
+import de pandas (si está instalado). Modo "mmap": catalogo_binario.
+
+Requiere Linux (/proc/self/smaps_rollup) o psutil.
+
+    python benchmarks/bench_memoria_catalogos.py --sesiones 4 --salida memoria_catalogos.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from catalogos import cargar_cie10, leer_stock, ultimo_stock, buscar_cie, buscar_medicamentos
+from catalogo_binario import cargar_catalogos
+
+CIE10_CSV = os.path.join(RAIZ, "cie10_es.csv")
+MODOS = ("csv", "mmap")
+
+
+def memoria():
+    """{rss, pss, uss} en bytes del proceso actual, o None si no se puede medir"""
+    try:
+        import psutil
+        m = psutil.Process().memory_full_info()
+        return {"rss": m.rss, "pss": getattr(m, "pss", None), "uss": m.uss}
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            campos = {p[0][:-1]: int(p[1]) * 1024 for p in (l.split() for l in f)
+                      if len(p) == 3 and p[0].endswith(":") and p[2] == "kB"}
+    except OSError:
+        return None
+    return {"rss": campos["Rss"], "pss": campos["Pss"],
+            "uss": campos["Private_Clean"] + campos["Private_Dirty"]}
+
+
+def hijo(modo, stock_path, destino):
+    """Carga los catálogos como una sesión, avisa y mide cuando el padre lo pide"""
+    antes = memoria()
+    t0 = time.perf_counter()
+    if modo == "csv":
+        try:
+            import pandas  # noqa: F401 (la aplicación lo importaba al arrancar)
+            pandas_cargado = True
+        except ImportError:
+            pandas_cargado = False
+        cie_index = cargar_cie10(CIE10_CSV)
+        cie_items = [(c, d) for c, d in cie_index.items()]
+        meds = [it["nombre"] for it in leer_stock(stock_path)]
+        carga_ms = (time.perf_counter() - t0) * 1000
+        buscar = lambda: (buscar_cie(cie_items, "J"), buscar_cie(cie_items, "fiebre", True),
+                          buscar_medicamentos(meds, "solido oral"))
+    else:
+        pandas_cargado = False
+        catalogo = cargar_catalogos(CIE10_CSV, stock_path, destino)
+        carga_ms = (time.perf_counter() - t0) * 1000
+        buscar = lambda: (catalogo.buscar_cie("J"), catalogo.buscar_cie("fiebre", True),
+                          catalogo.buscar_medicamentos("solido oral"))
+    buscar()
+    print("listo", flush=True)
+    sys.stdin.readline()
+    despues = memoria()
+    delta = {k: (despues[k] - antes[k]) if antes and antes[k] is not None else None for k in despues} \
+        if despues else {}
+    print(json.dumps({"carga_ms": carga_ms, "pandas": pandas_cargado, **delta}), flush=True)
+
+
+def medir_modo(modo, sesiones, stock_path, destino):
+    procesos = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--hijo", modo,
+                                  "--stock", stock_path, "--destino", destino],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                for _ in range(sesiones)]
+    for p in procesos:
+        if p.stdout.readline().strip() != "listo":
+            raise RuntimeError(f"Una sesión de modo {modo} no terminó de cargar")
+    resultados = []
+    for p in procesos:
+        p.stdin.write("\n")
+        p.stdin.flush()
+    for p in procesos:
+        resultados.append(json.loads(p.stdout.readline()))
+        p.wait()
+    mb = lambda k: (round(statistics.mean(r[k] for r in resultados) / 1024 / 1024, 2)
+                    if all(r.get(k) is not None for r in resultados) else None)
+    return {"sesiones": sesiones, "carga_ms": round(statistics.median(r["carga_ms"] for r in resultados), 2),
+            "pandas": resultados[0]["pandas"], "rss_mb": mb("rss"), "pss_mb": mb("pss"), "uss_mb": mb("uss")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria por sesión de los catálogos (CSV vs mmap)")
+    parser.add_argument("--sesiones", type=int, default=4, help="Procesos simultáneos por modo")
+    parser.add_argument("--stock", help="CSV de stock (por defecto el más reciente)")
+    parser.add_argument("--salida", default="bench_memoria_catalogos.json")
+    parser.add_argument("--hijo", choices=MODOS, help=argparse.SUPPRESS)
+    parser.add_argument("--destino", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    stock_path = args.stock or ultimo_stock(RAIZ)
+    if args.hijo:
+        hijo(args.hijo, stock_path, args.destino)
+        return 0
+    if memoria() is None:
+        print("No se puede medir la memoria: requiere Linux o psutil")
+        return 1
+
+    destino = tempfile.mkdtemp(prefix="bench_catalogos_")
+    try:
+        cargar_catalogos(CIE10_CSV, stock_path, destino).cerrar()  # compilar antes de arrancar las sesiones
+        resultado = {"fecha": datetime.now().isoformat(timespec="seconds"), "resultados": {}}
+        for modo in MODOS:
+            resultado["resultados"][modo] = medir_modo(modo, args.sesiones, stock_path, destino)
+    finally:
+        shutil.rmtree(destino, ignore_errors=True)
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"{'modo':<8}{'carga ms':>10}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}  (por sesión, {args.sesiones} a la vez)")
+    for modo, r in resultado["resultados"].items():
+        fila = "".join(f"{'-' if r[k] is None else r[k]:>10}" for k in ("carga_ms", "rss_mb", "pss_mb", "uss_mb"))
+        print(f"{modo:<8}{fila}{'  + pandas' if r['pandas'] else ''}")
+    print(f"Resultados: {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
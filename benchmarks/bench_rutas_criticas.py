@@ -0,0 +1,271 @@
+"""
+Benchmark de las rutas críticas, sin interfaz gráfica
+Mide carga de catálogos, sugerencias CIE-10/medicamentos, generación de PDFs,
+numeración, guardado completo, verificación de integridad y exportación CSV
+sobre bases sintéticas de distintos tamaños (generador_datos.py). Las bases se
+generan una vez y se reutilizan (--datos); cada corrida mide sobre una copia,
+así las recetas guardadas y sus agregados no se acumulan entre corridas. El
+resultado se escribe en JSON; con --base se compara con una corrida anterior
+y se sale con código 1 si alguna medición empeora más que --umbral.
+
+    python benchmarks/bench_rutas_criticas.py --salida bench_actual.json
+    python benchmarks/bench_rutas_criticas.py --tamanos 10000 --base bench_anterior.json --umbral 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from itertools import islice
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from generador_datos import generar
+from catalogos import cargar_cie10, leer_stock, ultimo_stock, buscar_cie, buscar_medicamentos
+from catalogo_binario import cargar_catalogos
+from ventanas_catalogo import TAMANO_PAGINA
+from datos_recetas import (
+    TIPOS_RECETA, crear_esquema, serializar_receta, asignar_numero,
+    guardar_receta, filas_exportacion, escribir_exportacion, verificar_integridad, verificar_receta,
+)
+import verificacion_recetas
+
+CIE10_CSV = os.path.join(RAIZ, "cie10_es.csv")
+TAMANOS = (10_000, 100_000, 1_000_000)
+CONSULTAS_CIE = ("J", "J06", "I10", "E11.9")
+CONSULTAS_CIE_DESC = ("fiebre", "diabetes", "infeccion aguda")
+CONSULTAS_MED = ("par", "amoxi", "losartan", "solido oral")
+
+
+def medir(fn, repeticiones=5, calentamiento=1):
+    """Mediana, mínimo y máximo en ms de `repeticiones` llamadas a fn()"""
+    for _ in range(calentamiento):
+        fn()
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return {
+        "mediana_ms": round(statistics.median(tiempos), 3),
+        "min_ms": round(min(tiempos), 3),
+        "max_ms": round(max(tiempos), 3),
+        "repeticiones": repeticiones,
+    }
+
+
+def receta_sintetica(rng, cie_items, meds, fecha):
+    code, desc = rng.choice(cie_items)
+    return {
+        "tipo": rng.choices(TIPOS_RECETA, weights=(70, 10, 20))[0],
+        "fecha": fecha.strftime("%d/%m/%Y"),
+        "unidad": "HOSPITAL BASICO DE CAYAMBE",
+        "servicio": "MEDICINA INTERNA", "prescriptor": f"MEDICO {rng.randint(1, 40)}",
+        "prescriptor_especialidad": "MEDICINA INTERNA",
+        "paciente": f"PACIENTE {rng.randint(1, 10 ** 6)}", "ci": str(1700000000 + rng.randint(0, 10 ** 7)),
+        "hc": str(rng.randint(1, 10 ** 6)), "edad": str(rng.randint(0, 95)), "meses": "0",
+        "sexo": rng.choice("MF"), "talla": "160", "peso": "60",
+        "cie": code, "cie_desc": desc, "indicaciones": "Reposo relativo. Control en 7 días.",
+        "actividad_fisica": "", "estado_enfermedad": "", "alergias": "No", "alergias_especificar": "",
+        "meds": [
+            {"nombre": rng.choice(meds), "dosis": "1", "frecuencia": "C/8H", "via": "ORAL",
+             "duracion": "5 días", "cantidad": str(rng.randint(1, 30))}
+            for _ in range(rng.randint(1, 4))
+        ],
+    }
+
+
+def base_sintetica(directorio, n, regenerar=False):
+    path = os.path.join(directorio, f"recetas_{n}.db")
+    if regenerar or not os.path.exists(path):
+        t0 = time.perf_counter()
+        print(f"Generando base sintética de {n} recetas...", flush=True)
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        generar(tmp, n, agregados=False)
+        os.replace(tmp, path)
+        print(f"  lista en {time.perf_counter() - t0:.1f} s", flush=True)
+    return path
+
+
+def bench_generales(cie_items, meds, stock_path, tmp):
+    """Rutas que no dependen del tamaño de la base"""
+    r = {
+        "load_cie10": medir(lambda: cargar_cie10(CIE10_CSV)),
+        "load_medicamentos": medir(lambda: leer_stock(stock_path)),
+        "sugerencias_cie_codigo": medir(
+            lambda: [buscar_cie(cie_items, q) for q in CONSULTAS_CIE], 50),
+        "sugerencias_cie_descripcion": medir(
+            lambda: [buscar_cie(cie_items, q, por_descripcion=True) for q in CONSULTAS_CIE_DESC], 50),
+        "sugerencias_medicamentos": medir(
+            lambda: [buscar_medicamentos(meds, q) for q in CONSULTAS_MED], 50),
+    }
+    # Catálogo compilado (mmap): el calentamiento lo compila, se mide la apertura
+    destino = os.path.join(tmp, "catalogos")
+    r["load_catalogos_mmap"] = medir(lambda: cargar_catalogos(CIE10_CSV, stock_path, destino).cerrar())
+    catalogo = cargar_catalogos(CIE10_CSV, stock_path, destino)
+    r["sugerencias_cie_codigo_mmap"] = medir(
+        lambda: [catalogo.buscar_cie(q) for q in CONSULTAS_CIE], 50)
+    r["sugerencias_cie_descripcion_mmap"] = medir(
+        lambda: [catalogo.buscar_cie(q, por_descripcion=True) for q in CONSULTAS_CIE_DESC], 50)
+    r["sugerencias_medicamentos_mmap"] = medir(
+        lambda: [catalogo.buscar_medicamentos(q) for q in CONSULTAS_MED], 50)
+    # Primera página de las listas completas (ventanas_catalogo) al filtrar
+    r["lista_cie_pagina_mmap"] = medir(
+        lambda: [list(islice(catalogo.filtrar_cie(q), TAMANO_PAGINA)) for q in CONSULTAS_CIE_DESC], 50)
+    r["lista_medicamentos_pagina_mmap"] = medir(
+        lambda: [list(islice(catalogo.filtrar_medicamentos(q), TAMANO_PAGINA)) for q in CONSULTAS_MED], 50)
+    try:
+        from pdf_layout_fixed import build_pdf, build_indicaciones_pdf, build_documentos
+    except ImportError as e:
+        for k in ("build_pdf", "build_indicaciones_pdf", "build_documentos_ambos", "build_documentos_combinado"):
+            r[k] = {"omitido": f"fpdf2 no disponible ({e})"}
+        return r
+    data = receta_sintetica(random.Random(1), cie_items, meds, datetime.now())
+    data["numero"] = "CE-2025-000001"
+    out = os.path.join(tmp, "bench.pdf")
+    r["build_pdf"] = medir(lambda: build_pdf(out, data, tipo=data["tipo"]), 20)
+    r["build_indicaciones_pdf"] = medir(lambda: build_indicaciones_pdf(out, data), 20)
+    # "Imprimir ambos": receta + hoja de indicaciones en una pasada (archivos aparte o un PDF)
+    out_ind = os.path.join(tmp, "bench_indicaciones.pdf")
+    r["build_documentos_ambos"] = medir(
+        lambda: build_documentos(out, data, data["tipo"], indicaciones_path=out_ind), 20)
+    r["build_documentos_combinado"] = medir(lambda: build_documentos(out, data, data["tipo"], combinado=True), 20)
+    return r
+
+
+def bench_base(path, cie_items, meds, tmp):
+    """Rutas que leen o escriben recetas.db (sobre una copia de la base sintética)"""
+    try:
+        from pdf_layout_fixed import build_pdf
+    except ImportError:
+        build_pdf = None
+    # Recetas, agregados, pacientes, frecuencias y secuencias vuelven a cero en
+    # cada corrida: se descarta la copia
+    copia = os.path.join(tmp, os.path.basename(path))
+    shutil.copyfile(path, copia)
+    conn = sqlite3.connect(copia, timeout=30)
+    # Bases generadas con versiones anteriores: tablas nuevas (pacientes, dispensaciones...)
+    crear_esquema(conn)
+    n = conn.execute("SELECT COUNT(*) FROM recetas").fetchone()[0]
+    # Recorridos completos: menos repeticiones (y sin calentamiento) en bases grandes
+    repeticiones_lectura, calentamiento = (5, 1) if n <= 10_000 else (3, 1) if n <= 100_000 else (1, 0)
+    rng = random.Random(99)
+    try:
+        r = {"next_number": medir(lambda: asignar_numero(conn, "CE"), 100)}
+
+        def guardar():
+            # Mismo camino que EnhancedApp.save_and_pdf (sin diálogos)
+            data = receta_sintetica(rng, cie_items, meds, datetime.now())
+            data["numero"] = asignar_numero(conn, data["tipo"])
+            out = ""
+            canonico, data_hash = serializar_receta(data)
+            if build_pdf:
+                out = os.path.join(tmp, f"{data['numero']}.pdf")
+                build_pdf(out, data, tipo=data["tipo"],
+                          codigo_verificacion=verificacion_recetas.codigo_verificacion(data["numero"], data_hash))
+            guardar_receta(conn, data, out, "bench", "127.0.0.1", data_hash, canonico=canonico)
+
+        r["guardado_completo"] = medir(guardar, 30)
+        if not build_pdf:
+            r["guardado_completo"]["nota"] = "sin PDF (fpdf2 no disponible)"
+        r["verify_integrity"] = medir(lambda: verificar_integridad(conn), repeticiones_lectura, calentamiento)
+        # Farmacia lee el QR: búsqueda por número + dispensaciones
+        codigos = [verificacion_recetas.codigo_verificacion(num, h) for num, h in conn.execute(
+            "SELECT numero, hash_verificacion FROM recetas ORDER BY random() LIMIT 100")]
+        r["verificar_receta_qr"] = medir(lambda: [verificar_receta(conn, c) for c in codigos], 5)
+        r["verificar_receta_qr"]["consultas"] = len(codigos)
+        out_csv = os.path.join(tmp, "export.csv")
+        r["export_csv"] = medir(lambda: escribir_exportacion(out_csv, filas_exportacion(conn)),
+                                repeticiones_lectura, calentamiento)
+    finally:
+        conn.close()
+        os.remove(copia)
+    return r
+
+
+def comparar(actual, base, umbral, minimo_ms=0.0):
+    """
+    Lista de (grupo, medición, antes_ms, ahora_ms) que empeoran más que el umbral
+    relativo y, además, más que minimo_ms (ruido de mediciones sub-milisegundo)
+    """
+    regresiones = []
+    for grupo, mediciones in actual["resultados"].items():
+        for nombre, m in mediciones.items():
+            previa = base.get("resultados", {}).get(grupo, {}).get(nombre, {})
+            if "mediana_ms" in m and "mediana_ms" in previa:
+                if (m["mediana_ms"] > previa["mediana_ms"] * (1 + umbral)
+                        and m["mediana_ms"] - previa["mediana_ms"] > minimo_ms):
+                    regresiones.append((grupo, nombre, previa["mediana_ms"], m["mediana_ms"]))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de rutas críticas")
+    parser.add_argument("--tamanos", default=",".join(str(t) for t in TAMANOS),
+                        help="Tamaños de base separados por comas")
+    parser.add_argument("--datos", default=os.path.join(tempfile.gettempdir(), "recetas_bench"),
+                        help="Carpeta de las bases sintéticas (se reutilizan)")
+    parser.add_argument("--regenerar", action="store_true", help="Vuelve a generar las bases")
+    parser.add_argument("--salida", default="bench_rutas_criticas.json")
+    parser.add_argument("--base", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--umbral", type=float, default=0.2, help="Regresión tolerada (0.2 = 20%%)")
+    parser.add_argument("--minimo-ms", type=float, default=0.5,
+                        help="Diferencia absoluta mínima para contar como regresión")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.datos, exist_ok=True)
+    cie_items = list(cargar_cie10(CIE10_CSV).items())
+    stock_path = ultimo_stock(RAIZ)
+    meds = [it["nombre"] for it in leer_stock(stock_path)]
+
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "resultados": {},
+    }
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    try:
+        resultado["resultados"]["generales"] = bench_generales(cie_items, meds, stock_path, tmp)
+        for n in (int(t) for t in args.tamanos.split(",") if t.strip()):
+            path = base_sintetica(args.datos, n, args.regenerar)
+            print(f"Midiendo base de {n} recetas...", flush=True)
+            resultado["resultados"][f"recetas_{n}"] = bench_base(path, cie_items, meds, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    print(f"{'grupo':<18}{'medición':<30}{'mediana ms':>12}")
+    for grupo, mediciones in resultado["resultados"].items():
+        for nombre, m in mediciones.items():
+            valor = f"{m['mediana_ms']:.3f}" if "mediana_ms" in m else m.get("omitido", "")
+            print(f"{grupo:<18}{nombre:<30}{valor:>12}")
+    print(f"Resultados: {args.salida}")
+
+    if args.base:
+        with open(args.base, encoding="utf-8") as f:
+            regresiones = comparar(resultado, json.load(f), args.umbral, args.minimo_ms)
+        for grupo, nombre, antes, ahora in regresiones:
+            print(f"REGRESIÓN {grupo}/{nombre}: {antes:.3f} ms -> {ahora:.3f} ms")
+        if regresiones:
+            return 1
+        print(f"Sin regresiones mayores al {args.umbral:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Prueba de carga del servidor de recetas: N estaciones concurrentes
+Cada estación repite el flujo de una receta: asignar número, guardar con PDF,
+registrar auditoría/bitácora, buscar la receta y descargar el PDF.
+Sin --url arranca un servidor local con una base temporal.
+
+    python benchmarks/carga_servidor.py --estaciones 20 --recetas 50
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliente_recetas import ClienteRecetas
+from servidor_recetas import iniciar_en_hilo
+
+PDF_FALSO = b"%PDF-1.4\n" + b"0" * 20000 + b"\n%%EOF\n"
+
+
+def receta(numero, tipo, estacion):
+    return {
+        "numero": numero, "tipo": tipo, "fecha": datetime.now().strftime("%d/%m/%Y"),
+        "unidad": "HOSPITAL BASICO DE CAYAMBE", "servicio": "MEDICINA INTERNA",
+        "prescriptor": f"Estacion {estacion}", "prescriptor_especialidad": "MEDICINA INTERNA",
+        "paciente": "PACIENTE DE PRUEBA", "ci": "1700000000", "hc": "123", "edad": "40", "meses": "0",
+        "sexo": "F", "talla": "160", "peso": "60", "cie": "J06.9", "cie_desc": "INFECCION AGUDA",
+        "indicaciones": "Reposo", "actividad_fisica": "", "estado_enfermedad": "", "alergias": "No",
+        "alergias_especificar": "",
+        "meds": [{"nombre": "Paracetamol 500 mg", "dosis": "1", "frecuencia": "TID", "via": "ORAL",
+                  "duracion": "3 días", "cantidad": "9"}],
+    }
+
+
+def estacion(idx, url, token, n, pdf_path, tiempos, errores, numeros, lock):
+    cliente = ClienteRecetas(url, token)
+    propios = {k: [] for k in ("numero", "guardar", "registrar", "buscar", "pdf", "total")}
+    for i in range(n):
+        try:
+            t0 = time.perf_counter()
+            tipo = ("CE", "EM", "EH")[i % 3]
+            numero = cliente.asignar_numero(tipo)
+            t1 = time.perf_counter()
+            cliente.guardar_receta(receta(numero, tipo, idx), pdf_path, f"estacion{idx}", "127.0.0.1", "")
+            t2 = time.perf_counter()
+            ahora = datetime.now().isoformat()
+            cliente.registrar([
+                ("auditoria", (str(uuid.uuid4()), numero, "CREACION", f"estacion{idx}", ahora, "127.0.0.1", "", "", "")),
+                ("bitacora_accesos", (str(uuid.uuid4()), f"estacion{idx}", "CREAR_RECETA", ahora, "127.0.0.1", numero, "EXITOSO")),
+            ])
+            t3 = time.perf_counter()
+            assert cliente.buscar_receta(numero)["numero"] == numero
+            t4 = time.perf_counter()
+            with tempfile.TemporaryDirectory() as tmp:
+                assert cliente.obtener_pdf(numero, tmp)
+            t5 = time.perf_counter()
+            for k, v in zip(propios, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t5 - t0)):
+                propios[k].append(v)
+            with lock:
+                numeros.append(numero)
+        except Exception as e:
+            with lock:
+                errores.append(f"estación {idx}: {e}")
+    with lock:
+        for k, v in propios.items():
+            tiempos[k].extend(v)
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    v = sorted(valores)
+    return v[min(len(v) - 1, int(round(p / 100 * (len(v) - 1))))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor de recetas")
+    parser.add_argument("--estaciones", type=int, default=20)
+    parser.add_argument("--recetas", type=int, default=50, help="Recetas por estación")
+    parser.add_argument("--url", help="Servidor existente (por defecto uno local temporal)")
+    parser.add_argument("--token", default="")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        servidor = None
+        url = args.url
+        if not url:
+            servidor, url = iniciar_en_hilo(os.path.join(tmp, "recetas.db"), os.path.join(tmp, "pdf"), token=args.token)
+        pdf_path = os.path.join(tmp, "receta.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(PDF_FALSO)
+
+        tiempos = {k: [] for k in ("numero", "guardar", "registrar", "buscar", "pdf", "total")}
+        errores, numeros, lock = [], [], threading.Lock()
+        hilos = [
+            threading.Thread(target=estacion, args=(i, url, args.token, args.recetas, pdf_path,
+                                                    tiempos, errores, numeros, lock))
+            for i in range(args.estaciones)
+        ]
+        inicio = time.perf_counter()
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        duracion = time.perf_counter() - inicio
+        if servidor:
+            servidor.shutdown()
+            servidor.server_close()
+
+    print(f"Estaciones: {args.estaciones}  Recetas: {len(numeros)}  Errores: {len(errores)}  "
+          f"Duración: {duracion:.2f} s  ({len(numeros) / duracion:.1f} recetas/s)")
+    print(f"{'operación':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for k, v in tiempos.items():
+        print(f"{k:<12}{percentil(v, 50) * 1000:>10.1f}{percentil(v, 95) * 1000:>10.1f}{percentil(v, 99) * 1000:>10.1f}")
+    duplicados = len(numeros) - len(set(numeros))
+    print(f"Números duplicados: {duplicados}")
+    for e in errores[:10]:
+        print("  " + e)
+    return 1 if errores or duplicados else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Generador de bases sintéticas de recetas (benchmarks y planificación de capacidad)
+Crea un recetas.db con el esquema de producción (datos_recetas.crear_esquema)
+y lo llena con recetas, auditoría, bitácora de accesos y secuencias coherentes:
+- tipos CE/EM/EH con proporciones y horarios distintos (consulta externa en
+  horario diurno de lunes a viernes, emergencia las 24 h),
+- pacientes recurrentes con cédula ecuatoriana válida,
+- diagnósticos de cie10_es.csv con sesgo hacia los más frecuentes,
+- medicamentos del CSV de stock con distribución de Zipf,
+- hash_verificacion válido (verificar_integridad no reporta alteraciones).
+
+Inserción masiva: PRAGMA sin diario ni fsync, executemany por lotes y los
+índices secundarios se crean al final.
+
+    python benchmarks/generador_datos.py --db /tmp/recetas_1M.db --recetas 1000000
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import bisect
+import sqlite3
+import argparse
+from itertools import accumulate
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import estadisticas
+import reportes_farmacia
+import pacientes
+import frecuencias_uso
+from catalogos import cargar_cie10, leer_stock, ultimo_stock
+from datos_recetas import TIPOS_RECETA, COLUMNAS_RECETA, SQL_INSERT_RECETA, crear_esquema, fila_receta, formatear_numero
+from registro_eventos import SQL_INSERT as SQL_INSERT_REGISTRO
+from validacion_recetas import SERVICIOS_AUTORIZADOS
+
+LOTE = 20_000
+COLUMNA_HASH = COLUMNAS_RECETA.index("hash_verificacion")
+
+# Proporción de cada tipo y horas de atención (inicio, fin)
+PESO_TIPO = {"CE": 0.70, "EM": 0.20, "EH": 0.10}
+HORARIO_TIPO = {"CE": (7, 16), "EM": (0, 23), "EH": (6, 20)}
+
+# Diagnósticos frecuentes en atención primaria/emergencia (60% de las recetas)
+CIE_FRECUENTES = ("J06.9", "J02.9", "J00", "A09", "I10", "E11.9", "K29.7", "N39.0", "M54.5",
+                  "R50.9", "R51", "J20.9", "B34.9", "K30", "O26.9", "L30.9", "H10.9", "J45.9")
+
+NOMBRES = ("MARIA", "JOSE", "LUIS", "ANA", "CARLOS", "ROSA", "JUAN", "CARMEN", "JORGE", "LUCIA",
+           "MIGUEL", "SANDRA", "DIEGO", "PAOLA", "SEGUNDO", "BLANCA", "EDISON", "NANCY", "FAUSTO", "GLORIA")
+APELLIDOS = ("QUISPE", "FARINANGO", "CACUANGO", "TUQUERRES", "LOPEZ", "PEREZ", "GUALAVISI", "ANRANGO",
+             "SANCHEZ", "TORRES", "NEPAS", "CHICAIZA", "MORALES", "ANDRANGO", "CABASCANGO", "ULCUANGO")
+FRECUENCIAS = ("C/8H", "C/12H", "C/24H", "C/6H", "STAT", "PRN")
+VIAS = ("ORAL", "ORAL", "ORAL", "INTRAVENOSA", "INTRAMUSCULAR", "TOPICA", "INHALATORIA")
+
+
+def cedula(rng):
+    """Cédula ecuatoriana de 10 dígitos con dígito verificador (módulo 10)"""
+    provincia = rng.randint(1, 24)
+    digitos = [provincia // 10, provincia % 10, rng.randint(0, 5)] + [rng.randint(0, 9) for _ in range(6)]
+    suma = 0
+    for i, d in enumerate(digitos):
+        v = d * (2 if i % 2 == 0 else 1)
+        suma += v - 9 if v > 9 else v
+    return "".join(map(str, digitos)) + str((10 - suma % 10) % 10)
+
+
+class Elector:
+    """Elección ponderada rápida con pesos acumulados precalculados"""
+
+    def __init__(self, valores, pesos):
+        self.valores = list(valores)
+        self.acumulados = list(accumulate(pesos))
+        self.total = self.acumulados[-1]
+
+    def __call__(self, rng):
+        return self.valores[bisect.bisect(self.acumulados, rng.random() * self.total)]
+
+
+def zipf(valores, rng, s=1.1):
+    """Elector con distribución de Zipf sobre un orden aleatorio de los valores"""
+    valores = list(valores)
+    rng.shuffle(valores)
+    return Elector(valores, [1 / (r ** s) for r in range(1, len(valores) + 1)])
+
+
+class Generador:
+    def __init__(self, cie_index, medicamentos, recetas, dias=730, semilla=1, fin=None):
+        self.rng = random.Random(semilla)
+        self.n = recetas
+        self.fin = (fin or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.inicio = self.fin - timedelta(days=dias)
+        self.dias = dias
+
+        rng = self.rng
+        frecuentes = [c for c in CIE_FRECUENTES if c in cie_index]
+        resto = zipf(cie_index, rng, s=0.8)
+        self._cie_frecuente = zipf(frecuentes, rng) if frecuentes else resto
+        self._cie_resto = resto
+        self.cie_index = cie_index
+        self._med = zipf(medicamentos, rng)
+
+        # Pacientes recurrentes: ~1 paciente por cada 4 recetas, algunos crónicos muy frecuentes
+        pacientes = []
+        for _ in range(max(1, recetas // 4)):
+            sexo = rng.choice("MF")
+            edad = min(99, int(rng.gammavariate(2.0, 18)))
+            pacientes.append((
+                f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)} {rng.choice(NOMBRES)}",
+                cedula(rng), str(rng.randint(1000, 999999)), sexo, edad,
+            ))
+        self._paciente = zipf(pacientes, rng, s=0.6)
+
+        servicios = list(SERVICIOS_AUTORIZADOS)
+        self.prescriptores = [
+            (f"DR. {rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}", rng.choice(servicios), f"medico{i:02d}")
+            for i in range(60)
+        ]
+        self._tipo = Elector(PESO_TIPO, PESO_TIPO.values())
+        self._dia = self._pesos_dias()
+
+    def _pesos_dias(self):
+        """Días con más carga en invierno (abril-julio) y menos en fines de semana"""
+        dias, pesos = [], []
+        for d in range(self.dias):
+            fecha = self.inicio + timedelta(days=d)
+            peso = 1.0 if fecha.weekday() < 5 else 0.45
+            if fecha.month in (4, 5, 6, 7):
+                peso *= 1.25
+            # Crecimiento de la demanda a lo largo del periodo
+            peso *= 0.8 + 0.4 * d / max(1, self.dias)
+            dias.append(fecha)
+            pesos.append(peso)
+        return Elector(dias, pesos)
+
+    def momento(self, tipo):
+        rng = self.rng
+        fecha = self._dia(rng)
+        # Consulta externa sólo de lunes a viernes
+        while tipo == "CE" and fecha.weekday() >= 5:
+            fecha = self._dia(rng)
+        desde, hasta = HORARIO_TIPO[tipo]
+        return fecha + timedelta(hours=rng.randint(desde, hasta), minutes=rng.randint(0, 59),
+                                 seconds=rng.randint(0, 59))
+
+    def receta(self, tipo, momento):
+        rng = self.rng
+        nombre, ci, hc, sexo, edad = self._paciente(rng)
+        prescriptor, especialidad, _ = rng.choice(self.prescriptores)
+        cie = self._cie_frecuente(rng) if rng.random() < 0.6 else self._cie_resto(rng)
+        n_meds = min(6, 1 + int(rng.expovariate(0.7)))
+        dias = rng.choice((3, 5, 7, 10, 14, 30))
+        meds = []
+        for _ in range(n_meds):
+            frecuencia = rng.choice(FRECUENCIAS)
+            por_dia = {"C/8H": 3, "C/12H": 2, "C/24H": 1, "C/6H": 4}.get(frecuencia, 1)
+            meds.append({
+                "nombre": self._med(rng), "dosis": str(rng.choice((1, 1, 1, 2))), "frecuencia": frecuencia,
+                "via": rng.choice(VIAS), "duracion": f"{dias} días", "cantidad": str(por_dia * dias),
+            })
+        alergias = "Sí" if rng.random() < 0.08 else "No"
+        return {
+            "tipo": tipo, "fecha": momento.strftime("%d/%m/%Y"), "unidad": "HOSPITAL BASICO DE CAYAMBE",
+            "servicio": especialidad, "prescriptor": prescriptor, "prescriptor_especialidad": especialidad,
+            "paciente": nombre, "ci": ci, "hc": hc, "edad": str(edad), "meses": str(rng.randint(0, 11)),
+            "sexo": sexo, "talla": str(rng.randint(50, 185) if edad < 15 else rng.randint(145, 185)),
+            "peso": str(rng.randint(4, 60) if edad < 15 else rng.randint(45, 110)),
+            "cie": cie, "cie_desc": self.cie_index[cie],
+            "indicaciones": "Tomar la medicación según lo indicado. Control por consulta externa.",
+            "actividad_fisica": rng.choice(("", "Reposo relativo", "Actividad normal")),
+            "estado_enfermedad": rng.choice(("", "Agudo", "Crónico compensado")),
+            "alergias": alergias, "alergias_especificar": "Penicilina" if alergias == "Sí" else "",
+            "meds": meds,
+        }
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def lotes(self):
+        """
+        Genera lotes (recetas, auditoria, bitacora) en orden cronológico;
+        al final self.ultimos tiene el último número usado por tipo.
+        """
+        rng = self.rng
+        momentos = sorted((self.momento(t), t) for t in (self._tipo(rng) for _ in range(self.n)))
+        self.ultimos = dict.fromkeys(TIPOS_RECETA, -1)
+        # Sesiones abiertas en el turno actual (los momentos vienen ordenados)
+        sesiones, turno_actual = set(), None
+        recetas, auditoria, bitacora = [], [], []
+        for momento, tipo in momentos:
+            data = self.receta(tipo, momento)
+            self.ultimos[tipo] += 1
+            data["numero"] = numero = formatear_numero(tipo, self.ultimos[tipo], momento.year)
+            _, _, usuario = rng.choice(self.prescriptores)
+            ip = f"192.168.10.{rng.randint(10, 80)}"
+            creado = momento.isoformat()
+            fila = list(fila_receta(data, f"output/{numero}.pdf", usuario, ip, None, self._uuid(), creado))
+            data_hash = fila[COLUMNA_HASH]
+
+            # Un inicio de sesión por usuario y turno
+            turno = (momento.date(), momento.hour // 8)
+            if turno != turno_actual:
+                sesiones.clear()
+                turno_actual = turno
+            if usuario not in sesiones:
+                sesiones.add(usuario)
+                bitacora.append((self._uuid(), usuario, "LOGIN", (momento - timedelta(minutes=5)).isoformat(),
+                                 ip, "Inicio de sesión exitoso", "EXITOSO"))
+            auditoria.append((self._uuid(), numero, "CREACION", usuario, creado, ip,
+                              f"Receta creada para paciente {data['paciente']}", "", data_hash))
+            bitacora.append((self._uuid(), usuario, "CREAR_RECETA", creado, ip,
+                             f"Receta {numero} creada exitosamente", "EXITOSO"))
+            if rng.random() < 0.25:
+                consulta = (momento + timedelta(hours=rng.randint(1, 240))).isoformat()
+                auditoria.append((self._uuid(), numero, "CONSULTA", usuario, consulta, ip,
+                                  f"PDF consultado desde {ip}", "", ""))
+                bitacora.append((self._uuid(), usuario, "ABRIR_PDF", consulta, ip, f"PDF {numero} abierto", "EXITOSO"))
+            if rng.random() < 0.005:
+                fila[-1] = "ANULADA"
+                auditoria.append((self._uuid(), numero, "ANULACION", usuario,
+                                  (momento + timedelta(minutes=rng.randint(1, 120))).isoformat(), ip,
+                                  "Receta anulada por error de digitación", data_hash, ""))
+            recetas.append(fila)
+
+            if len(recetas) >= LOTE:
+                yield recetas, auditoria, bitacora
+                recetas, auditoria, bitacora = [], [], []
+        if recetas:
+            yield recetas, auditoria, bitacora
+
+
+def _indices_secundarios(conn):
+    """(nombre, sql) de los índices creados por el esquema (no los automáticos de PK/UNIQUE)"""
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    ).fetchall()
+
+
+def generar(path, recetas, dias=730, semilla=1, agregados=True, progreso=None):
+    """
+    Crea `path` (no debe existir) con `recetas` recetas sintéticas.
+    Devuelve dict con conteos y segundos.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} ya existe; el generador sólo crea bases nuevas")
+    t0 = time.perf_counter()
+    cie_index = cargar_cie10(os.path.join(RAIZ, "cie10_es.csv"))
+    stock = leer_stock(ultimo_stock(RAIZ))
+    medicamentos = [it["nombre"] for it in stock if it["tipo"] == "medicamento"] or [it["nombre"] for it in stock]
+    gen = Generador(cie_index, medicamentos, recetas, dias, semilla)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-262144")  # 256 MB
+        crear_esquema(conn)
+
+        # Índices diferidos: se eliminan y se recrean tras la carga
+        indices = _indices_secundarios(conn)
+        for nombre, _ in indices:
+            conn.execute(f"DROP INDEX {nombre}")
+
+        conteo = {"recetas": 0, "auditoria": 0, "bitacora_accesos": 0}
+        for filas, auditoria, bitacora in gen.lotes():
+            with conn:
+                conn.executemany(SQL_INSERT_RECETA, filas)
+                conn.executemany(SQL_INSERT_REGISTRO["auditoria"], auditoria)
+                conn.executemany(SQL_INSERT_REGISTRO["bitacora_accesos"], bitacora)
+            conteo["recetas"] += len(filas)
+            conteo["auditoria"] += len(auditoria)
+            conteo["bitacora_accesos"] += len(bitacora)
+            if progreso:
+                progreso(conteo["recetas"], recetas)
+
+        with conn:
+            conn.executemany("UPDATE secuencias SET ultimo = ? WHERE tipo = ?",
+                             [(v, k) for k, v in gen.ultimos.items()])
+        t_carga = time.perf_counter() - t0
+        for _, sql in indices:
+            conn.execute(sql)
+        conn.commit()
+        t_indices = time.perf_counter() - t0 - t_carga
+
+        if agregados:
+            estadisticas.reconstruir(conn)
+            reportes_farmacia.reconstruir_consumo(conn)
+            pacientes.reconstruir(conn)
+            frecuencias_uso.reconstruir(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    conteo.update(segundos=round(time.perf_counter() - t0, 1), segundos_carga=round(t_carga, 1),
+                  segundos_indices=round(t_indices, 1))
+    return conteo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generador de bases sintéticas de recetas")
+    parser.add_argument("--db", required=True, help="Base a crear (no debe existir)")
+    parser.add_argument("--recetas", type=int, default=1_000_000)
+    parser.add_argument("--dias", type=int, default=730, help="Días de historia hasta hoy")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--sin-agregados", action="store_true",
+                        help="No recalcular estadísticas ni consumo de farmacia")
+    args = parser.parse_args(argv)
+
+    def progreso(hechas, total):
+        print(f"\r  {hechas}/{total} recetas", end="", flush=True)
+
+    conteo = generar(args.db, args.recetas, args.dias, args.semilla, not args.sin_agregados, progreso)
+    print()
+    print(f"{conteo['recetas']} recetas, {conteo['auditoria']} eventos de auditoría, "
+          f"{conteo['bitacora_accesos']} accesos en {conteo['segundos']} s "
+          f"(carga {conteo['segundos_carga']} s, índices {conteo['segundos_indices']} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+"""
+Catálogos compilados en un archivo binario de solo lectura compartido por mmap
+En un servidor de terminales cada sesión tenía su propia copia de CIE-10 y del
+stock (dict, lista de tuplas y lista de nombres: miles de objetos str). El
+catálogo se compila una vez a data/catalogos/catalogos_<huella>.bin y cada
+proceso lo abre con mmap: el sistema operativo comparte las páginas entre
+sesiones y abrirlo no lee ni interpreta los CSV. Los str se crean sólo al
+acceder a un elemento.
+
+La huella depende de la ruta, el tamaño y la fecha de los CSV y de VERSION: si
+cambian, se compila un archivo nuevo (nunca se reescribe uno que otra sesión
+puede tener abierto) y los anteriores se borran cuando ya nadie los usa.
+
+Formato (little endian):
+    cabecera   MAGIA (8 bytes), VERSION (uint32), número de secciones (uint32)
+    tabla      (desplazamiento, longitud) uint64 por cada sección de SECCIONES
+    secciones  alineadas a 8 bytes. Cada texto es un montón UTF-8 más un arreglo
+               uint32 de n+1 desplazamientos; las de búsqueda guardan los textos
+               en minúsculas separados por "\n" para buscar subcadenas con un
+               solo find sobre el mapa. cie_orden: índices ordenados por código.
+
+    python catalogo_binario.py                # compila (si hace falta) y muestra el tamaño
+    python catalogo_binario.py --forzar
+"""
+
+import os
+import sys
+import glob
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import argparse
+from array import array
+from itertools import islice
+from collections.abc import Mapping, Sequence, ItemsView
+
+from catalogos import (
+    cargar_cie10, leer_stock, buscar_cie, buscar_medicamentos, filtrar_cie, filtrar_medicamentos,
+    ordenar_por_uso,
+)
+
+logger = logging.getLogger(__name__)
+
+MAGIA = b"RXCATLG\0"
+VERSION = 1
+SECCIONES = (
+    "fuentes",
+    "cie_codigos", "cie_codigos_off", "cie_desc", "cie_desc_off",
+    "cie_busqueda", "cie_busqueda_off", "cie_orden",
+    "med", "med_off", "med_busqueda", "med_busqueda_off",
+)
+_CABECERA = struct.Struct("<8sII")
+_ENTRADA = struct.Struct("<QQ")
+PATRON_ARCHIVO = "catalogos_*.bin"
+
+
+# --- Compilación ---
+def _monton(textos, separador=b""):
+    """(bytes UTF-8 concatenados, array uint32 de n+1 desplazamientos)"""
+    offsets = array("I", [0])
+    partes = []
+    total = 0
+    for texto in textos:
+        dato = texto.encode("utf-8") + separador
+        partes.append(dato)
+        total += len(dato)
+        offsets.append(total)
+    if total >= 2 ** 32:
+        raise ValueError("Catálogo demasiado grande para desplazamientos de 32 bits")
+    return b"".join(partes), offsets
+
+
+def _uint32(arr):
+    if sys.byteorder != "little":
+        arr = array("I", arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def compilar(path, cie_index, medicamentos, fuentes=None):
+    """Escribe el catálogo binario en path (archivo temporal y os.replace)"""
+    codigos = list(cie_index)
+    descripciones = [cie_index[c] or "" for c in codigos]
+    secciones = {"fuentes": json.dumps(fuentes or {}, ensure_ascii=False).encode("utf-8")}
+    for nombre, textos in (("cie_codigos", codigos), ("cie_desc", descripciones), ("med", medicamentos)):
+        heap, off = _monton(textos)
+        secciones[nombre], secciones[nombre + "_off"] = heap, _uint32(off)
+    for nombre, textos in (("cie_busqueda", descripciones), ("med_busqueda", medicamentos)):
+        heap, off = _monton((t.lower() for t in textos), b"\n")
+        secciones[nombre], secciones[nombre + "_off"] = heap, _uint32(off)
+    secciones["cie_orden"] = _uint32(array("I", sorted(range(len(codigos)), key=codigos.__getitem__)))
+
+    inicio = _CABECERA.size + _ENTRADA.size * len(SECCIONES)
+    tabla, cuerpo = [], bytearray()
+    for nombre in SECCIONES:
+        cuerpo += b"\0" * (-(inicio + len(cuerpo)) % 8)
+        tabla.append(_ENTRADA.pack(inicio + len(cuerpo), len(secciones[nombre])))
+        cuerpo += secciones[nombre]
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_CABECERA.pack(MAGIA, VERSION, len(SECCIONES)))
+        f.write(b"".join(tabla))
+        f.write(cuerpo)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+# --- Lectura ---
+class Textos(Sequence):
+    """Secuencia de str sobre un montón UTF-8 mapeado (decodifica al acceder)"""
+
+    def __init__(self, heap, offsets):
+        self._heap = heap
+        self._off = offsets
+
+    def __len__(self):
+        return len(self._off) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._heap[self._off[i]:self._off[i + 1]], "utf-8")
+
+    def __iter__(self):
+        heap, off = self._heap, self._off
+        for i in range(len(off) - 1):
+            yield str(heap[off[i]:off[i + 1]], "utf-8")
+
+
+class ParesCIE(Sequence):
+    """[(code, desc)] del catálogo, en su orden (sustituye a la lista de tuplas)"""
+
+    def __init__(self, codigos, descripciones):
+        self._codigos = codigos
+        self._desc = descripciones
+
+    def __len__(self):
+        return len(self._codigos)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(zip(self._codigos[i], self._desc[i]))
+        return self._codigos[i], self._desc[i]
+
+    def __iter__(self):
+        return zip(self._codigos, self._desc)
+
+
+class _ItemsCIE(ItemsView):
+    def __iter__(self):
+        return iter(self._mapping.pares)
+
+
+class IndiceCIE(Mapping):
+    """{code: desc} de solo lectura; búsqueda binaria sobre cie_orden"""
+
+    def __init__(self, codigos, descripciones, orden):
+        self.codigos = codigos
+        self.pares = ParesCIE(codigos, descripciones)
+        self._desc = descripciones
+        self._orden = orden
+
+    def posicion(self, codigo):
+        """Primera posición de cie_orden cuyo código es >= codigo"""
+        lo, hi = 0, len(self._orden)
+        while lo < hi:
+            medio = (lo + hi) // 2
+            if self.codigos[self._orden[medio]] < codigo:
+                lo = medio + 1
+            else:
+                hi = medio
+        return lo
+
+    def __getitem__(self, codigo):
+        pos = self.posicion(codigo)
+        if pos < len(self._orden):
+            i = self._orden[pos]
+            if self.codigos[i] == codigo:
+                return self._desc[i]
+        raise KeyError(codigo)
+
+    def __iter__(self):
+        return iter(self.codigos)
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def items(self):
+        return _ItemsCIE(self)
+
+    def en_orden(self):
+        """Índices de todos los códigos en orden de código"""
+        return iter(self._orden)
+
+    def con_prefijo(self, prefijo):
+        """Índices (en orden de código) de los códigos que empiezan por prefijo"""
+        pos = self.posicion(prefijo)
+        while pos < len(self._orden):
+            i = self._orden[pos]
+            if not self.codigos[i].startswith(prefijo):
+                break
+            yield i
+            pos += 1
+
+
+def _coincidencias(mapa, inicio, fin, offsets, consulta):
+    """Índices de las entradas de una sección de búsqueda que contienen consulta"""
+    patron = consulta.encode("utf-8")
+    pos = mapa.find(patron, inicio, fin)
+    while pos != -1:
+        i = _entrada_de(offsets, pos - inicio)
+        yield i
+        pos = mapa.find(patron, inicio + offsets[i + 1], fin)
+
+
+def _coincidencias_pegadas(mapa, inicio, fin, offsets, consulta):
+    """Como _coincidencias en un montón sin separadores (descarta los cruces entre entradas)"""
+    patron = consulta.encode("utf-8")
+    pos = mapa.find(patron, inicio, fin)
+    while pos != -1:
+        i = _entrada_de(offsets, pos - inicio)
+        if pos - inicio + len(patron) <= offsets[i + 1]:
+            yield i
+        pos = mapa.find(patron, pos + 1, fin)
+
+
+def _entrada_de(offsets, desplazamiento):
+    lo, hi = 0, len(offsets) - 1
+    while hi - lo > 1:
+        medio = (lo + hi) // 2
+        if offsets[medio] <= desplazamiento:
+            lo = medio
+        else:
+            hi = medio
+    return lo
+
+
+class CatalogoBinario:
+    """Catálogos de un archivo compilado, abiertos con mmap (solo lectura)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, version, n = _CABECERA.unpack_from(self._mapa, 0)
+        if magia != MAGIA or version != VERSION or n != len(SECCIONES):
+            self._mapa.close()
+            raise ValueError(f"{path} no es un catálogo compilado de la versión {VERSION}")
+        vista = memoryview(self._mapa)
+        self._rangos, self._vistas = {}, {}
+        self._exportadas = [vista]  # se liberan al cerrar (mmap no cierra con vistas activas)
+        for k, nombre in enumerate(SECCIONES):
+            inicio, largo = _ENTRADA.unpack_from(self._mapa, _CABECERA.size + k * _ENTRADA.size)
+            self._rangos[nombre] = (inicio, inicio + largo)
+            seccion = vista[inicio:inicio + largo]
+            self._exportadas.append(seccion)
+            if nombre.endswith(("_off", "_orden")):
+                seccion = seccion.cast("I")
+                self._exportadas.append(seccion)
+            self._vistas[nombre] = seccion
+        v = self._vistas
+        self.fuentes = json.loads(str(v["fuentes"], "utf-8") or "{}")
+        codigos = Textos(v["cie_codigos"], v["cie_codigos_off"])
+        self.cie = IndiceCIE(codigos, Textos(v["cie_desc"], v["cie_desc_off"]), v["cie_orden"])
+        self.cie_items = self.cie.pares
+        self.medicamentos = Textos(v["med"], v["med_off"])
+
+    def buscar_cie(self, texto, por_descripcion=False, limite=12, preferidos=None):
+        """Como catalogos.buscar_cie; por código en orden de código, por descripción en orden del catálogo"""
+        if por_descripcion:
+            q = (texto or "").strip().lower()
+            if len(q) < 3:
+                return []
+            indices = _coincidencias(self._mapa, *self._rangos["cie_busqueda"],
+                                     self._vistas["cie_busqueda_off"], q)
+            coincide = lambda it: q in (it[1] or "").lower()
+        else:
+            q = (texto or "").strip().upper()
+            if not q:
+                return []
+            indices = self.cie.con_prefijo(q)
+            coincide = lambda it: it[0].startswith(q)
+        candidatos = (self.cie_items[i] for i in indices)
+        return ordenar_por_uso(candidatos, coincide, limite, preferidos, lambda it: it[0])
+
+    def buscar_medicamentos(self, texto, limite=10, preferidos=None):
+        """Como catalogos.buscar_medicamentos, con un find sobre los nombres en minúsculas"""
+        q = (texto or "").lower().strip()
+        if len(q) < 3:
+            return []
+        indices = _coincidencias(self._mapa, *self._rangos["med_busqueda"], self._vistas["med_busqueda_off"], q)
+        return ordenar_por_uso((self.medicamentos[i] for i in indices), lambda med: q in med.lower(),
+                                limite, preferidos)
+
+    def filtrar_cie(self, texto):
+        """Como catalogos.filtrar_cie, perezoso (códigos y descripciones con find sobre el mapa)"""
+        q = (texto or "").strip().lower()
+        if not q:
+            return (self.cie_items[i] for i in self.cie.en_orden())
+        elegidos = set(_coincidencias(self._mapa, *self._rangos["cie_busqueda"],
+                                      self._vistas["cie_busqueda_off"], q))
+        elegidos.update(_coincidencias_pegadas(self._mapa, *self._rangos["cie_codigos"],
+                                               self._vistas["cie_codigos_off"], q.upper()))
+        return (self.cie_items[i] for i in self.cie.en_orden() if i in elegidos)
+
+    def filtrar_medicamentos(self, texto):
+        """Como catalogos.filtrar_medicamentos, perezoso"""
+        q = (texto or "").strip().lower()
+        if not q:
+            return iter(self.medicamentos)
+        indices = _coincidencias(self._mapa, *self._rangos["med_busqueda"], self._vistas["med_busqueda_off"], q)
+        return (self.medicamentos[i] for i in indices)
+
+    def cerrar(self):
+        self._vistas.clear()
+        for vista in reversed(self._exportadas):
+            vista.release()
+        self._exportadas.clear()
+        self._mapa.close()
+
+
+class CatalogoListas:
+    """Misma interfaz sobre dict y lista en memoria (si no se puede compilar o mapear)"""
+
+    def __init__(self, cie_index, medicamentos):
+        self.path = None
+        self.fuentes = {}
+        self.cie = cie_index
+        self.cie_items = list(cie_index.items())
+        self.medicamentos = medicamentos
+
+    def buscar_cie(self, texto, por_descripcion=False, limite=12, preferidos=None):
+        return buscar_cie(self.cie_items, texto, por_descripcion, limite, preferidos)
+
+    def buscar_medicamentos(self, texto, limite=10, preferidos=None):
+        return buscar_medicamentos(self.medicamentos, texto, limite, preferidos)
+
+    def filtrar_cie(self, texto):
+        return filtrar_cie(self.cie_items, texto)
+
+    def filtrar_medicamentos(self, texto):
+        return filtrar_medicamentos(self.medicamentos, texto)
+
+    def cerrar(self):
+        pass
+
+
+def fuentes_de(cie_path, stock_path):
+    """{ruta: [tamaño, mtime_ns]} de los CSV (los que existen)"""
+    fuentes = {}
+    for path in (cie_path, stock_path):
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            fuentes[os.path.abspath(path)] = [st.st_size, st.st_mtime_ns]
+    return fuentes
+
+
+def ruta_compilada(directorio, fuentes):
+    huella = hashlib.blake2b(json.dumps([VERSION, fuentes], sort_keys=True).encode("utf-8"),
+                             digest_size=8).hexdigest()
+    return os.path.join(directorio, PATRON_ARCHIVO.replace("*", huella))
+
+
+def _limpiar(directorio, vigente):
+    """Borra compilaciones anteriores; las abiertas por otra sesión (Windows) se dejan"""
+    for path in glob.glob(os.path.join(directorio, PATRON_ARCHIVO)):
+        if os.path.abspath(path) != os.path.abspath(vigente):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def cargar_catalogos(cie_path, stock_path, directorio, forzar=False):
+    """
+    CatalogoBinario vigente para los CSV (lo compila si no existe). Si no se
+    puede escribir o mapear, CatalogoListas con los CSV leídos en memoria.
+    """
+    fuentes = fuentes_de(cie_path, stock_path)
+    path = ruta_compilada(directorio, fuentes)
+    try:
+        if forzar or not os.path.exists(path):
+            os.makedirs(directorio, exist_ok=True)
+            cie_index = cargar_cie10(cie_path) if cie_path else {}
+            medicamentos = [it["nombre"] for it in leer_stock(stock_path)] \
+                if stock_path and os.path.exists(stock_path) else []
+            tamano = compilar(path, cie_index, medicamentos, fuentes)
+            logger.info(f"Catálogos compilados en {path} ({tamano / 1024:.0f} KB)")
+            _limpiar(directorio, path)
+        return CatalogoBinario(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Catálogo compilado no disponible ({e}); se usan los CSV en memoria")
+        medicamentos = [it["nombre"] for it in leer_stock(stock_path)] \
+            if stock_path and os.path.exists(stock_path) else []
+        return CatalogoListas(cargar_cie10(cie_path) if cie_path else {}, medicamentos)
+
+
+def main(argv=None):
+    from catalogos import ultimo_stock
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compila los catálogos para abrirlos con mmap")
+    parser.add_argument("--cie10", default=os.path.join(raiz, "cie10_es.csv"))
+    parser.add_argument("--stock", help="CSV de stock (por defecto el más reciente)")
+    parser.add_argument("--destino", default=os.path.join(raiz, "data", "catalogos"))
+    parser.add_argument("--forzar", action="store_true", help="Vuelve a compilar aunque esté al día")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    catalogo = cargar_catalogos(args.cie10, args.stock or ultimo_stock(raiz), args.destino, args.forzar)
+    try:
+        tamano = f"{os.path.getsize(catalogo.path) / 1024:.0f} KB" if catalogo.path else "sin compilar"
+        print(f"{catalogo.path or 'CSV en memoria'}: {len(catalogo.cie)} códigos CIE-10, "
+              f"{len(catalogo.medicamentos)} ítems de stock, {tamano}")
+        for code, desc in islice(catalogo.cie_items, 3):
+            print(f"  {code}  {desc}")
+    finally:
+        catalogo.cerrar()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
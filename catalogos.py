@@ -0,0 +1,257 @@
+"""
+Lectura de catálogos compartidos (CIE-10, stock de farmacia y hojas xlsx)
+El CSV de stock que publica farmacia no escapa las comas de los nombres
+(p. ej. "Alprazolam Sólido Oral 0,5 Mg"), por lo que se separa desde la derecha.
+leer_xlsx lee la primera hoja de un .xlsx con la biblioteca estándar (el
+listado de usuarios), sin cargar pandas en cada sesión.
+"""
+
+import os
+import re
+import csv
+import glob
+import zipfile
+import posixpath
+from itertools import islice
+import unicodedata
+import xml.etree.ElementTree as ET
+
+STOCK_PATTERN = "stock_medicamentos_dispositivos_HBC_*.csv"
+TIPOS_STOCK = ("medicamento", "dispositivo/insumo")
+COLUMNAS_EXISTENCIA = ("existencia", "existencias", "stock", "saldo", "cantidad", "disponible")
+
+
+CIE10_COMUNES = {
+    'Z00.0': 'Examen médico general',
+    'Z51.1': 'Quimioterapia para neoplasia',
+    'I10': 'Hipertensión esencial (primaria)',
+    'E11': 'Diabetes mellitus no insulinodependiente',
+    'J06.9': 'Infección aguda de las vías respiratorias superiores, no especificada',
+    'K59.0': 'Estreñimiento',
+    'M79.3': 'Paniculitis, no especificada',
+    'R50.9': 'Fiebre, no especificada',
+    'R06.0': 'Disnea',
+    'R51': 'Cefalea'
+}
+
+CIE_PATTERN = re.compile(r'\b([A-Z]\d{2}(?:\.\d+)?)\b')
+
+
+def cargar_cie10(path):
+    """
+    Carga el catálogo CIE-10 en un diccionario {CODE: DESC}.
+    Si el archivo no existe devuelve {}; si no se reconoce ningún código,
+    prueba como CSV con cabecera y, en último caso, usa CIE10_COMUNES.
+    """
+    idx = {}
+    if not os.path.exists(path):
+        return idx
+
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    for line in content.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        for code in CIE_PATTERN.findall(line):
+            code_pos = line.find(code)
+            if code_pos != -1:
+                desc = line[code_pos + len(code):].strip()
+                desc = re.sub(r'^[^\w]*', '', desc)
+                desc = desc.split('  ')[0]
+
+                if desc and len(desc) > 3:
+                    idx[code.upper()] = desc[:200]
+
+    if not idx:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    code = (row.get('code') or row.get('codigo') or '').strip().upper()
+                    desc = (row.get('desc') or row.get('descripcion') or '').strip()
+                    if code and desc:
+                        idx[code] = desc
+        except Exception:
+            pass
+
+    if not idx:
+        idx.update(CIE10_COMUNES)
+    return idx
+
+
+def ultimo_stock(directorio):
+    """Devuelve el CSV de stock más reciente del directorio (por fecha en el nombre)"""
+    archivos = sorted(glob.glob(os.path.join(directorio, STOCK_PATTERN)))
+    return archivos[-1] if archivos else None
+
+
+def _parse_numero(valor):
+    txt = str(valor or "").strip().replace(",", ".")
+    try:
+        return float(txt) if txt else None
+    except ValueError:
+        return None
+
+
+def leer_stock(path):
+    """
+    Lee el CSV de stock y devuelve una lista de dicts:
+    {'nombre': ..., 'tipo': ..., 'existencia': float o None}
+    La columna de existencia es opcional (existencia/stock/saldo/cantidad).
+    """
+    items = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        lineas = [l.strip() for l in f if l.strip()]
+    if not lineas:
+        return items
+
+    header = [h.strip().lower() for h in lineas[0].split(",")]
+    ncols = len(header)
+    col_tipo = header.index("tipo") if "tipo" in header else None
+    col_exist = next((header.index(c) for c in COLUMNAS_EXISTENCIA if c in header), None)
+
+    for linea in lineas[1:]:
+        # Líneas completamente entrecomilladas: "NOMBRE, 1"" 22,tipo"
+        if linea.startswith('"') and linea.endswith('"') and linea.count('"') % 2 == 0:
+            linea = linea[1:-1].replace('""', '"')
+        partes = linea.rsplit(",", ncols - 1) if ncols > 1 else [linea]
+        nombre = partes[0].strip().strip('"').strip()
+        if not nombre:
+            continue
+        tipo = partes[col_tipo].strip() if col_tipo is not None and col_tipo < len(partes) else ""
+        existencia = _parse_numero(partes[col_exist]) if col_exist is not None and col_exist < len(partes) else None
+        items.append({"nombre": nombre, "tipo": tipo, "existencia": existencia})
+    return items
+
+
+def clave_item(nombre):
+    """Clave normalizada de un ítem (sin tildes, minúsculas, sin sufijo de tipo)"""
+    s = str(nombre or "").strip()
+    for tipo in TIPOS_STOCK:
+        if s.lower().endswith("," + tipo):
+            s = s[: -(len(tipo) + 1)]
+            break
+    s = "".join(c for c in unicodedata.normalize("NFD", s.lower()) if unicodedata.category(c) != "Mn")
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def ordenar_por_uso(items, coincide, limite, preferidos=None, clave=lambda it: it):
+    """Coincidencias entre los preferidos (en su orden) y luego el resto en orden del catálogo"""
+    elegidos = list(islice((it for it in preferidos or () if coincide(it)), limite))
+    if len(elegidos) >= limite:
+        return elegidos
+    vistos = {clave(it) for it in elegidos}
+    resto = (it for it in items if coincide(it) and clave(it) not in vistos)
+    return elegidos + list(islice(resto, limite - len(elegidos)))
+
+
+def buscar_cie(items, texto, por_descripcion=False, limite=12, preferidos=None):
+    """
+    Sugerencias CIE-10 [(code, desc)] en orden del catálogo: por prefijo de código
+    o, con por_descripcion, por subcadena de la descripción (mínimo 3 letras).
+    preferidos: items ya ordenados por uso (frecuencias_uso) que van primero.
+    """
+    if por_descripcion:
+        q = (texto or '').strip().lower()
+        if len(q) < 3:
+            return []
+        coincide = lambda it: q in (it[1] or '').lower()
+    else:
+        q = (texto or '').strip().upper()
+        if len(q) < 1:
+            return []
+        coincide = lambda it: it[0].startswith(q)
+    return ordenar_por_uso(items, coincide, limite, preferidos, lambda it: it[0])
+
+
+def buscar_medicamentos(nombres, texto, limite=10, preferidos=None):
+    """Sugerencias de medicamentos que contienen el texto (mínimo 3 letras), los más usados primero"""
+    q = (texto or '').lower().strip()
+    if len(q) < 3:
+        return []
+    return ordenar_por_uso(nombres, lambda med: q in med.lower(), limite, preferidos)
+
+
+def filtrar_cie(items, texto):
+    """(code, desc) con el texto en el código o en la descripción, en orden de código (listas completas)"""
+    q = (texto or '').strip().lower()
+    return (it for it in sorted(items) if q in it[0].lower() or q in (it[1] or '').lower())
+
+
+def filtrar_medicamentos(nombres, texto):
+    """Nombres que contienen el texto, en orden del catálogo (listas completas)"""
+    q = (texto or '').strip().lower()
+    return (med for med in nombres if q in med.lower())
+
+
+_NS_XLSX = {
+    "m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+
+
+def _texto_xml(elemento):
+    """Texto de un <si>/<is> (incluye el texto enriquecido, varios <t>)"""
+    return "".join(t.text or "" for t in elemento.iter(f"{{{_NS_XLSX['m']}}}t"))
+
+
+def _columna_xlsx(referencia):
+    """Índice 0.. de la columna de una celda ("C12" -> 2)"""
+    n = 0
+    for c in referencia:
+        if not c.isalpha():
+            break
+        n = n * 26 + ord(c.upper()) - 64
+    return n - 1
+
+
+def _valor_xlsx(celda, compartidos):
+    tipo = celda.get("t", "n")
+    if tipo == "inlineStr":
+        nodo = celda.find("m:is", _NS_XLSX)
+        return _texto_xml(nodo) if nodo is not None else ""
+    v = celda.find("m:v", _NS_XLSX)
+    if v is None or v.text is None:
+        return ""
+    if tipo == "s":
+        return compartidos[int(v.text)]
+    if tipo == "n" and v.text.endswith(".0"):
+        return v.text[:-2]  # enteros guardados como 1712345678.0
+    return v.text
+
+
+def leer_xlsx(path):
+    """
+    Filas de la primera hoja de un .xlsx como dicts {encabezado: texto}
+    (todas las celdas como str; vacías como ""). Sólo biblioteca estándar.
+    """
+    with zipfile.ZipFile(path) as z:
+        nombres = set(z.namelist())
+        compartidos = []
+        if "xl/sharedStrings.xml" in nombres:
+            raiz = ET.fromstring(z.read("xl/sharedStrings.xml"))
+            compartidos = [_texto_xml(si) for si in raiz.findall("m:si", _NS_XLSX)]
+        libro = ET.fromstring(z.read("xl/workbook.xml"))
+        hoja = libro.find("m:sheets/m:sheet", _NS_XLSX)
+        rid = hoja.get(f"{{{_NS_XLSX['r']}}}id")
+        relaciones = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        destino = next(r.get("Target") for r in relaciones.findall("rel:Relationship", _NS_XLSX)
+                       if r.get("Id") == rid)
+        ruta = destino.lstrip("/") if destino.startswith("/") else posixpath.normpath(posixpath.join("xl", destino))
+        datos = ET.fromstring(z.read(ruta))
+
+    filas = []
+    for fila in datos.iterfind("m:sheetData/m:row", _NS_XLSX):
+        valores = {}
+        for k, celda in enumerate(fila.findall("m:c", _NS_XLSX)):
+            col = _columna_xlsx(celda.get("r")) if celda.get("r") else k
+            valores[col] = _valor_xlsx(celda, compartidos)
+        filas.append([valores.get(i, "") for i in range(max(valores) + 1)] if valores else [])
+    if not filas:
+        return []
+    encabezado = [str(h).strip() for h in filas[0]]
+    return [{h: (fila[i] if i < len(fila) else "") for i, h in enumerate(encabezado) if h}
+            for fila in filas[1:] if any(str(v).strip() for v in fila)]
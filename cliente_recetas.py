@@ -0,0 +1,194 @@
+"""
+Cliente del servidor de recetas (modo cliente/servidor)
+Misma interfaz que datos_recetas.BackendLocal, pero cada operación es una
+petición HTTP/JSON a servidor_recetas.py. Mantiene una conexión persistente
+por hilo.
+"""
+
+import os
+import json
+import base64
+import threading
+import http.client
+from urllib.parse import urlparse, urlencode, quote
+
+from metricas import span
+
+
+class ErrorServidor(Exception):
+    """Error devuelto por el servidor de recetas o de comunicación con él"""
+
+    def __init__(self, mensaje, estado=None):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+class ClienteRecetas:
+    # POST que el servidor aplica sin duplicar (omite los ids ya insertados)
+    IDEMPOTENTES = ("/api/recetas/lote", "/api/registros")
+
+    def __init__(self, url, token="", timeout=15):
+        u = urlparse(url)
+        if u.scheme not in ("http", "https"):
+            raise ValueError(f"URL de servidor inválida: {url}")
+        self.url = url
+        self.https = u.scheme == "https"
+        self.host = u.hostname
+        self.port = u.port or (443 if self.https else 80)
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # --- Transporte ---
+    def _conexion(self, nueva=False):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or nueva:
+            if conn is not None:
+                conn.close()
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _pedir(self, metodo, ruta, cuerpo=None, params=None, crudo=False):
+        # Agrupar por recurso (/api/recetas/CE-... -> http.GET /api/recetas)
+        with span(f"http.{metodo} {'/'.join(ruta.split('/')[:3])}"):
+            return self._pedir_sin_medir(metodo, ruta, cuerpo, params, crudo)
+
+    def _pedir_sin_medir(self, metodo, ruta, cuerpo, params, crudo):
+        # Solo se reenvía lo que no tiene efecto repetido (un POST /api/recetas
+        # repetido gasta otro número o choca con 409 si el primero llegó)
+        reenviable = metodo == "GET" or ruta in self.IDEMPOTENTES
+        if params:
+            ruta += "?" + urlencode({k: v for k, v in params.items() if v not in (None, "")})
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8") if cuerpo is not None else None
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["X-Token"] = self.token
+
+        for intento in range(2):
+            conn = self._conexion(nueva=intento > 0)
+            reusada = conn.sock is not None
+            try:
+                conn.request(metodo, ruta, body=datos, headers=headers)
+                resp = conn.getresponse()
+                contenido = resp.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # Conexión persistente cerrada por el servidor antes de responder:
+                # reintentar una vez. Un timeout o un corte en conexión nueva no
+                # se reintenta (el servidor pudo haber procesado la petición).
+                cortada = isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError))
+                if intento or not (reusada and cortada and reenviable):
+                    raise ErrorServidor(f"Servidor de recetas no disponible: {e}")
+
+        if resp.status >= 400:
+            try:
+                mensaje = json.loads(contenido).get("error", "")
+            except ValueError:
+                mensaje = contenido.decode("utf-8", "replace")
+            raise ErrorServidor(mensaje or f"HTTP {resp.status}", resp.status)
+        return contenido if crudo else json.loads(contenido)
+
+    # --- Operaciones (misma interfaz que BackendLocal) ---
+    def salud(self):
+        return self._pedir("GET", "/api/salud").get("estado") == "ok"
+
+    def asignar_numero(self, tipo):
+        return self._pedir("POST", "/api/numeros", {"tipo": tipo})["numero"]
+
+    def reservar_bloque(self, tipo, cantidad, estacion=""):
+        r = self._pedir("POST", "/api/numeros/bloque", {"tipo": tipo, "cantidad": cantidad, "estacion": estacion})
+        return r["inicio"], r["fin"]
+
+    @staticmethod
+    def _pdf_b64(pdf_path):
+        if pdf_path and os.path.exists(pdf_path):
+            with open(pdf_path, "rb") as f:
+                return base64.b64encode(f.read()).decode("ascii")
+        return None
+
+    def guardar_receta(self, data, pdf_path, usuario, ip_address, data_hash, canonico=None):
+        # canonico no viaja: el servidor serializa la receta una vez al guardarla
+        r = self._pedir("POST", "/api/recetas", {
+            "data": data, "usuario": usuario, "ip": ip_address, "hash": data_hash,
+            "pdf": self._pdf_b64(pdf_path),
+        })
+        return r["id"]
+
+    def guardar_recetas_lote(self, items):
+        """Envía un lote idempotente (ver datos_recetas.guardar_recetas_lote); el PDF viaja con cada receta"""
+        # canonico (bytes) no viaja: el servidor serializa cada receta una vez al guardarla
+        cuerpo = [dict({k: v for k, v in it.items() if k != "canonico"}, pdf=self._pdf_b64(it.get("pdf_path")),
+                       pdf_path="") for it in items]
+        return self._pedir("POST", "/api/recetas/lote", {"items": cuerpo})["insertados"]
+
+    def buscar_receta(self, numero):
+        try:
+            return self._pedir("GET", f"/api/recetas/{quote(numero)}")
+        except ErrorServidor as e:
+            if e.estado == 404:
+                return None
+            raise
+
+    def verificar_receta(self, codigo):
+        return self._pedir("GET", "/api/verificar", params={"codigo": codigo})
+
+    def dispensar_receta(self, codigo, usuario, estacion=""):
+        return self._pedir("POST", "/api/dispensar", {"codigo": codigo, "usuario": usuario, "estacion": estacion})
+
+    def buscar_recetas(self, ci=None, limite=50):
+        return self._pedir("GET", "/api/recetas", params={"ci": ci, "limite": limite})
+
+    def buscar_paciente(self, ci):
+        try:
+            return self._pedir("GET", f"/api/pacientes/{quote(ci)}")
+        except ErrorServidor as e:
+            if e.estado == 404:
+                return None
+            raise
+
+    def medicamentos_recientes(self, ci, dias):
+        return self._pedir("GET", f"/api/pacientes/{quote(ci)}/medicamentos", params={"dias": dias})
+
+    def modelo_uso(self, prescriptor, especialidad):
+        return self._pedir("GET", "/api/uso", params={"prescriptor": prescriptor, "especialidad": especialidad})
+
+    def plantillas(self, prescriptor):
+        return self._pedir("GET", "/api/plantillas", params={"prescriptor": prescriptor})
+
+    def guardar_plantilla(self, prescriptor, nombre, contenido):
+        self._pedir("POST", "/api/plantillas", {"prescriptor": prescriptor, "nombre": nombre, "contenido": contenido})
+
+    def eliminar_plantilla(self, prescriptor, nombre):
+        return self._pedir("POST", "/api/plantillas/eliminar", {"prescriptor": prescriptor, "nombre": nombre})["eliminadas"]
+
+    def obtener_pdf(self, numero, destino_dir):
+        """Descarga el PDF a destino_dir (caché local) y devuelve la ruta, o None"""
+        destino = os.path.join(destino_dir, f"{numero}.pdf")
+        if os.path.exists(destino):
+            return destino
+        try:
+            contenido = self._pedir("GET", f"/api/recetas/{quote(numero)}/pdf", crudo=True)
+        except ErrorServidor as e:
+            if e.estado == 404:
+                return None
+            raise
+        os.makedirs(destino_dir, exist_ok=True)
+        with open(destino, "wb") as f:
+            f.write(contenido)
+        return destino
+
+    def exportar(self):
+        return [tuple(r) for r in self._pedir("GET", "/api/exportar")]
+
+    def registrar(self, items):
+        return self._pedir("POST", "/api/registros", {"items": [[t, list(f)] for t, f in items]})["insertados"]
+
+    def pagina_registros(self, registro, filtros=None, despues_de=None):
+        params = dict(filtros or {})
+        if despues_de:
+            params["despues_fecha"], params["despues_id"] = despues_de
+        r = self._pedir("GET", f"/api/registros/{registro}", params=params)
+        return [tuple(f) for f in r["filas"]], (tuple(r["siguiente"]) if r["siguiente"] else None)
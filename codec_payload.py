@@ -0,0 +1,151 @@
+"""
+Codificación compacta de recetas.payload
+El payload se guarda como BLOB: un byte de versión seguido del JSON compacto
+(claves ordenadas, sin espacios, UTF-8) comprimido con zlib y un diccionario
+predefinido con los nombres de campo (una receta es demasiado corta para que
+zlib aprenda sus propias repeticiones). Las filas antiguas (TEXT con
+json.dumps) se siguen leyendo igual; decodificar() acepta ambos.
+El hash de integridad se calcula sobre el dict, por lo que no cambia al recodificar.
+
+    python codec_payload.py                  # informe de tamaño
+    python codec_payload.py --migrar --vacuum
+"""
+
+import sys
+import json
+import zlib
+import sqlite3
+import argparse
+
+VERSION_ZLIB = 1
+NIVEL_ZLIB = 6
+TAM_LOTE = 500
+
+# Diccionario zlib de VERSION_ZLIB. NO modificar: los payloads ya guardados se
+# descomprimen con él; uno distinto requiere un nuevo byte de versión.
+DICCIONARIO_V1 = (
+    b'{"actividad_fisica":"","alergias":"No","alergias_especificar":"","ci":"","cie":"","cie_desc":"",'
+    b'"edad":"","estado_enfermedad":"","fecha":"","hc":"","indicaciones":"","meds":[{"cantidad":"",'
+    b'"dosis":"","duracion":" d\xc3\xadas","frecuencia":"C/8H","nombre":" S\xc3\xb3lido Oral Caja X '
+    b'Bl\xc3\xadster -Tableta","via":"ORAL"},{"cantidad":"","dosis":"","duracion":" d\xc3\xadas",'
+    b'"frecuencia":"C/12H","nombre":" L\xc3\xadquido parenteral mg/mL Caja x ampolla(s) x mL",'
+    b'"via":"INTRAVENOSA"}],"meses":"","numero":"CE-","paciente":"","peso":"","prescriptor":"",'
+    b'"prescriptor_especialidad":"","servicio":"","sexo":"","talla":"","tipo":"",'
+    b'"unidad":"HOSPITAL BASICO DE CAYAMBE"}'
+)
+
+
+def json_compacto(data):
+    """Bytes del JSON compacto y determinista de la receta"""
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def codificar(data):
+    """Payload listo para guardar (bytes: versión + JSON compacto comprimido)"""
+    return codificar_bytes(json_compacto(data))
+
+
+def codificar_bytes(json_bytes):
+    """Como codificar, a partir de bytes ya producidos por json_compacto"""
+    compresor = zlib.compressobj(NIVEL_ZLIB, zdict=DICCIONARIO_V1)
+    return bytes((VERSION_ZLIB,)) + compresor.compress(json_bytes) + compresor.flush()
+
+
+def decodificar_bytes(payload):
+    """Bytes del JSON contenido en un payload de cualquier versión"""
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    payload = bytes(payload)
+    if payload[:1] == bytes((VERSION_ZLIB,)):
+        descompresor = zlib.decompressobj(zdict=DICCIONARIO_V1)
+        return descompresor.decompress(payload[1:]) + descompresor.flush()
+    if payload[:1] == b"{":
+        return payload  # JSON sin comprimir guardado como BLOB
+    raise ValueError(f"Versión de payload desconocida: {payload[:1]!r}")
+
+
+def decodificar(payload):
+    """dict de la receta a partir de un payload de cualquier versión (TEXT antiguo o BLOB)"""
+    return json.loads(decodificar_bytes(payload))
+
+
+def informe_tamano(conn):
+    """{formato: (filas, bytes)} de la columna payload"""
+    informe = {}
+    for formato, filas, total in conn.execute("""
+        SELECT CASE WHEN typeof(payload) = 'blob' THEN 'comprimido' ELSE typeof(payload) END,
+               COUNT(*), COALESCE(SUM(length(CAST(payload AS BLOB))), 0)
+        FROM recetas GROUP BY 1
+    """):
+        informe[formato] = (filas, total)
+    return informe
+
+
+def migrar_payloads(conn, tam_lote=TAM_LOTE, progreso=None):
+    """
+    Recodifica por lotes (una transacción cada uno) las filas con payload TEXT.
+    Cada fila se verifica decodificándola antes de escribirla.
+    Devuelve (filas, bytes_antes, bytes_despues).
+    """
+    filas = antes = despues = 0
+    ultimo = 0
+    while True:
+        lote = conn.execute(
+            "SELECT rowid, payload FROM recetas WHERE rowid > ? AND typeof(payload) = 'text' "
+            "ORDER BY rowid LIMIT ?", (ultimo, tam_lote)
+        ).fetchall()
+        if not lote:
+            break
+        cambios = []
+        for rowid, payload in lote:
+            data = json.loads(payload)
+            nuevo = codificar(data)
+            if decodificar(nuevo) != data:
+                raise ValueError(f"La recodificación de la fila {rowid} no es idéntica")
+            cambios.append((nuevo, rowid))
+            antes += len(payload.encode("utf-8"))
+            despues += len(nuevo)
+        with conn:
+            conn.executemany("UPDATE recetas SET payload = ? WHERE rowid = ?", cambios)
+        filas += len(lote)
+        ultimo = lote[-1][0]
+        if progreso:
+            progreso(filas)
+    return filas, antes, despues
+
+
+def _mb(n):
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Informe y migración del payload de recetas")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--migrar", action="store_true", help="Recodifica los payloads TEXT")
+    parser.add_argument("--lote", type=int, default=TAM_LOTE, help="Filas por transacción")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM al terminar (recupera espacio en disco)")
+    args = parser.parse_args(argv)
+
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        for formato, (filas, total) in informe_tamano(conn).items():
+            print(f"{formato:<12}{filas:>10} filas {_mb(total):>12}")
+        if args.migrar:
+            filas, antes, despues = migrar_payloads(
+                conn, args.lote, lambda n: print(f"  {n} filas recodificadas", end="\r", flush=True))
+            ahorro = 1 - despues / antes if antes else 0
+            print(f"\n{filas} filas: {_mb(antes)} -> {_mb(despues)} ({ahorro:.0%} menos)")
+            if args.vacuum:
+                conn.execute("VACUUM")
+                print("VACUUM completado")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+"""
+Cola de impresión (impresión directa, sin visor de PDF)
+Al guardar una receta los PDF ya generados se anotan en una cola SQLite local
+(modo WAL) y un hilo los envía a la impresora en lotes: con CUPS una sola
+llamada a `lp` por lote, en Windows el spooler del sistema (verbo "print").
+Guardar no espera a la impresora ni al visor.
+
+Cada copia es un trabajo con su estado (PENDIENTE, IMPRESO o FALLIDO):
+    farmacia   la receta
+    paciente   la receta y la hoja de indicaciones (si la hay)
+Un lote que falla se reintenta en la pasada siguiente hasta max_intentos; luego
+queda FALLIDO y se puede reenviar (ColaImpresion.reintentar o --reintentar).
+Un trabajo ya anotado (mismo número, documento y copia) no se vuelve a encolar.
+
+Impresoras (RECETAS_IMPRESORA en la aplicación):
+    lp               impresora predeterminada de CUPS
+    lp:<nombre>      impresora de CUPS por nombre
+    windows          impresora predeterminada de Windows
+    archivo:<dir>    copia los PDF a una carpeta (pruebas, sin papel)
+
+    python cola_impresion.py --estado
+    python cola_impresion.py --reintentar
+    python cola_impresion.py --impresora archivo:/tmp/impresas --procesar
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import itertools
+import threading
+import subprocess
+from datetime import datetime
+
+from metricas import span
+
+logger = logging.getLogger(__name__)
+
+COPIAS = {
+    "farmacia": ("receta",),
+    "paciente": ("receta", "indicaciones"),
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    numero TEXT NOT NULL,
+    documento TEXT NOT NULL,
+    copia TEXT NOT NULL,
+    pdf_path TEXT NOT NULL,
+    usuario TEXT,
+    estado TEXT NOT NULL DEFAULT 'PENDIENTE',
+    intentos INTEGER DEFAULT 0,
+    ultimo_error TEXT,
+    creado TEXT NOT NULL,
+    impreso TEXT,
+    UNIQUE (numero, documento, copia)
+);
+CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos(estado, id);
+"""
+
+
+class ImpresoraLP:
+    """CUPS: un lote se envía en una sola llamada a lp (un trabajo de impresión)"""
+
+    def __init__(self, nombre="", comando="lp", timeout=60):
+        self.nombre = nombre
+        self.comando = comando
+        self.timeout = timeout
+
+    def imprimir(self, rutas, titulo="Recetas"):
+        args = [self.comando]
+        if self.nombre:
+            args += ["-d", self.nombre]
+        args += ["-t", titulo, "--", *rutas]
+        r = subprocess.run(args, capture_output=True, text=True, timeout=self.timeout)
+        if r.returncode != 0:
+            raise OSError((r.stderr or r.stdout).strip() or f"lp terminó con código {r.returncode}")
+
+    def __str__(self):
+        return f"lp:{self.nombre}" if self.nombre else "lp"
+
+
+class ImpresoraWindows:
+    """Spooler de Windows: el programa asociado a PDF imprime cada archivo"""
+
+    def imprimir(self, rutas, titulo="Recetas"):
+        for ruta in rutas:
+            os.startfile(ruta, "print")
+
+    def __str__(self):
+        return "windows"
+
+
+class ImpresoraArchivo:
+    """
+    Impresora de prueba: copia cada PDF a una carpeta y anota el lote en
+    impresiones.txt (un renglón por archivo: lote, título, nombre). El lote
+    lleva el pid y un contador del proceso: la aplicación y la línea de
+    comandos pueden imprimir en la misma carpeta en el mismo segundo.
+    """
+
+    _lotes = itertools.count(1)
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def imprimir(self, rutas, titulo="Recetas"):
+        os.makedirs(self.directorio, exist_ok=True)
+        lote = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{next(self._lotes)}"
+        renglones = []
+        for k, ruta in enumerate(rutas, 1):
+            nombre = f"{lote}-{k:03d}-{os.path.basename(ruta)}"
+            shutil.copyfile(ruta, os.path.join(self.directorio, nombre))
+            renglones.append(f"{lote}\t{titulo}\t{nombre}\n")
+        with open(os.path.join(self.directorio, "impresiones.txt"), "a", encoding="utf-8") as f:
+            f.writelines(renglones)
+
+    def __str__(self):
+        return f"archivo:{self.directorio}"
+
+
+def crear_impresora(spec):
+    """Impresora a partir de "lp", "lp:<nombre>", "windows" o "archivo:<dir>"; "" -> None"""
+    spec = (spec or "").strip()
+    if not spec:
+        return None
+    tipo, _, valor = spec.partition(":")
+    tipo = tipo.lower()
+    if tipo == "lp":
+        return ImpresoraLP(valor)
+    if tipo == "windows":
+        return ImpresoraWindows()
+    if tipo == "archivo" and valor:
+        return ImpresoraArchivo(valor)
+    raise ValueError(f"Impresora no reconocida: {spec!r} (lp, lp:<nombre>, windows o archivo:<carpeta>)")
+
+
+def impresora_predeterminada():
+    return ImpresoraWindows() if platform.system() == "Windows" else ImpresoraLP()
+
+
+def parsear_copias(texto):
+    """"farmacia,paciente" -> ("farmacia", "paciente"); valida contra COPIAS"""
+    copias = tuple(c.strip().lower() for c in (texto or "").split(",") if c.strip())
+    desconocidas = [c for c in copias if c not in COPIAS]
+    if desconocidas:
+        raise ValueError(f"Copias no reconocidas: {', '.join(desconocidas)} (use {', '.join(COPIAS)})")
+    return copias
+
+
+class ColaImpresion:
+    """
+    al_terminar(trabajo, impreso, error) se llama desde el hilo de la cola por
+    cada trabajo impreso o que quedó FALLIDO; trabajo es un dict con numero,
+    documento, copia y usuario.
+    """
+
+    def __init__(self, path, impresora, intervalo=5.0, lote=20, max_intentos=3, al_terminar=None):
+        self.path = path
+        self.impresora = impresora
+        self.intervalo = intervalo
+        self.lote = lote
+        self.max_intentos = max_intentos
+        self.al_terminar = al_terminar
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+        # Estado visible en la interfaz
+        self.ultimo_error = ""
+        self.ultima_impresion = None
+
+        conn = self._conectar()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(ESQUEMA)
+        finally:
+            conn.close()
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Hilo de impresión ---
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._run, name="cola-impresion", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, timeout=10.0):
+        """Detiene el hilo tras una última pasada (lo que no se imprima queda PENDIENTE)"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def despertar(self):
+        self._despertar.set()
+
+    def _run(self):
+        while True:
+            self._despertar.clear()
+            try:
+                self.procesar()
+            except Exception as e:
+                logger.error(f"Error en la cola de impresión: {e}")
+            if self._detener.is_set():
+                return
+            self._despertar.wait(self.intervalo)
+
+    # --- Trabajos ---
+    def encolar(self, numero, documentos, copias=tuple(COPIAS), usuario=""):
+        """
+        documentos: {"receta": ruta, "indicaciones": ruta o None}
+        Anota un trabajo por copia y documento existente; devuelve cuántos nuevos
+        """
+        ahora = datetime.now().isoformat()
+        filas = [(numero, doc, copia, documentos[doc], usuario, ahora)
+                 for copia in copias for doc in COPIAS[copia] if documentos.get(doc)]
+        conn = self._conectar()
+        try:
+            with conn:
+                antes = conn.total_changes
+                conn.executemany(
+                    """INSERT OR IGNORE INTO trabajos (numero, documento, copia, pdf_path, usuario, creado)
+                       VALUES (?, ?, ?, ?, ?, ?)""", filas)
+                nuevos = conn.total_changes - antes
+        finally:
+            conn.close()
+        if nuevos:
+            self.despertar()
+        return nuevos
+
+    def procesar(self):
+        """Imprime lo pendiente en lotes; devuelve los trabajos impresos en esta pasada"""
+        with self._lock:
+            impresos = 0
+            while True:
+                n = self._imprimir_lote()
+                if n <= 0:
+                    break
+                impresos += n
+            return impresos
+
+    def _imprimir_lote(self):
+        """Un lote: >0 impresos, 0 nada pendiente, -1 falló (se reintenta en la próxima pasada)"""
+        conn = self._conectar()
+        try:
+            filas = conn.execute(
+                """SELECT id, numero, documento, copia, pdf_path, intentos, usuario FROM trabajos
+                   WHERE estado = 'PENDIENTE' ORDER BY id LIMIT ?""",
+                (self.lote,)
+            ).fetchall()
+            if not filas:
+                return 0
+            # Un PDF borrado no se puede imprimir: falla solo, sin frenar el lote
+            faltantes = [f for f in filas if not os.path.exists(f[4])]
+            if faltantes:
+                self._marcar_fallidos(conn, faltantes, "El PDF ya no existe", definitivo=True)
+                filas = [f for f in filas if f not in faltantes]
+                if not filas:
+                    return len(faltantes)
+            numeros = sorted({f[1] for f in filas})
+            titulo = f"Recetas {numeros[0]}" + (f" a {numeros[-1]} ({len(numeros)})" if len(numeros) > 1 else "")
+            try:
+                with span("impresion.lote"):
+                    self.impresora.imprimir([f[4] for f in filas], titulo)
+            except Exception as e:
+                self.ultimo_error = str(e)
+                logger.warning(f"No se pudo imprimir el lote {titulo}: {e}")
+                self._marcar_fallidos(conn, filas, str(e))
+                return -1
+            ahora = datetime.now().isoformat()
+            with conn:
+                conn.executemany(
+                    """UPDATE trabajos SET estado = 'IMPRESO', impreso = ?, intentos = intentos + 1,
+                       ultimo_error = NULL WHERE id = ?""",
+                    [(ahora, f[0]) for f in filas]
+                )
+            self.ultimo_error = ""
+            self.ultima_impresion = datetime.now()
+            logger.info(f"Impreso: {titulo}, {len(filas)} documentos en {self.impresora}")
+            for f in filas:
+                self._avisar(f, True, "")
+            return len(filas)
+        finally:
+            conn.close()
+
+    def _marcar_fallidos(self, conn, filas, error, definitivo=False):
+        with conn:
+            conn.executemany(
+                """UPDATE trabajos SET intentos = intentos + 1, ultimo_error = ?,
+                   estado = CASE WHEN ? OR intentos + 1 >= ? THEN 'FALLIDO' ELSE estado END
+                   WHERE id = ?""",
+                [(error, definitivo, self.max_intentos, f[0]) for f in filas]
+            )
+        for f in filas:
+            if definitivo or f[5] + 1 >= self.max_intentos:
+                logger.error(f"Receta {f[1]} ({f[3]}, {f[2]}) no impresa tras {f[5] + 1} intentos: {error}")
+                self._avisar(f, False, error)
+
+    def _avisar(self, fila, impreso, error):
+        if self.al_terminar is not None:
+            trabajo = {"numero": fila[1], "documento": fila[2], "copia": fila[3], "usuario": fila[6]}
+            try:
+                self.al_terminar(trabajo, impreso, error)
+            except Exception as e:
+                logger.error(f"Error al notificar la impresión de {fila[1]}: {e}")
+
+    def reintentar(self, numero=None):
+        """Vuelve a PENDIENTE los trabajos FALLIDO (todos o los de una receta)"""
+        conn = self._conectar()
+        try:
+            with conn:
+                cur = conn.execute(
+                    """UPDATE trabajos SET estado = 'PENDIENTE', intentos = 0
+                       WHERE estado = 'FALLIDO' AND (? IS NULL OR numero = ?)""",
+                    (numero, numero)
+                )
+                n = cur.rowcount
+        finally:
+            conn.close()
+        if n:
+            self.despertar()
+        return n
+
+    def trabajos(self, numero):
+        """[(documento, copia, estado, intentos, ultimo_error, impreso)] de una receta"""
+        conn = self._conectar()
+        try:
+            return conn.execute(
+                """SELECT documento, copia, estado, intentos, ultimo_error, impreso
+                   FROM trabajos WHERE numero = ? ORDER BY id""", (numero,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def pendientes(self):
+        """(pendientes, fallidos)"""
+        conn = self._conectar()
+        try:
+            cuentas = dict(conn.execute(
+                "SELECT estado, COUNT(*) FROM trabajos WHERE estado != 'IMPRESO' GROUP BY estado"
+            ).fetchall())
+        finally:
+            conn.close()
+        return cuentas.get("PENDIENTE", 0), cuentas.get("FALLIDO", 0)
+
+    def estado(self):
+        """Texto corto para la barra de estado"""
+        pendientes, fallidos = self.pendientes()
+        texto = f"Impresión: {pendientes} en cola"
+        if fallidos:
+            texto += f", {fallidos} FALLIDOS"
+        if self.ultimo_error:
+            texto += f" | error: {self.ultimo_error[:60]}"
+        elif self.ultima_impresion:
+            texto += f" | última: {self.ultima_impresion.strftime('%H:%M:%S')}"
+        return texto
+
+
+def main(argv=None):
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Cola de impresión de recetas")
+    parser.add_argument("--db", default=os.path.join(raiz, "data", "impresion.db"))
+    parser.add_argument("--impresora", default=os.environ.get("RECETAS_IMPRESORA", ""),
+                        help="lp, lp:<nombre>, windows o archivo:<carpeta> (por defecto la del sistema)")
+    parser.add_argument("--estado", action="store_true", help="Muestra pendientes y fallidos")
+    parser.add_argument("--reintentar", nargs="?", const="", metavar="NUMERO",
+                        help="Vuelve a encolar los fallidos (todos o los de una receta)")
+    parser.add_argument("--procesar", action="store_true", help="Imprime ahora lo pendiente")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    cola = ColaImpresion(args.db, crear_impresora(args.impresora) or impresora_predeterminada())
+    if args.reintentar is not None:
+        print(f"{cola.reintentar(args.reintentar or None)} trabajos vueltos a la cola")
+    if args.procesar:
+        print(f"{cola.procesar()} documentos impresos en {cola.impresora}")
+    if args.estado or not (args.procesar or args.reintentar is not None):
+        print(cola.estado())
+        conn = cola._conectar()
+        try:
+            for fila in conn.execute(
+                """SELECT numero, copia, documento, intentos, ultimo_error FROM trabajos
+                   WHERE estado = 'FALLIDO' ORDER BY id"""
+            ):
+                print("FALLIDO  {} {}/{} ({} intentos): {}".format(*fila))
+        finally:
+            conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,624 @@
+"""
+Capa de datos de recetas (sin interfaz gráfica)
+Esquema y operaciones básicas sobre recetas.db compartidas por la aplicación
+de escritorio (modo local) y por servidor_recetas.py (modo cliente/servidor).
+Las búsquedas y la exportación incluyen los archivos anuales de solo lectura
+(recetas_AAAA.db junto a recetas.db, ver archivo_anual.py), que se adjuntan
+con ATTACH sólo cuando hacen falta.
+"""
+
+import os
+import re
+import csv
+import uuid
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+import reportes_farmacia
+import estadisticas
+import visor_registros
+import pacientes
+import frecuencias_uso
+import alertas_clinicas
+import verificacion_recetas
+from registro_eventos import SQL_INSERT as SQL_INSERT_REGISTRO
+from metricas import span
+from codec_payload import codificar_bytes
+import integridad
+
+logger = logging.getLogger(__name__)
+
+TIPOS_RECETA = ("CE", "EH", "EM")
+PATRON_ARCHIVO = re.compile(r"recetas_(\d{4})\.db")
+
+COLUMNAS_RECETA = (
+    "id", "numero", "tipo", "fecha", "unidad", "servicio", "prescriptor", "prescriptor_especialidad",
+    "paciente", "ci", "hc", "edad", "meses", "sexo", "talla", "peso",
+    "cie", "cie_desc", "indicaciones", "actividad_fisica", "estado_enfermedad",
+    "alergias", "alergias_especificar", "payload", "pdf_path",
+    "created_at", "created_by", "ip_address", "hash_verificacion", "estado",
+)
+COLUMNA_CREATED_AT = COLUMNAS_RECETA.index("created_at")
+SQL_INSERT_RECETA = (
+    f"INSERT INTO recetas ({', '.join(COLUMNAS_RECETA)}) "
+    f"VALUES ({','.join('?' * len(COLUMNAS_RECETA))})"
+)
+
+COLUMNAS_EXPORTACION = ("numero", "tipo", "fecha", "paciente", "ci", "cie", "cie_desc", "pdf_path", "estado", "created_by")
+COLUMNAS_CONSULTA = ("numero", "tipo", "fecha", "paciente", "ci", "hc", "cie", "cie_desc",
+                     "prescriptor", "pdf_path", "estado", "hash_verificacion", "created_at")
+
+
+def calcular_hash(data):
+    """Hash de integridad versionado ("b2:..."); ver integridad.py"""
+    return integridad.calcular_hash(data)
+
+
+def serializar_receta(data):
+    """
+    (bytes canónicos, hash) de la receta: la única serialización al guardar.
+    Los bytes se pasan a guardar_receta / encolar_receta como `canonico`.
+    """
+    canonico = integridad.canonico(data)
+    return canonico, integridad.hash_canonico(canonico)
+
+
+def crear_esquema(conn):
+    """Crea las tablas, índices y secuencias si no existen y migra columnas nuevas"""
+    cur = conn.cursor()
+
+    # Crear tabla de secuencias
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS secuencias (
+            tipo TEXT PRIMARY KEY, 
+            ultimo INTEGER NOT NULL
+        )
+    """)
+
+    # Crear tabla de recetas ENHANCED con campos de auditoría
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS recetas (
+            id TEXT PRIMARY KEY,
+            numero TEXT NOT NULL UNIQUE,
+            tipo TEXT NOT NULL,
+            fecha TEXT,
+            unidad TEXT, 
+            servicio TEXT, 
+            prescriptor TEXT,
+            prescriptor_especialidad TEXT,
+            paciente TEXT, 
+            ci TEXT, 
+            hc TEXT,
+            edad TEXT, 
+            meses TEXT, 
+            sexo TEXT,
+            talla TEXT, 
+            peso TEXT,
+            cie TEXT, 
+            cie_desc TEXT,
+            indicaciones TEXT,
+            actividad_fisica TEXT,
+            estado_enfermedad TEXT,
+            alergias TEXT,
+            alergias_especificar TEXT,
+            payload TEXT,
+            pdf_path TEXT,
+            created_at TEXT,
+            created_by TEXT,
+            ip_address TEXT,
+            hash_verificacion TEXT,
+            estado TEXT DEFAULT 'ACTIVA',
+            modificaciones TEXT
+        )
+    """)
+
+    # Crear tabla de auditoría para trazabilidad completa
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS auditoria (
+            id TEXT PRIMARY KEY,
+            receta_numero TEXT,
+            accion TEXT,
+            usuario TEXT,
+            fecha_hora TEXT,
+            ip_address TEXT,
+            detalles TEXT,
+            hash_anterior TEXT,
+            hash_nuevo TEXT
+        )
+    """)
+
+    # Crear tabla de accesos para bitácora de seguridad
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bitacora_accesos (
+            id TEXT PRIMARY KEY,
+            usuario TEXT,
+            accion TEXT,
+            fecha_hora TEXT,
+            ip_address TEXT,
+            detalles TEXT,
+            resultado TEXT
+        )
+    """)
+
+    # Crear tabla de respaldos
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS respaldos (
+            id TEXT PRIMARY KEY,
+            fecha_respaldo TEXT,
+            tipo_respaldo TEXT,
+            archivo_respaldo TEXT,
+            estado TEXT,
+            registros_respaldados INTEGER
+        )
+    """)
+
+    # --- MIGRACIÓN DE ESQUEMA: agregar columnas nuevas si faltan ---
+    try:
+        cur.execute("PRAGMA table_info(recetas)")
+        existing_cols = {row[1] for row in cur.fetchall()}
+        needed = {
+            "actividad_fisica": "TEXT",
+            "estado_enfermedad": "TEXT",
+            "alergias": "TEXT",
+            "alergias_especificar": "TEXT",
+            "prescriptor_especialidad": "TEXT",
+            "created_at": "TEXT",
+            "created_by": "TEXT", 
+            "ip_address": "TEXT",
+            "hash_verificacion": "TEXT",
+            "estado": "TEXT DEFAULT 'ACTIVA'",
+            "modificaciones": "TEXT"
+        }
+        for col, coltype in needed.items():
+            if col not in existing_cols:
+                cur.execute(f"ALTER TABLE recetas ADD COLUMN {col} {coltype}")
+    except Exception as e:
+        logger.warning(f"Migración de esquema: {e}")
+
+    # Historial por paciente (búsqueda por CI y alertas de repetición)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_recetas_ci ON recetas(ci, created_at)")
+
+    # Agregados de consumo para reportes de farmacia
+    reportes_farmacia.ensure_tables(cur)
+    estadisticas.ensure_tables(cur)
+    pacientes.ensure_tables(cur)
+    frecuencias_uso.ensure_tables(cur)
+    verificacion_recetas.ensure_tables(cur)
+
+    # Índices para paginar bitácora y auditoría por fecha_hora
+    visor_registros.ensure_indexes(cur)
+
+    # Bloques de números cedidos a estaciones (bandeja de salida sin conexión)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS secuencias_bloques (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            inicio INTEGER NOT NULL,
+            fin INTEGER NOT NULL,
+            estacion TEXT,
+            fecha TEXT
+        )
+    """)
+
+    # Inicializar secuencias
+    for tipo in ("CE", "EH", "EM"):
+        cur.execute(
+            "INSERT OR IGNORE INTO secuencias(tipo, ultimo) VALUES(?,?)", 
+            (tipo, -1)
+        )
+
+
+    conn.commit()
+
+
+def formatear_numero(tipo, ultimo, anio=None):
+    return f"{tipo}-{anio or datetime.now().year}-{ultimo:06d}"
+
+
+def asignar_numero(conn, tipo):
+    """Reserva el siguiente número correlativo (transacción inmediata: sin carreras entre estaciones)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT ultimo FROM secuencias WHERE tipo = ?", (tipo,)).fetchone()
+        if not row:
+            raise ValueError(f"Tipo de receta '{tipo}' no encontrado")
+        ultimo = row[0] + 1
+        conn.execute("UPDATE secuencias SET ultimo = ? WHERE tipo = ?", (ultimo, tipo))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return formatear_numero(tipo, ultimo)
+
+
+def reservar_bloque(conn, tipo, cantidad, estacion=""):
+    """
+    Cede a una estación un bloque de `cantidad` números consecutivos.
+    Devuelve (inicio, fin) incluidos; cada número se formatea con formatear_numero.
+    """
+    if cantidad < 1:
+        raise ValueError("La cantidad del bloque debe ser positiva")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT ultimo FROM secuencias WHERE tipo = ?", (tipo,)).fetchone()
+        if not row:
+            raise ValueError(f"Tipo de receta '{tipo}' no encontrado")
+        inicio, fin = row[0] + 1, row[0] + cantidad
+        conn.execute("UPDATE secuencias SET ultimo = ? WHERE tipo = ?", (fin, tipo))
+        conn.execute(
+            "INSERT INTO secuencias_bloques (tipo, inicio, fin, estacion, fecha) VALUES (?,?,?,?,?)",
+            (tipo, inicio, fin, estacion, datetime.now().isoformat())
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return inicio, fin
+
+
+def fila_receta(data, pdf_path, usuario, ip_address, data_hash=None, receta_id=None, created_at=None,
+                canonico=None):
+    """
+    Tupla de valores en el orden de COLUMNAS_RECETA. La receta se serializa una
+    vez: esos bytes canónicos son el payload y, si data_hash es None, el hash.
+    Con `canonico` (de serializar_receta) no se vuelve a serializar.
+    """
+    if canonico is None:
+        canonico = integridad.canonico(data)
+    if data_hash is None:
+        data_hash = integridad.hash_canonico(canonico)
+    g = lambda k: data.get(k, "")
+    return (
+        receta_id or str(uuid.uuid4()), data["numero"], data["tipo"], g("fecha"),
+        g("unidad"), g("servicio"), g("prescriptor"), g("prescriptor_especialidad"),
+        g("paciente"), g("ci"), g("hc"), g("edad"),
+        g("meses"), g("sexo"), g("talla"), g("peso"),
+        g("cie"), g("cie_desc"), g("indicaciones"),
+        g("actividad_fisica"), g("estado_enfermedad"),
+        g("alergias"), g("alergias_especificar"),
+        codificar_bytes(canonico), pdf_path,
+        created_at or datetime.now().isoformat(), usuario, ip_address, data_hash, "ACTIVA",
+    )
+
+
+def _insertar_receta(cur, data, pdf_path, usuario, ip_address, data_hash, receta_id=None, created_at=None,
+                     canonico=None):
+    fila = fila_receta(data, pdf_path, usuario, ip_address, data_hash, receta_id, created_at, canonico)
+    cur.execute(SQL_INSERT_RECETA, fila)
+    # Agregados de consumo de farmacia y estadísticas (incrementales), maestro de pacientes
+    # y frecuencias de uso por prescriptor
+    reportes_farmacia.registrar_consumo(cur, data)
+    estadisticas.registrar_receta(cur, data)
+    pacientes.registrar_paciente(cur, data, fila[COLUMNA_CREATED_AT])
+    frecuencias_uso.registrar_uso(cur, data)
+    return fila[0]
+
+
+def guardar_receta(conn, data, pdf_path, usuario, ip_address, data_hash, receta_id=None, created_at=None,
+                   canonico=None):
+    """Inserta la receta y actualiza los agregados en una sola transacción; devuelve el id"""
+    with conn:
+        return _insertar_receta(conn.cursor(), data, pdf_path, usuario, ip_address, data_hash,
+                                receta_id, created_at, canonico)
+
+
+def guardar_recetas_lote(conn, items):
+    """
+    Inserta un lote de recetas en una transacción de forma idempotente: las que
+    ya existen (mismo id) se omiten, así un lote reenviado no duplica ni suma
+    dos veces los agregados.
+    items: dicts con id, data, pdf_path, usuario, ip_address, hash, created_at
+    y, opcional, canonico (bytes de serializar_receta).
+    Devuelve la lista de ids insertados.
+    """
+    # Una receta ya trasladada a su archivo anual también cuenta como existente
+    archivadas = _ids_archivados(conn, items)
+    insertados = []
+    with conn:
+        cur = conn.cursor()
+        for it in items:
+            if it["id"] in archivadas or cur.execute("SELECT 1 FROM recetas WHERE id = ?", (it["id"],)).fetchone():
+                continue
+            _insertar_receta(cur, it["data"], it.get("pdf_path", ""), it.get("usuario", ""),
+                             it.get("ip_address", ""), it.get("hash", ""), it["id"], it.get("created_at"),
+                             it.get("canonico"))
+            insertados.append(it["id"])
+    return insertados
+
+
+# --- Archivos anuales ---
+def ruta_principal(conn):
+    """Archivo de la base principal de la conexión ('' si es en memoria)"""
+    for _, nombre, archivo in conn.execute("PRAGMA database_list"):
+        if nombre == "main":
+            return archivo or ""
+    return ""
+
+
+def ruta_archivo(db_file, anio):
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), f"recetas_{anio}.db")
+
+
+def anios_archivados(conn):
+    """Años con archivo recetas_AAAA.db junto a la base principal, del más reciente al más antiguo"""
+    db_file = ruta_principal(conn)
+    if not db_file:
+        return []
+    try:
+        nombres = os.listdir(os.path.dirname(os.path.abspath(db_file)))
+    except OSError:
+        return []
+    return sorted((int(m.group(1)) for m in map(PATRON_ARCHIVO.fullmatch, nombres) if m), reverse=True)
+
+
+def anio_numero(numero):
+    """Año de un número de receta TIPO-AAAA-NNNNNN, o None"""
+    partes = (numero or "").split("-")
+    return int(partes[1]) if len(partes) == 3 and partes[1].isdigit() else None
+
+
+def _ids_archivados(conn, items):
+    """
+    Ids del lote que ya están en el archivo anual del año de su número (ATTACH:
+    sin transacción abierta). Un número archivado con otro id es un conflicto,
+    igual que el índice único de recetas en la base actual.
+    """
+    por_anio = {}
+    for it in items:
+        por_anio.setdefault(anio_numero(it["data"].get("numero")), []).append(it)
+    anios = [a for a in anios_archivados(conn) if a in por_anio]
+    archivadas = set()
+    for anio in anios:
+        lote = {it["data"]["numero"]: it["id"] for it in por_anio[anio]}
+        with archivo_adjunto(conn, anio) as esquema:
+            filas = conn.execute(
+                f"SELECT numero, id FROM {esquema}.recetas WHERE numero IN ({','.join('?' * len(lote))})",
+                list(lote)
+            ).fetchall()
+        for numero, receta_id in filas:
+            if receta_id != lote[numero]:
+                raise sqlite3.IntegrityError(f"El número {numero} ya existe en el archivo {anio} con otra receta")
+            archivadas.add(receta_id)
+    return archivadas
+
+
+@contextmanager
+def archivo_adjunto(conn, anio, alias="archivo"):
+    """ATTACH del archivo del año mientras dura el bloque (no debe haber transacción abierta)"""
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (ruta_archivo(ruta_principal(conn), anio),))
+    try:
+        yield alias
+    finally:
+        conn.execute(f"DETACH DATABASE {alias}")
+
+
+def _buscar_receta_en(conn, esquema, numero):
+    return conn.execute(
+        f"SELECT {', '.join(COLUMNAS_CONSULTA)} FROM {esquema}.recetas WHERE numero = ?", (numero,)
+    ).fetchone()
+
+
+def buscar_receta(conn, numero):
+    """Datos principales de una receta por número (base actual o su archivo anual), o None"""
+    row = _buscar_receta_en(conn, "main", numero)
+    if row is None:
+        anio = anio_numero(numero)
+        if anio in anios_archivados(conn):
+            with archivo_adjunto(conn, anio) as esquema:
+                row = _buscar_receta_en(conn, esquema, numero)
+    return dict(zip(COLUMNAS_CONSULTA, row)) if row else None
+
+
+def _buscar_recetas_en(conn, esquema, ci, limite):
+    sql = f"SELECT {', '.join(COLUMNAS_CONSULTA)} FROM {esquema}.recetas"
+    params = []
+    if ci:
+        sql += " WHERE ci = ?"
+        params.append(ci)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limite)
+    return conn.execute(sql, params).fetchall()
+
+
+def buscar_recetas(conn, ci=None, limite=50):
+    """
+    Recetas más recientes, opcionalmente de un paciente (CI). Los archivos
+    anuales sólo se consultan, del más reciente al más antiguo, si la base
+    actual no completa el límite (sus recetas son todas anteriores).
+    """
+    filas = _buscar_recetas_en(conn, "main", ci, limite)
+    for anio in anios_archivados(conn):
+        if len(filas) >= limite:
+            break
+        with archivo_adjunto(conn, anio) as esquema:
+            filas += _buscar_recetas_en(conn, esquema, ci, limite - len(filas))
+    return [dict(zip(COLUMNAS_CONSULTA, r)) for r in filas]
+
+
+def filas_exportacion(conn):
+    """Filas de COLUMNAS_EXPORTACION de la base actual y de los archivos anuales"""
+    sql = "SELECT {} FROM {}.recetas ORDER BY fecha DESC"
+    filas = conn.execute(sql.format(", ".join(COLUMNAS_EXPORTACION), "main")).fetchall()
+    anios = anios_archivados(conn)
+    for anio in anios:
+        with archivo_adjunto(conn, anio) as esquema:
+            filas += conn.execute(sql.format(", ".join(COLUMNAS_EXPORTACION), esquema)).fetchall()
+    if anios:
+        fecha = COLUMNAS_EXPORTACION.index("fecha")
+        filas.sort(key=lambda f: f[fecha] or "", reverse=True)
+    return filas
+
+
+def escribir_exportacion(path, rows):
+    """Escribe las filas de filas_exportacion en un CSV con encabezado"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(COLUMNAS_EXPORTACION)
+        w.writerows(rows)
+
+
+def verificar_integridad(conn):
+    """
+    Recalcula el hash de cada receta ACTIVA y lo compara con el guardado.
+    Devuelve (verificadas, [números con posibles alteraciones]).
+    """
+    corruptas = []
+    verificadas = 0
+    for numero, payload_str, stored_hash in conn.execute(
+        "SELECT numero, payload, hash_verificacion FROM recetas WHERE estado = 'ACTIVA'"
+    ):
+        try:
+            if payload_str and stored_hash:
+                if not integridad.verificar(payload_str, stored_hash):
+                    corruptas.append(numero)
+                else:
+                    verificadas += 1
+        except Exception:
+            corruptas.append(numero)
+    return verificadas, corruptas
+
+
+def _verificar_en(conn, esquema, numero):
+    return conn.execute(
+        f"""SELECT estado, hash_verificacion, fecha, paciente, prescriptor, payload
+            FROM {esquema}.recetas WHERE numero = ?""", (numero,)
+    ).fetchone()
+
+
+def verificar_receta(conn, codigo):
+    """
+    Verificación de farmacia por código QR o número (ver verificacion_recetas):
+    una búsqueda por el índice único de número (en el archivo anual si no está
+    en la base actual) y otra por la clave de dispensaciones.
+    """
+    numero, digest = verificacion_recetas.leer_codigo(codigo)
+    fila = _verificar_en(conn, "main", numero)
+    if fila is None:
+        anio = anio_numero(numero)
+        if anio in anios_archivados(conn):
+            with archivo_adjunto(conn, anio) as esquema:
+                fila = _verificar_en(conn, esquema, numero)
+    integra = True
+    if fila is not None and fila[5] and fila[1]:
+        try:
+            integra = integridad.verificar(fila[5], fila[1])
+        except Exception:
+            integra = False
+    dispensacion = conn.execute(
+        "SELECT fecha_hora, usuario, estacion FROM dispensaciones WHERE numero = ?", (numero,)
+    ).fetchone()
+    return verificacion_recetas.resultado(numero, digest, fila[:5] if fila else None, dispensacion, integra)
+
+
+def dispensar_receta(conn, codigo, usuario, estacion=""):
+    """
+    Registra la dispensación si la receta es válida. La clave primaria de
+    dispensaciones decide entre dos estaciones simultáneas: sólo una inserta.
+    Devuelve el resultado de verificar_receta con 'dispensada_ahora'.
+    """
+    r = verificar_receta(conn, codigo)
+    r["dispensada_ahora"] = False
+    if not r["valida"]:
+        return r
+    ahora = datetime.now().isoformat()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO dispensaciones (numero, fecha_hora, usuario, estacion) VALUES (?,?,?,?)",
+            (r["numero"], ahora, usuario, estacion)
+        )
+    if cur.rowcount:
+        r.update(dispensada_ahora=True, valida=False, dispensada={"fecha_hora": ahora, "usuario": usuario, "estacion": estacion})
+        return r
+    # Otra estación la dispensó entre la verificación y el registro
+    r = verificar_receta(conn, codigo)
+    r["dispensada_ahora"] = False
+    return r
+
+
+def insertar_registros(conn, items):
+    """Inserta filas de bitácora/auditoría [(tabla, fila)] en una transacción"""
+    por_tabla = {}
+    for tabla, fila in items:
+        if tabla not in SQL_INSERT_REGISTRO:
+            raise ValueError(f"Tabla de registro desconocida: {tabla}")
+        por_tabla.setdefault(tabla, []).append(tuple(fila))
+    with conn:
+        for tabla, filas in por_tabla.items():
+            conn.executemany(SQL_INSERT_REGISTRO[tabla], filas)
+    return len(items)
+
+
+class BackendLocal:
+    """Acceso directo a recetas.db (modo por defecto)"""
+
+    def __init__(self, path_fn):
+        self.path_fn = path_fn
+
+    def conectar(self):
+        return sqlite3.connect(self.path_fn(), timeout=10)
+
+    def _con(self, fn, *args):
+        # Conexión + transacción completa: es lo que espera el usuario en recurso de red
+        with span(f"db.{fn.__name__}"):
+            conn = self.conectar()
+            try:
+                return fn(conn, *args)
+            finally:
+                conn.close()
+
+    def asignar_numero(self, tipo):
+        return self._con(asignar_numero, tipo)
+
+    def reservar_bloque(self, tipo, cantidad, estacion=""):
+        return self._con(reservar_bloque, tipo, cantidad, estacion)
+
+    def guardar_receta(self, data, pdf_path, usuario, ip_address, data_hash, canonico=None):
+        return self._con(guardar_receta, data, pdf_path, usuario, ip_address, data_hash, None, None, canonico)
+
+    def guardar_recetas_lote(self, items):
+        return self._con(guardar_recetas_lote, items)
+
+    def buscar_receta(self, numero):
+        return self._con(buscar_receta, numero)
+
+    def buscar_recetas(self, ci=None, limite=50):
+        return self._con(buscar_recetas, ci, limite)
+
+    def buscar_paciente(self, ci):
+        return self._con(pacientes.buscar_paciente, ci)
+
+    def medicamentos_recientes(self, ci, dias):
+        return self._con(alertas_clinicas.medicamentos_recientes, ci, dias)
+
+    def modelo_uso(self, prescriptor, especialidad):
+        return self._con(frecuencias_uso.modelo_uso, prescriptor, especialidad)
+
+    def plantillas(self, prescriptor):
+        return self._con(frecuencias_uso.listar_plantillas, prescriptor)
+
+    def guardar_plantilla(self, prescriptor, nombre, contenido):
+        return self._con(frecuencias_uso.guardar_plantilla, prescriptor, nombre, contenido)
+
+    def eliminar_plantilla(self, prescriptor, nombre):
+        return self._con(frecuencias_uso.eliminar_plantilla, prescriptor, nombre)
+
+    def verificar_receta(self, codigo):
+        return self._con(verificar_receta, codigo)
+
+    def dispensar_receta(self, codigo, usuario, estacion=""):
+        return self._con(dispensar_receta, codigo, usuario, estacion)
+
+    def obtener_pdf(self, numero, destino_dir=None):
+        info = self.buscar_receta(numero)
+        return info["pdf_path"] if info and info.get("pdf_path") and os.path.exists(info["pdf_path"]) else None
+
+    def exportar(self):
+        return self._con(filas_exportacion)
+
+    def registrar(self, items):
+        return self._con(insertar_registros, items)
+
+    def pagina_registros(self, registro, filtros=None, despues_de=None):
+        return self._con(visor_registros.consultar_pagina, registro, filtros, despues_de)
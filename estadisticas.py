@@ -0,0 +1,248 @@
+"""
+Estadísticas diarias materializadas de recetas
+La tabla estadisticas_diarias se actualiza en la misma transacción que inserta
+cada receta; los tableros leen sólo estos agregados (costo proporcional a los
+días consultados, no al número de recetas).
+"""
+
+import bisect
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from reportes_farmacia import fecha_iso
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONES = ("total", "tipo", "prescriptor", "capitulo_cie")
+
+# Capítulos CIE-10: (inicio del rango, capítulo, título)
+CAPITULOS_CIE = [
+    ("A00", "I", "Enfermedades infecciosas y parasitarias"),
+    ("C00", "II", "Neoplasias"),
+    ("D50", "III", "Enfermedades de la sangre y del sistema inmunitario"),
+    ("E00", "IV", "Enfermedades endocrinas, nutricionales y metabólicas"),
+    ("F00", "V", "Trastornos mentales y del comportamiento"),
+    ("G00", "VI", "Enfermedades del sistema nervioso"),
+    ("H00", "VII", "Enfermedades del ojo y sus anexos"),
+    ("H60", "VIII", "Enfermedades del oído y de la apófisis mastoides"),
+    ("I00", "IX", "Enfermedades del sistema circulatorio"),
+    ("J00", "X", "Enfermedades del sistema respiratorio"),
+    ("K00", "XI", "Enfermedades del sistema digestivo"),
+    ("L00", "XII", "Enfermedades de la piel y del tejido subcutáneo"),
+    ("M00", "XIII", "Enfermedades del sistema osteomuscular"),
+    ("N00", "XIV", "Enfermedades del sistema genitourinario"),
+    ("O00", "XV", "Embarazo, parto y puerperio"),
+    ("P00", "XVI", "Afecciones originadas en el período perinatal"),
+    ("Q00", "XVII", "Malformaciones congénitas"),
+    ("R00", "XVIII", "Síntomas y hallazgos anormales"),
+    ("S00", "XIX", "Traumatismos y envenenamientos"),
+    ("U00", "XXII", "Códigos para propósitos especiales"),
+    ("V01", "XX", "Causas externas de morbilidad y mortalidad"),
+    ("Z00", "XXI", "Factores que influyen en el estado de salud"),
+]
+_INICIOS_CIE = [c[0] for c in CAPITULOS_CIE]
+
+
+def capitulo_cie(code):
+    """Capítulo CIE-10 (número romano) de un código, o 'SIN CIE'"""
+    code = str(code or "").strip().upper()[:3]
+    if len(code) < 3 or not code[0].isalpha():
+        return "SIN CIE"
+    pos = bisect.bisect_right(_INICIOS_CIE, code) - 1
+    return CAPITULOS_CIE[pos][1] if pos >= 0 else "SIN CIE"
+
+
+def ensure_tables(cur):
+    """Crea la tabla de estadísticas diarias si no existe"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS estadisticas_diarias (
+            dimension TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, fecha, clave)
+        ) WITHOUT ROWID
+    """)
+
+
+def claves_receta(fecha, tipo, prescriptor, cie):
+    """Filas (dimension, fecha, clave) que aporta una receta"""
+    fecha = fecha_iso(fecha)
+    return [
+        ("total", fecha, "TOTAL"),
+        ("tipo", fecha, (tipo or "").strip().upper() or "SIN TIPO"),
+        ("prescriptor", fecha, (prescriptor or "").strip() or "SIN PRESCRIPTOR"),
+        ("capitulo_cie", fecha, capitulo_cie(cie)),
+    ]
+
+
+_UPSERT = """
+    INSERT INTO estadisticas_diarias (dimension, fecha, clave, total) VALUES (?,?,?,1)
+    ON CONFLICT(dimension, fecha, clave) DO UPDATE SET total = total + 1
+"""
+
+
+def registrar_receta(cur, data):
+    """Suma una receta a los agregados; usar el cursor de la transacción de inserción"""
+    cur.executemany(_UPSERT, claves_receta(data.get("fecha"), data.get("tipo"),
+                                           data.get("prescriptor"), data.get("cie")))
+
+
+def reconstruir(conn):
+    """
+    Recalcula estadisticas_diarias desde las columnas de recetas (sin leer
+    payload), de la base actual y de los archivos anuales
+    """
+    from datos_recetas import anios_archivados, archivo_adjunto
+
+    cur = conn.cursor()
+    ensure_tables(cur)
+    conn.commit()
+    conteo = {}
+    total = 0
+
+    def procesar(filas):
+        nonlocal total
+        for fecha, tipo, prescriptor, cie in filas:
+            for k in claves_receta(fecha, tipo, prescriptor, cie):
+                conteo[k] = conteo.get(k, 0) + 1
+            total += 1
+
+    sql = "SELECT fecha, tipo, prescriptor, cie FROM {}.recetas"
+    procesar(conn.execute(sql.format("main")))
+    for anio in anios_archivados(conn):
+        with archivo_adjunto(conn, anio) as esquema:
+            procesar(conn.execute(sql.format(esquema)))
+
+    # Los agregados se reemplazan en una sola transacción
+    with conn:
+        cur.execute("DELETE FROM estadisticas_diarias")
+        cur.executemany(
+            "INSERT INTO estadisticas_diarias (dimension, fecha, clave, total) VALUES (?,?,?,?)",
+            [k + (n,) for k, n in conteo.items()]
+        )
+    logger.info(f"Estadísticas reconstruidas desde {total} recetas")
+    return total
+
+
+def resumen(conn, dimension, desde, hasta):
+    """Totales por clave en el rango de fechas ISO: [(clave, total)]"""
+    if dimension not in DIMENSIONES:
+        raise ValueError(f"Dimensión no soportada: {dimension}")
+    return conn.execute("""
+        SELECT clave, SUM(total) FROM estadisticas_diarias
+        WHERE dimension = ? AND fecha BETWEEN ? AND ?
+        GROUP BY clave ORDER BY SUM(total) DESC, clave
+    """, (dimension, desde, hasta)).fetchall()
+
+
+def por_dia(conn, dimension, desde, hasta):
+    """Serie diaria en el rango de fechas ISO: [(fecha, clave, total)]"""
+    if dimension not in DIMENSIONES:
+        raise ValueError(f"Dimensión no soportada: {dimension}")
+    return conn.execute("""
+        SELECT fecha, clave, total FROM estadisticas_diarias
+        WHERE dimension = ? AND fecha BETWEEN ? AND ?
+        ORDER BY fecha, clave
+    """, (dimension, desde, hasta)).fetchall()
+
+
+def rango_por_defecto(dias=30):
+    hoy = datetime.now().date()
+    return (hoy - timedelta(days=dias - 1)).isoformat(), hoy.isoformat()
+
+
+class EstadisticasWindow:
+    """Ventana ligera de estadísticas (lee sólo estadisticas_diarias)"""
+
+    def __init__(self, parent, connect):
+        import tkinter as tk
+        from tkinter import ttk
+
+        self.connect = connect
+        self.win = tk.Toplevel(parent)
+        self.win.title("Estadísticas de Recetas")
+        self.win.geometry("800x550")
+
+        desde, hasta = rango_por_defecto()
+        frm = ttk.Frame(self.win, padding=8)
+        frm.pack(fill="x")
+        ttk.Label(frm, text="Desde (aaaa-mm-dd):").pack(side="left")
+        self.desde = tk.Entry(frm, width=12)
+        self.desde.insert(0, desde)
+        self.desde.pack(side="left", padx=4)
+        ttk.Label(frm, text="Hasta:").pack(side="left")
+        self.hasta = tk.Entry(frm, width=12)
+        self.hasta.insert(0, hasta)
+        self.hasta.pack(side="left", padx=4)
+        ttk.Label(frm, text="Dimensión:").pack(side="left", padx=(10, 0))
+        self.dimension = ttk.Combobox(frm, values=DIMENSIONES[1:], width=14, state="readonly")
+        self.dimension.set("tipo")
+        self.dimension.pack(side="left", padx=4)
+        self.detalle = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frm, text="Por día", variable=self.detalle).pack(side="left", padx=4)
+        ttk.Button(frm, text="Consultar", command=self.refresh).pack(side="left", padx=4)
+
+        self.tree = ttk.Treeview(self.win, columns=("fecha", "clave", "total"), show="headings")
+        for col, text, width in (("fecha", "Fecha", 110), ("clave", "Clave", 450), ("total", "Recetas", 90)):
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor="w")
+        scrollbar = ttk.Scrollbar(self.win, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side="left", fill="both", expand=True, padx=(10, 0), pady=10)
+        scrollbar.pack(side="right", fill="y", pady=10)
+
+        self.dimension.bind("<<ComboboxSelected>>", lambda e: self.refresh())
+        self.refresh()
+
+    def refresh(self):
+        desde, hasta = self.desde.get().strip(), self.hasta.get().strip()
+        dim = self.dimension.get()
+        conn = self.connect()
+        try:
+            if self.detalle.get():
+                rows = por_dia(conn, dim, desde, hasta)
+            else:
+                rows = [(f"{desde} a {hasta}", clave, total) for clave, total in resumen(conn, dim, desde, hasta)]
+        finally:
+            conn.close()
+        self.tree.delete(*self.tree.get_children())
+        for row in rows:
+            self.tree.insert("", "end", values=row)
+
+
+def main(argv=None):
+    import sqlite3
+    parser = argparse.ArgumentParser(description="Estadísticas diarias de recetas")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--dimension", choices=DIMENSIONES, default="tipo")
+    parser.add_argument("--desde", help="Fecha inicial aaaa-mm-dd")
+    parser.add_argument("--hasta", help="Fecha final aaaa-mm-dd")
+    parser.add_argument("--por-dia", action="store_true", help="Mostrar la serie diaria")
+    parser.add_argument("--reconstruir", action="store_true", help="Reconstruye los agregados desde recetas")
+    args = parser.parse_args(argv)
+
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+    desde, hasta = rango_por_defecto()
+    desde, hasta = args.desde or desde, args.hasta or hasta
+
+    conn = sqlite3.connect(args.db)
+    try:
+        ensure_tables(conn.cursor())
+        if args.reconstruir:
+            print(f"Recetas procesadas: {reconstruir(conn)}")
+        if args.por_dia:
+            for fecha, clave, total in por_dia(conn, args.dimension, desde, hasta):
+                print(f"{fecha}\t{clave}\t{total}")
+        else:
+            for clave, total in resumen(conn, args.dimension, desde, hasta):
+                print(f"{clave}\t{total}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+"""
+Firma digital de los PDF de recetas (firma separada, Ed25519)
+Cada PDF firmado tiene al lado un <nombre>.pdf.firma (JSON) con el SHA-256 del
+PDF, el prescriptor, la huella de su clave, la fecha y la firma Ed25519 de
+esos campos (JSON compacto de codec_payload). El PDF no se modifica: se puede
+imprimir o enviar antes de que termine la firma.
+
+Almacén de claves (directorio, por defecto data/firmas):
+    privadas/<prescriptor>.pem   clave privada cifrada con la clave del almacén
+                                 (PKCS#8, BestAvailableEncryption de cryptography)
+    privadas/<prescriptor>.json  titular (nombre con que se dio de alta) y huella
+    publicas/<huella>.json       prescriptor, fecha de alta y clave pública
+Las claves públicas no se borran al reemplazar una clave: las firmas viejas se
+siguen verificando. Verificar no necesita la clave del almacén.
+El prescriptor se identifica sin mayúsculas, acentos ni puntuación
+("JUAN PÉREZ" usa la clave de "Juan Perez"); la firma lleva el nombre del
+titular de la clave.
+
+La firma corre en un pool de hilos (PoolFirmas): guardar una receta sólo
+encola el trabajo. Un lote de PDF ya generados se firma o se verifica en
+paralelo con la línea de comandos:
+
+    python firma_recetas.py --crear-clave "Dr. Juan Pérez"
+    python firma_recetas.py --firmar output --db recetas.db      # prescriptor de cada receta
+    python firma_recetas.py --firmar output --prescriptor "Dr. Juan Pérez"
+    python firma_recetas.py --verificar output
+
+La clave del almacén se toma de RECETAS_CLAVE_FIRMAS o se pide por consola.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+import unicodedata
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from codec_payload import json_compacto
+from metricas import span
+
+logger = logging.getLogger(__name__)
+
+EXTENSION = ".firma"
+ALGORITMO = "Ed25519"
+VERSION = 1
+
+# Resultados de verificar()
+VALIDA = "VALIDA"
+SIN_FIRMA = "SIN_FIRMA"
+ALTERADO = "ALTERADO"            # el PDF cambió después de firmarse
+FIRMA_INVALIDA = "FIRMA_INVALIDA"
+CLAVE_DESCONOCIDA = "CLAVE_DESCONOCIDA"
+
+
+class ErrorAlmacen(Exception):
+    """Almacén bloqueado, clave incorrecta o prescriptor sin clave"""
+
+
+class SinClave(ErrorAlmacen):
+    """El prescriptor no fue dado de alta con --crear-clave"""
+
+    def __init__(self, prescriptor):
+        super().__init__(f"SIN CLAVE: {prescriptor} no tiene clave de firma; darla de alta con "
+                         f"python firma_recetas.py --crear-clave \"{prescriptor}\"")
+        self.prescriptor = prescriptor
+
+
+class ClaveExistente(ErrorAlmacen):
+    """crear_clave sin reemplazar para un prescriptor que ya tiene clave"""
+
+
+def identificador(prescriptor):
+    """Nombre de archivo de un prescriptor: 'Dr. Juan Pérez' -> 'dr_juan_perez'"""
+    texto = unicodedata.normalize("NFKD", prescriptor or "").encode("ascii", "ignore").decode("ascii")
+    slug = re.sub(r"[^a-z0-9]+", "_", texto.lower()).strip("_")
+    if not slug:
+        raise ValueError(f"Prescriptor inválido para firmar: {prescriptor!r}")
+    return slug
+
+
+def mismo_prescriptor(a, b):
+    """True si los dos nombres corresponden a la misma clave"""
+    try:
+        return identificador(a) == identificador(b)
+    except ValueError:
+        return False
+
+
+def sha256_archivo(path, bloque=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def _mensaje(firma):
+    """Bytes firmados: todos los campos salvo la firma, en JSON compacto"""
+    return json_compacto({k: v for k, v in firma.items() if k != "firma"})
+
+
+def _escribir(path, contenido):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(contenido)
+    os.replace(tmp, path)
+
+
+class AlmacenFirmas:
+    """
+    clave: contraseña del almacén (str); sin ella sólo se puede verificar.
+    Las claves descifradas quedan en memoria mientras viva el objeto.
+    """
+
+    def __init__(self, directorio, clave=None):
+        self.directorio = directorio
+        self.clave = clave.encode("utf-8") if isinstance(clave, str) else clave
+        self._privadas = {}
+        self._publicas = {}
+        self._avisados = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directorio, "privadas"), exist_ok=True)
+        os.makedirs(os.path.join(directorio, "publicas"), exist_ok=True)
+
+    def _ruta_privada(self, prescriptor):
+        return os.path.join(self.directorio, "privadas", identificador(prescriptor) + ".pem")
+
+    def tiene_clave(self, prescriptor):
+        return os.path.exists(self._ruta_privada(prescriptor))
+
+    def titular(self, prescriptor, huella=None):
+        """Nombre con que se dio de alta la clave de este prescriptor, o None"""
+        ruta = self._ruta_privada(prescriptor)[:-4] + ".json"
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                return json.load(f)["prescriptor"]
+        # Almacén anterior al archivo de titular: el registro de la pública
+        publica = self.clave_publica(huella) if huella else None
+        return publica[0] if publica else None
+
+    def crear_clave(self, prescriptor, reemplazar=False):
+        """Genera la clave del prescriptor; devuelve su huella"""
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+        if not self.clave:
+            raise ErrorAlmacen("El almacén de firmas está bloqueado (falta la clave)")
+        with self._lock:
+            ruta = self._ruta_privada(prescriptor)
+            if os.path.exists(ruta) and not reemplazar:
+                titular = self.titular(prescriptor)
+                raise ClaveExistente(f"{prescriptor} ya tiene clave de firma (identificador "
+                                     f"{identificador(prescriptor)}" + (f", alta como {titular})" if titular else ")"))
+            privada = Ed25519PrivateKey.generate()
+            huella = self._huella(privada.public_key())
+            publica_pem = privada.public_key().public_bytes(
+                serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode("ascii")
+            registro = {"prescriptor": prescriptor, "creada": datetime.now().isoformat(timespec="seconds"),
+                        "algoritmo": ALGORITMO, "clave": publica_pem}
+            # La pública primero: una firma nunca queda con una huella desconocida
+            _escribir(os.path.join(self.directorio, "publicas", huella + ".json"),
+                      json.dumps(registro, ensure_ascii=False, indent=2).encode("utf-8"))
+            _escribir(ruta, privada.private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                serialization.BestAvailableEncryption(self.clave)
+            ))
+            _escribir(ruta[:-4] + ".json", json.dumps({"prescriptor": prescriptor, "huella": huella},
+                                                      ensure_ascii=False, indent=2).encode("utf-8"))
+            self._privadas[identificador(prescriptor)] = (privada, huella, prescriptor)
+        logger.info(f"Clave de firma creada para {prescriptor} ({huella})")
+        return huella
+
+    @staticmethod
+    def _huella(publica):
+        from cryptography.hazmat.primitives import serialization
+        crudo = publica.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        return hashlib.sha256(crudo).hexdigest()[:16]
+
+    def clave_privada(self, prescriptor, crear=False):
+        """
+        (clave privada, huella, titular) descifrada una vez por sesión. Sin clave
+        en el almacén: SinClave, salvo crear=True (alta explícita, p. ej. --crear).
+        """
+        ident = identificador(prescriptor)
+        par = self._privadas.get(ident) or self._abrir_privada(prescriptor, crear)
+        titular = par[2]
+        if titular != prescriptor and (ident, prescriptor) not in self._avisados:
+            # Mismo identificador con otro nombre: o es el mismo prescriptor
+            # escrito distinto o dos prescriptores que chocan en un solo archivo
+            self._avisados.add((ident, prescriptor))
+            logger.warning(f"{prescriptor} firma con la clave de {titular} (identificador {ident}); "
+                           f"si son prescriptores distintos, corregir el nombre de uno de ellos")
+        return par
+
+    def _abrir_privada(self, prescriptor, crear):
+        from cryptography.hazmat.primitives import serialization
+
+        ident = identificador(prescriptor)
+        if not self.clave:
+            raise ErrorAlmacen("El almacén de firmas está bloqueado (falta la clave)")
+        if not self.tiene_clave(prescriptor):
+            if not crear:
+                raise SinClave(prescriptor)
+            try:
+                self.crear_clave(prescriptor)
+                return self._privadas[ident]
+            except ClaveExistente:
+                pass  # otro hilo o proceso la creó antes: se abre la del disco
+        with self._lock:
+            if ident not in self._privadas:
+                with open(self._ruta_privada(prescriptor), "rb") as f:
+                    try:
+                        privada = serialization.load_pem_private_key(f.read(), password=self.clave)
+                    except (ValueError, TypeError) as e:
+                        raise ErrorAlmacen(f"No se pudo abrir la clave de {prescriptor}: {e}")
+                huella = self._huella(privada.public_key())
+                self._privadas[ident] = (privada, huella, self.titular(prescriptor, huella) or prescriptor)
+            return self._privadas[ident]
+
+    def clave_publica(self, huella):
+        """(prescriptor, clave pública) de una huella, o None"""
+        from cryptography.hazmat.primitives import serialization
+
+        if huella not in self._publicas:
+            ruta = os.path.join(self.directorio, "publicas", os.path.basename(huella) + ".json")
+            if not os.path.exists(ruta):
+                return None
+            with open(ruta, encoding="utf-8") as f:
+                registro = json.load(f)
+            self._publicas[huella] = (registro["prescriptor"],
+                                      serialization.load_pem_public_key(registro["clave"].encode("ascii")))
+        return self._publicas[huella]
+
+    # --- Firma ---
+    def firmar(self, pdf_path, prescriptor, crear=False):
+        """Escribe <pdf>.firma a nombre del titular de la clave; devuelve la ruta de la firma"""
+        privada, huella, titular = self.clave_privada(prescriptor, crear)
+        firma = {
+            "version": VERSION, "algoritmo": ALGORITMO, "documento": os.path.basename(pdf_path),
+            "sha256": sha256_archivo(pdf_path), "prescriptor": titular, "huella": huella,
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+        }
+        firma["firma"] = base64.b64encode(privada.sign(_mensaje(firma))).decode("ascii")
+        ruta = pdf_path + EXTENSION
+        _escribir(ruta, json.dumps(firma, ensure_ascii=False, indent=1).encode("utf-8"))
+        return ruta
+
+    def verificar(self, pdf_path):
+        """(resultado, detalle): VALIDA, SIN_FIRMA, ALTERADO, FIRMA_INVALIDA o CLAVE_DESCONOCIDA"""
+        from cryptography.exceptions import InvalidSignature
+
+        ruta = pdf_path + EXTENSION
+        if not os.path.exists(ruta):
+            return SIN_FIRMA, ""
+        try:
+            with open(ruta, encoding="utf-8") as f:
+                firma = json.load(f)
+            firmado = base64.b64decode(firma["firma"])
+            huella = firma["huella"]
+        except (ValueError, KeyError, TypeError) as e:
+            return FIRMA_INVALIDA, f"Archivo de firma dañado: {e}"
+        publica = self.clave_publica(huella)
+        if publica is None:
+            return CLAVE_DESCONOCIDA, f"Huella {huella} no está en el almacén"
+        titular, clave = publica
+        if not mismo_prescriptor(titular, firma.get("prescriptor")):
+            return FIRMA_INVALIDA, f"La clave {huella} es de {titular}, no de {firma.get('prescriptor')}"
+        try:
+            clave.verify(firmado, _mensaje(firma))
+        except InvalidSignature:
+            return FIRMA_INVALIDA, "La firma no corresponde a los datos"
+        if sha256_archivo(pdf_path) != firma.get("sha256"):
+            return ALTERADO, "El PDF cambió después de firmarse"
+        return VALIDA, f"{titular} ({firma.get('fecha', '')})"
+
+
+class PoolFirmas:
+    """
+    Firma en segundo plano. al_terminar(ruta_pdf, prescriptor, ruta_firma, error)
+    se llama desde el hilo que firmó (error es '' si salió bien). Con crear=False
+    (por defecto) un prescriptor sin alta no se firma: error SinClave.
+    """
+
+    def __init__(self, almacen, hilos=2, crear=False, al_terminar=None):
+        self.almacen = almacen
+        self.crear = crear
+        self.al_terminar = al_terminar
+        self._pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="firma-recetas")
+        self.pendientes = 0
+        self.errores = 0
+        self._lock = threading.Lock()
+
+    def enviar(self, pdf_path, prescriptor):
+        """Encola la firma de un PDF; devuelve el Future (la ruta de la firma)"""
+        with self._lock:
+            self.pendientes += 1
+        return self._pool.submit(self._firmar, pdf_path, prescriptor)
+
+    def _firmar(self, pdf_path, prescriptor):
+        ruta, error = "", ""
+        try:
+            with span("firma.pdf"):
+                ruta = self.almacen.firmar(pdf_path, prescriptor, self.crear)
+            return ruta
+        except Exception as e:
+            error = str(e)
+            logger.error(f"No se pudo firmar {pdf_path}: {e}")
+            with self._lock:
+                self.errores += 1
+            raise
+        finally:
+            with self._lock:
+                self.pendientes -= 1
+            if self.al_terminar is not None:
+                try:
+                    self.al_terminar(pdf_path, prescriptor, ruta, error)
+                except Exception as e:
+                    logger.error(f"Error al notificar la firma de {pdf_path}: {e}")
+
+    def firmar_lote(self, items):
+        """items: [(pdf_path, prescriptor)]; devuelve [(pdf_path, ruta_firma o '', error)] en orden"""
+        futuros = [(p, self.enviar(p, prescriptor)) for p, prescriptor in items]
+        resultados = []
+        for p, futuro in futuros:
+            try:
+                resultados.append((p, futuro.result(), ""))
+            except Exception as e:
+                resultados.append((p, "", str(e)))
+        return resultados
+
+    def verificar_lote(self, pdf_paths):
+        """[(pdf_path, resultado, detalle)] en orden, verificados en paralelo"""
+        return [(p, *r) for p, r in zip(pdf_paths, self._pool.map(self.almacen.verificar, pdf_paths))]
+
+    def cerrar(self, esperar=True):
+        self._pool.shutdown(wait=esperar)
+
+
+def pdfs_de(rutas, excluir_firmados=False):
+    """PDF de las rutas dadas (archivos o carpetas, sin recorrer subcarpetas)"""
+    for ruta in rutas:
+        nombres = sorted(os.path.join(ruta, n) for n in os.listdir(ruta)) if os.path.isdir(ruta) else [ruta]
+        for p in nombres:
+            if p.lower().endswith(".pdf") and not (excluir_firmados and os.path.exists(p + EXTENSION)):
+                yield p
+
+
+def numero_de_pdf(pdf_path):
+    """'output/CE-2025-000123_indicaciones.pdf' -> 'CE-2025-000123'"""
+    return os.path.basename(pdf_path)[:-4].split("_", 1)[0]
+
+
+def main(argv=None):
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Firma digital de los PDF de recetas")
+    parser.add_argument("--almacen", default=os.environ.get("RECETAS_ALMACEN_FIRMAS",
+                                                           os.path.join(raiz, "data", "firmas")))
+    parser.add_argument("--crear-clave", metavar="PRESCRIPTOR", help="Genera la clave de un prescriptor")
+    parser.add_argument("--reemplazar", action="store_true", help="Con --crear-clave, reemplaza la clave actual")
+    parser.add_argument("--firmar", nargs="+", metavar="RUTA", help="PDF o carpetas a firmar")
+    parser.add_argument("--verificar", nargs="+", metavar="RUTA", help="PDF o carpetas a verificar")
+    parser.add_argument("--prescriptor", help="Con --firmar, firma todo con este prescriptor")
+    parser.add_argument("--db", help="Con --firmar, toma el prescriptor de cada receta de recetas.db")
+    parser.add_argument("--rehacer", action="store_true", help="Con --firmar, vuelve a firmar los ya firmados")
+    parser.add_argument("--crear", action="store_true", help="Con --firmar, crea las claves que falten")
+    parser.add_argument("--hilos", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args(argv)
+    if not (args.crear_clave or args.firmar or args.verificar):
+        parser.error("indique --crear-clave, --firmar o --verificar")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    clave = None
+    if args.crear_clave or args.firmar:
+        clave = os.environ.get("RECETAS_CLAVE_FIRMAS")
+        if not clave:
+            import getpass
+            clave = getpass.getpass("Clave del almacén de firmas: ")
+    almacen = AlmacenFirmas(args.almacen, clave)
+
+    codigo = 0
+    pool = PoolFirmas(almacen, args.hilos, crear=args.crear)
+    try:
+        if args.crear_clave:
+            print(f"Clave de {args.crear_clave}: {almacen.crear_clave(args.crear_clave, args.reemplazar)}")
+
+        if args.firmar:
+            items, sin_prescriptor = [], []
+            if args.db:
+                import sqlite3
+                from datos_recetas import buscar_receta
+                conn = sqlite3.connect(args.db)
+            for p in pdfs_de(args.firmar, excluir_firmados=not args.rehacer):
+                prescriptor = args.prescriptor
+                if args.db:
+                    info = buscar_receta(conn, numero_de_pdf(p))
+                    prescriptor = (info or {}).get("prescriptor") or prescriptor
+                if prescriptor:
+                    items.append((p, prescriptor))
+                else:
+                    sin_prescriptor.append(p)
+            if args.db:
+                conn.close()
+            t0 = time.perf_counter()
+            resultados = pool.firmar_lote(items)
+            segundos = time.perf_counter() - t0
+            fallidos = [(p, e) for p, _, e in resultados if e]
+            for p, e in fallidos:
+                print(f"ERROR  {p}: {e}")
+            for p in sin_prescriptor:
+                print(f"OMITIDO  {p}: sin prescriptor (use --db o --prescriptor)")
+            print(f"{len(resultados) - len(fallidos)} PDF firmados en {segundos:.2f} s con {args.hilos} hilos; "
+                  f"{len(fallidos)} con error, {len(sin_prescriptor)} omitidos")
+            codigo = 1 if fallidos else 0
+
+        if args.verificar:
+            t0 = time.perf_counter()
+            resultados = pool.verificar_lote(list(pdfs_de(args.verificar)))
+            segundos = time.perf_counter() - t0
+            cuentas = {}
+            for p, resultado, detalle in resultados:
+                cuentas[resultado] = cuentas.get(resultado, 0) + 1
+                if resultado != VALIDA:
+                    print(f"{resultado:<18}{p}" + (f": {detalle}" if detalle else ""))
+            print(f"{len(resultados)} PDF verificados en {segundos:.2f} s: "
+                  + ", ".join(f"{n} {r}" for r, n in sorted(cuentas.items())))
+            codigo = max(codigo, 1 if any(r != VALIDA for _, r, _ in resultados) else 0)
+    except ErrorAlmacen as e:
+        print(f"Error: {e}")
+        codigo = 2
+    finally:
+        pool.cerrar()
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
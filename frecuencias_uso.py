@@ -0,0 +1,277 @@
+"""
+Frecuencia de uso de diagnósticos y medicamentos por prescriptor y especialidad
+uso_cie y uso_medicamentos se actualizan (UPSERT) en la misma transacción que
+guarda la receta; uso_medicamentos cuenta cada pauta (dosis, frecuencia, vía,
+duración) para ofrecer la habitual. La aplicación carga una vez el modelo del
+prescriptor (ModeloUso), lo mantiene en memoria y lo actualiza al guardar; las
+sugerencias CIE-10 y de medicamentos muestran primero lo más usado.
+Las plantillas de receta favoritas (medicamentos, CIE e indicaciones) se
+guardan por prescriptor en la tabla plantillas.
+
+    python frecuencias_uso.py --reconstruir
+    python frecuencias_uso.py --prescriptor "DR. LUCIA TORRES" --especialidad PEDIATRÍA
+"""
+
+import json
+import logging
+import argparse
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+AMBITOS = ("prescriptor", "especialidad")
+# Un uso del propio prescriptor pesa más que uno de su especialidad
+PESO_PRESCRIPTOR = 3
+CAMPOS_PAUTA = ("dosis", "frecuencia", "via", "duracion")
+
+
+def ensure_tables(cur):
+    """Crea las tablas de frecuencias y plantillas si no existen"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS uso_cie (
+            ambito TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            code TEXT NOT NULL,
+            usos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (ambito, clave, code)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS uso_medicamentos (
+            ambito TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            nombre TEXT NOT NULL,
+            dosis TEXT NOT NULL DEFAULT '',
+            frecuencia TEXT NOT NULL DEFAULT '',
+            via TEXT NOT NULL DEFAULT '',
+            duracion TEXT NOT NULL DEFAULT '',
+            usos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (ambito, clave, nombre, dosis, frecuencia, via, duracion)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS plantillas (
+            prescriptor TEXT NOT NULL,
+            nombre TEXT NOT NULL,
+            contenido TEXT NOT NULL,
+            actualizado TEXT,
+            PRIMARY KEY (prescriptor, nombre)
+        )
+    """)
+
+
+def _texto(valor):
+    return str(valor or "").strip()
+
+
+def claves_receta(data):
+    """[(ambito, clave)] de una receta (prescriptor y especialidad no vacíos)"""
+    return [(a, c) for a, c in (("prescriptor", _texto(data.get("prescriptor"))),
+                                ("especialidad", _texto(data.get("prescriptor_especialidad")))) if c]
+
+
+def usos_receta(data):
+    """(código CIE o "", [(nombre, dosis, frecuencia, via, duracion)]) de una receta"""
+    meds = []
+    for med in data.get("meds") or []:
+        nombre = _texto(med.get("nombre"))
+        if nombre:
+            meds.append((nombre,) + tuple(_texto(med.get(k)) for k in CAMPOS_PAUTA))
+    return _texto(data.get("cie")).upper(), meds
+
+
+def filas_uso(data):
+    """Filas (uso_cie, uso_medicamentos) que aporta una receta"""
+    claves = claves_receta(data)
+    code, meds = usos_receta(data)
+    return ([(a, c, code) for a, c in claves] if code else [],
+            [(a, c) + med for a, c in claves for med in meds])
+
+
+_UPSERT_CIE = """
+    INSERT INTO uso_cie (ambito, clave, code, usos) VALUES (?,?,?,1)
+    ON CONFLICT(ambito, clave, code) DO UPDATE SET usos = usos + 1
+"""
+_UPSERT_MED = """
+    INSERT INTO uso_medicamentos (ambito, clave, nombre, dosis, frecuencia, via, duracion, usos)
+    VALUES (?,?,?,?,?,?,?,1)
+    ON CONFLICT(ambito, clave, nombre, dosis, frecuencia, via, duracion) DO UPDATE SET usos = usos + 1
+"""
+
+
+def registrar_uso(cur, data):
+    """Suma la receta a las frecuencias; usar el cursor de la transacción de inserción"""
+    cie, meds = filas_uso(data)
+    cur.executemany(_UPSERT_CIE, cie)
+    cur.executemany(_UPSERT_MED, meds)
+
+
+def reconstruir(conn):
+    """Recalcula las frecuencias desde las recetas (base actual y archivos anuales)"""
+    from codec_payload import decodificar
+    from datos_recetas import anios_archivados, archivo_adjunto
+
+    cur = conn.cursor()
+    ensure_tables(cur)
+    cur.execute("DELETE FROM uso_cie")
+    cur.execute("DELETE FROM uso_medicamentos")
+    conn.commit()
+    conteo_cie, conteo_med = {}, {}
+    total = 0
+
+    def procesar(filas):
+        nonlocal total
+        for (payload,) in filas:
+            try:
+                cie, meds = filas_uso(decodificar(payload))
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"Receta omitida al reconstruir frecuencias: {e}")
+                continue
+            for k in cie:
+                conteo_cie[k] = conteo_cie.get(k, 0) + 1
+            for k in meds:
+                conteo_med[k] = conteo_med.get(k, 0) + 1
+            total += 1
+
+    sql = "SELECT payload FROM {}.recetas WHERE estado = 'ACTIVA'"
+    procesar(conn.execute(sql.format("main")))
+    for anio in anios_archivados(conn):
+        with archivo_adjunto(conn, anio) as esquema:
+            procesar(conn.execute(sql.format(esquema)))
+
+    with conn:
+        cur.executemany("INSERT INTO uso_cie VALUES (?,?,?,?)", [k + (n,) for k, n in conteo_cie.items()])
+        cur.executemany("INSERT INTO uso_medicamentos VALUES (?,?,?,?,?,?,?,?)",
+                        [k + (n,) for k, n in conteo_med.items()])
+    logger.info(f"Frecuencias de uso reconstruidas desde {total} recetas")
+    return total
+
+
+def modelo_uso(conn, prescriptor, especialidad):
+    """
+    Datos para ModeloUso: {"cie": [[code, usos_prescriptor, usos_especialidad]],
+    "medicamentos": [[nombre, dosis, frecuencia, via, duracion, usos_prescriptor, usos_especialidad]]}
+    """
+    params = (_texto(prescriptor), _texto(especialidad))
+    filtro = "(ambito = 'prescriptor' AND clave = ?) OR (ambito = 'especialidad' AND clave = ?)"
+    suma = ("SUM(CASE WHEN ambito = 'prescriptor' THEN usos ELSE 0 END), "
+            "SUM(CASE WHEN ambito = 'especialidad' THEN usos ELSE 0 END)")
+    cie = conn.execute(f"SELECT code, {suma} FROM uso_cie WHERE {filtro} GROUP BY code", params).fetchall()
+    meds = conn.execute(
+        f"SELECT nombre, dosis, frecuencia, via, duracion, {suma} FROM uso_medicamentos WHERE {filtro} "
+        f"GROUP BY nombre, dosis, frecuencia, via, duracion", params
+    ).fetchall()
+    return {"cie": [list(r) for r in cie], "medicamentos": [list(r) for r in meds]}
+
+
+class ModeloUso:
+    """Frecuencias de un prescriptor en memoria; se actualiza con cada receta guardada"""
+
+    def __init__(self, prescriptor="", especialidad="", datos=None):
+        self.prescriptor = _texto(prescriptor)
+        self.especialidad = _texto(especialidad)
+        self._cie = {}
+        self._meds = {}
+        self._pautas = {}
+        self._orden_cie = self._orden_meds = None
+        for code, up, ue in (datos or {}).get("cie", []):
+            self._cie[code] = self._cie.get(code, 0) + PESO_PRESCRIPTOR * up + ue
+        for nombre, dosis, frecuencia, via, duracion, up, ue in (datos or {}).get("medicamentos", []):
+            puntaje = PESO_PRESCRIPTOR * up + ue
+            self._meds[nombre] = self._meds.get(nombre, 0) + puntaje
+            pautas = self._pautas.setdefault(nombre, {})
+            pauta = (dosis, frecuencia, via, duracion)
+            pautas[pauta] = pautas.get(pauta, 0) + puntaje
+
+    def registrar(self, data):
+        """Suma una receta recién guardada (mismo criterio que registrar_uso)"""
+        if _texto(data.get("prescriptor")) != self.prescriptor:
+            return
+        puntaje = PESO_PRESCRIPTOR + (1 if _texto(data.get("prescriptor_especialidad")) == self.especialidad else 0)
+        code, meds = usos_receta(data)
+        if code:
+            self._cie[code] = self._cie.get(code, 0) + puntaje
+        for nombre, *pauta in meds:
+            self._meds[nombre] = self._meds.get(nombre, 0) + puntaje
+            pautas = self._pautas.setdefault(nombre, {})
+            pautas[tuple(pauta)] = pautas.get(tuple(pauta), 0) + puntaje
+        self._orden_cie = self._orden_meds = None
+
+    def cie_preferidos(self):
+        """Códigos CIE-10 del más al menos usado"""
+        if self._orden_cie is None:
+            self._orden_cie = sorted(self._cie, key=lambda c: (-self._cie[c], c))
+        return self._orden_cie
+
+    def medicamentos_preferidos(self):
+        """Nombres de medicamentos del más al menos usado"""
+        if self._orden_meds is None:
+            self._orden_meds = sorted(self._meds, key=lambda n: (-self._meds[n], n))
+        return self._orden_meds
+
+    def pauta_habitual(self, nombre):
+        """{dosis, frecuencia, via, duracion} más usada para el medicamento, o None"""
+        pautas = self._pautas.get(_texto(nombre))
+        if not pautas:
+            return None
+        pauta = max(pautas, key=lambda p: (pautas[p], p))
+        return dict(zip(CAMPOS_PAUTA, pauta))
+
+
+# --- Plantillas de receta favoritas ---
+def listar_plantillas(conn, prescriptor):
+    """[{nombre, meds, cie, cie_desc, indicaciones}] del prescriptor, por nombre"""
+    return [dict(json.loads(contenido), nombre=nombre) for nombre, contenido in conn.execute(
+        "SELECT nombre, contenido FROM plantillas WHERE prescriptor = ? ORDER BY nombre", (_texto(prescriptor),)
+    )]
+
+
+def guardar_plantilla(conn, prescriptor, nombre, contenido):
+    """Crea o reemplaza la plantilla; contenido: {meds, cie, cie_desc, indicaciones}"""
+    contenido = {k: contenido.get(k, "" if k != "meds" else []) for k in ("meds", "cie", "cie_desc", "indicaciones")}
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO plantillas (prescriptor, nombre, contenido, actualizado) VALUES (?,?,?,?)",
+            (_texto(prescriptor), _texto(nombre), json.dumps(contenido, ensure_ascii=False), datetime.now().isoformat())
+        )
+
+
+def eliminar_plantilla(conn, prescriptor, nombre):
+    with conn:
+        return conn.execute("DELETE FROM plantillas WHERE prescriptor = ? AND nombre = ?",
+                            (_texto(prescriptor), _texto(nombre))).rowcount
+
+
+def main(argv=None):
+    import sqlite3
+    parser = argparse.ArgumentParser(description="Frecuencias de uso por prescriptor y especialidad")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--reconstruir", action="store_true", help="Recalcula desde las recetas existentes")
+    parser.add_argument("--prescriptor", default="", help="Muestra lo más usado por este prescriptor")
+    parser.add_argument("--especialidad", default="")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        ensure_tables(conn.cursor())
+        if args.reconstruir:
+            print(f"Recetas procesadas: {reconstruir(conn)}")
+        if args.prescriptor or args.especialidad:
+            modelo = ModeloUso(args.prescriptor, args.especialidad,
+                               modelo_uso(conn, args.prescriptor, args.especialidad))
+            print("CIE-10:", ", ".join(modelo.cie_preferidos()[:args.top]))
+            for nombre in modelo.medicamentos_preferidos()[:args.top]:
+                pauta = modelo.pauta_habitual(nombre)
+                print(f"  {nombre}: {' / '.join(v for v in pauta.values() if v)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
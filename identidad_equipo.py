@@ -0,0 +1,96 @@
+"""
+Identidad de la estación de trabajo (nombre, IP y MAC) en caché
+La resolución por DNS (gethostbyname) y la lectura de la MAC se hacen una vez,
+en segundo plano; los registros de bitácora sólo leen los valores guardados.
+Un hilo comprueba periódicamente, sin consultar DNS, si cambió el nombre del
+equipo o la interfaz de salida y, en ese caso, vuelve a resolver.
+"""
+
+import socket
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+IP_POR_DEFECTO = "127.0.0.1"
+
+
+def ip_interfaz_salida():
+    """IP de la interfaz con ruta por defecto (UDP sin enviar paquetes; no usa DNS)"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("10.255.255.255", 1))
+        return s.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        s.close()
+
+
+def formatear_mac(nodo):
+    return ":".join(f"{(nodo >> s) & 0xff:02x}" for s in range(40, -1, -8))
+
+
+class IdentidadEquipo:
+    """Valores de identidad en caché con actualización en segundo plano"""
+
+    def __init__(self, intervalo=30.0):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        # Valores iniciales baratos (sin DNS); la resolución completa llega después
+        self.hostname = socket.gethostname()
+        self.ip = ip_interfaz_salida() or IP_POR_DEFECTO
+        self.mac = ""
+        self._huella = (self.hostname, self.ip)
+
+    def iniciar(self):
+        """Lanza la resolución inicial y el hilo de vigilancia"""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._run, name="identidad-equipo", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+
+    def resolver(self):
+        """Resolución completa (puede tardar si el DNS es lento)"""
+        hostname = socket.gethostname()
+        ip = ip_interfaz_salida()
+        if not ip:
+            try:
+                ip = socket.gethostbyname(hostname)
+            except OSError:
+                ip = IP_POR_DEFECTO
+        try:
+            mac = formatear_mac(uuid.getnode())
+        except Exception:
+            mac = ""
+        with self._lock:
+            cambio = (hostname, ip) != (self.hostname, self.ip)
+            self.hostname, self.ip, self.mac = hostname, ip, mac
+            self._huella = (hostname, ip)
+        if cambio:
+            logger.info(f"Identidad de equipo: {hostname} {ip} {mac}")
+
+    def _huella_actual(self):
+        return (socket.gethostname(), ip_interfaz_salida() or self.ip)
+
+    def _run(self):
+        try:
+            self.resolver()
+        except Exception as e:
+            logger.warning(f"No se pudo resolver la identidad del equipo: {e}")
+        while not self._detener.wait(self.intervalo):
+            try:
+                if self._huella_actual() != self._huella:
+                    self.resolver()
+            except Exception as e:
+                logger.warning(f"Error actualizando identidad del equipo: {e}")
+
+    def descripcion(self):
+        with self._lock:
+            return f"{self.hostname} ({self.ip}{', ' + self.mac if self.mac else ''})"
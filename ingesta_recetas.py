@@ -0,0 +1,293 @@
+"""
+Ingesta masiva de recetas sin interfaz gráfica (integración con el HIS)
+Lee recetas en JSON Lines (un objeto por línea, mismas claves que el formulario:
+tipo, paciente, ci, cie, prescriptor, prescriptor_especialidad, meds, ...),
+las valida con las reglas del formulario (validacion_recetas.py), asigna
+números por bloques e inserta por lotes con executemany, una transacción por
+lote. Los PDFs se generan en segundo plano en un pool de procesos.
+Un registro inválido se reporta y no detiene el resto.
+
+    python ingesta_recetas.py altas_EH.jsonl --usuario HIS --pdf-dir output
+    python ingesta_recetas.py altas_EH.jsonl --sin-pdf --errores errores.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import reportes_farmacia
+import estadisticas
+import pacientes
+import frecuencias_uso
+from datos_recetas import (
+    TIPOS_RECETA, COLUMNAS_RECETA, COLUMNA_CREATED_AT, SQL_INSERT_RECETA, fila_receta, formatear_numero, reservar_bloque,
+)
+from registro_eventos import SQL_INSERT as SQL_INSERT_REGISTRO
+from validacion_recetas import validar_receta
+
+logger = logging.getLogger(__name__)
+
+TAM_LOTE = 200
+COLUMNA_PDF = COLUMNAS_RECETA.index("pdf_path")
+COLUMNA_HASH = COLUMNAS_RECETA.index("hash_verificacion")
+
+CAMPOS_TEXTO = (
+    "unidad", "servicio", "prescriptor", "prescriptor_especialidad", "paciente", "ci", "hc",
+    "edad", "meses", "sexo", "talla", "peso", "cie", "cie_desc", "indicaciones",
+    "actividad_fisica", "estado_enfermedad", "alergias", "alergias_especificar",
+)
+
+
+class ResultadoIngesta:
+    """Totales, errores por registro [(ref, mensaje)] y tiempos de una ingesta"""
+
+    def __init__(self):
+        self.total = 0
+        self.insertadas = []
+        self.errores = []
+        self.segundos = 0.0
+        self.pdfs = 0
+        self.segundos_pdf = 0.0
+
+    @property
+    def por_segundo(self):
+        return len(self.insertadas) / self.segundos if self.segundos else 0.0
+
+    def resumen(self):
+        texto = (f"{self.total} registros: {len(self.insertadas)} insertados, {len(self.errores)} con error "
+                 f"en {self.segundos:.2f} s ({self.por_segundo:.0f} recetas/s)")
+        if self.pdfs:
+            texto += f"; {self.pdfs} PDFs en {self.segundos_pdf:.2f} s"
+        return texto
+
+
+def leer_jsonl(lineas):
+    """Genera (número de línea, dict) o (número de línea, ValueError) si la línea no es JSON"""
+    for n, linea in enumerate(lineas, 1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            yield n, json.loads(linea)
+        except ValueError as e:
+            yield n, ValueError(f"JSON inválido: {e}")
+
+
+def _renderizar_pdf(out_path, data):
+    """Trabajo del pool de procesos (función de módulo para poder serializarla)"""
+    from pdf_layout_fixed import build_pdf
+    build_pdf(out_path, data, tipo=data["tipo"])
+    return out_path
+
+
+def normalizar(data):
+    """Completa los campos que el formulario siempre envía; devuelve una copia"""
+    data = dict(data)
+    for campo in CAMPOS_TEXTO:
+        data[campo] = "" if data.get(campo) is None else str(data[campo])
+    data["tipo"] = str(data.get("tipo") or "").strip().upper()
+    data["fecha"] = data.get("fecha") or datetime.now().strftime("%d/%m/%Y")
+    # Como collect_form: el servicio es la especialidad del prescriptor
+    data["servicio"] = data["servicio"] or data["prescriptor_especialidad"]
+    data["meds"] = data.get("meds") or []
+    return data
+
+
+def errores_registro(data, cie_index=None):
+    """Mensajes de error de un registro ya normalizado (lista vacía si es válido)"""
+    if not isinstance(data, dict):
+        return [str(data) if isinstance(data, Exception) else "El registro debe ser un objeto JSON"]
+    errores = []
+    if data.get("numero"):
+        errores.append("El número lo asigna el sistema; no envíe 'numero'")
+    if data["tipo"] not in TIPOS_RECETA:
+        errores.append(f"Tipo de receta inválido: '{data['tipo']}' (use {', '.join(TIPOS_RECETA)})")
+    if not isinstance(data["meds"], list) or not all(isinstance(m, dict) for m in data["meds"]):
+        errores.append("'meds' debe ser una lista de objetos")
+        return errores
+    errores.extend(m for _, m in validar_receta(data, cie_index))
+    return errores
+
+
+class IngestaRecetas:
+    """
+    Ingesta sobre una conexión a recetas.db.
+    pdf_dir=None no genera PDFs (pdf_path queda vacío).
+    """
+
+    def __init__(self, conn, usuario="INTEGRACION", ip_address="", pdf_dir=None, cie_index=None,
+                 tam_lote=TAM_LOTE, procesos=None):
+        self.conn = conn
+        self.usuario = usuario
+        self.ip_address = ip_address
+        self.pdf_dir = pdf_dir
+        self.cie_index = cie_index
+        self.tam_lote = tam_lote
+        self.procesos = procesos
+        self._pool = None
+        self._pdfs = []
+
+    def ingerir(self, registros):
+        """registros: iterable de (ref, dict); devuelve ResultadoIngesta"""
+        resultado = ResultadoIngesta()
+        if self.pdf_dir:
+            os.makedirs(self.pdf_dir, exist_ok=True)
+            self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+        inicio = time.perf_counter()
+        try:
+            lote = []
+            for ref, data in registros:
+                resultado.total += 1
+                lote.append((ref, data))
+                if len(lote) >= self.tam_lote:
+                    self._procesar_lote(lote, resultado)
+                    lote = []
+            if lote:
+                self._procesar_lote(lote, resultado)
+            resultado.segundos = time.perf_counter() - inicio
+            self._esperar_pdfs(resultado)
+        finally:
+            if self._pool:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+        return resultado
+
+    def _procesar_lote(self, lote, resultado):
+        validos = []
+        for ref, data in lote:
+            if isinstance(data, dict):
+                data = normalizar(data)
+            errores = errores_registro(data, self.cie_index)
+            if errores:
+                resultado.errores.append((ref, "; ".join(errores)))
+            else:
+                validos.append((ref, data))
+        if not validos:
+            return
+
+        # Un bloque de números por tipo y lote en lugar de una transacción por receta
+        por_tipo = {}
+        for _, data in validos:
+            por_tipo[data["tipo"]] = por_tipo.get(data["tipo"], 0) + 1
+        siguientes = {}
+        for tipo, n in por_tipo.items():
+            inicio, _ = reservar_bloque(self.conn, tipo, n, f"ingesta:{self.usuario}")
+            siguientes[tipo] = inicio
+
+        ahora = datetime.now().isoformat()
+        preparados = []
+        for ref, data in validos:
+            data["numero"] = formatear_numero(data["tipo"], siguientes[data["tipo"]])
+            siguientes[data["tipo"]] += 1
+            pdf_path = os.path.join(self.pdf_dir, f"{data['numero']}.pdf") if self.pdf_dir else ""
+            # Una sola serialización: el payload y el hash salen de los mismos bytes
+            fila = fila_receta(data, pdf_path, self.usuario, self.ip_address, created_at=ahora)
+            data_hash = fila[COLUMNA_HASH]
+            auditoria = (str(uuid.uuid4()), data["numero"], "CREACION", self.usuario, ahora, self.ip_address,
+                         f"Receta creada por ingesta masiva ({ref}) para paciente {data['paciente']}", "", data_hash)
+            preparados.append((ref, data, fila, auditoria))
+
+        try:
+            with self.conn:
+                self._insertar(preparados)
+            correctos = preparados
+        except sqlite3.Error as e:
+            # Fallo del lote: se aísla el registro culpable insertando de a uno
+            logger.warning(f"Lote de {len(preparados)} recetas rechazado ({e}); reintentando por registro")
+            correctos = []
+            for item in preparados:
+                try:
+                    with self.conn:
+                        self._insertar([item])
+                    correctos.append(item)
+                except sqlite3.Error as e_reg:
+                    resultado.errores.append((item[0], f"Error de base de datos: {e_reg}"))
+
+        for ref, data, fila, _ in correctos:
+            resultado.insertadas.append((ref, data["numero"]))
+            if self._pool:
+                self._pdfs.append((ref, self._pool.submit(_renderizar_pdf, fila[COLUMNA_PDF], data)))
+
+    def _insertar(self, preparados):
+        cur = self.conn.cursor()
+        cur.executemany(SQL_INSERT_RECETA, [p[2] for p in preparados])
+        cur.executemany(SQL_INSERT_REGISTRO["auditoria"], [p[3] for p in preparados])
+        for _, data, fila, _ in preparados:
+            reportes_farmacia.registrar_consumo(cur, data)
+            estadisticas.registrar_receta(cur, data)
+            pacientes.registrar_paciente(cur, data, fila[COLUMNA_CREATED_AT])
+            frecuencias_uso.registrar_uso(cur, data)
+
+    def _esperar_pdfs(self, resultado):
+        inicio = time.perf_counter()
+        for ref, futuro in self._pdfs:
+            try:
+                futuro.result()
+                resultado.pdfs += 1
+            except Exception as e:
+                resultado.errores.append((ref, f"Receta guardada, pero falló el PDF: {e}"))
+        self._pdfs = []
+        resultado.segundos_pdf = time.perf_counter() - inicio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingesta masiva de recetas (JSON Lines)")
+    parser.add_argument("archivo", help="Archivo .jsonl ('-' para entrada estándar)")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--usuario", default="INTEGRACION", help="Usuario registrado como creador")
+    parser.add_argument("--pdf-dir", default="output", help="Carpeta de PDFs")
+    parser.add_argument("--sin-pdf", action="store_true", help="No generar PDFs")
+    parser.add_argument("--lote", type=int, default=TAM_LOTE, help="Recetas por transacción")
+    parser.add_argument("--procesos", type=int, help="Procesos para PDFs (por defecto, núcleos)")
+    parser.add_argument("--cie10", help="Catálogo CIE-10 para normalizar descripciones")
+    parser.add_argument("--errores", help="Escribe los errores en este archivo (JSON Lines)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+    cie_index = None
+    if args.cie10:
+        from catalogos import cargar_cie10
+        cie_index = cargar_cie10(args.cie10)
+
+    from identidad_equipo import IdentidadEquipo
+    ip_address = IdentidadEquipo().ip
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    entrada = sys.stdin if args.archivo == "-" else open(args.archivo, "r", encoding="utf-8-sig")
+    try:
+        ingesta = IngestaRecetas(conn, args.usuario, ip_address, None if args.sin_pdf else args.pdf_dir,
+                                 cie_index, args.lote, args.procesos)
+        resultado = ingesta.ingerir(("línea %d" % n, data) for n, data in leer_jsonl(entrada))
+        with conn:
+            conn.execute(SQL_INSERT_REGISTRO["bitacora_accesos"], (
+                str(uuid.uuid4()), args.usuario, "INGESTA_MASIVA", datetime.now().isoformat(), ip_address,
+                f"{args.archivo}: {resultado.resumen()}", "EXITOSO" if not resultado.errores else "PARCIAL"
+            ))
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        conn.close()
+
+    print(resultado.resumen())
+    if args.errores:
+        with open(args.errores, "w", encoding="utf-8") as f:
+            for ref, mensaje in resultado.errores:
+                f.write(json.dumps({"registro": ref, "error": mensaje}, ensure_ascii=False) + "\n")
+    else:
+        for ref, mensaje in resultado.errores:
+            print(f"  {ref}: {mensaje}", file=sys.stderr)
+    return 1 if resultado.errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
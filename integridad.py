@@ -0,0 +1,46 @@
+"""
+Hash de integridad de las recetas
+La receta se serializa una sola vez, al guardar, en su forma canónica (JSON
+compacto de codec_payload: claves ordenadas, sin espacios, UTF-8); esos bytes
+se comprimen como payload y su BLAKE2b se guarda con el prefijo "b2:".
+Verificar es descomprimir y hashear los bytes guardados, sin json.loads ni
+json.dumps. Los hashes antiguos (SHA-256 hexadecimal sin prefijo, sobre
+json.dumps con sort_keys) se siguen verificando por el camino anterior.
+"""
+
+import json
+import hashlib
+
+from codec_payload import json_compacto, decodificar_bytes
+
+PREFIJO_BLAKE2B = "b2:"
+TAMANO_DIGEST = 32
+
+
+def canonico(data):
+    """Bytes canónicos de la receta (los mismos que guarda el payload)"""
+    return json_compacto(data)
+
+
+def hash_canonico(canonico_bytes):
+    """Hash versionado de bytes ya canónicos"""
+    return PREFIJO_BLAKE2B + hashlib.blake2b(canonico_bytes, digest_size=TAMANO_DIGEST).hexdigest()
+
+
+def calcular_hash(data):
+    """Hash versionado de la receta; TypeError/ValueError si no es serializable"""
+    return hash_canonico(canonico(data))
+
+
+def hash_legado(data):
+    """SHA-256 de las versiones anteriores (sin prefijo)"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def verificar(payload, hash_guardado):
+    """True si el payload guardado (cualquier versión) corresponde al hash"""
+    if hash_guardado.startswith(PREFIJO_BLAKE2B):
+        if isinstance(payload, str):
+            payload = canonico(json.loads(payload))  # TEXT sin recodificar: no es forma canónica
+        return hash_canonico(decodificar_bytes(payload)) == hash_guardado
+    return hash_legado(json.loads(decodificar_bytes(payload))) == hash_guardado
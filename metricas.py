@@ -0,0 +1,313 @@
+"""
+Instrumentación de rendimiento
+Cada operación instrumentada (arranque, carga de catálogos, búsquedas, PDFs,
+transacciones, escritura de registros) registra su duración en un histograma
+móvil en memoria (últimas VENTANA muestras) del que se obtienen p50/p95/p99.
+Un hilo vuelca periódicamente el resumen a un archivo JSON Lines local y la
+ventana Auditoría -> Diagnóstico lo muestra en vivo. cProfile y tracemalloc
+se pueden activar y detener en caliente desde esa ventana.
+
+    with span("pdf.receta"):
+        build_pdf(...)
+
+    @medido("catalogo.cargar")
+    def load_catalogos(...): ...
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import functools
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+VENTANA = 1000
+
+
+class Histograma:
+    """Últimas `ventana` duraciones (ms) más totales acumulados"""
+
+    __slots__ = ("muestras", "n", "total_ms", "max_ms", "errores")
+
+    def __init__(self, ventana=VENTANA):
+        self.muestras = deque(maxlen=ventana)
+        self.n = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.errores = 0
+
+    def agregar(self, ms, error=False):
+        self.muestras.append(ms)
+        self.n += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if error:
+            self.errores += 1
+
+    def resumen(self):
+        v = sorted(self.muestras)
+        if not v:
+            return {"n": self.n}
+
+        def p(q):
+            return round(v[min(len(v) - 1, int(q * len(v)))], 3)
+
+        return {
+            "n": self.n, "errores": self.errores, "p50": p(0.50), "p95": p(0.95), "p99": p(0.99),
+            "max": round(self.max_ms, 3), "media": round(self.total_ms / self.n, 3),
+        }
+
+
+class Metricas:
+    """Registro de histogramas por nombre de operación"""
+
+    def __init__(self, ventana=VENTANA):
+        self.ventana = ventana
+        self._hist = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def registrar(self, nombre, ms, error=False):
+        with self._lock:
+            h = self._hist.get(nombre)
+            if h is None:
+                h = self._hist[nombre] = Histograma(self.ventana)
+            h.agregar(ms, error)
+
+    @contextmanager
+    def span(self, nombre):
+        t0 = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.registrar(nombre, (time.perf_counter() - t0) * 1000, error)
+
+    def medido(self, nombre):
+        """Decorador equivalente a envolver la función en span(nombre)"""
+        def decorador(fn):
+            @functools.wraps(fn)
+            def envoltura(*args, **kwargs):
+                with self.span(nombre):
+                    return fn(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def resumen(self):
+        """{nombre: {n, errores, p50, p95, p99, max, media}} (ms)"""
+        with self._lock:
+            return {nombre: h.resumen() for nombre, h in sorted(self._hist.items())}
+
+    def reiniciar(self):
+        with self._lock:
+            self._hist.clear()
+
+    # --- Volcado periódico ---
+    def volcar(self, path, estacion=""):
+        """Agrega una línea JSON con el resumen actual al archivo"""
+        linea = {"fecha_hora": datetime.now().isoformat(timespec="seconds"), "estacion": estacion,
+                 "metricas": self.resumen()}
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+
+    def iniciar_volcado(self, directorio, estacion="", intervalo=300.0):
+        """Vuelca cada `intervalo` segundos a directorio/metricas_AAAAMMDD.jsonl"""
+        if self._hilo is not None:
+            return
+
+        def run():
+            while not self._detener.wait(intervalo):
+                try:
+                    self.volcar(ruta_volcado(directorio), estacion)
+                except Exception as e:
+                    logger.warning(f"No se pudieron guardar las métricas: {e}")
+
+        os.makedirs(directorio, exist_ok=True)
+        self._hilo = threading.Thread(target=run, name="metricas", daemon=True)
+        self._hilo.start()
+
+    def detener_volcado(self):
+        self._detener.set()
+
+
+def ruta_volcado(directorio):
+    return os.path.join(directorio, f"metricas_{datetime.now().strftime('%Y%m%d')}.jsonl")
+
+
+class Perfilador:
+    """cProfile y tracemalloc activables en caliente"""
+
+    def __init__(self):
+        self._perfil = None
+        self._lock = threading.Lock()
+
+    @property
+    def perfilando(self):
+        return self._perfil is not None
+
+    @property
+    def trazando_memoria(self):
+        return tracemalloc.is_tracing()
+
+    def iniciar_perfil(self):
+        with self._lock:
+            if self._perfil is None:
+                self._perfil = cProfile.Profile()
+                self._perfil.enable()
+
+    def detener_perfil(self, path=None, lineas=30):
+        """Detiene cProfile; guarda el .prof si se indica path y devuelve el top por tiempo acumulado"""
+        with self._lock:
+            perfil, self._perfil = self._perfil, None
+        if perfil is None:
+            return ""
+        perfil.disable()
+        if path:
+            perfil.dump_stats(path)
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(lineas)
+        return salida.getvalue()
+
+    def iniciar_memoria(self, marcos=10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(marcos)
+
+    def captura_memoria(self, lineas=25):
+        """Top de asignaciones vivas por línea de código"""
+        if not tracemalloc.is_tracing():
+            return ""
+        actual, pico = tracemalloc.get_traced_memory()
+        estadisticas = tracemalloc.take_snapshot().statistics("lineno")
+        texto = [f"Memoria rastreada: actual {actual / 1024:.0f} KiB, pico {pico / 1024:.0f} KiB"]
+        texto += [str(s) for s in estadisticas[:lineas]]
+        return "\n".join(texto)
+
+    def detener_memoria(self):
+        texto = self.captura_memoria()
+        tracemalloc.stop()
+        return texto
+
+
+# Instancias compartidas por el proceso
+METRICAS = Metricas()
+PERFILADOR = Perfilador()
+span = METRICAS.span
+medido = METRICAS.medido
+registrar = METRICAS.registrar
+
+
+class DiagnosticoWindow:
+    """Ventana Auditoría -> Diagnóstico: percentiles en vivo y perfiles en caliente"""
+
+    COLUMNAS = ("nombre", "n", "p50", "p95", "p99", "max", "errores")
+    ENCABEZADOS = ("Operación", "N", "p50 ms", "p95 ms", "p99 ms", "Máx ms", "Errores")
+
+    def __init__(self, parent, metricas=METRICAS, perfilador=PERFILADOR, directorio=None, estacion=""):
+        import tkinter as tk
+        from tkinter import ttk
+
+        self.metricas = metricas
+        self.perfilador = perfilador
+        self.directorio = directorio
+        self.estacion = estacion
+
+        self.win = tk.Toplevel(parent)
+        self.win.title("Diagnóstico de rendimiento")
+        self.win.geometry("900x650")
+
+        frm = ttk.Frame(self.win, padding=8)
+        frm.pack(fill="x")
+        self.btn_perfil = ttk.Button(frm, command=self.alternar_perfil)
+        self.btn_perfil.pack(side="left", padx=4)
+        self.btn_memoria = ttk.Button(frm, command=self.alternar_memoria)
+        self.btn_memoria.pack(side="left", padx=4)
+        ttk.Button(frm, text="Captura de memoria", command=self.captura_memoria).pack(side="left", padx=4)
+        ttk.Button(frm, text="Guardar métricas", command=self.guardar).pack(side="left", padx=4)
+        ttk.Button(frm, text="Reiniciar", command=self.reiniciar).pack(side="left", padx=4)
+
+        self.tree = ttk.Treeview(self.win, columns=self.COLUMNAS, show="headings", height=14)
+        for col, texto in zip(self.COLUMNAS, self.ENCABEZADOS):
+            self.tree.heading(col, text=texto)
+            self.tree.column(col, width=260 if col == "nombre" else 80, anchor="w" if col == "nombre" else "e")
+        self.tree.pack(fill="both", expand=True, padx=10)
+
+        self.texto = tk.Text(self.win, height=14, font=("Courier", 9), wrap="none")
+        self.texto.pack(fill="both", expand=True, padx=10, pady=8)
+        self.estado = ttk.Label(self.win, text="")
+        self.estado.pack(fill="x", padx=10, pady=(0, 8))
+
+        self.actualizar_botones()
+        self.refrescar()
+
+    def refrescar(self):
+        if not self.win.winfo_exists():
+            return
+        self.tree.delete(*self.tree.get_children())
+        for nombre, r in self.metricas.resumen().items():
+            self.tree.insert("", "end", values=(nombre, r["n"], r.get("p50", ""), r.get("p95", ""),
+                                                r.get("p99", ""), r.get("max", ""), r.get("errores", 0)))
+        self.win.after(2000, self.refrescar)
+
+    def actualizar_botones(self):
+        self.btn_perfil.config(text="Detener cProfile" if self.perfilador.perfilando else "Iniciar cProfile")
+        self.btn_memoria.config(text="Detener tracemalloc" if self.perfilador.trazando_memoria
+                                else "Iniciar tracemalloc")
+
+    def mostrar(self, texto):
+        self.texto.delete("1.0", "end")
+        self.texto.insert("1.0", texto)
+
+    def alternar_perfil(self):
+        if self.perfilador.perfilando:
+            path = None
+            if self.directorio:
+                os.makedirs(self.directorio, exist_ok=True)
+                path = os.path.join(self.directorio, f"perfil_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+            self.mostrar(self.perfilador.detener_perfil(path))
+            self.estado.config(text=f"Perfil guardado en {path}" if path else "Perfil detenido")
+        else:
+            self.perfilador.iniciar_perfil()
+            self.estado.config(text="cProfile activo: reproduzca la operación lenta y luego deténgalo")
+        self.actualizar_botones()
+
+    def alternar_memoria(self):
+        if self.perfilador.trazando_memoria:
+            self.mostrar(self.perfilador.detener_memoria())
+            self.estado.config(text="tracemalloc detenido")
+        else:
+            self.perfilador.iniciar_memoria()
+            self.estado.config(text="tracemalloc activo (la aplicación será algo más lenta)")
+        self.actualizar_botones()
+
+    def captura_memoria(self):
+        texto = self.perfilador.captura_memoria()
+        self.mostrar(texto or "tracemalloc no está activo")
+
+    def guardar(self):
+        if not self.directorio:
+            return
+        try:
+            path = ruta_volcado(self.directorio)
+            os.makedirs(self.directorio, exist_ok=True)
+            self.metricas.volcar(path, self.estacion)
+            self.estado.config(text=f"Métricas guardadas en {path}")
+        except OSError as e:
+            self.estado.config(text=f"No se pudieron guardar las métricas: {e}")
+
+    def reiniciar(self):
+        self.metricas.reiniciar()
+        self.tree.delete(*self.tree.get_children())
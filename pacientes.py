@@ -0,0 +1,295 @@
+"""
+Maestro de pacientes por CI
+La tabla pacientes guarda los datos demográficos más recientes de cada
+paciente y se actualiza (UPSERT) en la misma transacción que guarda la
+receta. El formulario la usa para autocompletar al escribir la CI, a través
+de CachePacientes (LRU en memoria delante de la consulta a la base).
+reconstruir() la llena desde las recetas existentes (incluidos los archivos
+anuales).
+
+    python pacientes.py --reconstruir
+    python pacientes.py --ci 1712345678
+    python pacientes.py --nombre "QUISPE CAC"
+"""
+
+import time
+import logging
+import argparse
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = ("ci", "paciente", "hc", "sexo", "fecha_nacimiento", "talla", "peso",
+          "alergias", "alergias_especificar", "actualizado")
+COLUMNAS_UPSERT = ("ci", "paciente", "paciente_norm", "hc", "sexo", "fecha_nacimiento", "talla", "peso",
+                   "alergias", "alergias_especificar", "actualizado")
+# Columnas de recetas de las que sale cada paciente (fecha_nacimiento sólo está en el payload)
+COLUMNAS_RECETA = ("ci", "paciente", "hc", "sexo", "talla", "peso", "alergias", "alergias_especificar",
+                   "created_at", "payload")
+
+
+def normalizar_ci(ci):
+    return str(ci or "").strip().replace(" ", "").upper()
+
+
+def normalizar_nombre(nombre):
+    """Mayúsculas sin tildes y con espacios simples (clave del índice por prefijo)"""
+    texto = unicodedata.normalize("NFKD", str(nombre or ""))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.upper().split())
+
+
+def ensure_tables(cur):
+    """Crea la tabla pacientes y sus índices (HC y prefijo del nombre) si no existen"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pacientes (
+            ci TEXT PRIMARY KEY,
+            paciente TEXT,
+            paciente_norm TEXT,
+            hc TEXT,
+            sexo TEXT,
+            fecha_nacimiento TEXT,
+            talla TEXT,
+            peso TEXT,
+            alergias TEXT,
+            alergias_especificar TEXT,
+            actualizado TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pacientes_hc ON pacientes(hc)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pacientes_nombre ON pacientes(paciente_norm)")
+
+
+# Un dato vacío no borra el conocido; alergias y su detalle se actualizan juntos.
+# Una receta más antigua (ingesta o bandeja sincronizada tarde) no pisa a una más nueva.
+_UPSERT = f"""
+    INSERT INTO pacientes ({', '.join(COLUMNAS_UPSERT)}) VALUES ({','.join('?' * len(COLUMNAS_UPSERT))})
+    ON CONFLICT(ci) DO UPDATE SET
+        paciente = COALESCE(NULLIF(excluded.paciente, ''), paciente),
+        paciente_norm = COALESCE(NULLIF(excluded.paciente_norm, ''), paciente_norm),
+        hc = COALESCE(NULLIF(excluded.hc, ''), hc),
+        sexo = COALESCE(NULLIF(excluded.sexo, ''), sexo),
+        fecha_nacimiento = COALESCE(NULLIF(excluded.fecha_nacimiento, ''), fecha_nacimiento),
+        talla = COALESCE(NULLIF(excluded.talla, ''), talla),
+        peso = COALESCE(NULLIF(excluded.peso, ''), peso),
+        alergias_especificar = CASE WHEN excluded.alergias != '' THEN excluded.alergias_especificar
+                                    ELSE alergias_especificar END,
+        alergias = COALESCE(NULLIF(excluded.alergias, ''), alergias),
+        actualizado = excluded.actualizado
+    WHERE excluded.actualizado >= COALESCE(pacientes.actualizado, '')
+"""
+
+
+def fila_paciente(data, actualizado):
+    """Valores de _UPSERT (orden de COLUMNAS_UPSERT) para una receta, o None si no trae CI y nombre"""
+    ci = normalizar_ci(data.get("ci"))
+    nombre = str(data.get("paciente") or "").strip()
+    if not ci or not nombre:
+        return None
+    g = lambda k: str(data.get(k) or "").strip()
+    return (ci, nombre, normalizar_nombre(nombre), g("hc"), g("sexo"), g("fecha_nacimiento"), g("talla"),
+            g("peso"), g("alergias"), g("alergias_especificar"), actualizado)
+
+
+def registrar_paciente(cur, data, actualizado):
+    """Actualiza el maestro con los datos de la receta; usar el cursor de la transacción de inserción"""
+    fila = fila_paciente(data, actualizado)
+    if fila:
+        cur.execute(_UPSERT, fila)
+
+
+def _dict(row):
+    return dict(zip(CAMPOS, row)) if row else None
+
+
+def buscar_paciente(conn, ci):
+    """Datos del paciente por CI, o None"""
+    return _dict(conn.execute(
+        f"SELECT {', '.join(CAMPOS)} FROM pacientes WHERE ci = ?", (normalizar_ci(ci),)
+    ).fetchone())
+
+
+def buscar_por_hc(conn, hc):
+    return [_dict(r) for r in conn.execute(
+        f"SELECT {', '.join(CAMPOS)} FROM pacientes WHERE hc = ?", (str(hc or "").strip(),)
+    )]
+
+
+def buscar_por_nombre(conn, prefijo, limite=20):
+    """Pacientes cuyo nombre normalizado empieza por prefijo (rango sobre el índice)"""
+    prefijo = normalizar_nombre(prefijo)
+    if not prefijo:
+        return []
+    return [_dict(r) for r in conn.execute(
+        f"SELECT {', '.join(CAMPOS)} FROM pacientes WHERE paciente_norm >= ? AND paciente_norm < ? "
+        f"ORDER BY paciente_norm LIMIT ?", (prefijo, prefijo + "\uffff", limite)
+    )]
+
+
+def reconstruir(conn):
+    """
+    Llena pacientes desde las recetas (base actual y archivos anuales), de la
+    más reciente a la más antigua: cada campo toma el último valor no vacío.
+    Idempotente (mismo UPSERT que el guardado). Devuelve el número de pacientes.
+    """
+    from codec_payload import decodificar
+    from datos_recetas import anios_archivados, archivo_adjunto
+
+    cur = conn.cursor()
+    ensure_tables(cur)
+    conn.commit()
+    vistos = {}
+
+    def procesar(filas):
+        for ci, nombre, hc, sexo, talla, peso, alergias, alergias_esp, creada, payload in filas:
+            ci = normalizar_ci(ci)
+            if not ci or not nombre:
+                continue
+            p = vistos.get(ci)
+            if p is None:
+                p = vistos[ci] = {"ci": ci, "paciente": nombre, "hc": "", "sexo": "", "fecha_nacimiento": None,
+                                  "talla": "", "peso": "", "alergias": "", "alergias_especificar": "",
+                                  "actualizado": creada or ""}
+            for campo, valor in (("hc", hc), ("sexo", sexo), ("talla", talla), ("peso", peso)):
+                if not p[campo] and valor:
+                    p[campo] = valor
+            if not p["alergias"] and alergias:
+                p["alergias"], p["alergias_especificar"] = alergias, alergias_esp or ""
+            if p["fecha_nacimiento"] is None or (not p["fecha_nacimiento"] and payload):
+                # Sólo en el payload: se decodifica hasta encontrarla
+                try:
+                    p["fecha_nacimiento"] = (decodificar(payload).get("fecha_nacimiento") or "") if payload else ""
+                except ValueError:
+                    p["fecha_nacimiento"] = ""
+
+    def consulta(esquema):
+        return conn.execute(f"SELECT {', '.join(COLUMNAS_RECETA)} FROM {esquema}.recetas ORDER BY created_at DESC")
+
+    procesar(consulta("main"))
+    for anio in anios_archivados(conn):
+        with archivo_adjunto(conn, anio) as esquema:
+            procesar(consulta(esquema))
+
+    with conn:
+        conn.executemany(_UPSERT, [fila_paciente(p, p["actualizado"]) for p in vistos.values()])
+    logger.info(f"Maestro de pacientes reconstruido: {len(vistos)} pacientes")
+    return len(vistos)
+
+
+_ERROR = object()  # marca de consulta fallida en CachePacientes
+
+
+class CachePacientes:
+    """
+    LRU en memoria delante de consulta(ci) (p. ej. backend().buscar_paciente).
+    Las CI no encontradas se recuerdan ttl_ausentes segundos para no consultar
+    la base en cada tecla; un error de consulta (central o servidor caídos) se
+    recuerda ttl_errores segundos, así sin conexión no se espera la red en cada
+    tecla y se vuelve a intentar poco después.
+    """
+
+    def __init__(self, consulta, capacidad=5000, ttl_ausentes=60.0, ttl_errores=15.0):
+        self.consulta = consulta
+        self.capacidad = capacidad
+        self.ttl_ausentes = ttl_ausentes
+        self.ttl_errores = ttl_errores
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _guardar(self, ci, valor):
+        with self._lock:
+            self._datos[ci] = (valor, time.monotonic())
+            self._datos.move_to_end(ci)
+            while len(self._datos) > self.capacidad:
+                self._datos.popitem(last=False)
+
+    def en_cache(self, ci):
+        """
+        (encontrado, paciente) sin consultar: encontrado es False si hay que ir
+        a la base (CI nueva o entrada vencida)
+        """
+        ci = normalizar_ci(ci)
+        if not ci:
+            return True, None
+        with self._lock:
+            entrada = self._datos.get(ci)
+            if entrada is None:
+                return False, None
+            valor, instante = entrada
+            if valor is _ERROR:
+                vigente = time.monotonic() - instante < self.ttl_errores
+            else:
+                vigente = valor is not None or time.monotonic() - instante < self.ttl_ausentes
+            if not vigente:
+                return False, None
+            self._datos.move_to_end(ci)
+            return True, None if valor is _ERROR else valor
+
+    def obtener(self, ci):
+        encontrado, valor = self.en_cache(ci)
+        if encontrado:
+            return valor
+        ci = normalizar_ci(ci)
+        try:
+            valor = self.consulta(ci)
+        except Exception as e:
+            logger.warning(f"No se pudo consultar el paciente {ci}: {e}")
+            self._guardar(ci, _ERROR)
+            return None
+        self._guardar(ci, valor)
+        return valor
+
+    def actualizar(self, data, actualizado=""):
+        """Refleja en la caché una receta recién guardada (mismas reglas que el UPSERT)"""
+        fila = fila_paciente(data, actualizado)
+        if not fila:
+            return
+        nuevo = dict(zip(COLUMNAS_UPSERT, fila))
+        del nuevo["paciente_norm"]
+        with self._lock:
+            previo = (self._datos.get(nuevo["ci"]) or (None,))[0]
+            combinado = dict(previo) if isinstance(previo, dict) else {}
+        combinado.update((k, v) for k, v in nuevo.items() if v)
+        if nuevo["alergias"]:
+            combinado["alergias_especificar"] = nuevo["alergias_especificar"]
+        self._guardar(nuevo["ci"], combinado)
+
+
+def main(argv=None):
+    import sqlite3
+    parser = argparse.ArgumentParser(description="Maestro de pacientes")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--reconstruir", action="store_true", help="Llena la tabla desde las recetas existentes")
+    parser.add_argument("--ci", help="Muestra el paciente con esta CI")
+    parser.add_argument("--hc", help="Muestra los pacientes con esta historia clínica")
+    parser.add_argument("--nombre", help="Pacientes cuyo nombre empieza así")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        ensure_tables(conn.cursor())
+        if args.reconstruir:
+            inicio = time.perf_counter()
+            print(f"Pacientes: {reconstruir(conn)} ({time.perf_counter() - inicio:.1f} s)")
+        encontrados = []
+        if args.ci:
+            encontrados.append(buscar_paciente(conn, args.ci))
+        if args.hc:
+            encontrados += buscar_por_hc(conn, args.hc)
+        if args.nombre:
+            encontrados += buscar_por_nombre(conn, args.nombre)
+        for p in filter(None, encontrados):
+            print("\t".join(str(p[c] or "") for c in CAMPOS))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,293 +2,519 @@
 PDF Layout module for generating prescription PDFs using fpdf2
 Supports different prescription types with color-coded headers
 Fixed version with proper text wrapping for medications
+
+Receta e indicaciones salen de un mismo flujo (build_documentos): los bloques
+comunes (datos del paciente, tabla de medicamentos, indicaciones) se parten en
+líneas una sola vez y se dibujan en la receta y en la hoja del paciente, en
+dos archivos o en un solo PDF de dos partes.
 """
 
 from fpdf import FPDF
+from fpdf.enums import RenderStyle
 import os
+import unicodedata
 from datetime import datetime
 
-def build_pdf(output_path, data, tipo="CE"):
+from verificacion_recetas import matriz_qr
+
+FUENTE = 'Helvetica'  # la que fpdf2 usaba al pedir 'Arial'
+# Codificación WinAnsi de las fuentes base: además de latin-1 trae – — “ ” † •,
+# que aparecen en el catálogo CIE-10 y en el stock
+CODIFICACION = 'windows-1252'
+
+# Color mapping for different prescription types
+COLORES_TIPO = {
+    "CE": (0, 100, 200),    # Blue for Consulta Externa
+    "EM": (255, 193, 7),    # Yellow for Emergencia
+    "EH": (220, 53, 69)     # Red for Hospitalización
+}
+NOMBRES_TIPO = {
+    "CE": "CONSULTA EXTERNA",
+    "EM": "EMERGENCIA",
+    "EH": "HOSPITALIZACIÓN"
+}
+
+# Table column widths (adjusted to fit page width of 190mm)
+ANCHOS_MEDICAMENTOS = (70, 20, 25, 25, 25, 25)
+ENCABEZADOS_MEDICAMENTOS = ('Medicamento', 'Dosis', 'Frecuencia', 'Vía', 'Duración', 'Cantidad')
+CAMPOS_MEDICAMENTO = ("nombre", "dosis", "frecuencia", "via", "duracion", "cantidad")
+ANCHO_TEXTO = 180  # mm de las indicaciones
+LADO_QR = 24  # mm del código de verificación (arriba a la derecha de la receta)
+
+
+def texto_pdf(texto):
     """
-    Builds a PDF prescription with the given data
-    
-    Args:
-        output_path: Path where to save the PDF
-        data: Dictionary with prescription data
-        tipo: Type of prescription (CE, EM, EH)
+    Texto dibujable con las fuentes base: lo que no existe en CODIFICACION se
+    reemplaza por su forma sin diacríticos o compatible (NFKD) y, si no tiene,
+    se quita (uso privado, formato, símbolos como las llaves ⎫ del CIE-10) o
+    pasa a '?'.
     """
-    
-    # Color mapping for different prescription types
-    colors = {
-        "CE": (0, 100, 200),    # Blue for Consulta Externa
-        "EM": (255, 193, 7),    # Yellow for Emergencia  
-        "EH": (220, 53, 69)     # Red for Hospitalización
-    }
-    
-    # Get color for this prescription type
-    header_color = colors.get(tipo, (0, 100, 200))
-    
-    class PDF(FPDF):
-        def header(self):
-            # Hospital header with colored background
-            self.set_fill_color(*header_color)
-            self.rect(0, 0, 210, 25, 'F')
-            
-            # White text on colored background
-            self.set_text_color(255, 255, 255)
-            self.set_font('Arial', 'B', 16)
-            self.cell(0, 10, 'HOSPITAL BÁSICO DE CAYAMBE', 0, 1, 'C')
-            self.set_font('Arial', 'B', 12)
-            self.cell(0, 8, 'RECETA MÉDICA ELECTRÓNICA', 0, 1, 'C')
-            
-            # Reset text color to black
-            self.set_text_color(0, 0, 0)
-            self.ln(5)
-        
-        def footer(self):
-            self.set_y(-15)
-            self.set_font('Arial', 'I', 8)
-            self.cell(0, 10, f'Página {self.page_no()}', 0, 0, 'C')
+    try:
+        texto.encode(CODIFICACION)
+        return texto
+    except UnicodeEncodeError:
+        return "".join(_caracter_pdf(c) for c in texto)
+
+
+def _caracter_pdf(c):
+    try:
+        c.encode(CODIFICACION)
+        return c
+    except UnicodeEncodeError:
+        pass
+    equivalente = unicodedata.normalize("NFKD", c).encode(CODIFICACION, "ignore").decode(CODIFICACION)
+    if equivalente:
+        return equivalente
+    categoria = unicodedata.category(c)
+    return "" if categoria in ("Co", "Cf", "Cc", "Cn") or categoria[0] == "S" else "?"
+
+
+class DocumentoReceta(FPDF):
+    """
+    Receta y hoja de indicaciones. El encabezado y la numeración de páginas
+    dependen de la parte en curso (iniciar_parte), así ambas pueden ir en un
+    mismo PDF.
+    """
+
+    def __init__(self, tipo="CE"):
+        super().__init__()
+        self.tipo = tipo
+        self.parte = None
+        self.inicio_parte = 1
+        self._siguiente_parte = None
+        self._filas_en_pagina = 0
+        self.core_fonts_encoding = CODIFICACION
+
+    def normalize_text(self, text):
+        # fpdf pasa por aquí todo texto de text(), cell() y los anchos: un solo punto
+        return super().normalize_text(texto_pdf(text))
+
+    def iniciar_parte(self, parte):
+        """Empieza 'receta' o 'indicaciones' en una página nueva"""
+        self._siguiente_parte = parte
+        self.add_page()
 
-        def wrap_text(self, text, width):
-            """Wrap text to fit within specified width"""
-            if not text:
-                return ['']
-            
-            words = str(text).split()
-            lines = []
-            current_line = ""
-            
-            for word in words:
-                test_line = current_line + " " + word if current_line else word
-                if self.get_string_width(test_line) <= width:
-                    current_line = test_line
-                else:
-                    if current_line:
-                        lines.append(current_line)
-                        current_line = word
+    def header(self):
+        if self._siguiente_parte:
+            # add_page ya dibujó el pie de la página anterior con la parte anterior
+            self.parte, self._siguiente_parte = self._siguiente_parte, None
+            self.inicio_parte = self.page_no()
+        if self.parte == "indicaciones":
+            self.set_fill_color(240, 240, 240)
+            self.rect(0, 0, 210, 18, 'F')
+            self.set_font(FUENTE, 'B', 12)
+            self.linea('HOSPITAL BÁSICO DE CAYAMBE - INDICACIONES', 10, 'C')
+            self.ln(2)
+            return
+        # Hospital header with colored background
+        self.set_fill_color(*COLORES_TIPO.get(self.tipo, COLORES_TIPO["CE"]))
+        self.rect(0, 0, 210, 25, 'F')
+
+        # White text on colored background
+        self.set_text_color(255, 255, 255)
+        self.set_font(FUENTE, 'B', 16)
+        self.linea('HOSPITAL BÁSICO DE CAYAMBE', 10, 'C')
+        self.set_font(FUENTE, 'B', 12)
+        self.linea('RECETA MÉDICA ELECTRÓNICA', 8, 'C')
+
+        # Reset text color to black
+        self.set_text_color(0, 0, 0)
+        self.ln(5)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font(FUENTE, 'I', 8)
+        self.cell(0, 10, f'Página {self.page_no() - self.inicio_parte + 1}', align='C')
+
+    def linea(self, texto, h=6, align='L'):
+        """Celda de ancho completo y salto de línea (alineada a la izquierda con texto_en)"""
+        if align != 'L':
+            self.cell(0, h, texto, align=align, new_x="LMARGIN", new_y="NEXT")
+            return
+        if self.get_y() + h > self.page_break_trigger and self.auto_page_break and not self.in_footer:
+            self.add_page()
+        y = self.get_y()
+        self.texto_en(self.get_x(), y, h, texto)
+        self.set_xy(self.l_margin, y + h)
+
+    def texto_en(self, x, y, h, texto):
+        """
+        Texto donde lo pondría cell(w, h, texto) en (x, y) alineado a la
+        izquierda, con text(): cell() pasa por el motor de líneas y es ~10 veces
+        más lento para líneas ya partidas.
+        """
+        self.text(x + self.c_margin, y + 0.5 * h + 0.3 * self.font_size, texto)
+
+    def medidor(self):
+        """
+        Ancho en mm de un texto con la fuente actual. Con las fuentes base se
+        suma la tabla de anchos (get_string_width es mucho más lento y se
+        llamaba una vez por palabra).
+        """
+        cw = getattr(self.current_font, "cw", None)
+        if not isinstance(cw, dict) or self.char_spacing or self.font_stretching != 100:
+            return self.get_string_width
+        escala = self.font_size_pt * 0.001 / self.k
+
+        def ancho(texto):
+            try:
+                return sum(cw[c] for c in texto) * escala
+            except KeyError:
+                return self.get_string_width(texto)
+        return ancho
+
+    def codigo_qr(self, texto, x, y, lado=LADO_QR):
+        """
+        QR de texto en un cuadrado de lado mm con el texto debajo, alineado a
+        la derecha; sin segno ni qrcode, sólo el texto. Los tramos de módulos
+        negros que se repiten en filas seguidas van en un solo rect (rect es lo
+        caro: unos 120 en lugar de 170 por código).
+        """
+        matriz = matriz_qr(texto)
+        if matriz:
+            m = lado / len(matriz)
+            self.set_fill_color(0, 0, 0)
+            abiertos = {}  # (columna inicial, final) -> fila inicial
+            for i, fila in enumerate(list(matriz) + [()]):
+                tramos, j = set(), 0
+                while j < len(fila):
+                    if fila[j]:
+                        k = j
+                        while k < len(fila) and fila[k]:
+                            k += 1
+                        tramos.add((j, k))
+                        j = k
                     else:
-                        # Word is too long, break it
-                        lines.append(word[:20] + "...")
-                        current_line = ""
-            
-            if current_line:
-                lines.append(current_line)
-            
-            return lines if lines else ['']
-
-        def multi_cell_table(self, data_list, widths, height=6):
-            """Create a table with multi-line cells"""
-            if not data_list:
-                return
-            
-            # Calculate maximum lines needed for each row
-            for row_data in data_list:
-                max_lines = 1
-                wrapped_cells = []
-                
-                for i, (cell_data, width) in enumerate(zip(row_data, widths)):
-                    wrapped_text = self.wrap_text(cell_data, width - 2)  # -2 for padding
-                    wrapped_cells.append(wrapped_text)
-                    max_lines = max(max_lines, len(wrapped_text))
-                
-                # Draw the row with proper height
-                row_height = height * max_lines
-                start_y = self.get_y()
-                
-                # Draw cells
-                for i, (wrapped_text, width) in enumerate(zip(wrapped_cells, widths)):
-                    x_pos = 10 + sum(widths[:i])  # Calculate x position
-                    
-                    # Draw cell border
-                    self.rect(x_pos, start_y, width, row_height)
-                    
-                    # Add text line by line
-                    for j, line in enumerate(wrapped_text):
-                        self.set_xy(x_pos + 1, start_y + (j * height) + 1)
-                        self.cell(width - 2, height - 1, line, 0, 0, 'L')
-                
-                # Move to next row
-                self.set_y(start_y + row_height)
-
-    # Create PDF instance
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_font('Arial', '', 10)
-    
+                        j += 1
+                for (j, k), desde in list(abiertos.items()):
+                    if (j, k) not in tramos:
+                        self.rect(x + j * m, y + desde * m, (k - j) * m, (i - desde) * m, RenderStyle.F)
+                        del abiertos[(j, k)]
+                for tramo in tramos:
+                    abiertos.setdefault(tramo, i)
+            y += lado + 1
+        self.set_font(FUENTE, '', 6)
+        self.text(x + lado - self.get_string_width(texto), y + 2, texto)
+
+    def wrap_text(self, text, width):
+        """Wrap text to fit within specified width"""
+        return partir_lineas(text, width, self.medidor())
+
+    def encabezado_tabla(self, headers, widths, height=8):
+        self.set_fill_color(240, 240, 240)
+        for header, width in zip(headers, widths):
+            self.cell(width, height, header, border=1, align='C', fill=True)
+        self.ln(height)
+        self.set_fill_color(255, 255, 255)
+
+    def multi_cell_table(self, data_list, widths, height=6, headers=None):
+        """
+        Tabla con celdas de varias líneas. data_list: filas ya partidas
+        ([[líneas de cada celda], ...], ver partir_tabla). Una fila que no cabe
+        pasa entera a la página siguiente (repitiendo los encabezados); sólo se
+        parte si no cabe ni en una página vacía.
+        """
+        if headers:
+            self.encabezado_tabla(headers, widths)
+        self._filas_en_pagina = 1  # la primera fila también salta si no cabe
+        for celdas in data_list:
+            total = max(len(lineas) for lineas in celdas)
+            inicio = 0
+            while inicio < total:
+                cabe = int((self.page_break_trigger - self.get_y()) // height)
+                if cabe < total - inicio and (self._filas_en_pagina or cabe < 1):
+                    self.add_page()
+                    if headers:
+                        self.encabezado_tabla(headers, widths)
+                    self._filas_en_pagina = 0
+                    continue
+                fin = min(total, inicio + cabe)
+                self._dibujar_fila(celdas, widths, height, inicio, fin)
+                self._filas_en_pagina += 1
+                inicio = fin
+
+    def _dibujar_fila(self, celdas, widths, height, inicio, fin):
+        start_y = self.get_y()
+        x_pos = self.l_margin
+        for lineas, width in zip(celdas, widths):
+            # Draw cell border
+            self.rect(x_pos, start_y, width, height * (fin - inicio))
+            # Add text line by line
+            for j, line in enumerate(lineas[inicio:fin]):
+                if line:
+                    self.texto_en(x_pos + 1, start_y + (j * height) + 1, height - 1, line)
+            x_pos += width
+        # Move to next row
+        self.set_xy(self.l_margin, start_y + height * (fin - inicio))
+
+
+def partir_lineas(texto, ancho_max, ancho):
+    """
+    Parte el texto en líneas de hasta ancho_max (mm) midiendo con ancho(texto).
+    Respeta los saltos de línea y corta por caracteres las palabras más largas
+    que la línea (antes se truncaban con "...").
+    """
+    lineas = []
+    espacio = ancho(" ")
+    for parrafo in str(texto or "").splitlines() or [""]:
+        actual, w_actual = "", 0.0
+        for palabra in parrafo.split():
+            w = ancho(palabra)
+            if actual and w_actual + espacio + w <= ancho_max:
+                actual += " " + palabra
+                w_actual += espacio + w
+                continue
+            if actual:
+                lineas.append(actual)
+            while w > ancho_max and len(palabra) > 1:
+                corte, acumulado = 0, 0.0
+                for c in palabra:
+                    acumulado += ancho(c)
+                    if acumulado > ancho_max:
+                        break
+                    corte += 1
+                corte = max(corte, 1)
+                lineas.append(palabra[:corte])
+                palabra = palabra[corte:]
+                w = ancho(palabra)
+            actual, w_actual = palabra, w
+        lineas.append(actual)
+    return lineas
+
+
+def maquetar(pdf, data):
+    """
+    Bloques comunes de receta e indicaciones partidos en líneas una sola vez:
+    {'medicamentos': [[líneas por columna], ...], 'indicaciones': [líneas]}
+    """
+    pdf.set_font(FUENTE, '', 9)
+    ancho = pdf.medidor()
+    medicamentos = [
+        [partir_lineas(str(med.get(campo, "")), w - 2, ancho)  # -2 for padding
+         for campo, w in zip(CAMPOS_MEDICAMENTO, ANCHOS_MEDICAMENTOS)]
+        for med in data.get("meds", [])
+    ]
+    pdf.set_font(FUENTE, '', 10)
+    indicaciones = partir_lineas(data.get("indicaciones", ""), ANCHO_TEXTO, pdf.medidor()) \
+        if data.get("indicaciones") else []
+    return {"medicamentos": medicamentos, "indicaciones": indicaciones}
+
+
+def _bloque_receta(pdf, data, tipo, bloques, codigo_verificacion=None):
+    pdf.iniciar_parte("receta")
+    if codigo_verificacion:
+        pdf.codigo_qr(codigo_verificacion, 200 - LADO_QR, pdf.get_y())
+
     # Prescription type and number
-    pdf.set_font('Arial', 'B', 12)
-    tipo_names = {
-        "CE": "CONSULTA EXTERNA",
-        "EM": "EMERGENCIA", 
-        "EH": "HOSPITALIZACIÓN"
-    }
-    pdf.cell(0, 8, f'TIPO: {tipo_names.get(tipo, tipo)}', 0, 1)
-    pdf.cell(0, 8, f'NÚMERO: {data.get("numero", "N/A")}', 0, 1)
-    pdf.cell(0, 8, f'FECHA: {data.get("fecha", datetime.now().strftime("%d/%m/%Y"))}', 0, 1)
+    pdf.set_font(FUENTE, 'B', 12)
+    pdf.linea(f'TIPO: {NOMBRES_TIPO.get(tipo, tipo)}', 8)
+    pdf.linea(f'NÚMERO: {data.get("numero", "N/A")}', 8)
+    pdf.linea(f'FECHA: {data.get("fecha", datetime.now().strftime("%d/%m/%Y"))}', 8)
     pdf.ln(3)
-    
+
     # Health unit and service
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, f'Unidad de Salud: {data.get("unidad", "")}', 0, 1)
-    pdf.cell(0, 6, f'Especialidad: {data.get("prescriptor_especialidad", data.get("servicio", ""))}', 0, 1)
-pdf.cell(0, 6, f'Prescriptor: {data.get("prescriptor", "")}', 0, 1)
+    pdf.set_font(FUENTE, '', 10)
+    pdf.linea(f'Unidad de Salud: {data.get("unidad", "")}')
+    pdf.linea(f'Especialidad: {data.get("prescriptor_especialidad", data.get("servicio", ""))}')
+    pdf.linea(f'Prescriptor: {data.get("prescriptor", "")}')
     pdf.ln(3)
-    
+
     # Patient data section
-    # (Modificado) incluir Fecha de Nacimiento si existe
-    pdf.set_font('Arial', 'B', 11)
-    pdf.cell(0, 8, 'DATOS DEL PACIENTE', 0, 1)
-    pdf.set_font('Arial', '', 10)
-    
+    pdf.set_font(FUENTE, 'B', 11)
+    pdf.linea('DATOS DEL PACIENTE', 8)
+    pdf.set_font(FUENTE, '', 10)
+
     # Patient info in two columns
-    pdf.cell(100, 6, f'Paciente: {data.get("paciente", "")}', 0, 0)
-    pdf.cell(0, 6, f'CI: {data.get("ci", "")}', 0, 1)
-    
-    pdf.cell(50, 6, f'Historia Clínica: {data.get("hc", "")}', 0, 0)
-    pdf.cell(30, 6, f'Sexo: {data.get("sexo", "")}', 0, 0)
-    pdf.cell(30, 6, f'Edad: {data.get("edad", "")} años', 0, 0)
-    pdf.cell(0, 6, f'Meses: {data.get("meses", "")}', 0, 1)
-    
-    pdf.cell(50, 6, f'Talla: {data.get("talla", "")} cm', 0, 0)
-    pdf.cell(0, 6, f'Peso: {data.get("peso", "")} kg', 0, 1)
+    pdf.cell(100, 6, f'Paciente: {data.get("paciente", "")}')
+    pdf.linea(f'CI: {data.get("ci", "")}')
+
+    pdf.cell(50, 6, f'Historia Clínica: {data.get("hc", "")}')
+    pdf.cell(30, 6, f'Sexo: {data.get("sexo", "")}')
+    pdf.cell(30, 6, f'Edad: {data.get("edad", "")} años')
+    pdf.linea(f'Meses: {data.get("meses", "")}')
+
+    pdf.cell(50, 6, f'Talla: {data.get("talla", "")} cm')
+    pdf.linea(f'Peso: {data.get("peso", "")} kg')
     pdf.ln(2)
-    
+
     # Health status fields
     if data.get("actividad_fisica") or data.get("estado_enfermedad") or data.get("alergias"):
-        pdf.cell(70, 6, f'Actividad Física: {data.get("actividad_fisica", "")}', 0, 0)
-        pdf.cell(0, 6, f'Estado de Enfermedad: {data.get("estado_enfermedad", "")}', 0, 1)
-        
+        pdf.cell(70, 6, f'Actividad Física: {data.get("actividad_fisica", "")}')
+        pdf.linea(f'Estado de Enfermedad: {data.get("estado_enfermedad", "")}')
+
         alergias_text = f'Alergias: {data.get("alergias", "")}'
         if data.get("alergias_especificar"):
             alergias_text += f' - {data.get("alergias_especificar", "")}'
-        pdf.cell(0, 6, alergias_text, 0, 1)
+        pdf.linea(alergias_text)
         pdf.ln(2)
-    
+
     # CIE-10 diagnosis
-    pdf.set_font('Arial', 'B', 11)
-    pdf.cell(0, 8, 'DIAGNÓSTICO', 0, 1)
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, f'CIE-10: {data.get("cie", "")} - {data.get("cie_desc", "")}', 0, 1)
+    pdf.set_font(FUENTE, 'B', 11)
+    pdf.linea('DIAGNÓSTICO', 8)
+    pdf.set_font(FUENTE, '', 10)
+    pdf.linea(f'CIE-10: {data.get("cie", "")} - {data.get("cie_desc", "")}')
     pdf.ln(3)
-    
+
     # Medications section
-    pdf.set_font('Arial', 'B', 11)
-    pdf.cell(0, 8, 'MEDICAMENTOS PRESCRITOS', 0, 1)
-    pdf.set_font('Arial', '', 9)
-    
-    # Table column widths (adjusted to fit page width of 190mm)
-    col_widths = [70, 20, 25, 25, 25, 25]  # Total: 190mm
-    headers = ['Medicamento', 'Dosis', 'Frecuencia', 'Vía', 'Duración', 'Cantidad']
-    
-    # Draw table header
-    pdf.set_fill_color(240, 240, 240)
-    start_x = 10
-    for i, (header, width) in enumerate(zip(headers, col_widths)):
-        pdf.set_xy(start_x + sum(col_widths[:i]), pdf.get_y())
-        pdf.cell(width, 8, header, 1, 0, 'C', True)
-    pdf.ln(8)
-    
-    # Medications data with text wrapping
-    medications = data.get("meds", [])
-    pdf.set_fill_color(255, 255, 255)
-    
-    if medications:
-        # Prepare data for multi-cell table
-        med_data = []
-        for med in medications:
-            row = [
-                str(med.get("nombre", "")),
-                str(med.get("dosis", "")),
-                str(med.get("frecuencia", "")),
-                str(med.get("via", "")),
-                str(med.get("duracion", "")),
-                str(med.get("cantidad", ""))
-            ]
-            med_data.append(row)
-        
-        # Draw medications table with text wrapping
-        pdf.multi_cell_table(med_data, col_widths, height=6)
-    
+    pdf.set_font(FUENTE, 'B', 11)
+    pdf.linea('MEDICAMENTOS PRESCRITOS', 8)
+    pdf.set_font(FUENTE, '', 9)
+    pdf.multi_cell_table(bloques["medicamentos"], ANCHOS_MEDICAMENTOS, height=6,
+                         headers=ENCABEZADOS_MEDICAMENTOS)
     pdf.ln(5)
-    
+
     # Instructions section
-    if data.get("indicaciones"):
-        pdf.set_font('Arial', 'B', 11)
-        pdf.cell(0, 8, 'INDICACIONES / ADVERTENCIAS / RECOMENDACIONES', 0, 1)
-        pdf.set_font('Arial', '', 10)
-        
-        # Split long text into multiple lines with proper wrapping
-        indicaciones = str(data.get("indicaciones", ""))
-        wrapped_lines = pdf.wrap_text(indicaciones, 180)  # 180mm width for text
-        
-        for line in wrapped_lines:
-            pdf.cell(0, 6, line, 0, 1)
-    
-    pdf.ln(10)
-    
-    # Signature section
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, '_' * 50, 0, 1, 'C')
-    pdf.cell(0, 6, 'Firma y Sello del Prescriptor', 0, 1, 'C')
-    pdf.cell(0, 6, data.get("prescriptor", ""), 0, 1, 'C')
-    
-    # Save the PDF
+    if bloques["indicaciones"]:
+        pdf.set_font(FUENTE, 'B', 11)
+        pdf.linea('INDICACIONES / ADVERTENCIAS / RECOMENDACIONES', 8)
+        pdf.set_font(FUENTE, '', 10)
+        for line in bloques["indicaciones"]:
+            pdf.linea(line)
+
+    # Signature section (línea, leyenda y nombre en la misma página)
+    if pdf.get_y() + 10 + 3 * 6 > pdf.page_break_trigger:
+        pdf.add_page()
+    else:
+        pdf.ln(10)
+    pdf.set_font(FUENTE, '', 10)
+    pdf.linea('_' * 50, align='C')
+    pdf.linea('Firma y Sello del Prescriptor', align='C')
+    pdf.linea(data.get("prescriptor", ""), align='C')
+
+
+def _bloque_indicaciones(pdf, data, bloques):
+    """Hoja para el paciente: datos mínimos del paciente y del prescriptor e indicaciones"""
+    pdf.iniciar_parte("indicaciones")
+    pdf.set_font(FUENTE, '', 10)
+
+    pdf.linea(f'Paciente: {data.get("paciente", "")}')
+    if data.get('fecha_nacimiento'):
+        pdf.linea(f'Fecha de Nacimiento: {data.get("fecha_nacimiento", "")}')
+    pdf.linea(f'Edad: {data.get("edad", "")} años {data.get("meses", "")} meses')
+    pdf.linea(f'CI: {data.get("ci", "")}')
+    pdf.linea(f'Prescriptor: {data.get("prescriptor", "")}')
+    pdf.ln(4)
+
+    pdf.set_font(FUENTE, 'B', 11)
+    pdf.linea('INDICACIONES', 8)
+    pdf.set_font(FUENTE, '', 10)
+    for line in bloques["indicaciones"] or ["(Sin indicaciones)"]:
+        pdf.linea(line)
+
+
+def _guardar(pdf, output_path):
     try:
         # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
         pdf.output(output_path)
-        return True
     except Exception as e:
         raise Exception(f"Error saving PDF: {str(e)}")
+    return output_path
 
 
+def build_documentos(output_path, data, tipo="CE", indicaciones_path=None, combinado=False,
+                     codigo_verificacion=None):
+    """
+    Receta y hoja de indicaciones del paciente en una sola pasada.
+
+    Args:
+        output_path: PDF de la receta (o de las dos partes con combinado=True)
+        data: Dictionary with prescription data
+        tipo: Type of prescription (CE, EM, EH)
+        indicaciones_path: PDF aparte con las indicaciones (None: sin hoja aparte)
+        combinado: receta e indicaciones en un solo PDF, cada parte en página nueva
+        codigo_verificacion: texto del QR de la receta (verificacion_recetas.codigo_verificacion)
+
+    Returns:
+        dict {'receta': ruta, 'indicaciones': ruta o None}
+    """
+    pdf = DocumentoReceta(tipo)
+    bloques = maquetar(pdf, data)
+    _bloque_receta(pdf, data, tipo, bloques, codigo_verificacion)
+    if combinado:
+        _bloque_indicaciones(pdf, data, bloques)
+        indicaciones_path = output_path
+    elif indicaciones_path:
+        hoja = DocumentoReceta(tipo)
+        _bloque_indicaciones(hoja, data, bloques)
+        _guardar(hoja, indicaciones_path)
+    _guardar(pdf, output_path)
+    return {"receta": output_path, "indicaciones": indicaciones_path}
+
+
+def build_pdf(output_path, data, tipo="CE", codigo_verificacion=None):
+    """
+    Builds a PDF prescription with the given data
+    
+    Args:
+        output_path: Path where to save the PDF
+        data: Dictionary with prescription data
+        tipo: Type of prescription (CE, EM, EH)
+        codigo_verificacion: texto del QR de verificación (None: sin QR)
+    """
+    build_documentos(output_path, data, tipo, codigo_verificacion=codigo_verificacion)
+    return True
+
 
 def build_indicaciones_pdf(output_path, data):
     """
     Genera un PDF únicamente con las INDICACIONES para entregar aparte.
     Incluye encabezado institucional, datos mínimos del paciente y del prescriptor.
     """
-    class PDFInd(FPDF):
+    pdf = DocumentoReceta(data.get("tipo", "CE"))
+    _bloque_indicaciones(pdf, data, maquetar(pdf, data))
+    return _guardar(pdf, output_path)
+
+
+def build_consumo_pdf(output_path, titulo, secciones):
+    """
+    Genera el reporte de consumo de farmacia.
+
+    Args:
+        output_path: Ruta del PDF
+        titulo: Título del reporte
+        secciones: Lista de (subtitulo, encabezados, anchos, filas)
+    """
+    class PDFRep(FPDF):
         def header(self):
-            self.set_fill_color(240, 240, 240)
+            self.set_fill_color(0, 100, 200)
             self.rect(0, 0, 210, 18, 'F')
+            self.set_text_color(255, 255, 255)
             self.set_font('Arial', 'B', 12)
-            self.cell(0, 10, 'HOSPITAL BÁSICO DE CAYAMBE - INDICACIONES', 0, 1, 'C')
+            self.cell(0, 10, 'HOSPITAL BÁSICO DE CAYAMBE - FARMACIA', 0, 1, 'C')
+            self.set_text_color(0, 0, 0)
             self.ln(2)
+
         def footer(self):
             self.set_y(-15)
             self.set_font('Arial', 'I', 8)
             self.cell(0, 10, f'Página {self.page_no()}', 0, 0, 'C')
 
-    pdf = PDFInd()
+    pdf = PDFRep()
+    pdf.set_auto_page_break(True, margin=18)
     pdf.add_page()
-    pdf.set_font('Arial', '', 10)
-
-    pdf.cell(0, 6, f'Paciente: {data.get("paciente", "")}', 0, 1)
-    if data.get('fecha_nacimiento'):
-        pdf.cell(0, 6, f'Fecha de Nacimiento: {data.get("fecha_nacimiento", "")}', 0, 1)
-    edad_str = f'{data.get("edad", "")} años {data.get("meses", "")} meses'
-    pdf.cell(0, 6, f'Edad: {edad_str}', 0, 1)
-    pdf.cell(0, 6, f'CI: {data.get("ci", "")}', 0, 1)
-    pdf.cell(0, 6, f'Prescriptor: {data.get("prescriptor", "")}', 0, 1)
-    pdf.ln(4)
-
     pdf.set_font('Arial', 'B', 11)
-    pdf.cell(0, 8, 'INDICACIONES', 0, 1)
-    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 8, titulo, 0, 1)
 
-    indicaciones = str(data.get("indicaciones", "")) or "(Sin indicaciones)"
-    # simple wrap using available wrap_text if present
-    try:
-        lines = pdf.wrap_text(indicaciones, 180)  # type: ignore
-    except Exception:
-        # naive wrap
-        import textwrap as tw
-        lines = tw.wrap(indicaciones, width=110)
-    for line in lines:
-        pdf.cell(0, 6, line, 0, 1)
-
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    for subtitulo, encabezados, anchos, filas in secciones:
+        pdf.ln(3)
+        pdf.set_font('Arial', 'B', 10)
+        pdf.cell(0, 7, subtitulo, 0, 1)
+        pdf.set_font('Arial', 'B', 8)
+        pdf.set_fill_color(240, 240, 240)
+        for header, width in zip(encabezados, anchos):
+            pdf.cell(width, 6, str(header), 1, 0, 'C', True)
+        pdf.ln(6)
+        pdf.set_font('Arial', '', 7)
+        for fila in filas:
+            for valor, width in zip(fila, anchos):
+                texto = "" if valor is None else str(valor)
+                # Recortar al ancho de la columna
+                while texto and pdf.get_string_width(texto) > width - 1:
+                    texto = texto[:-1]
+                pdf.cell(width, 5, texto, 1, 0, 'L')
+            pdf.ln(5)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
     pdf.output(output_path)
     return output_path
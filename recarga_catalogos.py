@@ -0,0 +1,176 @@
+"""
+Recarga en caliente de catálogos y de la lista de usuarios
+Farmacia publica un stock nuevo (stock_medicamentos_dispositivos_HBC_<fecha>.csv)
+o RR. HH. actualiza LISTADO NOMBRES.xlsx con las estaciones abiertas. Un hilo
+sondea los archivos vigilados cada INTERVALO segundos:
+    1. si cambia la ruta (p. ej. un stock con fecha más reciente), el tamaño o
+       la fecha de modificación, espera al sondeo siguiente: si no volvió a
+       cambiar, el archivo terminó de copiarse;
+    2. calcula el BLAKE2b del contenido; si es igual al cargado (se tocó o se
+       copió el mismo archivo) no hace nada;
+    3. reconstruye en el mismo hilo (compilación del catálogo, índices) y
+       entrega el resultado completo a al_recargar.
+La interfaz reemplaza lo cargado de una vez desde su propio hilo: nunca ve un
+catálogo a medio construir y escribir no espera a la reconstrucción.
+
+    python recarga_catalogos.py              # vigila y recompila los catálogos al cambiar
+    python recarga_catalogos.py --intervalo 2
+"""
+
+import os
+import sys
+import hashlib
+import logging
+import argparse
+import threading
+
+from metricas import span
+
+logger = logging.getLogger(__name__)
+
+INTERVALO = 10.0
+
+
+def huella_archivo(path, bloque=1 << 20):
+    """BLAKE2b (128 bits, hex) del contenido del archivo"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def _firma(path):
+    """(tamaño, mtime_ns) o None si no existe"""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class Vigilado:
+    """
+    Archivos que se reconstruyen juntos (p. ej. CIE-10 + stock).
+    rutas() -> tupla de rutas, resuelta en cada sondeo
+    reconstruir(*rutas) -> datos nuevos; al_recargar(datos) los publica
+    """
+
+    def __init__(self, nombre, rutas, reconstruir, al_recargar):
+        self.nombre = nombre
+        self.rutas = rutas
+        self.reconstruir = reconstruir
+        self.al_recargar = al_recargar
+        self.recargas = 0
+        self._firmas = None
+        self._huellas = None
+        self._pendiente = None
+
+    def _huellas_de(self, rutas, firmas):
+        return tuple(huella_archivo(p) if f else None for p, f in zip(rutas, firmas))
+
+    def revisar(self):
+        """Un sondeo; True si reconstruyó. El primero sólo toma nota de lo cargado"""
+        rutas = tuple(self.rutas())
+        firmas = (rutas, tuple(_firma(p) for p in rutas))
+        if self._firmas is None:
+            self._huellas = self._huellas_de(rutas, firmas[1])
+            self._firmas = firmas
+            return False
+        if firmas == self._firmas:
+            self._pendiente = None
+            return False
+        if firmas != self._pendiente:
+            self._pendiente = firmas
+            return False
+        self._pendiente = None
+        huellas = self._huellas_de(rutas, firmas[1])
+        self._firmas = firmas
+        if huellas == self._huellas:
+            return False
+        self._huellas = huellas
+        # Si falla (archivo dañado) se sigue con lo cargado hasta el próximo cambio
+        with span(f"recarga.{self.nombre}"):
+            datos = self.reconstruir(*rutas)
+        self.recargas += 1
+        self.al_recargar(datos)
+        logger.info(f"Recargado {self.nombre}: {', '.join(os.path.basename(p) for p in rutas if p)}")
+        return True
+
+
+class VigilanteArchivos:
+    """Hilo de sondeo de los archivos vigilados"""
+
+    def __init__(self, intervalo=INTERVALO):
+        self.intervalo = intervalo
+        self.vigilados = []
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def vigilar(self, nombre, rutas, reconstruir, al_recargar):
+        vigilado = Vigilado(nombre, rutas, reconstruir, al_recargar)
+        self.vigilados.append(vigilado)
+        return vigilado
+
+    def revisar(self):
+        """Un sondeo de todos; devuelve los nombres recargados"""
+        recargados = []
+        for vigilado in self.vigilados:
+            try:
+                if vigilado.revisar():
+                    recargados.append(vigilado.nombre)
+            except Exception as e:
+                logger.warning(f"No se pudo recargar {vigilado.nombre}: {e}")
+        return recargados
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._run, name="recarga-catalogos", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, timeout=2.0):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def _run(self):
+        self.revisar()
+        while not self._detener.wait(self.intervalo):
+            self.revisar()
+
+
+def main(argv=None):
+    from catalogos import ultimo_stock
+    from catalogo_binario import cargar_catalogos
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Vigila los catálogos y los recompila al cambiar")
+    parser.add_argument("--cie10", default=os.path.join(raiz, "cie10_es.csv"))
+    parser.add_argument("--directorio-stock", default=raiz, help="Carpeta donde farmacia publica el stock")
+    parser.add_argument("--destino", default=os.path.join(raiz, "data", "catalogos"))
+    parser.add_argument("--intervalo", type=float, default=INTERVALO)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    cargar_catalogos(args.cie10, ultimo_stock(args.directorio_stock), args.destino).cerrar()
+
+    def publicar(catalogo):
+        print(f"{catalogo.path or 'CSV en memoria'}: {len(catalogo.cie)} códigos CIE-10, "
+              f"{len(catalogo.medicamentos)} ítems de stock")
+        catalogo.cerrar()
+
+    vigilante = VigilanteArchivos(args.intervalo)
+    vigilante.vigilar("catalogos", lambda: (args.cie10, ultimo_stock(args.directorio_stock)),
+                      lambda cie, stock: cargar_catalogos(cie, stock, args.destino), publicar)
+    vigilante.iniciar()
+    print(f"Vigilando {args.cie10} y {args.directorio_stock} cada {args.intervalo:g} s (Ctrl+C para salir)")
+    try:
+        while vigilante._hilo.is_alive():
+            vigilante._hilo.join(1.0)
+    except KeyboardInterrupt:
+        vigilante.detener()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Log de texto de la aplicación sin bloquear la interfaz
+Los logger.* sólo encolan el registro (QueueHandler); un QueueListener en
+segundo plano lo escribe como una línea JSON en un archivo por estación
+(recetas_audit_<equipo>.jsonl), que se rota al superar un tamaño o al cambiar
+de día y cuyos segmentos anteriores se comprimen con gzip.
+
+    listener = iniciar_logging(log_dir, "PC-FARMACIA-01")
+    ...
+    listener.stop()   # vacía la cola al cerrar
+"""
+
+import os
+import copy
+import gzip
+import glob
+import json
+import queue
+import shutil
+import logging
+import logging.handlers
+from datetime import datetime
+
+TAMANO_MAXIMO = 10 * 1024 * 1024
+SEGMENTOS = 60
+FORMATO_CONSOLA = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Atributos propios de LogRecord; el resto (extra=...) se incluye en el JSON
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro: fecha_hora, nivel, origen, mensaje y campos extra"""
+
+    def format(self, record):
+        linea = {
+            "fecha_hora": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "origen": record.name,
+            "hilo": record.threadName,
+            "mensaje": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_ESTANDAR:
+                linea[clave] = valor
+        if record.exc_text:
+            linea["excepcion"] = record.exc_text
+        return json.dumps(linea, ensure_ascii=False, default=str)
+
+
+class ArchivoRotativo(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler que además rota al cambiar de día. El segmento cerrado
+    se renombra con fecha y hora (nombre_AAAAMMDD_HHMMSS.jsonl.gz), se comprime
+    y se conservan los `segmentos` más recientes.
+    """
+
+    def __init__(self, path, tamano_maximo=TAMANO_MAXIMO, segmentos=SEGMENTOS):
+        super().__init__(path, maxBytes=tamano_maximo, backupCount=segmentos, encoding="utf-8", delay=True)
+        self._dia = self._dia_archivo()
+
+    def _dia_archivo(self):
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(self.baseFilename)).date()
+        except OSError:
+            return datetime.now().date()
+
+    def shouldRollover(self, record):
+        if datetime.fromtimestamp(record.created).date() != self._dia and os.path.exists(self.baseFilename):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename):
+            raiz, ext = os.path.splitext(self.baseFilename)
+            destino = f"{raiz}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
+            n = 1
+            while os.path.exists(destino + ".gz"):
+                destino = f"{raiz}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{n}{ext}"
+                n += 1
+            os.replace(self.baseFilename, destino)
+            comprimir(destino)
+            self._depurar(raiz, ext)
+        self._dia = datetime.now().date()
+
+    def _depurar(self, raiz, ext):
+        segmentos = sorted(glob.glob(f"{glob.escape(raiz)}_*{ext}.gz"), key=os.path.getmtime)
+        for viejo in segmentos[:-self.backupCount] if self.backupCount else []:
+            try:
+                os.remove(viejo)
+            except OSError:
+                pass
+
+
+class ColaHandler(logging.handlers.QueueHandler):
+    """
+    Resuelve mensaje y traza de la excepción antes de encolar (los argumentos
+    pueden cambiar después) pero, a diferencia de QueueHandler, no mezcla la
+    traza con el mensaje
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def comprimir(path):
+    """Comprime path a path.gz y borra el original"""
+    with open(path, "rb") as origen, gzip.open(path + ".gz", "wb") as destino:
+        shutil.copyfileobj(origen, destino)
+    os.remove(path)
+
+
+def iniciar_logging(log_dir, estacion="", nivel=logging.INFO, tamano_maximo=TAMANO_MAXIMO,
+                    segmentos=SEGMENTOS, consola=True):
+    """
+    Deja en el logger raíz sólo un QueueHandler y arranca el QueueListener que
+    escribe en log_dir/recetas_audit_<estacion>.jsonl (y en consola, en texto).
+    Un archivo por estación: varias estaciones no rotan el mismo archivo compartido.
+    """
+    nombre = f"recetas_audit_{estacion}.jsonl" if estacion else "recetas_audit.jsonl"
+    archivo = ArchivoRotativo(os.path.join(log_dir, nombre), tamano_maximo, segmentos)
+    archivo.setFormatter(FormatoJSON())
+    destinos = [archivo]
+    if consola:
+        pantalla = logging.StreamHandler()
+        pantalla.setFormatter(logging.Formatter(FORMATO_CONSOLA))
+        destinos.append(pantalla)
+
+    cola = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(ColaHandler(cola))
+    raiz.setLevel(nivel)
+
+    listener = logging.handlers.QueueListener(cola, *destinos, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,203 @@
+"""
+Escritor en segundo plano para bitácora de accesos y auditoría
+Los eventos se encolan en memoria y un hilo los escribe en lotes (una
+transacción por lote). Garantías de durabilidad:
+- vaciado cada `intervalo` segundos como máximo,
+- vaciado al cerrar la aplicación (atexit / cierre de ventana),
+- escritura síncrona para eventos críticos (p. ej. LOGIN fallido): el llamador
+  espera hasta que el evento, y todo lo encolado antes, está confirmado.
+La cola es acotada: si se llena, el llamador espera (contrapresión) y, en
+último caso, escribe él mismo; nunca se descartan eventos.
+"""
+
+import queue
+import sqlite3
+import logging
+import threading
+import time
+
+from metricas import span
+
+logger = logging.getLogger(__name__)
+
+SQL_INSERT = {
+    "bitacora_accesos": """
+        INSERT OR IGNORE INTO bitacora_accesos
+        (id, usuario, accion, fecha_hora, ip_address, detalles, resultado)
+        VALUES (?,?,?,?,?,?,?)
+    """,
+    "auditoria": """
+        INSERT OR IGNORE INTO auditoria
+        (id, receta_numero, accion, usuario, fecha_hora, ip_address, detalles, hash_anterior, hash_nuevo)
+        VALUES (?,?,?,?,?,?,?,?,?)
+    """,
+}
+
+
+class EscritorRegistros:
+    """Cola acotada + hilo escritor con transacciones por lote"""
+
+    def __init__(self, path_fn, intervalo=0.5, lote_max=500, capacidad=10000, espera_llena=2.0, destino=None):
+        self.path_fn = path_fn
+        # destino(items) alternativo a SQLite (p. ej. el cliente del servidor de recetas)
+        self.destino = destino
+        self.intervalo = intervalo
+        self.lote_max = lote_max
+        self.espera_llena = espera_llena
+        self.cola = queue.Queue(maxsize=capacidad)
+        self._pendientes = []
+        self._conn = None
+        self._lock_escritura = threading.Lock()
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._run, name="escritor-registros", daemon=True)
+        self._hilo.start()
+
+    # --- API pública ---
+    def encolar(self, tabla, fila, critico=False):
+        """Encola una fila para `tabla`; si es crítica, espera a que quede escrita"""
+        if tabla not in SQL_INSERT:
+            raise ValueError(f"Tabla de registro desconocida: {tabla}")
+        if self._cerrado or not self._hilo.is_alive():
+            self._escribir_directo([(tabla, fila)])
+            return
+        try:
+            self.cola.put((tabla, fila), timeout=self.espera_llena)
+        except queue.Full:
+            logger.warning("Cola de registros llena; escritura directa")
+            self._escribir_directo([(tabla, fila)])
+            return
+        if critico:
+            self.flush()
+
+    def flush(self, timeout=10.0):
+        """Bloquea hasta que todo lo encolado hasta ahora esté confirmado en la base"""
+        if self._cerrado or not self._hilo.is_alive():
+            return True
+        listo = threading.Event()
+        try:
+            self.cola.put(("__flush__", listo), timeout=timeout)
+        except queue.Full:
+            return False
+        return listo.wait(timeout) and listo.ok
+
+    def cerrar(self, timeout=10.0):
+        """Vacía la cola y detiene el hilo escritor"""
+        if self._cerrado:
+            return
+        self.flush(timeout)
+        self._cerrado = True
+        try:
+            self.cola.put(("__stop__", None), timeout=timeout)
+        except queue.Full:
+            pass
+        self._hilo.join(timeout)
+        # Cualquier resto (p. ej. fallos de red al final) se intenta una última vez
+        with self._lock_escritura:
+            resto = self._pendientes
+            self._pendientes = []
+            while True:
+                try:
+                    item = self.cola.get_nowait()
+                except queue.Empty:
+                    break
+                if item[0] in SQL_INSERT:
+                    resto.append(item)
+        if resto:
+            self._escribir_directo(resto)
+        self._cerrar_conexion()
+
+    # --- Hilo escritor ---
+    def _run(self):
+        while True:
+            # Base inaccesible con un lote completo pendiente: no seguir drenando la
+            # cola, así se llena y los llamadores sienten la contrapresión
+            if len(self._pendientes) >= self.lote_max and not self._vaciar():
+                time.sleep(self.intervalo)
+                continue
+            try:
+                item = self.cola.get(timeout=self.intervalo)
+            except queue.Empty:
+                self._vaciar()
+                continue
+
+            limite = time.monotonic() + self.intervalo
+            esperando = []
+            detener = False
+            while True:
+                tipo, valor = item
+                if tipo == "__flush__":
+                    esperando.append(valor)
+                    break
+                if tipo == "__stop__":
+                    detener = True
+                    break
+                self._pendientes.append(item)
+                if len(self._pendientes) >= self.lote_max:
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self.cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+
+            ok = self._vaciar()
+            for ev in esperando:
+                ev.ok = ok
+                ev.set()
+            if detener:
+                return
+
+    def _vaciar(self):
+        with self._lock_escritura:
+            if not self._pendientes:
+                return True
+            try:
+                with span("registros.lote"):
+                    if self.destino:
+                        self.destino(self._pendientes)
+                    else:
+                        self._escribir(self._conexion(), self._pendientes)
+                self._pendientes = []
+                return True
+            except Exception as e:
+                # Se conservan los eventos y se reintenta en el próximo intervalo
+                logger.error(f"Error escribiendo lote de registros ({len(self._pendientes)}): {e}")
+                self._cerrar_conexion()
+                return False
+
+    def _conexion(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path_fn(), timeout=10, check_same_thread=False)
+        return self._conn
+
+    def _cerrar_conexion(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    @staticmethod
+    def _escribir(conn, items):
+        por_tabla = {}
+        for tabla, fila in items:
+            por_tabla.setdefault(tabla, []).append(fila)
+        with conn:
+            for tabla, filas in por_tabla.items():
+                conn.executemany(SQL_INSERT[tabla], filas)
+
+    def _escribir_directo(self, items):
+        try:
+            if self.destino:
+                self.destino(items)
+                return
+            conn = sqlite3.connect(self.path_fn(), timeout=10)
+            try:
+                self._escribir(conn, items)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error registrando eventos: {e}")
@@ -0,0 +1,251 @@
+"""
+Reportes de consumo de farmacia y proyección de agotamiento de stock
+Las cantidades prescritas se agregan por ítem, día y servicio en la tabla
+consumo_diario dentro de la misma transacción que guarda la receta, de modo
+que los reportes nunca necesitan recorrer recetas.payload.
+"""
+
+import os
+import re
+import csv
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from catalogos import leer_stock, clave_item, ultimo_stock
+from codec_payload import decodificar
+
+logger = logging.getLogger(__name__)
+
+PERIODOS = {
+    "dia": "%Y-%m-%d",
+    "semana": "%Y-S%W",
+    "mes": "%Y-%m",
+}
+
+
+def ensure_tables(cur):
+    """Crea las tablas de agregados de consumo si no existen"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS consumo_diario (
+            fecha TEXT NOT NULL,
+            servicio TEXT NOT NULL,
+            item TEXT NOT NULL,
+            nombre TEXT,
+            cantidad REAL NOT NULL DEFAULT 0,
+            prescripciones INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, servicio, item)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_consumo_item_fecha ON consumo_diario(item, fecha)")
+
+
+def parse_cantidad(texto):
+    """Extrae la cantidad numérica de un texto libre ('30', '# 30 tabletas', '1,5')"""
+    m = re.search(r"\d+(?:[.,]\d+)?", str(texto or ""))
+    if not m:
+        return 0.0
+    return float(m.group(0).replace(",", "."))
+
+
+def fecha_iso(fecha):
+    """Convierte dd/mm/aaaa (formato del formulario) a aaaa-mm-dd"""
+    try:
+        return datetime.strptime(str(fecha).strip(), "%d/%m/%Y").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return datetime.now().strftime("%Y-%m-%d")
+
+
+def filas_consumo(data):
+    """Agrupa los medicamentos de una receta por ítem: [(fecha, servicio, item, nombre, cantidad)]"""
+    fecha = fecha_iso(data.get("fecha"))
+    servicio = (data.get("servicio") or data.get("prescriptor_especialidad") or data.get("tipo") or "").strip().upper()
+    por_item = {}
+    for med in data.get("meds") or []:
+        nombre = str(med.get("nombre", "")).strip()
+        item = clave_item(nombre)
+        if not item:
+            continue
+        _, cantidad = por_item.get(item, (nombre, 0.0))
+        por_item[item] = (nombre, cantidad + parse_cantidad(med.get("cantidad")))
+    return [(fecha, servicio, item, nombre, cant) for item, (nombre, cant) in por_item.items()]
+
+
+def registrar_consumo(cur, data):
+    """
+    Suma los medicamentos de una receta a consumo_diario.
+    Debe llamarse con el cursor de la transacción que inserta la receta.
+    """
+    filas = filas_consumo(data)
+    if not filas:
+        return 0
+    cur.executemany("""
+        INSERT INTO consumo_diario (fecha, servicio, item, nombre, cantidad, prescripciones)
+        VALUES (?,?,?,?,?,1)
+        ON CONFLICT(fecha, servicio, item) DO UPDATE SET
+            cantidad = cantidad + excluded.cantidad,
+            prescripciones = prescripciones + 1
+    """, filas)
+    return len(filas)
+
+
+def reconstruir_consumo(conn):
+    """
+    Recalcula consumo_diario desde cero a partir de las recetas existentes
+    (base actual y archivos anuales)
+    """
+    from datos_recetas import anios_archivados, archivo_adjunto
+
+    cur = conn.cursor()
+    ensure_tables(cur)
+    cur.execute("DELETE FROM consumo_diario")
+    total = 0
+
+    def procesar(filas):
+        nonlocal total
+        for (payload,) in filas:
+            try:
+                registrar_consumo(cur, decodificar(payload))
+                total += 1
+            except Exception as e:
+                logger.warning(f"Receta omitida al reconstruir consumo: {e}")
+        # DETACH no se permite con la transacción abierta
+        conn.commit()
+
+    sql = "SELECT payload FROM {}.recetas WHERE estado = 'ACTIVA'"
+    procesar(conn.execute(sql.format("main")))
+    for anio in anios_archivados(conn):
+        with archivo_adjunto(conn, anio) as esquema:
+            procesar(conn.execute(sql.format(esquema)))
+    logger.info(f"Consumo reconstruido desde {total} recetas")
+    return total
+
+
+def consumo_por_periodo(conn, desde, hasta, periodo="dia", servicio=None):
+    """
+    Consumo agregado entre dos fechas ISO (incluidas).
+    Devuelve [(periodo, servicio, nombre, cantidad, prescripciones)].
+    """
+    fmt = PERIODOS.get(periodo)
+    if not fmt:
+        raise ValueError(f"Periodo no soportado: {periodo}")
+    sql = f"""
+        SELECT strftime('{fmt}', fecha) AS periodo, servicio, MIN(nombre),
+               SUM(cantidad), SUM(prescripciones)
+        FROM consumo_diario
+        WHERE fecha BETWEEN ? AND ?
+    """
+    params = [desde, hasta]
+    if servicio:
+        sql += " AND servicio = ?"
+        params.append(servicio.upper())
+    sql += " GROUP BY periodo, servicio, item ORDER BY periodo, servicio, MIN(nombre)"
+    return conn.execute(sql, params).fetchall()
+
+
+def proyectar_agotamiento(conn, stock, dias_ventana=30, referencia=None):
+    """
+    Proyecta el agotamiento de cada ítem del stock con el consumo medio de los
+    últimos `dias_ventana` días.
+    Devuelve [(nombre, tipo, existencia, consumo_ventana, promedio_diario, dias_cobertura, fecha_agotamiento)].
+    """
+    referencia = referencia or datetime.now().date()
+    desde = (referencia - timedelta(days=dias_ventana - 1)).isoformat()
+    consumos = dict(conn.execute("""
+        SELECT item, SUM(cantidad) FROM consumo_diario
+        WHERE fecha BETWEEN ? AND ? GROUP BY item
+    """, (desde, referencia.isoformat())).fetchall())
+
+    filas = []
+    for it in stock:
+        consumo = consumos.get(clave_item(it["nombre"]), 0.0)
+        promedio = consumo / dias_ventana
+        existencia = it.get("existencia")
+        dias = fecha_fin = None
+        if existencia is not None and promedio > 0:
+            dias = existencia / promedio
+            fecha_fin = (referencia + timedelta(days=int(dias))).isoformat()
+        filas.append((it["nombre"], it.get("tipo", ""), existencia, consumo, round(promedio, 2),
+                      None if dias is None else round(dias, 1), fecha_fin))
+    # Primero lo que se agota antes; luego lo más consumido sin existencia registrada
+    filas.sort(key=lambda r: (r[5] is None, r[5] if r[5] is not None else -r[3]))
+    return filas
+
+
+ENCABEZADOS_CONSUMO = ["periodo", "servicio", "item", "cantidad", "prescripciones"]
+ENCABEZADOS_AGOTAMIENTO = ["item", "tipo", "existencia", "consumo_ventana", "promedio_diario",
+                           "dias_cobertura", "fecha_agotamiento"]
+
+
+def exportar_csv(path, encabezados, filas):
+    """Escribe un reporte CSV"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(encabezados)
+        w.writerows(filas)
+    return path
+
+
+def generar_reporte(conn, out_dir, formato="csv", desde=None, hasta=None, periodo="dia",
+                    stock_path=None, dias_ventana=30):
+    """Genera los reportes de consumo y de agotamiento; devuelve las rutas creadas"""
+    hoy = datetime.now().date()
+    hasta = hasta or hoy.isoformat()
+    desde = desde or (hoy - timedelta(days=dias_ventana - 1)).isoformat()
+    stock_path = stock_path or ultimo_stock(os.path.dirname(os.path.abspath(__file__)))
+    stock = leer_stock(stock_path) if stock_path and os.path.exists(stock_path) else []
+
+    consumo = consumo_por_periodo(conn, desde, hasta, periodo)
+    agotamiento = proyectar_agotamiento(conn, stock, dias_ventana, datetime.fromisoformat(hasta).date())
+
+    os.makedirs(out_dir, exist_ok=True)
+    sello = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if formato == "pdf":
+        from pdf_layout_fixed import build_consumo_pdf
+        out = os.path.join(out_dir, f"consumo_farmacia_{sello}.pdf")
+        build_consumo_pdf(out, f"CONSUMO DE FARMACIA {desde} a {hasta}", [
+            ("CONSUMO POR " + periodo.upper(), ENCABEZADOS_CONSUMO, [25, 45, 80, 20, 20], consumo),
+            (f"PROYECCIÓN DE AGOTAMIENTO (ventana {dias_ventana} días)",
+             ["item", "existencia", "consumo", "prom./día", "días", "agota"],
+             [80, 20, 20, 20, 20, 30],
+             [(r[0], r[2], r[3], r[4], r[5], r[6]) for r in agotamiento]),
+        ])
+        return [out]
+
+    return [
+        exportar_csv(os.path.join(out_dir, f"consumo_farmacia_{sello}.csv"), ENCABEZADOS_CONSUMO, consumo),
+        exportar_csv(os.path.join(out_dir, f"agotamiento_stock_{sello}.csv"), ENCABEZADOS_AGOTAMIENTO, agotamiento),
+    ]
+
+
+def main(argv=None):
+    import sqlite3
+    parser = argparse.ArgumentParser(description="Reportes de consumo de farmacia")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--desde", help="Fecha inicial aaaa-mm-dd")
+    parser.add_argument("--hasta", help="Fecha final aaaa-mm-dd")
+    parser.add_argument("--periodo", choices=sorted(PERIODOS), default="dia")
+    parser.add_argument("--formato", choices=["csv", "pdf"], default="csv")
+    parser.add_argument("--stock", help="CSV de stock (por defecto el más reciente)")
+    parser.add_argument("--ventana", type=int, default=30, help="Días para el consumo promedio")
+    parser.add_argument("--salida", default="output")
+    parser.add_argument("--reconstruir", action="store_true", help="Recalcula los agregados desde las recetas")
+    args = parser.parse_args(argv)
+
+    if not args.db:
+        from app_enhanced_fixed import db_path
+        args.db = db_path()
+    conn = sqlite3.connect(args.db)
+    try:
+        ensure_tables(conn.cursor())
+        if args.reconstruir:
+            reconstruir_consumo(conn)
+        for path in generar_reporte(conn, args.salida, args.formato, args.desde, args.hasta,
+                                    args.periodo, args.stock, args.ventana):
+            print(path)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
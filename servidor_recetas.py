@@ -0,0 +1,330 @@
+"""
+Servidor de recetas (modo cliente/servidor)
+Un único proceso es dueño de recetas.db (en disco local, modo WAL) y expone
+por HTTP/JSON la asignación de números, el guardado y la búsqueda de recetas,
+la bitácora/auditoría y la descarga de PDFs. Las estaciones usan
+cliente_recetas.ClienteRecetas en lugar de abrir la base por el recurso de red.
+
+    python servidor_recetas.py --db /srv/recetas/recetas.db --port 8765 [--token SECRETO]
+
+Las estaciones se configuran con RECETAS_SERVER_URL=http://servidor:8765
+(y RECETAS_SERVER_TOKEN si el servidor usa --token).
+"""
+
+import os
+import re
+import hmac
+import json
+import base64
+import queue
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import datos_recetas
+import archivo_anual
+import visor_registros
+import pacientes
+import frecuencias_uso
+import alertas_clinicas
+
+logger = logging.getLogger(__name__)
+
+NUMERO_VALIDO = re.compile(r"^[A-Z]{2}-\d{4}-\d+$")
+
+RUTAS = [
+    ("GET", re.compile(r"^/api/salud$"), "salud"),
+    ("POST", re.compile(r"^/api/numeros$"), "numero"),
+    ("POST", re.compile(r"^/api/numeros/bloque$"), "bloque"),
+    ("POST", re.compile(r"^/api/recetas$"), "guardar"),
+    ("POST", re.compile(r"^/api/recetas/lote$"), "guardar_lote"),
+    ("GET", re.compile(r"^/api/recetas$"), "buscar_varias"),
+    ("GET", re.compile(r"^/api/recetas/(?P<numero>[^/]+)$"), "buscar"),
+    ("GET", re.compile(r"^/api/recetas/(?P<numero>[^/]+)/pdf$"), "pdf"),
+    ("GET", re.compile(r"^/api/verificar$"), "verificar"),
+    ("POST", re.compile(r"^/api/dispensar$"), "dispensar"),
+    ("GET", re.compile(r"^/api/pacientes/(?P<ci>[^/]+)$"), "paciente"),
+    ("GET", re.compile(r"^/api/pacientes/(?P<ci>[^/]+)/medicamentos$"), "medicamentos_recientes"),
+    ("GET", re.compile(r"^/api/uso$"), "uso"),
+    ("GET", re.compile(r"^/api/plantillas$"), "plantillas"),
+    ("POST", re.compile(r"^/api/plantillas$"), "guardar_plantilla"),
+    ("POST", re.compile(r"^/api/plantillas/eliminar$"), "eliminar_plantilla"),
+    ("GET", re.compile(r"^/api/exportar$"), "exportar"),
+    ("POST", re.compile(r"^/api/registros$"), "registrar"),
+    ("GET", re.compile(r"^/api/registros/(?P<registro>\w+)$"), "registros"),
+]
+
+
+class ErrorPeticion(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+class ServidorRecetas(ThreadingHTTPServer):
+    """Servidor HTTP con un pool de conexiones SQLite y un único escritor a la vez"""
+
+    daemon_threads = True
+
+    def __init__(self, direccion, db, pdf_dir, token="", conexiones=8):
+        self.db = db
+        self.pdf_dir = pdf_dir
+        self.token = token
+        self.lock_escritura = threading.Lock()
+        self._pool = queue.LifoQueue()
+        os.makedirs(pdf_dir, exist_ok=True)
+
+        conn = sqlite3.connect(db)
+        conn.execute("PRAGMA journal_mode=WAL")
+        datos_recetas.crear_esquema(conn)
+        conn.close()
+        for _ in range(conexiones):
+            c = sqlite3.connect(db, timeout=30, check_same_thread=False)
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._pool.put(c)
+
+        super().__init__(direccion, ManejadorRecetas)
+
+    def con(self, fn, *args, escritura=False):
+        """Ejecuta fn(conn, *args) con una conexión del pool"""
+        conn = self._pool.get()
+        try:
+            if escritura:
+                with self.lock_escritura:
+                    return fn(conn, *args)
+            return fn(conn, *args)
+        finally:
+            self._pool.put(conn)
+
+    def server_close(self):
+        super().server_close()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ManejadorRecetas(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RecetasServidor/1.0"
+
+    def setup(self):
+        super().setup()
+        # Cabeceras y cuerpo van en escrituras separadas: sin esto, Nagle + ACK
+        # retardado añaden ~40 ms a cada respuesta en conexiones persistentes
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    def do_GET(self):
+        self._despachar("GET")
+
+    def do_POST(self):
+        self._despachar("POST")
+
+    # --- Infraestructura ---
+    def _despachar(self, metodo):
+        url = urlparse(self.path)
+        try:
+            if self.server.token and not hmac.compare_digest(
+                self.headers.get("X-Token", ""), self.server.token
+            ):
+                raise ErrorPeticion(401, "Token inválido")
+            for m, patron, nombre in RUTAS:
+                match = patron.match(url.path)
+                if m == metodo and match:
+                    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                    return getattr(self, "api_" + nombre)(params, **match.groupdict())
+            raise ErrorPeticion(404, "Ruta no encontrada")
+        except ErrorPeticion as e:
+            self._json({"error": str(e)}, e.estado)
+        except (ValueError, KeyError) as e:
+            self._json({"error": f"Petición inválida: {e}"}, 400)
+        except sqlite3.IntegrityError as e:
+            self._json({"error": f"Conflicto: {e}"}, 409)
+        except Exception as e:
+            logger.error(f"Error atendiendo {metodo} {url.path}: {e}")
+            self._json({"error": str(e)}, 500)
+
+    def _cuerpo(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(largo) or b"{}") if largo else {}
+
+    def _enviar(self, cuerpo, tipo, estado=200):
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _json(self, obj, estado=200):
+        self._enviar(json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8", estado)
+
+    @staticmethod
+    def _numero(numero):
+        if not NUMERO_VALIDO.match(numero or ""):
+            raise ErrorPeticion(400, f"Número de receta inválido: {numero}")
+        return numero
+
+    # --- Operaciones ---
+    def api_salud(self, params):
+        self._json({"estado": "ok"})
+
+    def api_numero(self, params):
+        tipo = self._cuerpo()["tipo"]
+        numero = self.server.con(datos_recetas.asignar_numero, tipo, escritura=True)
+        self._json({"numero": numero})
+
+    def api_bloque(self, params):
+        cuerpo = self._cuerpo()
+        inicio, fin = self.server.con(
+            datos_recetas.reservar_bloque, cuerpo["tipo"], int(cuerpo["cantidad"]),
+            cuerpo.get("estacion", ""), escritura=True
+        )
+        self._json({"inicio": inicio, "fin": fin})
+
+    def _guardar_pdf(self, numero, pdf_b64):
+        if not pdf_b64:
+            return ""
+        pdf_path = os.path.join(self.server.pdf_dir, f"{self._numero(numero)}.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(base64.b64decode(pdf_b64))
+        return pdf_path
+
+    def api_guardar(self, params):
+        cuerpo = self._cuerpo()
+        data = cuerpo["data"]
+        numero = self._numero(data["numero"])
+        pdf_path = self._guardar_pdf(numero, cuerpo.get("pdf"))
+        receta_id = self.server.con(
+            datos_recetas.guardar_receta, data, pdf_path, cuerpo.get("usuario", ""),
+            cuerpo.get("ip", ""), cuerpo.get("hash", ""), escritura=True
+        )
+        self._json({"id": receta_id, "numero": numero, "pdf_path": pdf_path})
+
+    def api_guardar_lote(self, params):
+        items = self._cuerpo()["items"]
+        for it in items:
+            it["pdf_path"] = self._guardar_pdf(it["data"]["numero"], it.pop("pdf", None))
+            it.pop("canonico", None)  # el payload se serializa aquí, no se acepta del cliente
+        ids = self.server.con(datos_recetas.guardar_recetas_lote, items, escritura=True)
+        self._json({"insertados": ids})
+
+    def api_buscar(self, params, numero):
+        info = self.server.con(datos_recetas.buscar_receta, numero)
+        if not info:
+            raise ErrorPeticion(404, f"Receta {numero} no encontrada")
+        self._json(info)
+
+    def api_buscar_varias(self, params):
+        limite = min(int(params.get("limite", 50)), 500)
+        self._json(self.server.con(datos_recetas.buscar_recetas, params.get("ci"), limite))
+
+    def api_verificar(self, params):
+        self._json(self.server.con(datos_recetas.verificar_receta, params["codigo"]))
+
+    def api_dispensar(self, params):
+        cuerpo = self._cuerpo()
+        self._json(self.server.con(datos_recetas.dispensar_receta, cuerpo["codigo"], cuerpo.get("usuario", ""),
+                                   cuerpo.get("estacion", ""), escritura=True))
+
+    def api_paciente(self, params, ci):
+        paciente = self.server.con(pacientes.buscar_paciente, ci)
+        if not paciente:
+            raise ErrorPeticion(404, f"Paciente {ci} no encontrado")
+        self._json(paciente)
+
+    def api_medicamentos_recientes(self, params, ci):
+        dias = min(int(params.get("dias", alertas_clinicas.DIAS_REPETICION)), 366)
+        self._json(self.server.con(alertas_clinicas.medicamentos_recientes, ci, dias))
+
+    def api_uso(self, params):
+        self._json(self.server.con(frecuencias_uso.modelo_uso, params.get("prescriptor", ""),
+                                   params.get("especialidad", "")))
+
+    def api_plantillas(self, params):
+        self._json(self.server.con(frecuencias_uso.listar_plantillas, params.get("prescriptor", "")))
+
+    def api_guardar_plantilla(self, params):
+        cuerpo = self._cuerpo()
+        if not str(cuerpo.get("nombre") or "").strip():
+            raise ErrorPeticion(400, "La plantilla necesita un nombre")
+        self.server.con(frecuencias_uso.guardar_plantilla, cuerpo.get("prescriptor", ""), cuerpo["nombre"],
+                        cuerpo.get("contenido") or {}, escritura=True)
+        self._json({"ok": True})
+
+    def api_eliminar_plantilla(self, params):
+        cuerpo = self._cuerpo()
+        n = self.server.con(frecuencias_uso.eliminar_plantilla, cuerpo.get("prescriptor", ""),
+                            cuerpo.get("nombre", ""), escritura=True)
+        self._json({"eliminadas": n})
+
+    def api_pdf(self, params, numero):
+        info = self.server.con(datos_recetas.buscar_receta, self._numero(numero))
+        path = (info or {}).get("pdf_path")
+        if not path or not os.path.exists(path):
+            raise ErrorPeticion(404, f"PDF de {numero} no disponible")
+        with open(path, "rb") as f:
+            self._enviar(f.read(), "application/pdf")
+
+    def api_exportar(self, params):
+        self._json([list(r) for r in self.server.con(datos_recetas.filas_exportacion)])
+
+    def api_registrar(self, params):
+        items = [(tabla, fila) for tabla, fila in self._cuerpo()["items"]]
+        n = self.server.con(datos_recetas.insertar_registros, items, escritura=True)
+        self._json({"insertados": n})
+
+    def api_registros(self, params, registro):
+        if registro not in visor_registros.REGISTROS:
+            raise ErrorPeticion(404, f"Registro desconocido: {registro}")
+        despues = None
+        if params.get("despues_fecha") and params.get("despues_id"):
+            despues = (params.pop("despues_fecha"), params.pop("despues_id"))
+        filas, siguiente = self.server.con(visor_registros.consultar_pagina, registro, params, despues)
+        self._json({"filas": [list(f) for f in filas], "siguiente": list(siguiente) if siguiente else None})
+
+
+def iniciar_en_hilo(db, pdf_dir, host="127.0.0.1", port=0, token=""):
+    """Arranca un servidor en segundo plano (pruebas y carga); devuelve (servidor, url)"""
+    servidor = ServidorRecetas((host, port), db, pdf_dir, token)
+    threading.Thread(target=servidor.serve_forever, name="servidor-recetas", daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de recetas (HTTP/JSON)")
+    parser.add_argument("--db", required=True, help="Ruta local de recetas.db")
+    parser.add_argument("--pdf-dir", help="Directorio de PDFs (por defecto junto a la base)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token", default=os.environ.get("RECETAS_SERVER_TOKEN", ""))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    pdf_dir = args.pdf_dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), "pdf")
+    servidor = ServidorRecetas((args.host, args.port), args.db, pdf_dir, args.token)
+    # Años cerrados a recetas_AAAA.db antes de atender (ver archivo_anual.py)
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        for anio, n in archivo_anual.archivar_anios_cerrados(conn):
+            logger.info(f"Archivo anual {anio}: {n} recetas trasladadas")
+    finally:
+        conn.close()
+    logger.info(f"Servidor de recetas en http://{args.host}:{servidor.server_address[1]} (db: {args.db})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Reglas de validación de recetas (sin interfaz gráfica)
+Las usan el formulario (EnhancedApp.validate, que muestra el primer error en
+un messagebox) y la ingesta masiva (ingesta_recetas.py, que reporta todos).
+"""
+
+# Professional services mapping for validation
+SERVICIOS_AUTORIZADOS = {
+    "MEDICINA INTERNA": ["MEDICO GENERAL", "MEDICO INTERNISTA", "MEDICO ESPECIALISTA"],
+    "GINECOLOGÍA": ["MEDICO GINECOLOGO", "MEDICO OBSTETRA", "MEDICO ESPECIALISTA"],
+    "CIRUGÍA GENERAL": ["MEDICO CIRUJANO", "MEDICO ESPECIALISTA"],
+    "PEDIATRÍA": ["MEDICO PEDIATRA", "MEDICO ESPECIALISTA"],
+    "MEDICINA OCUPACIONAL": ["MEDICO OCUPACIONAL", "MEDICO GENERAL"],
+    "EMERGENCIA": ["MEDICO GENERAL", "MEDICO ESPECIALISTA", "MEDICO EMERGENCIOLOGO"],
+    "HOSPITALIZACIÓN": ["MEDICO GENERAL", "MEDICO ESPECIALISTA", "MEDICO INTERNISTA"],
+}
+
+CAMPOS_REQUERIDOS = (
+    ("Paciente", "paciente"),
+    ("CI", "ci"),
+    ("CIE-10", "cie"),
+    ("Prescriptor", "prescriptor"),
+    ("Especialidad del Prescriptor", "prescriptor_especialidad"),
+)
+
+RANGOS_NUMERICOS = (
+    ("Edad", "edad", 0, 150),
+    ("Meses", "meses", 0, 11),
+    ("Talla", "talla", 0, 300),
+    ("Peso", "peso", 0, 1000),
+)
+
+
+def validate_ci(ci):
+    """Valida el identificador del paciente (CI)"""
+    if not ci:
+        return False
+    ci = ci.strip().replace(" ", "")
+    if len(ci) < 10:
+        return False
+    return ci.isalnum()
+
+
+def validate_professional_service(servicio, prescriptor_especialidad):
+    # Validación desactivada: usamos especialidad del usuario y no hay servicio
+    return True
+
+
+def error_numerico(value, field_name, min_val=0, max_val=None):
+    """Mensaje de error si el valor no es numérico o está fuera de rango; None si es válido"""
+    if not value or not str(value).strip():
+        return None  # Campos opcionales
+    try:
+        num_val = float(value)
+    except ValueError:
+        return f"{field_name} debe ser un número válido"
+    if num_val < min_val:
+        return f"{field_name} debe ser mayor o igual a {min_val}"
+    if max_val is not None and num_val > max_val:
+        return f"{field_name} debe ser menor o igual a {max_val}"
+    return None
+
+
+def validar_receta(data, cie_index=None, todos=True):
+    """
+    Aplica las reglas del formulario y devuelve una lista de errores
+    [(titulo, mensaje)]; vacía si la receta es válida. Con todos=False se
+    detiene en el primero (como el formulario).
+    Si el código CIE-10 está en cie_index, normaliza data['cie_desc'].
+    """
+    errores = []
+
+    def error(titulo, mensaje):
+        errores.append((titulo, mensaje))
+        return not todos
+
+    # Campos requeridos
+    for label, campo in CAMPOS_REQUERIDOS:
+        if not (data.get(campo) or "").strip():
+            if error("Campo requerido", f"Falta: {label}"):
+                return errores
+
+    # Validar CI
+    if data.get("ci") and not validate_ci(data["ci"]):
+        if error("Validación", "CI no válida (mínimo 10 caracteres alfanuméricos)"):
+            return errores
+
+    # Correspondencia profesional-servicio
+    if not validate_professional_service(data.get("servicio", ""), data.get("prescriptor_especialidad", "")):
+        if error(
+            "Validación Profesional",
+            f"La especialidad '{data.get('prescriptor_especialidad', '')}' no está autorizada "
+            f"para el servicio '{data.get('servicio', '')}'"
+        ):
+            return errores
+
+    # Validar campos numéricos
+    for label, campo, minimo, maximo in RANGOS_NUMERICOS:
+        mensaje = error_numerico(data.get(campo), label, minimo, maximo)
+        if mensaje and error("Validación", mensaje):
+            return errores
+
+    # Validar medicamentos
+    if not data.get("meds"):
+        if error("Medicamentos", "Agregue al menos un medicamento."):
+            return errores
+
+    # Si tenemos catálogo CIE-10 y el código existe, aseguramos descripción estándar
+    if cie_index and data.get("cie"):
+        desc = cie_index.get(data["cie"].strip().upper())
+        if desc:
+            data["cie_desc"] = desc
+
+    return errores
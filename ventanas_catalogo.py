@@ -0,0 +1,186 @@
+"""
+Ventanas de catálogo reutilizables (lista CIE-10, lista de medicamentos y
+listas flotantes de sugerencias)
+Se construyen una vez y después sólo se ocultan (withdraw) y se vuelven a
+mostrar (deiconify): conservan el texto buscado, la selección, la posición y
+el tamaño. Las filas salen de los filtros del catálogo compartido
+(catalogo_binario.filtrar_cie / filtrar_medicamentos) y se insertan por páginas
+al desplazarse, como en visor_registros: escribir no vuelve a insertar el
+catálogo entero en el Treeview.
+"""
+
+from itertools import islice
+
+TAMANO_PAGINA = 200
+ESPERA_FILTRO_MS = 120
+
+
+class VentanaCatalogo:
+    """
+    Lista completa con buscador.
+    filtrar(texto) -> iterable de filas (tuplas, una columna por encabezado)
+    al_elegir(fila) llena el formulario; la ventana se oculta después.
+    """
+
+    def __init__(self, parent, titulo, encabezados, filtrar, al_elegir, geometria="900x600", anchos=None):
+        import tkinter as tk
+        from tkinter import ttk
+
+        self.filtrar = filtrar
+        self.al_elegir = al_elegir
+        self._filas = iter(())
+        self._datos = {}
+        self._hay_mas = False
+        self._espera = None
+
+        self.win = tk.Toplevel(parent)
+        self.win.withdraw()
+        self.win.title(titulo)
+        self.win.geometry(geometria)
+        self.win.protocol("WM_DELETE_WINDOW", self.ocultar)
+        self.win.bind("<Escape>", lambda e: self.ocultar())
+
+        main_frame = ttk.Frame(self.win)
+        main_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
+        search_frame = ttk.Frame(main_frame)
+        search_frame.pack(fill="x", pady=(0, 10))
+        ttk.Label(search_frame, text="Buscar:").pack(side="left")
+        self.busqueda = tk.StringVar()
+        self.entry = tk.Entry(search_frame, textvariable=self.busqueda, width=60)
+        self.entry.pack(side="left", padx=(5, 10))
+        self.entry.bind("<KeyRelease>", self.programar_filtro)
+        self.entry.bind("<Return>", lambda e: self.elegir(primero=True))
+        self.entry.bind("<Down>", lambda e: self.enfocar_lista())
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(side="bottom", fill="x", pady=(10, 0))
+        ttk.Button(button_frame, text="Seleccionar", command=self.elegir).pack(side="left")
+        ttk.Button(button_frame, text="Cerrar", command=self.ocultar).pack(side="right")
+        self.status = ttk.Label(button_frame, text="")
+        self.status.pack(side="left", padx=12)
+
+        columnas = tuple(f"c{k}" for k in range(len(encabezados)))
+        self.tree = ttk.Treeview(main_frame, columns=columnas, show="headings", height=20)
+        for k, (col, texto) in enumerate(zip(columnas, encabezados)):
+            self.tree.heading(col, text=texto)
+            self.tree.column(col, width=(anchos or {}).get(k, 600), anchor="w")
+        self.scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.bind("<Double-1>", lambda e: self.elegir())
+        self.tree.bind("<Return>", lambda e: self.elegir())
+
+        self.refrescar()
+
+    def mostrar(self, texto=None):
+        """Muestra la ventana como quedó; con texto, filtra por él"""
+        if texto is not None and texto != self.busqueda.get():
+            self.busqueda.set(texto)
+            self.refrescar()
+        self.win.deiconify()
+        self.win.lift()
+        self.entry.focus_set()
+        self.entry.select_range(0, "end")
+
+    def ocultar(self):
+        self.win.withdraw()
+
+    def programar_filtro(self, event=None):
+        """Filtra cuando se deja de escribir (una consulta por ráfaga de teclas)"""
+        if event is not None and event.keysym in ("Return", "Down", "Escape"):
+            return
+        if self._espera is not None:
+            self.win.after_cancel(self._espera)
+        self._espera = self.win.after(ESPERA_FILTRO_MS, self.refrescar)
+
+    def refrescar(self):
+        """Vuelve a filtrar con el texto actual (también tras recargar el catálogo)"""
+        self._espera = None
+        self.tree.delete(*self.tree.get_children())
+        self._datos.clear()
+        self._filas = iter(self.filtrar(self.busqueda.get()))
+        self.cargar_pagina()
+        self.tree.yview_moveto(0)
+
+    def cargar_pagina(self):
+        filas = list(islice(self._filas, TAMANO_PAGINA))
+        for fila in filas:
+            self._datos[self.tree.insert("", "end", values=fila)] = fila
+        self._hay_mas = len(filas) == TAMANO_PAGINA
+        self.status.config(text=f"{len(self._datos)} mostrados" + (" (desplace para ver más)" if self._hay_mas else ""))
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._hay_mas and float(last) > 0.9:
+            self.cargar_pagina()
+
+    def enfocar_lista(self):
+        hijos = self.tree.get_children()
+        if hijos:
+            if not self.tree.selection():
+                self.tree.selection_set(hijos[0])
+            self.tree.focus(self.tree.selection()[0])
+            self.tree.focus_set()
+
+    def elegir(self, primero=False):
+        if self._espera is not None:
+            self.win.after_cancel(self._espera)
+            self.refrescar()
+        sel = self.tree.selection() or (self.tree.get_children()[:1] if primero else ())
+        if sel:
+            self.al_elegir(self._datos[sel[0]])
+            self.ocultar()
+
+
+class ListaSugerencias:
+    """
+    Lista flotante bajo un campo. Se crea una vez; al escribir sólo cambia el
+    contenido (y el lugar, si el campo se movió: geometry() no se llama en cada tecla).
+    """
+
+    def __init__(self, parent, ancho, al_elegir, formato=str, alto=160, caracteres=80):
+        import tkinter as tk
+
+        self.ancho = ancho
+        self.alto = alto
+        self.al_elegir = al_elegir
+        self.formato = formato
+        self._items = []
+        self._lugar = None
+
+        self.win = tk.Toplevel(parent)
+        self.win.withdraw()
+        self.win.overrideredirect(True)
+        self.lista = tk.Listbox(self.win, height=8, width=caracteres)
+        self.lista.pack(fill="both", expand=True)
+        self.lista.bind("<Double-Button-1>", lambda e: self.elegir())
+        self.lista.bind("<Return>", lambda e: self.elegir())
+
+    @property
+    def visible(self):
+        return self.win.state() != "withdrawn"
+
+    def mostrar(self, items, widget):
+        items = list(items)
+        if items != self._items:
+            self._items = items
+            self.lista.delete(0, "end")
+            self.lista.insert("end", *(self.formato(it) for it in items))
+        lugar = (widget.winfo_rootx(), widget.winfo_rooty() + widget.winfo_height())
+        if lugar != self._lugar:
+            self._lugar = lugar
+            self.win.geometry(f"{self.ancho}x{self.alto}+{lugar[0]}+{lugar[1]}")
+        if not self.visible:
+            self.win.deiconify()
+
+    def ocultar(self):
+        if self.visible:
+            self.win.withdraw()
+
+    def elegir(self):
+        sel = self.lista.curselection()
+        if sel:
+            self.al_elegir(self._items[sel[0]])
+            self.ocultar()
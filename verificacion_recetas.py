@@ -0,0 +1,253 @@
+"""
+Verificación de recetas impresas (código QR) y registro de dispensación
+Cada receta lleva un QR con su número y los primeros DIGITOS_DIGEST caracteres
+de su hash_verificacion:
+    RX1:CE-2025-000123:3F9A0C1B7D22
+Sólo mayúsculas, dígitos, ':' y '-': el QR usa el modo alfanumérico y queda
+pequeño. Farmacia lo lee con un lector (que escribe como un teclado) o escribe
+el número a mano; la receta se busca por número (índice único de recetas, o el
+archivo anual del año del número) y se informa:
+    - si existe y su estado (ACTIVA, ANULADA, ...)
+    - si el código impreso coincide con el hash guardado (papel no alterado)
+    - si el payload guardado sigue correspondiendo al hash (base no alterada)
+    - si ya fue dispensada, cuándo y por quién
+La dispensación se anota en la tabla dispensaciones (clave primaria = número):
+dos estaciones que dispensan la misma receta a la vez no pueden ganar ambas.
+
+El QR se dibuja con segno o qrcode si están instalados; sin ellos la receta
+lleva sólo el código en texto, que se puede escribir en la ventana.
+
+    python verificacion_recetas.py RX1:CE-2025-000123:3F9A0C1B7D22
+    python verificacion_recetas.py CE-2025-000123 --dispensar --usuario farmacia1
+    python verificacion_recetas.py --servidor http://servidor:8765 RX1:...
+"""
+
+import os
+import sys
+import hmac
+import time
+import argparse
+import platform
+
+PREFIJO_CODIGO = "RX1"
+DIGITOS_DIGEST = 12
+MASCARA_QR = 4
+
+MOTIVOS = {
+    "no_encontrada": "Receta no encontrada",
+    "codigo_invalido": "El código no corresponde a la receta (posible alteración)",
+    "alterada": "Los datos guardados no corresponden a su hash (avise a sistemas)",
+    "estado": "La receta no está ACTIVA",
+    "dispensada": "La receta ya fue dispensada",
+}
+
+
+def ensure_tables(cur):
+    """Tabla de dispensaciones (una fila por receta dispensada)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dispensaciones (
+            numero TEXT PRIMARY KEY,
+            fecha_hora TEXT NOT NULL,
+            usuario TEXT,
+            estacion TEXT
+        )
+    """)
+
+
+# --- Código ---
+def digest_corto(hash_verificacion):
+    """Primeros DIGITOS_DIGEST caracteres hexadecimales del hash, en mayúsculas"""
+    h = (hash_verificacion or "").split(":", 1)[-1]
+    return h[:DIGITOS_DIGEST].upper()
+
+
+def codigo_verificacion(numero, hash_verificacion):
+    return f"{PREFIJO_CODIGO}:{numero}:{digest_corto(hash_verificacion)}"
+
+
+def leer_codigo(texto):
+    """
+    (numero, digest) de un código leído; un número escrito a mano da digest None.
+    ValueError si el texto no es ninguno de los dos.
+    """
+    partes = (texto or "").strip().upper().split(":")
+    if len(partes) == 3 and partes[0] == PREFIJO_CODIGO and partes[1] and partes[2]:
+        return partes[1], partes[2]
+    if len(partes) == 1 and partes[0].count("-") == 2:
+        return partes[0], None
+    raise ValueError(f"Código de receta no reconocido: {texto!r}")
+
+
+def matriz_qr(texto):
+    """
+    Filas de módulos (verdadero = negro) sin margen, o None si no hay segno ni
+    qrcode. Máscara fija: elegir la mejor evalúa las ocho y triplica el costo;
+    cualquier máscara es legible.
+    """
+    try:
+        import segno
+        return segno.make(texto, error="m", micro=False, mask=MASCARA_QR).matrix
+    except ImportError:
+        pass
+    try:
+        import qrcode
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=0, mask_pattern=MASCARA_QR)
+        qr.add_data(texto)
+        qr.make(fit=True)
+        return qr.get_matrix()
+    except ImportError:
+        return None
+
+
+# --- Resultado ---
+def resultado(numero, digest, fila, dispensacion, integra):
+    """
+    fila: (estado, hash_verificacion, fecha, paciente, prescriptor) o None
+    dispensacion: (fecha_hora, usuario, estacion) o None
+    """
+    r = {"numero": numero, "encontrada": fila is not None, "estado": None, "fecha": None,
+         "paciente": None, "prescriptor": None, "hash_coincide": None, "integra": integra,
+         "dispensada": None, "valida": False, "motivo": ""}
+    if fila is None:
+        r["motivo"] = MOTIVOS["no_encontrada"]
+        return r
+    r.update(estado=fila[0], fecha=fila[2], paciente=fila[3], prescriptor=fila[4])
+    if digest is not None:
+        r["hash_coincide"] = hmac.compare_digest(digest, digest_corto(fila[1]))
+    if dispensacion:
+        r["dispensada"] = dict(zip(("fecha_hora", "usuario", "estacion"), dispensacion))
+    if r["hash_coincide"] is False:
+        r["motivo"] = MOTIVOS["codigo_invalido"]
+    elif not integra:
+        r["motivo"] = MOTIVOS["alterada"]
+    elif fila[0] != "ACTIVA":
+        r["motivo"] = f"{MOTIVOS['estado']} ({fila[0]})"
+    elif dispensacion:
+        r["motivo"] = MOTIVOS["dispensada"]
+    else:
+        r["valida"] = True
+    return r
+
+
+def texto_resultado(r):
+    """Resumen de varias líneas para la ventana y la línea de comandos"""
+    if not r["encontrada"]:
+        return f"{r['numero']}: {r['motivo']}"
+    lineas = [
+        f"Receta {r['numero']} - {r['estado']}",
+        f"Fecha: {r['fecha']}   Paciente: {r['paciente']}",
+        f"Prescriptor: {r['prescriptor']}",
+    ]
+    if r["hash_coincide"] is None:
+        lineas.append("Código: no leído (número escrito a mano; compare los datos con el papel)")
+    else:
+        lineas.append("Código: " + ("coincide" if r["hash_coincide"] else "NO COINCIDE"))
+    if r["dispensada"]:
+        d = r["dispensada"]
+        lineas.append(f"Dispensada: {d['fecha_hora'][:16].replace('T', ' ')} por {d['usuario']}"
+                      + (f" ({d['estacion']})" if d.get("estacion") else ""))
+    if r.get("dispensada_ahora"):
+        lineas.append("DISPENSACIÓN REGISTRADA")
+    else:
+        lineas.append("VÁLIDA PARA DISPENSAR" if r["valida"] else f"NO DISPENSAR: {r['motivo']}")
+    return "\n".join(lineas)
+
+
+class VentanaVerificacion:
+    """
+    Ventana de farmacia: el lector de QR escribe el código y Enter verifica.
+    verificar(codigo) -> resultado; dispensar(codigo) -> resultado (con
+    'dispensada_ahora'). Los errores de acceso a datos se muestran en la ventana.
+    """
+
+    def __init__(self, parent, verificar, dispensar):
+        import tkinter as tk
+        from tkinter import ttk
+
+        self.verificar = verificar
+        self.dispensar = dispensar
+        self._codigo = None
+
+        self.win = tk.Toplevel(parent)
+        self.win.title("Verificar receta")
+        self.win.geometry("620x320")
+
+        frm = ttk.Frame(self.win, padding=10)
+        frm.pack(fill="both", expand=True)
+        fila = ttk.Frame(frm)
+        fila.pack(fill="x")
+        ttk.Label(fila, text="Código o número:").pack(side="left")
+        self.entry = tk.Entry(fila, width=40)
+        self.entry.pack(side="left", padx=(5, 8))
+        self.entry.bind("<Return>", lambda e: self.consultar())
+        ttk.Button(fila, text="Verificar", command=self.consultar).pack(side="left")
+        self.btn_dispensar = ttk.Button(fila, text="Dispensar", command=self.marcar_dispensada, state="disabled")
+        self.btn_dispensar.pack(side="left", padx=(8, 0))
+
+        self.lbl = tk.Label(frm, text="", justify="left", anchor="nw", font=("TkDefaultFont", 11))
+        self.lbl.pack(fill="both", expand=True, pady=(12, 0))
+        self.entry.focus_set()
+
+    def _mostrar(self, r):
+        self.lbl.config(text=texto_resultado(r), fg="dark green" if r["valida"] else "red")
+        self.btn_dispensar.config(state="normal" if r["valida"] else "disabled")
+
+    def consultar(self):
+        self._codigo = self.entry.get().strip()
+        try:
+            self._mostrar(self.verificar(self._codigo))
+        except Exception as e:
+            self._codigo = None
+            self.lbl.config(text=f"No se pudo verificar: {e}", fg="red")
+            self.btn_dispensar.config(state="disabled")
+        # El lector escribe el siguiente código encima
+        self.entry.select_range(0, "end")
+
+    def marcar_dispensada(self):
+        if not self._codigo:
+            return
+        try:
+            r = self.dispensar(self._codigo)
+        except Exception as e:
+            self.lbl.config(text=f"No se pudo registrar la dispensación: {e}", fg="red")
+            return
+        self._mostrar(r)
+        self.lbl.config(fg="dark green" if r.get("dispensada_ahora") else "red")
+        self.btn_dispensar.config(state="disabled")
+        self.entry.focus_set()
+        self.entry.select_range(0, "end")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica una receta por su código QR o su número")
+    parser.add_argument("codigo", help="Código leído (RX1:NUMERO:DIGEST) o número de receta")
+    parser.add_argument("--db", help="Ruta de recetas.db (por defecto la de la aplicación)")
+    parser.add_argument("--servidor", default=os.environ.get("RECETAS_SERVER_URL", ""),
+                        help="URL del servidor de recetas (en lugar de --db)")
+    parser.add_argument("--token", default=os.environ.get("RECETAS_SERVER_TOKEN", ""))
+    parser.add_argument("--dispensar", action="store_true", help="Registra la dispensación si es válida")
+    parser.add_argument("--usuario", default=os.environ.get("USER") or os.environ.get("USERNAME", ""))
+    args = parser.parse_args(argv)
+
+    if args.servidor:
+        from cliente_recetas import ClienteRecetas
+        backend = ClienteRecetas(args.servidor, args.token)
+    else:
+        from datos_recetas import BackendLocal
+        if not args.db:
+            from app_enhanced_fixed import db_path
+            args.db = db_path()
+        backend = BackendLocal(lambda: args.db)
+    t0 = time.perf_counter()
+    if args.dispensar:
+        r = backend.dispensar_receta(args.codigo, args.usuario, platform.node())
+    else:
+        r = backend.verificar_receta(args.codigo)
+    ms = (time.perf_counter() - t0) * 1000
+    print(texto_resultado(r))
+    print(f"({ms:.1f} ms)")
+    return 0 if r["valida"] or r.get("dispensada_ahora") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
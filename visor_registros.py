@@ -0,0 +1,178 @@
+"""
+Visores paginados de la bitácora de accesos y de la auditoría de recetas
+Paginación por conjunto de claves (keyset) sobre (fecha_hora, id): cada página
+es una búsqueda en índice y cuesta lo mismo al principio que al final del
+historial, a diferencia de LIMIT/OFFSET.
+"""
+
+from datetime import datetime, timedelta
+
+TAMANO_PAGINA = 200
+
+REGISTROS = {
+    "accesos": {
+        "tabla": "bitacora_accesos",
+        "titulo": "Bitácora de Accesos",
+        "columnas": ("fecha_hora", "usuario", "accion", "ip_address", "resultado", "detalles"),
+        "encabezados": ("Fecha/Hora", "Usuario", "Acción", "IP", "Resultado", "Detalles"),
+        "filtros": ("usuario", "accion", "resultado"),
+    },
+    "auditoria": {
+        "tabla": "auditoria",
+        "titulo": "Auditoría de Recetas",
+        "columnas": ("fecha_hora", "receta_numero", "accion", "usuario", "ip_address", "detalles"),
+        "encabezados": ("Fecha/Hora", "Receta", "Acción", "Usuario", "IP", "Detalles"),
+        "filtros": ("usuario", "accion", "receta_numero"),
+    },
+}
+
+ETIQUETAS_FILTRO = {
+    "usuario": "Usuario",
+    "accion": "Acción",
+    "resultado": "Resultado",
+    "receta_numero": "Receta",
+}
+
+
+def ensure_indexes(cur):
+    """Índices para paginar por fecha_hora, con y sin filtro de igualdad"""
+    for registro in REGISTROS.values():
+        tabla = registro["tabla"]
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_fecha ON {tabla}(fecha_hora, id)")
+        for col in registro["filtros"]:
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{tabla}_{col}_fecha ON {tabla}({col}, fecha_hora, id)"
+            )
+
+
+def _fin_de_dia(fecha):
+    """Límite superior exclusivo para una fecha aaaa-mm-dd"""
+    return (datetime.strptime(fecha, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def consultar_pagina(conn, registro, filtros=None, despues_de=None, limite=TAMANO_PAGINA):
+    """
+    Devuelve (filas, cursor_siguiente) ordenadas por fecha_hora descendente.
+
+    filtros: dict con claves de REGISTROS[registro]['filtros'] (igualdad exacta)
+             y opcionalmente 'desde' / 'hasta' (aaaa-mm-dd, incluidas).
+    despues_de: cursor (fecha_hora, id) devuelto por la página anterior.
+    cursor_siguiente es None cuando no hay más filas.
+    """
+    cfg = REGISTROS[registro]
+    filtros = filtros or {}
+    where, params = [], []
+
+    for col in cfg["filtros"]:
+        valor = (filtros.get(col) or "").strip()
+        if valor:
+            where.append(f"{col} = ?")
+            params.append(valor)
+    if filtros.get("desde"):
+        where.append("fecha_hora >= ?")
+        params.append(filtros["desde"])
+    if filtros.get("hasta"):
+        where.append("fecha_hora < ?")
+        params.append(_fin_de_dia(filtros["hasta"]))
+    if despues_de:
+        where.append("(fecha_hora, id) < (?, ?)")
+        params.extend(despues_de)
+
+    sql = f"SELECT id, {', '.join(cfg['columnas'])} FROM {cfg['tabla']}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY fecha_hora DESC, id DESC LIMIT ?"
+    params.append(limite + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    hay_mas = len(rows) > limite
+    rows = rows[:limite]
+    siguiente = (rows[-1][1], rows[-1][0]) if hay_mas and rows else None
+    return [r[1:] for r in rows], siguiente
+
+
+class VisorRegistros:
+    """
+    Ventana con filtros y carga perezosa al desplazarse.
+    paginar(registro, filtros, despues_de) -> (filas, siguiente); ver consultar_pagina.
+    """
+
+    def __init__(self, parent, registro, paginar):
+        import tkinter as tk
+        from tkinter import ttk
+
+        self.registro = registro
+        self.cfg = REGISTROS[registro]
+        self.paginar = paginar
+        self.siguiente = None
+        self.cargando = False
+
+        self.win = tk.Toplevel(parent)
+        self.win.title(self.cfg["titulo"])
+        self.win.geometry("1100x650")
+
+        frm = ttk.Frame(self.win, padding=8)
+        frm.pack(fill="x")
+        self.entries = {}
+        for col in self.cfg["filtros"] + ("desde", "hasta"):
+            etiqueta = ETIQUETAS_FILTRO.get(col, col.capitalize() + " (aaaa-mm-dd)")
+            ttk.Label(frm, text=etiqueta + ":").pack(side="left")
+            e = tk.Entry(frm, width=14 if col in ("desde", "hasta") else 18)
+            e.pack(side="left", padx=(2, 8))
+            e.bind("<Return>", lambda ev: self.buscar())
+            self.entries[col] = e
+        ttk.Button(frm, text="Filtrar", command=self.buscar).pack(side="left")
+
+        body = ttk.Frame(self.win)
+        body.pack(fill="both", expand=True, padx=10, pady=(0, 4))
+        cols = self.cfg["columnas"]
+        self.tree = ttk.Treeview(body, columns=cols, show="headings", height=25)
+        for col, text in zip(cols, self.cfg["encabezados"]):
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=300 if col == "detalles" else 130, anchor="w")
+
+        self.scrollbar = ttk.Scrollbar(body, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.status = ttk.Label(self.win, text="")
+        self.status.pack(fill="x", padx=10, pady=(0, 8))
+
+        self.buscar()
+
+    def filtros(self):
+        return {col: e.get().strip() for col, e in self.entries.items()}
+
+    def buscar(self):
+        """Reinicia la consulta con los filtros actuales"""
+        self.tree.delete(*self.tree.get_children())
+        self.siguiente = None
+        self.cargar_pagina(inicio=True)
+
+    def cargar_pagina(self, inicio=False):
+        if self.cargando or (not inicio and not self.siguiente):
+            return
+        self.cargando = True
+        try:
+            rows, self.siguiente = self.paginar(
+                self.registro, self.filtros(), None if inicio else self.siguiente
+            )
+            for row in rows:
+                self.tree.insert("", "end", values=row)
+            total = len(self.tree.get_children())
+            self.status.config(
+                text=f"{total} registros mostrados" + (" — desplácese para cargar más" if self.siguiente else "")
+            )
+        except ValueError as e:
+            self.status.config(text=f"Filtro inválido: {e}")
+        except Exception as e:
+            self.status.config(text=f"Error en la consulta: {e}")
+        finally:
+            self.cargando = False
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Cargar la siguiente página al acercarse al final de la lista
+        if self.siguiente and float(last) >= 0.95:
+            self.win.after_idle(self.cargar_pagina)